@@ -0,0 +1,288 @@
+#!/usr/bin env python
+# -*- coding: utf-8 -*-
+
+import csv
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+
+from weir3k import find_files, GRAPH_WORKERS_ENVIRONMENT
+from pyflow import AREAS, METADATA_ENVIRONMENT, fc
+from metadata import ConnectionPool, MSSQLBackend, snapshot_from_server
+
+"""
+batch.py runs weir3k.py and then pyflow.py for every gauged site and water year that has a corr table and data to process, several at a time
+
+Each site and water year is one job. A job runs the two scripts one after the other in their own processes, exactly as they are run by hand, with their output going to a log file of its own in 'batch_logs'. Nothing can be typed at a prompt in a batch, so a job that would have asked a question fails instead and the question is in its log. When every job is done, the outcome of each is printed and written to 'batch_report.csv'.
+
+Before the jobs start, the equations and sample dates of all of their sites are copied from the server into 'batch_metadata.sqlite' with one query per table, the three run side by side on their own connections, and every pyflow in the batch reads them from there. If PYFLOW_METADATA is already set, that is used instead.
+
+..Example:
+python batch.py
+python batch.py 2015
+python batch.py 2015 re 4
+"""
+
+# where the scripts live, so the batch can be started from the directory that holds the data
+SCRIPT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+LOG_DIRECTORY = 'batch_logs'
+
+REPORT_FILENAME = 'batch_report.csv'
+
+# the equations and sample dates of every site in the batch, copied from the server once so each job does not have to ask for them
+METADATA_SNAPSHOT = 'batch_metadata.sqlite'
+
+def find_jobs(wateryear=None, method='auto'):
+    """ Finds every site and water year that has a corr table, and works out what to run for it
+
+    With method 'auto', a site and year that already has an 're' file in its working directory is run with 're'; one that only has raw data is run with 'first'.
+
+    **Inputs**
+    :wateryear: only this water year, ex. 2015 (optional, all years with corr tables by default)
+    :method: 'auto', 'first', or 're'
+
+    **Returns**
+    :jobs: list of dictionaries, ex. [{'sitecode': 'GSWS01', 'wateryear': 2015, 'method': 're'}]
+    :skipped: list of dictionaries of the same kind, with a 'message' saying why they can not be run
+    """
+
+    jobs = []
+    skipped = []
+
+    for name in sorted(os.listdir('corr_table')):
+
+        # ex. corr_table_gsws01_2015.csv
+        parts = os.path.splitext(name)[0].split('_')
+
+        if len(parts) != 4 or parts[0] != 'corr' or parts[1] != 'table':
+            continue
+
+        try:
+            sitecode = parts[2].upper()
+            this_wateryear = int(parts[3])
+        except ValueError:
+            continue
+
+        if wateryear != None and this_wateryear != int(wateryear):
+            continue
+
+        job = {'sitecode': sitecode, 'wateryear': this_wateryear, 'method': method}
+
+        # pyflow can only put flows on an area it knows
+        if sitecode not in AREAS:
+            job['message'] = "not a gauged site in pyflow.AREAS"
+            skipped.append(job)
+            continue
+
+        working_files = [x for x in find_files(sitecode, this_wateryear, sitecode + "_" + str(this_wateryear) + "_working") if 'partial' not in x]
+        raw_files = find_files(sitecode, this_wateryear, 'raw_data')
+
+        if method == 'auto':
+            if working_files != []:
+                job['method'] = 're'
+            else:
+                job['method'] = 'first'
+
+        # these are the cases where weir3k would stop to ask which file to use
+        if job['method'] == 're' and len(working_files) != 1:
+            job['message'] = "needs exactly one \'re\' file in the working directory, found " + str(len(working_files))
+            skipped.append(job)
+
+        elif job['method'] == 'first' and len(raw_files) != 1:
+            job['message'] = "needs exactly one file in \'raw_data\', found " + str(len(raw_files))
+            skipped.append(job)
+
+        else:
+            jobs.append(job)
+
+    return jobs, skipped
+
+def run_job(job):
+    """ Runs weir3k.py and then pyflow.py for one site and water year, with everything they print going to the job's log
+
+    Runs in a worker of the pool. The scripts get an empty stdin, so anything that asks for input stops with an error rather than waiting.
+
+    **Inputs**
+    :job: dictionary of 'sitecode', 'wateryear', and 'method'
+
+    **Returns**
+    :job: the same dictionary with 'status' ('done', or which script failed), 'seconds', 'log' and 'message' (the last line the failing script printed)
+    """
+
+    sitecode = job['sitecode']
+    wateryear = str(job['wateryear'])
+
+    # the method stays out of the name; weir3k copies away any file named like the site, year and 'first'
+    log_filename = os.path.join(LOG_DIRECTORY, sitecode + "_" + wateryear + ".log")
+
+    steps = [('weir3k', [sys.executable, os.path.join(SCRIPT_DIRECTORY, 'weir3k.py'), sitecode, wateryear, job['method']]), ('pyflow', [sys.executable, os.path.join(SCRIPT_DIRECTORY, 'pyflow.py'), sitecode, wateryear, 'csv'])]
+
+    # the graphs are only saved to files, never shown
+    environment = dict(os.environ)
+    environment['MPLBACKEND'] = 'Agg'
+
+    result = dict(job)
+    result['status'] = 'done'
+    result['message'] = ''
+    result['log'] = log_filename
+
+    start_time = time.time()
+
+    with open(log_filename, 'w') as logfile:
+        with open(os.devnull, 'r') as nothing:
+
+            for step_name, command in steps:
+
+                logfile.write("#### " + " ".join(command[1:]) + "\n")
+                logfile.flush()
+
+                returncode = subprocess.call(command, stdin=nothing, stdout=logfile, stderr=subprocess.STDOUT, env=environment)
+
+                if returncode != 0:
+                    result['status'] = step_name + ' failed'
+                    break
+
+    result['seconds'] = round(time.time() - start_time, 1)
+
+    # the last thing a failed script printed is usually the reason
+    if result['status'] != 'done':
+        with open(log_filename, 'r') as readfile:
+            lines = [x.strip() for x in readfile if x.strip() != '']
+
+        if lines != []:
+            result['message'] = lines[-1]
+
+    return result
+
+def write_report(results):
+    """ Prints the outcome of each job and writes it to batch_report.csv
+
+    :results: list of dictionaries from run_job and the skipped jobs from find_jobs
+    """
+
+    if sys.version_info >= (3,0):
+        mode = 'w'
+    else:
+        mode = 'wb'
+
+    results = sorted(results, key=lambda x: (x['wateryear'], x['sitecode']))
+
+    with open(REPORT_FILENAME, mode) as writefile:
+        writer = csv.writer(writefile, quoting=csv.QUOTE_NONNUMERIC, delimiter=",")
+        writer.writerow(["SITECODE", "WATERYEAR", "METHOD", "STATUS", "SECONDS", "LOG", "MESSAGE"])
+
+        for each_result in results:
+            writer.writerow([each_result['sitecode'], each_result['wateryear'], each_result['method'], each_result['status'], each_result.get('seconds'), each_result.get('log'), each_result['message']])
+
+    for each_result in results:
+        print(each_result['sitecode'] + " " + str(each_result['wateryear']) + " " + each_result['method'] + " : " + each_result['status'] + " " + each_result['message'])
+
+    done = len([x for x in results if x['status'] == 'done'])
+    print(str(done) + " of " + str(len(results)) + " site-years finished. See " + REPORT_FILENAME + " and the logs in " + LOG_DIRECTORY)
+
+def snapshot_metadata(jobs):
+    """ Copies the metadata of the sites in the jobs from the server into METADATA_SNAPSHOT, and points the jobs to it
+
+    If the server can not be reached, the jobs are left to get their metadata on their own.
+
+    :jobs: list of dictionaries from find_jobs
+    """
+
+    if METADATA_ENVIRONMENT in os.environ:
+        print("Using the metadata in " + os.environ[METADATA_ENVIRONMENT])
+        return
+
+    pool = ConnectionPool(lambda: MSSQLBackend(fc))
+
+    try:
+        snapshot_from_server(METADATA_SNAPSHOT, pool, sorted(set([x['sitecode'] for x in jobs])))
+
+    except Exception as exc:
+        print("Could not copy the metadata from the server (" + str(exc) + "), each job will get its own")
+        return
+
+    finally:
+        pool.close()
+
+    # the workers, and the scripts they start, get this from the environment
+    os.environ[METADATA_ENVIRONMENT] = os.path.abspath(METADATA_SNAPSHOT)
+
+def run_batch(wateryear=None, method='auto', workers=None):
+    """ Finds the jobs and runs them in a pool of processes
+
+    :wateryear: only this water year, ex. 2015 (optional)
+    :method: 'auto', 'first', or 're'
+    :workers: number of jobs run at once (the number of cpus by default)
+    """
+
+    if workers == None:
+        workers = multiprocessing.cpu_count()
+
+    try:
+        os.mkdir(LOG_DIRECTORY)
+    except OSError:
+        pass
+
+    jobs, skipped = find_jobs(wateryear, method)
+
+    for each_job in skipped:
+        each_job['status'] = 'skipped'
+
+    print("Running " + str(len(jobs)) + " site-years with " + str(workers) + " workers, skipping " + str(len(skipped)))
+
+    results = []
+
+    if jobs != []:
+        snapshot_metadata(jobs)
+
+        # the jobs running side by side share the cpus for drawing their graphs
+        if GRAPH_WORKERS_ENVIRONMENT not in os.environ:
+            os.environ[GRAPH_WORKERS_ENVIRONMENT] = str(max(1, multiprocessing.cpu_count() // min(workers, len(jobs))))
+
+        pool = multiprocessing.Pool(processes=min(workers, len(jobs)))
+
+        try:
+            # report each job as it finishes, not in order
+            for each_result in pool.imap_unordered(run_job, jobs):
+                print("...finished " + each_result['sitecode'] + " " + str(each_result['wateryear']) + " in " + str(each_result['seconds']) + " seconds : " + each_result['status'])
+                results.append(each_result)
+        finally:
+            pool.close()
+            pool.join()
+
+    write_report(results + skipped)
+
+    return results + skipped
+
+
+if __name__ == "__main__":
+    """ Runs the batch
+
+    :wateryear: - optional, on command line 2015 or 'all'
+    :method: - optional, 'auto' (default), 'first', or 're'
+    :workers: - optional, number of jobs at once
+
+    ..Example:
+    python batch.py 2015 re 8
+    """
+
+    wateryear = None
+    method = 'auto'
+    workers = None
+
+    if len(sys.argv) > 1 and sys.argv[1].lower() != 'all':
+        wateryear = int(sys.argv[1])
+
+    if len(sys.argv) > 2:
+        method = sys.argv[2].lower()
+
+        if method not in ['auto', 'first', 're']:
+            sys.exit("The method must be \'auto\', \'first\' or \'re\'")
+
+    if len(sys.argv) > 3:
+        workers = int(sys.argv[3])
+
+    run_batch(wateryear, method, workers)
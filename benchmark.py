@@ -0,0 +1,521 @@
+#!/usr/bin env python
+# -*- coding: utf-8 -*-
+
+import csv
+import datetime
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import numpy as np
+
+import weir3k
+import pyflow
+from metadata import write_snapshot, SAMPLE_SITECODES
+from profiling import PROFILE
+from timeseries import datetime_to_minutes, open_csv, csv_field, csv_date_fields, csv_number_fields, write_csv_columns
+
+"""
+benchmark.py times the stages of weir3k.py and pyflow.py on made-up gauge data, so a change meant to make them faster comes with a number
+
+For each size (in site-years) it makes a raw stage log, a corr table, and rating equations and sample dates for every site-year, in a directory of its own, with nothing from the server. The site-years cycle through four kinds of record:
+
+- regular : a reading every five minutes
+- sparse  : a reading only when the stage changes, run with the 'sparse' method
+- gappy   : five minute readings with missing days and blank values
+- storm   : five minute readings with many large storms and one-reading spikes
+
+Each site-year then goes through 'first' (or 'sparse') and the graphs, 're' with nothing edited, 're' again without the record of the corrections, and pyflow, the way the scripts run them, with every stage timed by profiling.py. How long weir3k and pyflow take to import is timed as well, in fresh pythons. The time of each stage is added to 'benchmark_results.csv' next to this file, under the version of the code (the git commit), and printed next to the last run at the same size. The made-up data is the same every time, so the numbers of two versions can be compared.
+
+..Example:
+python benchmark.py
+python benchmark.py 1 10
+"""
+
+SCRIPT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+RESULTS_FILENAME = os.path.join(SCRIPT_DIRECTORY, 'benchmark_results.csv')
+
+# the columns of the results, one row per stage per run
+RESULT_FIELDS = ['version', 'date', 'python', 'site_years', 'stage', 'parent', 'calls', 'seconds', 'rows', 'peak_memory_kb']
+
+# how many site-years are run, by default
+BENCHMARK_SIZES = [1, 10, 50]
+
+# the kinds of record, in the order the site-years take them
+RECORD_KINDS = ['regular', 'sparse', 'gappy', 'storm']
+
+# every site gets the same rating equations: {max height: [ln_a, b]}
+BENCHMARK_EQUATIONS = {0.509: [3.568, 1.741562], 2.54: [3.856196, 2.168731]}
+
+# the made-up data comes from this seed, so it is the same on every run
+BENCHMARK_SEED = 2015
+
+# the scripts are started once per site-year by batch.py, so how long they take to import counts; the benchmark says when one takes longer than this, in seconds
+IMPORT_BUDGET_SECONDS = 0.3
+
+# the modules that must not be loaded just by importing a script; they are loaded where they are used
+HEAVY_MODULES = ['matplotlib', 'scipy', 'pymssql']
+
+# each script is imported this many times in a fresh python, and the fastest is kept
+IMPORT_REPEATS = 5
+
+def code_version():
+    """ The git commit of the code being benchmarked, ex. '3e8751f' or '3e8751f+' when there are changes not committed, or 'unknown' outside of git"""
+
+    try:
+        with open(os.devnull, 'w') as nothing:
+            version = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=SCRIPT_DIRECTORY, stderr=nothing).decode('ascii').strip()
+            changes = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=SCRIPT_DIRECTORY, stderr=nothing).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+    if changes != '':
+        version += '+'
+
+    return version
+
+def import_time(module):
+    """ How long a module takes to import in a fresh python, and the heavy modules importing it loads
+
+    **Inputs**
+    :module: ex. 'weir3k'
+
+    **Returns**
+    :seconds: the fastest of IMPORT_REPEATS imports
+    :heavy: list of the HEAVY_MODULES it loaded, which should be empty
+    """
+
+    code = "import sys, time; started = time.time(); import " + module + "; print(time.time() - started); print(' '.join([x for x in " + repr(HEAVY_MODULES) + " if x in sys.modules]))"
+
+    times = []
+
+    for repeat in range(IMPORT_REPEATS):
+        output = subprocess.check_output([sys.executable, '-c', code], cwd=SCRIPT_DIRECTORY).decode('ascii').splitlines()
+        times.append(float(output[0]))
+
+    return min(times), output[1].split() if len(output) > 1 else []
+
+def startup_stages():
+    """ The import time of weir3k and pyflow, as stages of 'startup' like the ones of summarize_stages, and a warning for each that is over IMPORT_BUDGET_SECONDS or loads a heavy module"""
+
+    stages = []
+
+    for each_module in ['weir3k', 'pyflow']:
+        seconds, heavy = import_time(each_module)
+        stages.append({'stage': 'import_' + each_module, 'parent': 'startup', 'calls': IMPORT_REPEATS, 'seconds': round(seconds, 6), 'rows': None, 'peak_memory_kb': None})
+
+        if seconds > IMPORT_BUDGET_SECONDS:
+            print(each_module + " took " + ("%.3f" % seconds) + " s to import, over its budget of " + str(IMPORT_BUDGET_SECONDS) + " s")
+
+        if heavy != []:
+            print(each_module + " loads " + ", ".join(heavy) + " when it is imported")
+
+    return stages
+
+def synthetic_site_years(number):
+    """ The site-years of a benchmark of a given size - every gauged site once, then again a year earlier, and so on
+
+    **Returns**
+    :site_years: list of dictionaries of 'sitecode', 'wateryear', 'kind', and 'seed'
+    """
+
+    sitecodes = sorted(pyflow.AREAS.keys())
+
+    return [{'sitecode': sitecodes[x % len(sitecodes)], 'wateryear': 2015 - x // len(sitecodes), 'kind': RECORD_KINDS[x % len(RECORD_KINDS)], 'seed': BENCHMARK_SEED + x} for x in range(number)]
+
+def synthetic_stage(wateryear, kind, seed):
+    """ A made-up water year of stage heights
+
+    A base flow that is high in winter and low in late summer, storms that rise fast and fall off slowly, and a little noise, rounded to the millimeter like the loggers.
+
+    **Inputs**
+    :wateryear: ex. 2015
+    :kind: one of RECORD_KINDS
+    :seed: for the random numbers
+
+    **Returns**
+    :minutes: numpy array of the times of the readings
+    :values: numpy array of the readings, nan where a reading is blank
+    """
+
+    random = np.random.RandomState(seed)
+
+    first = datetime_to_minutes(datetime.datetime(wateryear - 1, 10, 1, 0, 0))
+    last = datetime_to_minutes(datetime.datetime(wateryear, 10, 1, 0, 0))
+    minutes = np.arange(first, last + 5, 5, dtype=np.int64)
+
+    # days since the start of the water year; the base flow peaks in late january
+    days = (minutes - first)/1440.
+    values = 0.12 + 0.08*np.cos(2*np.pi*(days - 120)/365.)
+
+    if kind == 'storm':
+        number_of_storms = 60
+        largest = 1.5
+    else:
+        number_of_storms = 15
+        largest = 0.6
+
+    for each_start in np.sort(random.uniform(0, 365, number_of_storms)):
+        after = days - each_start
+        rising = (after >= 0) & (after < 0.25)
+        falling = after >= 0.25
+        peak = random.uniform(0.05, largest)
+        values[rising] += peak*after[rising]/0.25
+        values[falling] += peak*np.exp(-(after[falling] - 0.25)/random.uniform(0.5, 3.))
+
+    values = np.round(values + random.normal(0, 0.001, len(values)), 3)
+
+    if kind == 'storm':
+        spikes = random.randint(0, len(values), 40)
+        values[spikes] = np.round(values[spikes] + random.uniform(-0.3, 0.3, len(spikes)), 3)
+
+    if kind == 'sparse':
+        # a reading when the stage changes, and one at each midnight
+        changed = np.concatenate(([True], values[1:] != values[:-1]))
+        keep = changed | (minutes % 1440 == 0)
+        minutes = minutes[keep]
+        values = values[keep]
+
+    elif kind == 'gappy':
+        keep = np.ones(len(minutes), dtype=bool)
+
+        for each_start in random.randint(0, len(minutes) - 1000, 10):
+            keep[each_start:each_start + random.randint(24, 864)] = False
+
+        # the ends are always there, like a logger that was downloaded
+        keep[0] = True
+        keep[-1] = True
+
+        values[random.randint(1, len(values) - 1, 200)] = np.nan
+        minutes = minutes[keep]
+        values = values[keep]
+
+    return minutes, np.maximum(values, 0.001)
+
+def write_raw_data(filename, sitecode, minutes, values):
+    """ Writes a raw stage log the way the loggers are downloaded - sitecode, date, and the reading twice"""
+
+    with open_csv(filename) as writefile:
+        readings = csv_number_fields(values)
+        write_csv_columns(writefile, [csv_field(sitecode), csv_date_fields(minutes), readings, readings])
+
+def synthetic_visits(wateryear, seed):
+    """ The dates of the visits to the weir from mid september of the year before until after the end of the water year, three to five weeks apart, at odd minutes like the field notes"""
+
+    random = np.random.RandomState(seed)
+
+    visits = [datetime.datetime(wateryear - 1, 9, random.randint(10, 20), random.randint(7, 16), random.randint(0, 60))]
+
+    while visits[-1] < datetime.datetime(wateryear, 10, 1, 0, 0):
+        visits.append(visits[-1] + datetime.timedelta(days=int(random.randint(21, 36)), minutes=int(random.randint(-300, 300))))
+
+    return visits
+
+def write_corr_table(filename, sitecode, wateryear, seed):
+    """ Writes a corr table of a site-year: from each visit to the next, the stage the logger had and the stage on the hook gauge at both ends. The last visit has no end yet."""
+
+    random = np.random.RandomState(seed)
+    visits = synthetic_visits(wateryear, seed)
+
+    # the logger drifts away from the hook gauge a little between visits and is reset at each one
+    logger = np.round(random.uniform(0.05, 0.6, len(visits)), 3)
+    gauge = np.round(logger + random.uniform(-0.015, 0.015, len(visits)), 3)
+
+    if sys.version_info >= (3,0):
+        mode = 'w'
+    else:
+        mode = 'wb'
+
+    with open(filename, mode) as writefile:
+        writer = csv.writer(writefile)
+        writer.writerow(["dbcode", " entity", " sitecode", " bgn_date_time", " bgn_cr", " bgn_hg", " end_date_time", " end_cr", " end_hg", " comment"])
+
+        for index, each_visit in enumerate(visits):
+            bgn_date = str(each_visit.month) + "/" + str(each_visit.day) + "/" + str(each_visit.year) + " " + str(each_visit.hour) + ":" + str(each_visit.minute).zfill(2)
+
+            if index + 1 < len(visits):
+                end_visit = visits[index + 1]
+                end_date = str(end_visit.month) + "/" + str(end_visit.day) + "/" + str(end_visit.year) + " " + str(end_visit.hour) + ":" + str(end_visit.minute).zfill(2)
+                writer.writerow(["HF002", 6, sitecode, bgn_date, gauge[index], gauge[index], end_date, logger[index + 1], gauge[index + 1], ""])
+            else:
+                writer.writerow(["HF002", 6, sitecode, bgn_date, gauge[index], gauge[index], "", "", "", "not visited yet"])
+
+def write_metadata(filename, site_years):
+    """ Writes a metadata snapshot for the site-years: one equation set per site, used from the start of each water year to its end, and a sample every three weeks"""
+
+    tables = {'HF00204': [], 'HF00203': [], 'CF00206': []}
+
+    for each_sitecode in sorted(set([x['sitecode'] for x in site_years])):
+        for number, max_ht in enumerate(sorted(BENCHMARK_EQUATIONS)):
+            tables['HF00203'].append((each_sitecode, 'A', '1', str(number + 1), str(pyflow.AREAS[each_sitecode]), max_ht, BENCHMARK_EQUATIONS[max_ht][0], BENCHMARK_EQUATIONS[max_ht][1]))
+
+    for each_site_year in site_years:
+        sitecode = each_site_year['sitecode']
+        wateryear = each_site_year['wateryear']
+
+        tables['HF00204'].append((sitecode, 'A', '1', str(wateryear), str(wateryear - 1) + "-10-01 00:01:00", str(wateryear) + "-10-01 00:00:00"))
+
+        # the sample dates of some sites are kept under another sitecode
+        sample_sitecode = SAMPLE_SITECODES.get(sitecode, sitecode)
+
+        sample_date = datetime.datetime(wateryear - 1, 10, 15, 11, 5)
+        while sample_date < datetime.datetime(wateryear, 10, 1, 0, 0):
+            tables['CF00206'].append((sample_sitecode, sample_date.strftime('%Y-%m-%d %H:%M:%S')))
+            sample_date += datetime.timedelta(days=21)
+
+    write_snapshot(filename, tables)
+
+def make_site_years(site_years):
+    """ Writes the raw data, corr tables, and metadata snapshot of the site-years in the current directory
+
+    **Returns**
+    :metadata_filename: the snapshot to give pyflow
+    """
+
+    for each_directory in ['raw_data', 'corr_table']:
+        weir3k.make_sure_path_exists(each_directory)
+
+    for each_site_year in site_years:
+        sitecode = each_site_year['sitecode']
+        wateryear = each_site_year['wateryear']
+
+        minutes, values = synthetic_stage(wateryear, each_site_year['kind'], each_site_year['seed'])
+        write_raw_data(os.path.join('raw_data', sitecode + "_" + str(wateryear) + "_first.csv"), sitecode, minutes, values)
+        write_corr_table(os.path.join('corr_table', "corr_table_" + sitecode.lower() + "_" + str(wateryear) + ".csv"), sitecode, wateryear, each_site_year['seed'])
+
+    metadata_filename = os.path.abspath('benchmark_metadata.sqlite')
+    write_metadata(metadata_filename, site_years)
+
+    return metadata_filename
+
+def run_site_year(site_year, metadata_filename):
+    """ Runs weir3k 'first' (or 'sparse'), the graphs, 're' again, and then pyflow on one site-year in the current directory, the way the scripts do"""
+
+    sitecode = site_year['sitecode']
+    wateryear = site_year['wateryear']
+
+    with PROFILE.stage('weir3k'):
+        corr_od = weir3k.load_corr_table(sitecode, wateryear)
+        weir3k.create_subfolders(sitecode, wateryear)
+
+        od, date_column = weir3k.parameterize_first(sitecode, wateryear, os.path.join('raw_data', sitecode + "_" + str(wateryear) + "_first.csv"))
+
+        if site_year['kind'] == 'sparse':
+            method = 'sparse'
+        else:
+            method = 'first'
+
+        first_filename = weir3k.generate_first(od, sitecode, wateryear, False, sparse=(method == 'sparse'))
+        adjusted_dictionary, re_filename = weir3k.do_adjustments(sitecode, wateryear, first_filename, corr_od, method, False, date_column)
+        weir3k.make_graphs(sitecode, wateryear, adjusted_dictionary)
+
+    # what a technician runs after each look at the graphs, here with nothing edited, and then again from the csv alone
+    with PROFILE.stage('re'):
+        adjusted_dictionary, months = weir3k.patch_adjustments(sitecode, wateryear, re_filename, corr_od, False)
+        weir3k.make_graphs(sitecode, wateryear, adjusted_dictionary, months)
+
+    with PROFILE.stage('full_re'):
+        os.remove(weir3k.corr_record_name(re_filename))
+        adjusted_dictionary, re_filename = weir3k.do_adjustments(sitecode, wateryear, re_filename, corr_od, 're', False, 1)
+
+    with PROFILE.stage('pyflow'):
+        o2, bfav = pyflow.get_data_from_csv(re_filename)
+
+        metadata = pyflow.open_metadata(metadata_filename)
+        o = pyflow.get_equation_sets(metadata, sitecode, wateryear)
+        o1 = pyflow.get_equations_by_value(metadata, sitecode, o, wateryear)
+        sd = pyflow.get_samples_dates(metadata, sitecode, wateryear)
+        metadata.close()
+
+        o3 = pyflow.set_up_iterators(o2, o1, wateryear)
+        o4 = pyflow.loop_over_data(o3, o1)
+
+        pyflow.print_five_minute_file(o4, sitecode, wateryear, 5, o2, sd)
+        days = pyflow.summarize_days(o4, o2)
+        pyflow.print_daily_values(sitecode, wateryear, o4, o2, days)
+
+        if sd != None:
+            pyflow.print_sdate_values(wateryear, o4, sitecode, sd)
+
+        o_daily = pyflow.compute_daily_dictionary(sitecode, wateryear, o4, o2, days)
+        pyflow.create_monthly_files(sitecode, wateryear, o_daily)
+
+def summarize_stages(records):
+    """ Adds up the runs of each stage (by name and the stage it ran in)
+
+    **Returns**
+    :stages: list of dictionaries of 'stage', 'parent', 'calls', 'seconds', 'rows', and 'peak_memory_kb', in the order the stages first ran
+    """
+
+    stages = []
+    found = {}
+
+    for each_record in records:
+        key = (each_record['stage'], each_record['parent'])
+
+        if key not in found:
+            found[key] = {'stage': each_record['stage'], 'parent': each_record['parent'], 'calls': 0, 'seconds': 0.0, 'rows': None, 'peak_memory_kb': None}
+            stages.append(found[key])
+
+        stage = found[key]
+        stage['calls'] += 1
+        stage['seconds'] += each_record['seconds']
+
+        if each_record['rows'] != None:
+            stage['rows'] = (stage['rows'] or 0) + each_record['rows']
+
+        if each_record['peak_memory_kb'] != None:
+            stage['peak_memory_kb'] = max(stage['peak_memory_kb'] or 0, each_record['peak_memory_kb'])
+
+    for each_stage in stages:
+        each_stage['seconds'] = round(each_stage['seconds'], 6)
+
+    return stages
+
+def run_benchmark(number):
+    """ Makes the data of a number of site-years in a directory of its own, runs them, and gives back the time of each stage
+
+    The graphs are drawn by one process, so the numbers do not depend on how many cpus there are.
+
+    **Returns**
+    :stages: from summarize_stages, for all the site-years together
+    """
+
+    site_years = synthetic_site_years(number)
+
+    here = os.getcwd()
+    directory = tempfile.mkdtemp(prefix='benchmark_')
+
+    graph_workers = os.environ.get(weir3k.GRAPH_WORKERS_ENVIRONMENT)
+    os.environ[weir3k.GRAPH_WORKERS_ENVIRONMENT] = '1'
+
+    # the scripts talk a lot; none of it is wanted here
+    stdout = sys.stdout
+
+    try:
+        os.chdir(directory)
+        metadata_filename = make_site_years(site_years)
+
+        sys.stdout = open(os.devnull, 'w')
+
+        PROFILE.start('benchmark_' + str(number))
+
+        for each_site_year in site_years:
+            run_site_year(each_site_year, metadata_filename)
+
+        # the stages as they ran; the profile itself is not kept
+        records = PROFILE.records
+        PROFILE.enabled = False
+
+    finally:
+        if sys.stdout != stdout:
+            sys.stdout.close()
+            sys.stdout = stdout
+
+        os.chdir(here)
+        shutil.rmtree(directory, ignore_errors=True)
+
+        if graph_workers == None:
+            del os.environ[weir3k.GRAPH_WORKERS_ENVIRONMENT]
+        else:
+            os.environ[weir3k.GRAPH_WORKERS_ENVIRONMENT] = graph_workers
+
+    return summarize_stages(records)
+
+def read_results(filename=RESULTS_FILENAME):
+    """ The results of earlier benchmarks, as a list of dictionaries with the RESULT_FIELDS"""
+
+    if not os.path.isfile(filename):
+        return []
+
+    if sys.version_info >= (3,0):
+        mode = 'r'
+    else:
+        mode = 'rb'
+
+    with open(filename, mode) as readfile:
+        reader = csv.reader(readfile)
+        header = [x.lower() for x in next(reader)]
+
+        return [dict(zip(header, row)) for row in reader]
+
+def write_results(number, stages, version, filename=RESULTS_FILENAME):
+    """ Adds the time of each stage of a benchmark to the results"""
+
+    new_file = not os.path.isfile(filename)
+
+    if sys.version_info >= (3,0):
+        mode = 'a'
+    else:
+        mode = 'ab'
+
+    today = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    python = ".".join([str(x) for x in sys.version_info[:3]])
+
+    with open(filename, mode) as writefile:
+        writer = csv.writer(writefile, quoting=csv.QUOTE_NONNUMERIC, delimiter=",")
+
+        if new_file:
+            writer.writerow([x.upper() for x in RESULT_FIELDS])
+
+        for each_stage in stages:
+            writer.writerow([version, today, python, number, each_stage['stage'], each_stage['parent'], each_stage['calls'], each_stage['seconds'], each_stage['rows'], each_stage['peak_memory_kb']])
+
+def print_comparison(number, stages, version, earlier):
+    """ Prints the time of each stage next to the last run benchmarked at the same size, which is usually the version before"""
+
+    # the last run with results for this size, by its version and date
+    others = [x for x in earlier if x['site_years'] == str(number)]
+
+    if others != []:
+        last_run = (others[-1]['version'], others[-1]['date'])
+        last = dict(((x['stage'], x['parent']), float(x['seconds'])) for x in others if (x['version'], x['date']) == last_run)
+        print(str(number) + " site-years of " + version + ", compared to " + last_run[0] + " on " + last_run[1])
+    else:
+        last = {}
+        print(str(number) + " site-years of " + version)
+
+    for each_stage in stages:
+        name = each_stage['stage']
+
+        if each_stage['parent'] != None:
+            name = each_stage['parent'] + " / " + name
+
+        line = "    " + name.ljust(50) + ("%.3f" % each_stage['seconds']).rjust(10) + " s"
+
+        # the results file has an empty parent for the stages that ran in none
+        before = last.get((each_stage['stage'], '' if each_stage['parent'] == None else each_stage['parent']))
+
+        if before != None and before > 0:
+            line += ("%.3f" % before).rjust(10) + " s" + ("%+.0f%%" % (100.*(each_stage['seconds'] - before)/before)).rjust(8)
+
+        print(line)
+
+
+if __name__ == "__main__":
+    """ Runs the benchmark
+
+    :sizes: - optional, the numbers of site-years to run, 1 10 50 by default
+
+    ..Example:
+    python benchmark.py 1 10
+    """
+
+    if len(sys.argv) > 1:
+        sizes = [int(x) for x in sys.argv[1:]]
+    else:
+        sizes = BENCHMARK_SIZES
+
+    version = code_version()
+    earlier = read_results()
+
+    startup = startup_stages()
+
+    for each_size in sizes:
+        stages = startup + run_benchmark(each_size)
+        write_results(each_size, stages, version)
+        print_comparison(each_size, stages, version, earlier)
+
+    print("Added the results of " + version + " to " + RESULTS_FILENAME)
@@ -0,0 +1,313 @@
+#!/usr/bin env python
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import re
+import sys
+import time
+
+"""
+catalog.py keeps a list of the files under the data directory, so weir3k.py does not have to walk every images, backups and working directory of every site and year to find the few files it wants
+
+The names of the files and directories of each directory are kept in 'file_catalog.json' with the time the directory was last changed. Adding, removing or renaming a file changes the time of its directory, so on the next look only the directories whose time has changed are read again; the others cost one os.stat each. Deleting the catalog is always safe; it is made again on the next look.
+
+Each file is also filed under the site, water year and role its name or its directory gives it:
+
+- raw_data/GSWS01_2015_first.csv                 : ('GSWS01', 2015, 'raw')
+- GSWS01_2015_first.csv                          : ('GSWS01', 2015, 'first')
+- GSWS01_2015_working/GSWS01_2015_re.csv         : ('GSWS01', 2015, 're')
+- GSWS01_2015_working/GSWS01_2015_re_partial.csv : ('GSWS01', 2015, 're_partial')
+- GSWS01_2015_backups/GSWS01_2015_first.csv      : ('GSWS01', 2015, 'backup')
+- GSWS01_2015_images/2014_10_wy_GSWS01.png       : ('GSWS01', 2015, 'image')
+
+so finding the files of a site and year is a dictionary lookup. Names that do not follow these forms are kept aside and searched the old way.
+
+..Example:
+python catalog.py
+python catalog.py GSWS01 2015
+"""
+
+CATALOG_FILENAME = 'file_catalog.json'
+
+CATALOG_VERSION = 1
+
+# a directory changed less than this many seconds before it was read may change again within the same tick of its clock, without its time changing; it is read again next time rather than trusted
+RACY_SECONDS = 2
+
+# ex. GSWS01_2015_re_partial.csv or gsws01_2015_working; the sitecode is all upper or all lower case
+SITE_YEAR_NAME = re.compile(r'^([A-Z]{2}[A-Z0-9]{4}|[a-z]{2}[a-z0-9]{4})_([0-9]{4})_([A-Za-z_]+)(\..*)?$')
+
+# the month graphs, ex. 2014_10_wy_GSWS01.png, whose year is the calendar year; the water year comes from their directory
+IMAGE_NAME = re.compile(r'^[0-9]{4}_[0-9]{2}_wy_([A-Za-z]{2}[A-Za-z0-9]{4})\.png$')
+
+# the role of every file in a directory of one of these kinds, ex. GSWS01_2015_backups
+FOLDER_ROLES = {'raw_data': 'raw', 'backups': 'backup', 'images': 'image'}
+
+def parse_name(name):
+    """ The site, water year and role in the name of a file or directory, or None for a name not in the usual form
+
+    Only a name with one year in it is taken, so that it can only be the file of one site and year.
+
+    ..Example:
+    >>> parse_name('GSWS01_2015_re_partial.csv')
+    >>> ('GSWS01', 2015, 're_partial')
+    """
+
+    found = SITE_YEAR_NAME.match(name)
+
+    if found == None:
+        return None
+
+    if len(set(re.findall(r'(?=([0-9]{4}))', name))) != 1:
+        return None
+
+    return found.group(1).upper(), int(found.group(2)), found.group(3).lower()
+
+def folder_site_year(path):
+    """ The site, water year and role of the files in a directory, from the names of it and the directories it is in, or None
+
+    ..Example:
+    >>> folder_site_year('./GSWS01_2015_images')
+    >>> ('GSWS01', 2015, 'image')
+    >>> folder_site_year('./raw_data')
+    >>> (None, None, 'raw')
+    """
+
+    for each_part in reversed(os.path.normpath(path).split(os.sep)):
+
+        if each_part in FOLDER_ROLES:
+            return None, None, FOLDER_ROLES[each_part]
+
+        parsed = parse_name(each_part)
+
+        if parsed != None and parsed[2] in FOLDER_ROLES:
+            return parsed[0], parsed[1], FOLDER_ROLES[parsed[2]]
+
+    return None
+
+def catalog_path(path):
+    """ A directory the way the catalog names it, relative to the root like os.walk('.') does, ex. 'raw_data/' is './raw_data' and the root is '.'"""
+
+    path = os.path.normpath(path)
+
+    if path == '.':
+        return path
+
+    return os.path.join('.', path)
+
+class FileCatalog(object):
+    """ The files under one directory, read again only where a directory has changed
+
+    :root: the data directory, ex. '.'
+    :filename: where the catalog is kept, in the root
+    """
+
+    def __init__(self, root='.', filename=CATALOG_FILENAME):
+        self.root = root
+        self.filename = filename
+        self.loaded_from = None
+        self.directories = {}
+        self.index = {}
+        self.others = {}
+
+    def load(self):
+        """ Reads the catalog kept on disk, if there is one and it can be read; anything wrong with it just means the directories are read again"""
+
+        self.loaded_from = os.path.abspath(self.root)
+        self.directories = {}
+        self.index = {}
+
+        try:
+            with open(os.path.join(self.root, self.filename), 'r') as readfile:
+                kept = json.load(readfile)
+
+            if kept.get('version') == CATALOG_VERSION:
+                self.directories = kept['directories']
+
+        except (IOError, OSError, ValueError, KeyError, AttributeError):
+            pass
+
+    def save(self):
+        """ Writes the catalog to disk. It is written in place, so writing it does not change the time of the root; a run reading it half written reads the directories again."""
+
+        try:
+            with open(os.path.join(self.root, self.filename), 'w') as writefile:
+                json.dump({'version': CATALOG_VERSION, 'directories': self.directories}, writefile, sort_keys=True)
+        except (IOError, OSError):
+            pass
+
+    def read_directory(self, path):
+        """ The names of the files and directories in one directory, and its time, from the disk
+
+        Hidden names (ex. .git) are left out.
+        """
+
+        full_path = os.path.join(self.root, path)
+        mtime = os.stat(full_path).st_mtime
+
+        files = []
+        folders = []
+
+        for each_name in sorted(os.listdir(full_path)):
+
+            if each_name.startswith('.'):
+                continue
+
+            if os.path.isdir(os.path.join(full_path, each_name)):
+                folders.append(each_name)
+            else:
+                files.append(each_name)
+
+        # the time is only trusted once the directory has been still for a while
+        if time.time() - mtime < RACY_SECONDS:
+            mtime = None
+
+        return {'mtime': mtime, 'files': files, 'folders': folders}
+
+    def refresh(self, top='.'):
+        """ Brings the catalog of one directory and everything under it up to date, and writes the catalog if anything changed
+
+        :top: relative to the root, ex. 'raw_data' or '.' for all of it
+        """
+
+        if self.loaded_from != os.path.abspath(self.root):
+            self.load()
+
+        top = catalog_path(top)
+        changed = False
+
+        # every directory under top that is in the catalog now; what is left over afterwards was removed
+        removed = set(x for x in self.directories if x == top or x.startswith(top + os.sep))
+
+        stack = [top]
+
+        while stack != []:
+            path = stack.pop()
+            removed.discard(path)
+
+            try:
+                mtime = os.stat(os.path.join(self.root, path)).st_mtime
+            except OSError:
+                continue
+
+            kept = self.directories.get(path)
+
+            if kept == None or kept['mtime'] == None or kept['mtime'] != mtime:
+                try:
+                    found = self.read_directory(path)
+                except OSError:
+                    continue
+
+                if kept != found:
+                    self.directories[path] = found
+                    changed = True
+
+            stack.extend([os.path.join(path, x) for x in reversed(self.directories[path]['folders'])])
+
+        for path in removed:
+            del self.directories[path]
+            changed = True
+
+        if changed or self.index == {}:
+            self.build_index()
+
+        if changed:
+            self.save()
+
+        return self
+
+    def build_index(self):
+        """ Files each file under its site, water year and role, or aside in others by directory"""
+
+        self.index = {}
+        self.others = {}
+
+        for path, listing in self.directories.items():
+            folder = folder_site_year(path)
+
+            for each_name in listing['files']:
+                parsed = parse_name(each_name)
+
+                if folder != None and folder[2] == 'image':
+                    image = IMAGE_NAME.match(each_name)
+
+                    if image != None and folder[0] != None:
+                        parsed = (image.group(1).upper(), folder[1], 'image')
+
+                if parsed == None:
+                    self.others.setdefault(path, []).append(each_name)
+                    continue
+
+                sitecode, wateryear, role = parsed
+
+                # a file in raw_data, backups or images has the role of its directory
+                if folder != None:
+                    role = folder[2]
+
+                self.index.setdefault((sitecode, wateryear), []).append((path, each_name, role))
+
+    def walk(self, top='.'):
+        """ Like os.walk, from the catalog: (directory, folders, files) for top and every directory under it, top down"""
+
+        top = catalog_path(top)
+        stack = [top]
+
+        while stack != []:
+            path = stack.pop()
+            listing = self.directories.get(path)
+
+            if listing == None:
+                continue
+
+            yield path, listing['folders'], listing['files']
+
+            stack.extend([os.path.join(path, x) for x in reversed(listing['folders'])])
+
+    def candidates(self, sitecode, wateryear, top='.'):
+        """ (directory, name, role) of the files under top that can be of a site and water year: the ones filed under it, and every name not in a usual form (with role None)
+
+        The caller still checks the names the way it always has; this only keeps it from looking at the files of every other site and year.
+        """
+
+        top = catalog_path(top)
+
+        def under_top(path):
+            return top == '.' or path == top or path.startswith(top + os.sep)
+
+        found = [x for x in self.index.get((str(sitecode).upper(), int(wateryear)), []) if under_top(x[0])]
+
+        for path in self.others:
+            if under_top(path):
+                found.extend([(path, x, None) for x in self.others[path]])
+
+        return sorted(found, key=lambda x: (x[0], x[1]))
+
+    def site_year_files(self, sitecode, wateryear, role=None):
+        """ The paths of the files of a site and water year, ex. role 're' for the working files
+
+        ..Example:
+        >>> FILE_CATALOG.refresh().site_year_files('GSWS01', 2015, 'image')
+        >>> ['./GSWS01_2015_images/2014_10_wy_GSWS01.png', ...]
+        """
+
+        return sorted([os.path.join(x[0], x[1]) for x in self.index.get((str(sitecode).upper(), int(wateryear)), []) if role == None or x[2] == role])
+
+# the catalog of the directory the scripts are run in
+FILE_CATALOG = FileCatalog()
+
+if __name__ == "__main__":
+    """ Brings the catalog up to date and says what is in it, or lists the files of one site and year
+
+    ..Example:
+    python catalog.py
+    python catalog.py GSWS01 2015
+    """
+
+    FILE_CATALOG.refresh()
+
+    if len(sys.argv) > 2:
+        for each_path in FILE_CATALOG.site_year_files(sys.argv[1], int(sys.argv[2])):
+            print(each_path)
+    else:
+        print(str(len(FILE_CATALOG.directories)) + " directories, " + str(sum(len(x) for x in FILE_CATALOG.index.values())) + " files of " + str(len(FILE_CATALOG.index)) + " site-years, " + str(sum(len(x) for x in FILE_CATALOG.others.values())) + " others")
@@ -0,0 +1,452 @@
+#!/usr/bin env python
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from profiling import PROFILE
+
+if sys.version_info >= (3,0):
+    import queue
+else:
+    import Queue as queue
+
+# the queries of many sites are run side by side with asyncio where there is one (python 3); without it they are run one after the other
+try:
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    asyncio = None
+
+"""
+metadata.py holds the places pyflow can get its equations (HF00203, HF00204) and sample dates (CF00206) from
+
+- MSSQLBackend is the database on the server, the way pyflow has always gotten them
+- SQLiteBackend is a local copy of those three tables in one SQLite file, for working without the server (field laptops, tests)
+- CachedBackend keeps the rows each site and water year got from another backend on disk, and only asks that backend again when they are older than a time to live
+- MemoryBackend holds the three tables of a list of sites in memory, fetched with one query per table run side by side on a ConnectionPool (see prefetch_metadata), so the metadata of every site costs about one round trip to the server
+
+Every backend has fetch(table, sitecode, wateryear, sql), which gives back the rows of the query as a list of tuples. The queries are written for the server; the SQLite backend runs them on its own copy of the tables.
+
+A snapshot for working offline is made with:
+
+..Example:
+python metadata.py snapshot metadata.sqlite
+python metadata.py snapshot metadata.sqlite GSWS01 GSWSMA
+"""
+
+# the tables pyflow reads, and the columns of them a snapshot keeps
+SNAPSHOT_TABLES = [('HF00204', ['sitecode', 'eq_set', 'eq_ver', 'eqn_set_code', 'bgn_date_time', 'end_date_time']), ('HF00203', ['sitecode', 'eq_set', 'eq_ver', 'eq_num', 'ws_acres', 'max_ht', 'ln_a', 'b']), ('CF00206', ['sitecode', 'date_time'])]
+
+# these columns are kept as numbers so they sort like numbers; everything else is kept as the text pyflow would have made of it
+SNAPSHOT_NUMBERS = ['max_ht', 'ln_a', 'b']
+
+# the sample dates of GSWSMA and GSWSMF are kept under this sitecode
+SAMPLE_SITECODES = {'GSWSMA': 'GSMACK', 'GSWSMF': 'GSMACK'}
+
+# the cache directory, and how long (in seconds) what is in it is good for
+CACHE_DIRECTORY = 'metadata_cache'
+CACHE_TTL = 86400
+
+# connections to the server open at once for fetching the tables side by side, one per table
+POOL_SIZE = 3
+
+class MetadataBackend(object):
+    """ The rows of the metadata queries pyflow makes, from wherever they are kept"""
+
+    def fetch(self, table, sitecode, wateryear, sql):
+        """ Runs a query on a table for one site and water year
+
+        **Inputs**
+        :table: the table the query reads, ex. 'HF00204'
+        :sitecode: ex. 'GSWS01'
+        :wateryear: ex. 2015
+        :sql: the query as it is written for the server
+
+        **Returns**
+        :rows: list of tuples
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """ Lets go of any connection"""
+        pass
+
+class MSSQLBackend(MetadataBackend):
+    """ The metadata on the SQL server, connected to the first time it is needed
+
+    :connect: function that returns (conn, cur), ex. pyflow.fc
+    """
+
+    def __init__(self, connect):
+        self.connect = connect
+        self.conn = None
+        self.cur = None
+
+    def fetch(self, table, sitecode, wateryear, sql):
+
+        if self.cur == None:
+            self.conn, self.cur = self.connect()
+
+        self.cur.execute(sql)
+
+        return [tuple(row) for row in self.cur]
+
+    def close(self):
+        if self.conn != None:
+            self.conn.close()
+            self.conn = None
+            self.cur = None
+
+class SQLiteBackend(MetadataBackend):
+    """ A local copy of the metadata tables in one SQLite file, made by write_snapshot
+
+    :filename: the SQLite file, ex. 'metadata.sqlite'
+    """
+
+    def __init__(self, filename):
+
+        if not os.path.isfile(filename):
+            raise IOError("There is no metadata snapshot at " + filename)
+
+        self.filename = filename
+
+        # pyflow asks from a thread of its own (see pyflow.start), one query at a time
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+
+    def fetch(self, table, sitecode, wateryear, sql):
+
+        # the tables are not in a database or a schema here
+        local_sql = re.sub(r'fsdbdata\.dbo\.', '', sql, flags=re.IGNORECASE)
+
+        return [tuple(row) for row in self.conn.execute(local_sql)]
+
+    def close(self):
+        self.conn.close()
+
+class MemoryBackend(SQLiteBackend):
+    """ The metadata tables of some sites, held in a SQLite database in memory; pyflow's queries for any of those sites are answered from it the way SQLiteBackend answers them from a snapshot
+
+    :tables: dictionary of table name to a list of rows, each with the columns in SNAPSHOT_TABLES, ex. from fetch_tables
+    """
+
+    def __init__(self, tables):
+        self.filename = ':memory:'
+        self.conn = sqlite3.connect(':memory:', check_same_thread=False)
+        fill_snapshot(self.conn, tables)
+
+class ConnectionPool(object):
+    """ Backends for running queries side by side, each used by one query at a time and kept for the next; they are made the first time they are needed, up to size of them
+
+    :connect: function that makes a backend, ex. lambda: MSSQLBackend(fc)
+    :size: the most backends open at once
+
+    ..Example:
+    pool = ConnectionPool(lambda: MSSQLBackend(fc))
+    metadata = prefetch_metadata(pool, ['GSWS01', 'GSWSMA'])
+    pool.close()
+    """
+
+    def __init__(self, connect, size=POOL_SIZE):
+        self.connect = connect
+        self.size = size
+        self.idle = queue.Queue()
+        self.opened = []
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """ An idle backend, a new one if there is room for it, or else the next one let go of"""
+
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self.lock:
+            room = len(self.opened) < self.size
+
+            if room:
+                self.opened.append(None)
+
+        if not room:
+            return self.idle.get()
+
+        try:
+            backend = self.connect()
+        except Exception:
+            with self.lock:
+                self.opened.remove(None)
+            raise
+
+        with self.lock:
+            self.opened[self.opened.index(None)] = backend
+
+        return backend
+
+    def release(self, backend):
+        self.idle.put(backend)
+
+    def fetch(self, table, sql):
+        """ Runs one query on a backend of the pool, for fetch_tables"""
+
+        backend = self.acquire()
+
+        try:
+            return backend.fetch(table, None, None, sql)
+        finally:
+            self.release(backend)
+
+    def close(self):
+        for each_backend in self.opened:
+            if each_backend != None:
+                each_backend.close()
+
+        self.opened = []
+        self.idle = queue.Queue()
+
+class CachedBackend(MetadataBackend):
+    """ Keeps what another backend gives for each table, site and water year in a file, until it is older than the time to live
+
+    If the backend can not be reached, what is in the cache is used no matter how old it is.
+
+    :backend: the backend to ask, ex. MSSQLBackend(fc)
+    :directory: where the cache files go
+    :ttl: seconds a cache file is good for
+    """
+
+    def __init__(self, backend, directory=CACHE_DIRECTORY, ttl=CACHE_TTL):
+        self.backend = backend
+        self.directory = directory
+        self.ttl = ttl
+
+    def cache_name(self, table, sitecode, wateryear):
+        """ The cache file of a table, site and water year, ex. metadata_cache/HF00204_GSWS01_2015.json"""
+        return os.path.join(self.directory, table.upper() + "_" + sitecode.upper() + "_" + str(wateryear) + ".json")
+
+    def fetch(self, table, sitecode, wateryear, sql):
+
+        cache_filename = self.cache_name(table, sitecode, wateryear)
+
+        # the query is kept with the rows so a changed query is not answered from the cache
+        cached = None
+        if os.path.isfile(cache_filename):
+            with open(cache_filename, 'r') as readfile:
+                cached = json.load(readfile)
+
+            if cached['sql'] != sql:
+                cached = None
+
+        if cached != None and time.time() - os.path.getmtime(cache_filename) < self.ttl:
+            return [tuple(row) for row in cached['rows']]
+
+        try:
+            rows = self.backend.fetch(table, sitecode, wateryear, sql)
+        except Exception as exc:
+            if cached == None:
+                raise
+            print("Could not reach the metadata (" + str(exc) + "), using the cached " + table + " for " + sitecode + " " + str(wateryear))
+            return [tuple(row) for row in cached['rows']]
+
+        # pyflow only ever uses the text of what it gets, so the text is what is kept
+        rows = [tuple(None if x == None else str(x) for x in row) for row in rows]
+
+        try:
+            os.mkdir(self.directory)
+        except OSError:
+            pass
+
+        temporary_filename = cache_filename + ".tmp"
+        with open(temporary_filename, 'w') as writefile:
+            json.dump({'sql': sql, 'rows': rows}, writefile)
+
+        if sys.version_info >= (3,0):
+            os.replace(temporary_filename, cache_filename)
+        else:
+            if os.path.isfile(cache_filename):
+                os.remove(cache_filename)
+            os.rename(temporary_filename, cache_filename)
+
+        return rows
+
+    def close(self):
+        self.backend.close()
+
+def fetch_rows(source, table, sitecode, wateryear, sql):
+    """ The rows of a query, from a backend or from a plain database cursor (like the one from pyflow.fc)
+
+    **Inputs**
+    :source: a MetadataBackend or a cursor
+    :table: the table the query reads, ex. 'HF00204'
+    :sitecode: ex. 'GSWS01'
+    :wateryear: ex. 2015
+    :sql: the query as it is written for the server
+
+    **Returns**
+    :rows: list of tuples
+    """
+
+    with PROFILE.stage('fetch_' + table) as stage:
+
+        if isinstance(source, MetadataBackend):
+            rows = source.fetch(table, sitecode, wateryear, sql)
+        else:
+            source.execute(sql)
+            rows = [tuple(row) for row in source]
+
+        stage.rows = len(rows)
+
+    return rows
+
+def fetch_tables(pool, queries):
+    """ Runs queries side by side, each on a backend of the pool, with asyncio; one after the other where there is no asyncio
+
+    The drivers only block, so each query waits in a thread of its own while the event loop gathers them.
+
+    **Inputs**
+    :pool: a ConnectionPool
+    :queries: list of (table, sql), ex. from snapshot_queries
+
+    **Returns**
+    :tables: dictionary of table name to its list of rows
+    """
+
+    with PROFILE.stage('fetch_tables') as stage:
+
+        if asyncio == None:
+            results = [pool.fetch(table, sql) for table, sql in queries]
+
+        else:
+            loop = asyncio.new_event_loop()
+            executor = ThreadPoolExecutor(max_workers=pool.size)
+
+            try:
+                waiting = [loop.run_in_executor(executor, pool.fetch, table, sql) for table, sql in queries]
+                results = loop.run_until_complete(asyncio.gather(*waiting))
+            finally:
+                executor.shutdown()
+                loop.close()
+
+        stage.rows = sum(len(x) for x in results)
+
+    return dict(zip([x[0] for x in queries], results))
+
+def snapshot_queries(sitecodes=None):
+    """ One query per table for the rows of a list of sites, with 'sitecode in (...)'
+
+    **Inputs**
+    :sitecodes: ex. ['GSWS01', 'GSWSMA'] (optional, all sites by default)
+
+    **Returns**
+    :queries: list of (table, sql), in the order of SNAPSHOT_TABLES
+    """
+
+    queries = []
+
+    for table, columns in SNAPSHOT_TABLES:
+
+        sql = "SELECT " + ", ".join(columns) + " FROM fsdbdata.dbo." + table
+
+        if sitecodes != None:
+            these_sitecodes = [x.upper() for x in sitecodes]
+
+            # the sample dates of some sites are under another sitecode
+            if table == 'CF00206':
+                these_sitecodes = these_sitecodes + [SAMPLE_SITECODES[x] for x in these_sitecodes if x in SAMPLE_SITECODES]
+
+            sql += " WHERE sitecode in (" + ", ".join(["\'" + x + "\'" for x in sorted(set(these_sitecodes))]) + ")"
+
+        queries.append((table, sql))
+
+    return queries
+
+def prefetch_metadata(pool, sitecodes):
+    """ The metadata of a list of sites, fetched with one query per table run side by side on a pool, as a MemoryBackend that pyflow can use like any other
+
+    ..Example:
+    >>> metadata = prefetch_metadata(ConnectionPool(lambda: SQLiteBackend('metadata.sqlite')), ['GSWS01', 'GSWSMA'])
+    >>> pyflow.metadata_by_site(metadata, ['GSWS01', 'GSWSMA'], 2015)
+    """
+
+    return MemoryBackend(fetch_tables(pool, snapshot_queries(sitecodes)))
+
+def fill_snapshot(conn, tables):
+    """ Makes the metadata tables in a SQLite database and puts the rows in them
+
+    :conn: a sqlite3 connection
+    :tables: dictionary of table name to a list of rows, each with the columns in SNAPSHOT_TABLES
+    """
+
+    for table, columns in SNAPSHOT_TABLES:
+
+        conn.execute("CREATE TABLE " + table + " (" + ", ".join([x + (" REAL" if x in SNAPSHOT_NUMBERS else " TEXT") for x in columns]) + ")")
+
+        rows = []
+        for row in tables.get(table, []):
+            rows.append(tuple(None if value == None else (float(str(value)) if name in SNAPSHOT_NUMBERS else str(value)) for name, value in zip(columns, row)))
+
+        conn.executemany("INSERT INTO " + table + " VALUES (" + ", ".join(["?"]*len(columns)) + ")", rows)
+
+    conn.commit()
+
+def write_snapshot(filename, tables):
+    """ Writes the metadata tables to a SQLite file for SQLiteBackend, replacing the file if there is one
+
+    **Inputs**
+    :filename: ex. 'metadata.sqlite'
+    :tables: dictionary of table name to a list of rows, each with the columns in SNAPSHOT_TABLES, ex. {'CF00206': [('GSMACK', '2014-10-15 11:05:00')], ...}
+    """
+
+    if os.path.isfile(filename):
+        os.remove(filename)
+
+    conn = sqlite3.connect(filename)
+    fill_snapshot(conn, tables)
+    conn.close()
+
+def snapshot_from_server(filename, pool, sitecodes=None):
+    """ Copies the metadata tables from the server into a SQLite file, one query per table, side by side
+
+    **Inputs**
+    :filename: ex. 'metadata.sqlite'
+    :pool: a ConnectionPool of the server, ex. ConnectionPool(lambda: MSSQLBackend(fc))
+    :sitecodes: only these sites, ex. ['GSWS01', 'GSWSMA'] (optional, all sites by default)
+    """
+
+    tables = fetch_tables(pool, snapshot_queries(sitecodes))
+
+    for table, columns in SNAPSHOT_TABLES:
+        print("...copied " + str(len(tables[table])) + " rows of " + table)
+
+    write_snapshot(filename, tables)
+
+
+if __name__ == "__main__":
+    """ Makes a snapshot of the metadata for working offline
+
+    :filename: - the SQLite file to write
+    :sitecodes: - optional, only these sites
+
+    ..Example:
+    python metadata.py snapshot metadata.sqlite GSWS01 GSWSMA
+    """
+
+    if len(sys.argv) < 3 or sys.argv[1] != 'snapshot':
+        sys.exit("Usage: python metadata.py snapshot <filename> [sitecode ...]")
+
+    from pyflow import fc
+
+    pool = ConnectionPool(lambda: MSSQLBackend(fc))
+
+    try:
+        if len(sys.argv) > 3:
+            snapshot_from_server(sys.argv[2], pool, sys.argv[3:])
+        else:
+            snapshot_from_server(sys.argv[2], pool)
+    finally:
+        pool.close()
+
+    print("Wrote the metadata snapshot to " + sys.argv[2])
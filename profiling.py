@@ -0,0 +1,263 @@
+#!/usr/bin env python
+# -*- coding: utf-8 -*-
+
+import atexit
+import cProfile
+import csv
+import datetime
+import functools
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+# peak memory is only known where there is a resource module (not on Windows)
+try:
+    import resource
+except ImportError:
+    resource = None
+
+"""
+profiling.py times the stages of a weir3k.py or pyflow.py run
+
+A stage is a block of code or a whole function:
+
+..Example:
+with PROFILE.stage('write_re') as stage:
+    ...
+    stage.rows = len(copy)
+
+@timed('determine_weights', rows=len)
+def determine_weights(...):
+
+Nothing is kept unless the profile is switched on, with --profile anywhere on the command line (or PROFILE_ENVIRONMENT set to 1). With --profile=determine_weights, that stage is also run under cProfile. When the run ends, every stage it went through (name, the stage it was in, seconds, rows, and the peak memory of the process so far) is written to 'profiles' as json and csv.
+
+..Example:
+python weir3k.py GSWS01 2015 re --profile
+python pyflow.py GSWS01 2015 csv --profile=flow_the_data
+"""
+
+PROFILE_ENVIRONMENT = 'WEIR3K_PROFILE'
+
+PROFILE_DIRECTORY = 'profiles'
+
+# the columns of the csv profile, one row per time a stage was run
+PROFILE_FIELDS = ['stage', 'parent', 'start', 'seconds', 'rows', 'peak_memory_kb']
+
+# the clock for timing; time.time on old pythons
+if sys.version_info >= (3,3):
+    clock = time.perf_counter
+else:
+    clock = time.time
+
+def peak_memory_kb():
+    """ The most memory the process has held so far, in kilobytes, or None where that can not be told"""
+
+    if resource == None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # the mac counts it in bytes, linux in kilobytes
+    if sys.platform == 'darwin':
+        return peak // 1024
+
+    return peak
+
+class Stage(object):
+    """ One run of a stage, from Profile.stage. Set rows to how many rows it handled, if that means something."""
+
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+        self.rows = None
+
+    def __enter__(self):
+
+        if self.profile.enabled:
+            open_stages = self.profile.open_stages()
+            self.parent = open_stages[-1].name if open_stages != [] else None
+            open_stages.append(self)
+
+            if self.name == self.profile.cprofile_stage:
+                self.profile.profiler.enable()
+
+            self.start = clock()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        if self.profile.enabled:
+            seconds = clock() - self.start
+
+            if self.name == self.profile.cprofile_stage:
+                self.profile.profiler.disable()
+
+            self.profile.open_stages().pop()
+            self.profile.records.append({'stage': self.name, 'parent': self.parent, 'start': round(self.start - self.profile.started, 6), 'seconds': round(seconds, 6), 'rows': self.rows, 'peak_memory_kb': peak_memory_kb()})
+
+        return False
+
+class Profile(object):
+    """ The stages of one run. It is off until start is called, and then costs a clock reading per stage."""
+
+    def __init__(self):
+        self.enabled = False
+        self.records = []
+        self.threads = threading.local()
+        self.cprofile_stage = None
+        self.profiler = None
+
+    def start(self, run, cprofile_stage=None):
+        """ Switches the profile on, and writes it when the process ends
+
+        :run: the name of the run, for the file names, ex. 'weir3k_GSWS01_2015_re'
+        :cprofile_stage: the name of a stage to run under cProfile (optional)
+        """
+
+        self.enabled = True
+        self.records = []
+        self.threads = threading.local()
+        self.run = run
+        self.started = clock()
+        self.started_at = datetime.datetime.now()
+
+        if cprofile_stage != None:
+            self.cprofile_stage = cprofile_stage
+            self.profiler = cProfile.Profile()
+
+        # at the end, even if the run stops on an error or a sys.exit
+        atexit.register(self.write)
+
+    def open_stages(self):
+        """ The stages open in the thread that asks, innermost last. Each thread has its own, so the stages of work done side by side in threads (see pyflow.start) do not end up inside one another."""
+
+        if not hasattr(self.threads, 'open_stages'):
+            self.threads.open_stages = []
+
+        return self.threads.open_stages
+
+    def stage(self, name):
+        """ A stage to use with 'with', see the top of this file"""
+        return Stage(self, name)
+
+    def write(self, directory=PROFILE_DIRECTORY):
+        """ Writes the stages to <directory>/<run>_<date and time>.json and .csv, and the cProfile of the one stage to .prof
+
+        **Returns**
+        :filenames: list of the files written
+        """
+
+        if not self.enabled:
+            return []
+
+        # only once, if it is called before the end as well
+        self.enabled = False
+
+        try:
+            os.mkdir(directory)
+        except OSError:
+            pass
+
+        base = os.path.join(directory, self.run + "_" + self.started_at.strftime('%Y%m%d_%H%M%S'))
+
+        # a stage is recorded when it ends, so one that holds others comes after them; put them back in the order they started
+        records = sorted(self.records, key=lambda x: x['start'])
+
+        profile = {'run': self.run, 'argv': sys.argv, 'started': self.started_at.strftime('%Y-%m-%d %H:%M:%S'), 'seconds': round(clock() - self.started, 6), 'peak_memory_kb': peak_memory_kb(), 'stages': records}
+
+        with open(base + ".json", 'w') as writefile:
+            json.dump(profile, writefile, indent=1)
+
+        if sys.version_info >= (3,0):
+            mode = 'w'
+        else:
+            mode = 'wb'
+
+        with open(base + ".csv", mode) as writefile:
+            writer = csv.writer(writefile, quoting=csv.QUOTE_NONNUMERIC, delimiter=",")
+            writer.writerow([x.upper() for x in PROFILE_FIELDS])
+
+            for each_record in records:
+                writer.writerow([each_record[x] for x in PROFILE_FIELDS])
+
+        filenames = [base + ".json", base + ".csv"]
+
+        if self.profiler != None:
+            self.profiler.dump_stats(base + "_" + self.cprofile_stage + ".prof")
+            filenames.append(base + "_" + self.cprofile_stage + ".prof")
+
+        print("Wrote the profile of this run to " + base + ".json")
+
+        return filenames
+
+# the profile of this process
+PROFILE = Profile()
+
+def timed(name, rows=None):
+    """ Makes every call of a function a stage
+
+    :name: the name of the stage, ex. 'determine_weights'
+    :rows: a function of what the function returns that gives its number of rows, ex. len (optional)
+    """
+
+    def decorate(function):
+
+        @functools.wraps(function)
+        def timed_function(*args, **kwargs):
+
+            if not PROFILE.enabled:
+                return function(*args, **kwargs)
+
+            with PROFILE.stage(name) as stage:
+                result = function(*args, **kwargs)
+
+                if rows != None:
+                    try:
+                        stage.rows = int(rows(result))
+                    except (TypeError, ValueError, IndexError, KeyError):
+                        pass
+
+            return result
+
+        return timed_function
+
+    return decorate
+
+def switch_on_profile(argv, script):
+    """ Takes --profile or --profile=<stage> out of a command line and, if it was there (or PROFILE_ENVIRONMENT is set), starts the profile
+
+    **Inputs**
+    :argv: the command line, ex. sys.argv
+    :script: the name of the script, which starts the name of the run, ex. 'weir3k'
+
+    **Returns**
+    :argv: the command line without the option, so the other arguments are where they always were
+    """
+
+    option = os.environ.get(PROFILE_ENVIRONMENT)
+    remaining = []
+
+    for each_argument in argv:
+        if each_argument == '--profile':
+            option = '1'
+        elif each_argument.startswith('--profile='):
+            option = each_argument[len('--profile='):]
+        else:
+            remaining.append(each_argument)
+
+    if option == None or option in ['', '0']:
+        return remaining
+
+    if option == '1':
+        cprofile_stage = None
+    else:
+        cprofile_stage = option
+
+    # the arguments can hold paths, which can not go in a file name
+    PROFILE.start(re.sub(r'[^A-Za-z0-9._-]+', '-', "_".join([script] + [str(x) for x in remaining[1:]])), cprofile_stage)
+
+    return remaining
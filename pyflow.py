@@ -1,15 +1,16 @@
 #!/usr/bin env python
 # -*- coding: utf-8 -*-
 
-from scipy.interpolate import interp1d
 import numpy as np
 import datetime
 import csv
-import pymssql
 import sys
 import os
 import math
-
+import bisect
+from profiling import PROFILE, timed, switch_on_profile
+from metadata import MSSQLBackend, SQLiteBackend, CachedBackend, fetch_rows
+from timeseries import Series, FLAG_LABELS, EVENT_LABELS, DATEFORMAT_IDEAL, DATEFORMAT_DAY, datetime_to_minutes, minutes_to_datetime, minutes_to_datetimes, parse_dates, read_working_binary, read_csv_chunks, following_rows, stream_option, water_year_range, round_column, open_csv, csv_field, csv_text_fields, csv_code_fields, csv_number_fields, csv_date_fields, write_csv_columns
 
 # import itertools if it's the old python
 if sys.version_info >= (3,0):
@@ -17,13 +18,39 @@ if sys.version_info >= (3,0):
 else:
     pass
 
+# the metadata queries and the output files are done in threads alongside the rest where there is concurrent.futures (python 3, or the futures package on python 2); without it they are done one after the other
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    ThreadPoolExecutor = None
+
 """
 pyFLOW.py is a single file version of all the other flow calculators
-The inputs to pyFLOW.py are sitecode, wateryear, "csv"
+The inputs to pyFLOW.py are sitecode, wateryear, "csv", and optionally where to get the equations and sample dates from (see open_metadata)
 """
 
+# set this to a metadata snapshot (see metadata.py) to run without the server
+METADATA_ENVIRONMENT = 'PYFLOW_METADATA'
+
+# set this to 0 to do the metadata queries and write the output files one after the other, in the one thread
+THREADS_ENVIRONMENT = 'PYFLOW_THREADS'
+
+# the metadata, and the five minute, daily, sample and monthly files
+IO_THREADS = 4
+
+# the stages are kept to the thousandth of a foot, so each rating keeps the q of every thousandth from 0 up to its top (or up to this many thousandths) and looks them up rather than working out exp and log for every reading and minute
+RATING_LOOKUP_LIMIT = 100000
+
 def fc():
-    """ Connection to SQL server """
+    """ Connection to SQL server
+
+    pymssql is only loaded here, so pyflow can be run from a metadata snapshot, or imported, without it.
+    """
+
+    try:
+        import pymssql
+    except ImportError:
+        raise ImportError("pymssql is needed to reach the SQL server; without it, use a metadata snapshot (see metadata.py)")
 
     # Connect to MSSQL Server
     conn = pymssql.connect(server="stewartia.forestry.oregonstate.edu:1433",
@@ -35,6 +62,62 @@ def fc():
 
     return conn, cur
 
+def open_metadata(source=None):
+    """ Where the equations and sample dates come from
+
+    **Inputs**
+    :source: 'server' for the SQL server through the cache in 'metadata_cache', 'live' for the SQL server without the cache, or the name of a SQLite snapshot made by metadata.py. By default, the PYFLOW_METADATA environment variable, or 'server' if it is not set.
+
+    **Returns**
+    :backend: a MetadataBackend, which can be passed to get_equation_sets, get_equations_by_value and get_samples_dates in place of a cursor
+    """
+
+    if source == None:
+        source = os.environ.get(METADATA_ENVIRONMENT, 'server')
+
+    if source == 'server':
+        return CachedBackend(MSSQLBackend(fc))
+
+    elif source == 'live':
+        return MSSQLBackend(fc)
+
+    else:
+        return SQLiteBackend(source)
+
+class FinishedCall(object):
+    """ What start gives for a call that was made right away, with the same result() as a future from a thread"""
+
+    def __init__(self, value):
+        self.value = value
+
+    def result(self):
+        return self.value
+
+def io_executor():
+    """ The threads the metadata queries and the output files are done in, or None to do them one after the other (with THREADS_ENVIRONMENT set to 0, or without concurrent.futures)"""
+
+    if ThreadPoolExecutor == None or os.environ.get(THREADS_ENVIRONMENT) == '0':
+        return None
+
+    return ThreadPoolExecutor(max_workers=IO_THREADS)
+
+def start(executor, function, *args):
+    """ Starts function(*args) in a thread of the executor, or without one makes the call right away
+
+    These calls mostly wait on the server or the disk, so they go on while the main thread parses and computes. The result (or the error) is had from .result().
+
+    ..Example:
+    metadata_call = start(executor, fetch_metadata, metadata, 'GSWS01', '2015')
+    o2, bfav = get_data_from_csv(csvfilename)
+    o1, sd = metadata_call.result()
+    """
+
+    if executor == None:
+        return FinishedCall(function(*args))
+
+    return executor.submit(function, *args)
+
+@timed('get_equation_sets', rows=len)
 def get_equation_sets(cur, sitecode, wateryear):
     """
     Get the equation sets by ids to associate with the notch on and notch off, and to create a look up table for the adjustment.
@@ -42,6 +125,8 @@ def get_equation_sets(cur, sitecode, wateryear):
     EXAMPLE:
     eqns = get_equation_sets(cur, 'GSWSMA', 2015)
 
+    The cur can be a cursor or a backend from open_metadata.
+
     RETURNS:
     {'A3': {'tuple_date': [(datetime.datetime(1979, 10, 1, 0, 1), datetime.datetime(1995, 10, 1, 0, 0)), (datetime.datetime(1995, 10, 1, 0, 1), datetime.datetime(2051, 1, 1, 0, 0))], 'eqn_set': ['32', '35']}}
 
@@ -63,9 +148,7 @@ def get_equation_sets(cur, sitecode, wateryear):
         # these sites have a starting date for their current equation that is far older than last year or the year before.
         sql = "SELECT eq_set, eq_ver, eqn_set_code, bgn_date_time, end_date_time FROM fsdbdata.dbo.HF00204 WHERE sitecode like \'" + sitecode +"\'"
 
-    cur.execute(sql)
-
-    for row in cur:
+    for row in fetch_rows(cur, 'HF00204', sitecode, wateryear, sql):
 
         # eqn set + eqn ver
         cat_name = str(row[0]) + str(row[1])
@@ -82,7 +165,8 @@ def get_equation_sets(cur, sitecode, wateryear):
     return od
 
 
-def get_equations_by_value(cur, sitecode, o):
+@timed('get_equations_by_value', rows=len)
+def get_equations_by_value(cur, sitecode, o, wateryear=None):
     """
     Using the limited to one site code dictionary created by get_equation_set, get the parameters of the specific equations from HF00203. YOUR OUTPUT VARIABLE MUST MATCH YOUR THIRD INPUT ARGUMENT!
 
@@ -92,6 +176,8 @@ def get_equations_by_value(cur, sitecode, o):
 
     o = get_equations_by_value(cur, 'GSWSMA', o)
 
+    The wateryear is optional; it only names the cache file when cur is a cached backend.
+
     RETURNS:
 
     o = {'A3': {'eqns': {0.509: [3.568, 1.741562], 2.54: [3.856196, 2.168731]}, 'acres': '1436.0', 'tuple_date': [(datetime.datetime(1979, 10, 1, 0, 1), datetime.datetime(1995, 10, 1, 0, 0)), (datetime.datetime(1995, 10, 1, 0, 1), datetime.datetime(2051, 1, 1, 0, 0))], 'eqn_set': ['32', '35']}}
@@ -103,9 +189,7 @@ def get_equations_by_value(cur, sitecode, o):
 
     sql = "SELECT eq_set, eq_ver, eq_num, ws_acres, max_ht, ln_a, b from fsdbdata.dbo.HF00203 where sitecode like \'" + sitecode + "\' order by max_ht asc"
 
-    cur.execute(sql)
-
-    for row in cur:
+    for row in fetch_rows(cur, 'HF00203', sitecode, wateryear, sql):
 
         # this is the combination of set and version, like A3 or B1, etc.
         cat_name = str(row[0]) + str(row[1])
@@ -173,106 +257,254 @@ def get_data_from_sql(cur, sitecode, wateryear):
 
     return od
 
+@timed('get_data_from_csv', rows=lambda x: len(x[0]))
 def get_data_from_csv(csvfilename):
     """
     Gets the data from a csv-file. By default based on the main loop, it will look in your /working/ directory for a file which contains '_re'.
 
-    Outputs a look-up dictionary : {datetime : 'val': 0.2, 'fval' : a, 'event' : na}
+    Outputs a Series with the value 'val' (nan when missing) and the codes 'fval' and 'event'
     """
 
-    # if an input value is 'nan' then make it 'None' as a string
-    naner = lambda x: 'None' if x == 'nan' else x
+    # the binary copy that weir3k writes next to the working file is memory-mapped instead of parsing the csv, as long as the csv has not changed since
+    working, header = read_working_binary(csvfilename)
 
-    od = {}
+    if working != None:
 
-    # if data could not be found, append to this dictionary
-    bad_flags_and_values = {}
+        # column 4 of the csv is the adjusted data, column 5 the flag and column 6 the event
+        od = Series(working.minutes, values={'val': working.values['adj']}, codes={'fval': (working.codes['flag'], working.labels['flag']), 'event': (working.codes['event'], working.labels['event'])})
+
+        # every row in a binary copy was complete
+        bad_flags_and_values = {}
 
-    if sys.version_info >= (3,0):
-        mode = 'r'
     else:
-        mode = 'rb'
+        # if data could not be found, append to this dictionary
+        bad_flags_and_values = {}
 
-    with open(csvfilename, mode) as readfile:
-        reader = csv.reader(readfile)
+        if sys.version_info >= (3,0):
+            mode = 'r'
+        else:
+            mode = 'rb'
 
-        for row in reader:
-
-            # import the date from column 1 - will always be in column 1.
-            dt = datetime.datetime.strptime(str(row[1]), '%Y-%m-%d %H:%M:%S')
-
-            # get the correct value from column 4 -- this is the column which contains the adjusted data!
-            try:
-                val = naner(str(row[4]))
-
-            except Exception:
-                val = naner(str(row[3]))
-
-                # send to the output list
-                if dt not in bad_flags_and_values:
-                    bad_flags_and_values[dt] = {'val': val}
-                elif dt in bad_flags_and_values:
-                    if 'val' not in bad_flags_and_values[dt]:
-                        bad_flags_and_values[dt].update({'val': val})
-                    elif 'val' in bad_flags_and_values[dt]:
-                        bad_flags_and_values[dt].update({'duplication': True})
-
-
-            # get the flag from column 5
-            try:
-                flag = str(row[5])
-            except Exception:
-                flag = str(row[3])
-                if dt not in bad_flags_and_values:
-                    bad_flags_and_values[dt] = {'flag': flag}
-                elif dt in bad_flags_and_values:
-                    if 'flag' not in bad_flags_and_values[dt]:
-                        bad_flags_and_values[dt].update({'flag': flag})
-                    elif 'flag' in bad_flags_and_values[dt]:
-                        bad_flags_and_values[dt].update({'duplication_flag': True})
-
-            # get the event from column 6
-            try:
-                event = str(row[6])
-            except Exception:
-                event = str(row[4])
-
-            # before the maintenance event (notch), by one reading, also give a flag "MAINTV"
-            if event == "MAINTE":
-                prior_date = max(od.keys())
-                od[prior_date]['event']="MAINTV"
-            else:
-                pass
+        with open(csvfilename, mode) as readfile:
+            rows = list(csv.reader(readfile))
 
-            if dt not in od:
-                od[dt] = {'val': val, 'fval': flag, 'event' : event}
+        od = working_file_series(rows, bad_flags_and_values)
 
-            elif dt in od:
-                pass
+    mark_maintenance(od)
 
     return od, bad_flags_and_values
 
+def working_file_series(rows, bad_flags_and_values):
+    """ The Series of rows of the working csv, as get_data_from_csv reads them: the value 'val' (nan when missing) and the codes 'fval' and 'event'
+
+    :rows: the rows, as csv.reader gives them
+    :bad_flags_and_values: dictionary the rows that are missing a column are added to, by date
+    """
+
+    # if an input value is 'nan' then make it 'None' as a string
+    naner = lambda x: 'None' if x == 'nan' else x
+
+    # the columns as they are read
+    vals = []
+    flags = []
+    events = []
+
+    # import the dates from column 1 - will always be in column 1. They are parsed as one column rather than one strptime call per row.
+    minutes = parse_dates([str(row[1]) for row in rows], DATEFORMAT_IDEAL)
+
+    for index, row in enumerate(rows):
+
+        # get the correct value from column 4 -- this is the column which contains the adjusted data!
+        try:
+            val = naner(str(row[4]))
+
+        except Exception:
+            val = naner(str(row[3]))
+
+            # send to the output list, keyed on the date
+            dt = minutes_to_datetime(minutes[index])
+            if dt not in bad_flags_and_values:
+                bad_flags_and_values[dt] = {'val': val}
+            elif dt in bad_flags_and_values:
+                if 'val' not in bad_flags_and_values[dt]:
+                    bad_flags_and_values[dt].update({'val': val})
+                elif 'val' in bad_flags_and_values[dt]:
+                    bad_flags_and_values[dt].update({'duplication': True})
+
+
+        # get the flag from column 5
+        try:
+            flag = str(row[5])
+        except Exception:
+            flag = str(row[3])
+            dt = minutes_to_datetime(minutes[index])
+            if dt not in bad_flags_and_values:
+                bad_flags_and_values[dt] = {'flag': flag}
+            elif dt in bad_flags_and_values:
+                if 'flag' not in bad_flags_and_values[dt]:
+                    bad_flags_and_values[dt].update({'flag': flag})
+                elif 'flag' in bad_flags_and_values[dt]:
+                    bad_flags_and_values[dt].update({'duplication_flag': True})
+
+        # get the event from column 6
+        try:
+            event = str(row[6])
+        except Exception:
+            event = str(row[4])
+
+        vals.append(val)
+        flags.append(flag)
+        events.append(event)
+
+    # sorted by date; if a date is repeated the first one is kept
+    return Series.from_rows(minutes, values={'val': vals}, codes={'fval': flags, 'event': events}, code_labels={'fval': FLAG_LABELS, 'event': EVENT_LABELS})
+
+def mark_maintenance(od):
+    """ Before the maintenance event (notch), by one reading, also give a flag "MAINTV"
+
+    :od: the Series from get_data_from_csv, changed in place
+    """
+
+    prior_to_event = np.flatnonzero(od.is_label('event', 'MAINTE')) - 1
+    od.codes['event'][prior_to_event[prior_to_event >= 0]] = od.code_of('event', 'MAINTV')
+
+def working_data_chunks(csvfilename, chunk_rows, bad_flags_and_values):
+    """ The Series get_data_from_csv reads, a chunk of rows at a time and before the MAINTV's are marked, for --stream: from the binary copy when it still matches the csv, otherwise from the csv, which has to be in order by date
+
+    :bad_flags_and_values: dictionary the rows that are missing a column are added to, by date
+    """
+
+    working, header = read_working_binary(csvfilename)
+
+    if working != None:
+        for start in range(0, len(working), chunk_rows):
+            piece = working.take(slice(start, start + chunk_rows))
+            yield Series(piece.minutes, values={'val': piece.values['adj']}, codes={'fval': (piece.codes['flag'], piece.labels['flag']), 'event': (piece.codes['event'], piece.labels['event'])})
+
+        return
+
+    last_minute = None
+
+    for rows in read_csv_chunks(csvfilename, chunk_rows):
+
+        od = following_rows(working_file_series(rows, bad_flags_and_values), last_minute, csvfilename)
+
+        if len(od) != 0:
+            last_minute = int(od.minutes[-1])
+            yield od
+
+def stream_working_data(csvfilename, chunk_rows):
+    """ The Series get_data_from_csv gives, a chunk of rows at a time, for --stream
+
+    Whether a row gets a MAINTV depends on the row after it, so the last row of each chunk is held back until the next chunk comes.
+
+    **Returns**
+    :chunks: generator of Series with the value 'val' and the codes 'fval' and 'event', one after the other in time
+    """
+
+    held = None
+
+    for od in working_data_chunks(csvfilename, chunk_rows, {}):
+
+        if held != None:
+            od = Series.concatenate([held, od])
+
+        mark_maintenance(od)
+
+        held = od.take(slice(len(od) - 1, None))
+
+        if len(od) > 1:
+            yield od.take(slice(0, len(od) - 1))
+
+    if held != None:
+        yield held
+
+@timed('scan_working_file')
+def scan_working_file(csvfilename, chunk_rows):
+    """ What pyflow needs to know about the working file before it can go through it a chunk at a time, for --stream
+
+    **Returns**
+    :first_minute: the first date of the data, in minutes since the epoch
+    :last_minute: the last date of the data
+    :final_val: the last value of the data, which is carried to the end of the water year
+    :missing: a Series of the rows whose value is missing, for quickly_recheck_data
+    :bad_flags_and_values: as get_data_from_csv gives it
+    """
+
+    bad_flags_and_values = {}
+    first_minute = None
+    missing = []
+
+    for od in working_data_chunks(csvfilename, chunk_rows, bad_flags_and_values):
+
+        if first_minute == None:
+            first_minute = int(od.minutes[0])
+
+        last_minute = int(od.minutes[-1])
+        final_val = od.values['val'][-1]
+        missing.append(od.take(np.isnan(od.values['val'])))
+
+    if first_minute == None:
+        raise ValueError("There is no data in " + csvfilename)
+
+    return first_minute, last_minute, final_val, Series.concatenate(missing), bad_flags_and_values
+
+@timed('set_up_iterators')
 def set_up_iterators(o2, o1, wateryear):
     """ Bin the incoming data into the appropriate equation sets
-    and create some iterators
+    and collect the dates and heights of each span
 
-    od = {'b1' : 'flags' : <iterator>, 'vals' :<iterator> }
+    od = {'b1' : 'raw_dts' : [<int64 array of minutes>], 'raw_hts' : [<float64 array of heights, nan for missing>] }
     I am confident that this section is working
+
+    :o2: the Series from get_data_from_csv
     """
     od = {}
 
-    # "high-resolution dictionary"
-    hr_d = sorted(list(o2.keys()))
+    final_val = o2.values['val'][-1]
+
+    for each_span in equation_spans(o1, o2.first_date(), o2.last_date(), wateryear):
+
+        # should not fail even if the "end on" is beyond its range because it is still less than this
+        rows = o2.between(each_span['first_minute'], each_span['last_minute'])
+        raw_dts = o2.minutes[rows]
+        raw_hts = o2.values['val'][rows]
 
-    # ex. GSWSMA, 2015 : datetime.datetime(2014, 10, 1, 0, 0)
-    first_date = hr_d[0]
-    # ex. GSWSMA, 2015 : datetime.datetime(2014, 10, 1, 0, 5) (one past end)
-    last_date = hr_d[-1]
+        if each_span['ends_the_year']:
+            raw_dts = np.append(raw_dts, each_span['last_minute'])
+            raw_hts = np.append(raw_hts, final_val)
 
+        each_set = each_span['key']
+
+        if each_set not in od:
+            od[each_set] = {'raw_dts': [raw_dts], 'raw_hts':[raw_hts]}
+
+        elif each_set in od:
+            od[each_set]['raw_dts'].append(raw_dts)
+            od[each_set]['raw_hts'].append(raw_hts)
+    return od
+
+def equation_spans(o1, first_date, last_date, wateryear):
+    """ The spans of the data each equation set is used over, in the order set_up_iterators and loop_over_data go through them
+
+    **Inputs**
+    :o1: the equation sets, from get_equations_by_value
+    :first_date: the first date of the data, ex. datetime.datetime(2014, 10, 1, 0, 0)
+    :last_date: the last date of the data, ex. datetime.datetime(2015, 10, 1, 0, 0)
+    :wateryear: ex. 2015
+
+    **Returns**
+    :spans: list of dictionaries - 'key' (the eqn_set and eqn_number, ex. 'A1'), 'eqn_set' (the name loop_over_data gives its values), 'first_minute' and 'last_minute' (the rows of the data in it, both included), and 'ends_the_year' (True when the last value of the data is added on at the end of the water year, at last_minute)
+    """
+
+    spans = []
 
     for each_set in sorted(list(o1.keys())):
         list_of_tuples_sorted = sorted(list(o1[each_set]['tuple_date']))
 
+        # the spans found for this set, whose equation set names are taken in order
+        found = 0
+
         for each_tuple in list_of_tuples_sorted:
 
             # if the last date of the tuple comes before the data starts, pass it
@@ -298,33 +530,19 @@ def set_up_iterators(o2, o1, wateryear):
             else:
                 end_on = each_tuple[1]+datetime.timedelta(minutes=5)
 
-            # should not fail even if the "end on" is beyond its range because it is still less than this
-            dts = [x for x in hr_d if x >= begin_on and x <= end_on]
-
-
             print("Data Found ! Under the group of eqn_set and eqn_number \'" + each_set + "\', which starts on " + datetime.datetime.strftime(begin_on, '%Y-%m-%d %H:%M:%S') + " and ends on " + datetime.datetime.strftime(end_on, '%Y-%m-%d %H:%M:%S'))
 
+            # (a begin date with seconds, like 00:00:01, starts on the next minute)
+            spans.append({'key': each_set, 'eqn_set': o1[each_set]['eqn_set'][found], 'first_minute': datetime_to_minutes(begin_on) + (begin_on.second > 0), 'last_minute': datetime_to_minutes(end_on), 'ends_the_year': end_on == datetime.datetime(int(wateryear), 10,1,0,5)})
+            found += 1
 
-            final_val = o2[max(o2.keys())]['val']
-            all_hts = [o2[x]['val'] for x in dts]
-
-            if end_on == datetime.datetime(int(wateryear), 10,1,0,5):
-                dts.append(end_on)
-                all_hts.append(final_val)
-
-            raw_dts = iter(dts)
-            raw_hts = iter(all_hts)
-
-            if each_set not in od:
-                od[each_set] = {'raw_dts': [raw_dts], 'raw_hts':[raw_hts]}
-
-            elif each_set in od:
-                od[each_set]['raw_dts'].append(raw_dts)
-                od[each_set]['raw_hts'].append(raw_hts)
-    return od
+    return spans
 
+@timed('get_samples_dates', rows=len)
 def get_samples_dates(cur, sitecode, wateryear):
     """ Creates a list of tuple date ranges between the starting date and the ending date - base on the begining date, anything afterward doesn't get to count
+
+    The cur can be a cursor or a backend from open_metadata.
     """
 
     startdate = datetime.datetime.strftime(datetime.datetime(int(wateryear)-1,10,1,0,0), '%Y-%m-%d %H:%M:%S')
@@ -337,12 +555,10 @@ def get_samples_dates(cur, sitecode, wateryear):
 
         query = "select date_time from fsdbdata.dbo.cf00206 where sitecode like \'GSMACK\' and date_time >= \'" + startdate + "\' and date_time < \'" + enddate + "\' order by date_time asc"
 
-    cur.execute(query)
-
     # list of tuples containing start and end dates
     Sdate_list = []
 
-    for row in cur:
+    for row in fetch_rows(cur, 'CF00206', sitecode, wateryear, query):
 
         dt = datetime.datetime.strptime(str(row[0]), '%Y-%m-%d %H:%M:%S')
 
@@ -372,14 +588,51 @@ def get_samples_dates(cur, sitecode, wateryear):
 
     return Sdate_list
 
+def fetch_metadata(metadata, sitecode, wateryear):
+    """ The equations by value and the sample dates of a site and water year, the queries one after the other on the one connection; with start, they are done while the working file is read
+
+    **Returns**
+    :o1: from get_equations_by_value
+    :sd: from get_samples_dates
+    """
+
+    with PROFILE.stage('fetch_metadata'):
+
+        # get the equation sets you need to run this analysis
+        o = get_equation_sets(metadata, sitecode, wateryear)
+
+        # modify that dictionary to have the maxheight mapped to ln_a and b
+        o1 = get_equations_by_value(metadata, sitecode, o, wateryear)
+
+        # get the sample dates.
+        sd = get_samples_dates(metadata, sitecode, wateryear)
+
+    return o1, sd
+
+def metadata_by_site(metadata, sitecodes, wateryear):
+    """ fetch_metadata for each of a list of sites; give it a backend from metadata.prefetch_metadata, and the queries are answered from memory
+
+    **Returns**
+    :by_site: dictionary of sitecode to (o1, sd)
+
+    ..Example:
+    >>> metadata_by_site(prefetch_metadata(pool, ['GSWS01', 'GSWSMA']), ['GSWS01', 'GSWSMA'], '2015')
+    >>> {'GSWS01': (o1, sd), 'GSWSMA': (o1, sd)}
+    """
+
+    return dict((x, fetch_metadata(metadata, x, wateryear)) for x in sitecodes)
 
+@timed('loop_over_data', rows=len)
 def loop_over_data(o3, o1):
     """
     This is a function wrapper for the data iterators, it identifies the iterators in each key, identifies the set of rating equations associated with that key, and runs the `flow` on that data, returning the results.
+
+    The results are a Series with the values 'stage', 'inst_q', 'total_q', 'mean_q' and the code 'eqn_set'.
     """
 
-    # final output dictionary
-    od_1 = {}
+    # the output of each span, and its equation set name
+    flows = []
+    eqn_sets = []
 
     # each of the tuples, i.e. 'C1', 'B1'
     for each_key in sorted(list(o3.keys())):
@@ -388,8 +641,8 @@ def loop_over_data(o3, o1):
         raw_dts_1 = o3[each_key]['raw_dts']
         raw_hts_1 = o3[each_key]['raw_hts']
 
-        # rating calib is the possible calibrations: ex. {0.509: [3.568, 1.741562], 2.54: [3.856196, 2.168731]} which is {max height: [ln_a, b]}
-        rating_calib = o1[each_key]['eqns']
+        # rating calib is the possible calibrations: ex. {0.509: [3.568, 1.741562], 2.54: [3.856196, 2.168731]} which is {max height: [ln_a, b]}, sorted once for the whole set
+        rating_calib = rating_table(o1[each_key]['eqns'])
 
         # the numerical name of the eqn set
         eq_sets = o1[each_key]['eqn_set']
@@ -398,97 +651,174 @@ def loop_over_data(o3, o1):
         for index, value in enumerate(raw_dts_1):
             print("the key processed is " + each_key + " and the index is " + str(index))
 
-            # the equation set name; i.e. "3" or "4" or "2"
-            computed_eq_set = eq_sets[index]
+            # create an output structure called od_2 - a Series of stages, instq, total_q, and mean_q, in order, by dates; the equation set name is i.e. "3" or "4" or "2"
+            flows.append(flow_the_data(raw_dts_1[index], raw_hts_1[index], rating_calib, desired=300))
+            eqn_sets.append(eq_sets[index])
 
-            # create an output structure called od_2
-            od_2 = flow_the_data(raw_dts_1[index], raw_hts_1[index], rating_calib, desired=300)
+            #print("....Processed all found data for eqn_set + eqn_num \'" + each_key + "\' over " + str(index) + " values ")
+        #print(".....Finished processing data for eqn_set + eqn_num :" + each_key)
 
-            # this is the list of dates, stages, instq, total_q, and mean_q, in order, by dates
-            computed_dates = sorted(list(od_2.keys()))
+    od_1, repeated = join_span_flows(flows, eqn_sets)
 
-            #print("the number of values in this date structure were " + str(len(od_2)))
+    if repeated > 0:
+        print(str(repeated) + " dates had already been included in the lookup")
 
-            computed_stages = [od_2[x]['stage'] for x in computed_dates]
-            computed_inst_q = [od_2[x]['inst_q'] for x in computed_dates]
-            computed_total_q = [od_2[x]['total_q'] for x in computed_dates]
-            computed_mean_q = [od_2[x]['mean_q'] for x in computed_dates]
+    return od_1
 
-            for index, each_date in enumerate(computed_dates):
+def join_span_flows(flows, eqn_sets):
+    """ One Series from the output of flow_the_data for each span, in the order of the spans, with the code 'eqn_set'. If a date was computed under two equation sets, the first one is kept.
 
-                if each_date not in od_1:
-                    od_1[each_date] = {'stage': computed_stages[index], 'inst_q': computed_inst_q[index], 'total_q' : computed_total_q[index], 'mean_q': computed_mean_q[index], 'eqn_set' : computed_eq_set}
+    **Inputs**
+    :flows: list of Series from flow_the_data
+    :eqn_sets: list of the equation set name of each, ex. ['32', '35']
 
-                elif each_date in od_1:
-                    print("this date has already been included in the lookup")
+    **Returns**
+    :od: the Series
+    :repeated: how many dates were left out because they had already been included
+    """
 
-            #print("....Processed all found data for eqn_set + eqn_num \'" + each_key + "\' over " + str(index) + " values ")
-        #print(".....Finished processing data for eqn_set + eqn_num :" + each_key)
+    final_dates = np.concatenate([x.minutes for x in flows] + [np.zeros(0, dtype=np.int64)])
 
-    return od_1
+    final_columns = {}
+    for name in ['stage', 'inst_q', 'total_q', 'mean_q']:
+        final_columns[name] = np.concatenate([x.values[name] for x in flows] + [np.zeros(0)])
 
+    final_eqn_sets = []
+    for each_flow, each_set in zip(flows, eqn_sets):
+        final_eqn_sets.extend([each_set]*len(each_flow))
 
-def check_value_versus_keys(rating_calib, value):
-    """
-    Recursively scans the parameters for the log-function to find those that apply, returning a minimum threshold (maximum height of previous value) and the value (max height) that is the upper threshold
-    """
+    od = Series.from_rows(final_dates, values=final_columns, codes={'eqn_set': final_eqn_sets})
 
-    for index, each_value in enumerate(sorted(rating_calib.keys())):
+    return od, len(final_dates) - len(od)
 
-        if value <= each_value:
-            try:
-                lower_value = each_value[index-1]
-            except Exception:
-                lower_value = 0
-            return lower_value, each_value
-        else:
-            pass
 
-def interpolate_raw(first_value, second_value, interval_length):
-    """ Returns appropriate linear interpolation,
-    usually is 5 minutes.
-    Sadly you'd be numpy-free without this.
+class RatingTable(object):
+    """ The rating equations of one equation set, sorted once so stages can be looked up by bisection
+
+    Each equation covers the stages above the max height of the equation before it (0 for the first one) up to and including its own max height.
+
+    **Inputs**
+    :eqns: the 'eqns' dictionary from get_equations_by_value, {max height: [ln_a, b]}, ex. {0.509: [3.568, 1.741562], 2.54: [3.856196, 2.168731]}
+
+    ..Example:
+
+    >>> rating = RatingTable({0.509: [3.568, 1.741562], 2.54: [3.856196, 2.168731]})
+    >>> rating.bounds(1.2)
+    >>> (0.509, 2.54)
+    >>> rating[2.54]
+    >>> [3.856196, 2.168731]
     """
 
-    fxn_interp = interp1d([0,interval_length],[first_value, second_value])
+    def __init__(self, eqns):
 
-    # a np_array containing the interpolated values
-    try:
-        return fxn_interp(xrange(0, interval_length))
-    except Exception:
-        try:
-            return fxn_interp(range(0, interval_length))
-        except Exception:
-            return fxn_interp(range(0, int(interval_length)))
+        self.eqns = eqns
+
+        # the breakpoints, and the parameters of each equation in the same order
+        self.max_heights = sorted(eqns.keys())
+        self.min_heights = [0] + self.max_heights[:-1]
+
+        self.max_array = np.array(self.max_heights, dtype=np.float64)
+        self.ln_a = np.array([eqns[x][0] for x in self.max_heights], dtype=np.float64)
+        self.b = np.array([eqns[x][1] for x in self.max_heights], dtype=np.float64)
+
+        # the q of each thousandth of a foot, made the first time it is needed (see lookup)
+        self.lookup_q = None
+
+    def __getitem__(self, max_height):
+        """ [ln_a, b] of the equation with that max height, like the 'eqns' dictionary"""
+        return self.eqns[max_height]
+
+    def bounds(self, stage):
+        """ The lower cutoff (max height of the equation before, or 0) and the max height of the equation a stage falls under. None if the stage is above the top equation or is not a number"""
+
+        # this is also False for a nan
+        if not stage <= self.max_heights[-1]:
+            return None
+
+        index = bisect.bisect_left(self.max_heights, stage)
+
+        return self.min_heights[index], self.max_heights[index]
+
+    def segments(self, stages):
+        """ The index of the equation each of an array of stages falls under; len(self.max_heights) for a stage above the top equation or a nan"""
+        return np.searchsorted(self.max_array, stages, side='left')
+
+    def lookup(self):
+        """ The q of every thousandth of a foot from 0 up to the top equation (or RATING_LOOKUP_LIMIT thousandths), from evaluate; made once and kept"""
+
+        if self.lookup_q is None:
+            top = int(min(math.floor(self.max_heights[-1]*1000), RATING_LOOKUP_LIMIT))
+            self.lookup_q = self.evaluate(np.arange(max(top, 0) + 1)/1000.)
 
+        return self.lookup_q
 
-def check_interval_length(first_date, second_date, desired=300):
+    def discharge(self, stages):
+        """ Discharge, exp(ln_a + b*ln(stage)), for an array of stages, each on its own equation. nan where logfunc would give None - a stage that is not positive, above the top equation, or nan
+
+        A stage that is exactly a thousandth of a foot, as every stage read from a file is and every minute between two readings at the same height is, is looked up in the table from lookup; the q there was worked out from that same number, so it is the same q. Any other stage is worked out with evaluate.
+        """
+
+        stages = np.asarray(stages, dtype=np.float64)
+        table = self.lookup()
+
+        keys = np.rint(stages*1000)
+        on_table = (keys/1000. == stages) & (keys >= 0) & (keys < len(table))
+
+        if on_table.all():
+            return table[keys.astype(np.int64)]
+
+        inst_q = np.empty(stages.shape, dtype=np.float64)
+        inst_q[on_table] = table[keys[on_table].astype(np.int64)]
+        inst_q[~on_table] = self.evaluate(stages[~on_table])
+
+        return inst_q
+
+    def evaluate(self, stages):
+        """ Discharge for an array of stages from the equations themselves, for discharge"""
+
+        stages = np.asarray(stages, dtype=np.float64)
+        index = self.segments(stages)
+
+        valid = (index < len(self.max_heights)) & (stages > 0)
+        index = np.minimum(index, len(self.max_heights) - 1)
+
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            inst_q = np.exp(self.ln_a[index] + self.b[index]*np.log(stages))
+
+        # math.exp raises rather than giving inf
+        inst_q[~valid | np.isinf(inst_q)] = np.nan
+
+        return inst_q
+
+# the RatingTable of each set of equations seen so far, so the spans of an equation set, and the sites and years that share one, make its lookup once
+RATING_TABLES = {}
+
+def rating_table(eqns):
+    """ The RatingTable of an 'eqns' dictionary, the same one for the same equations every time it is asked for
+
+    ..Example:
+    >>> rating_table({0.509: [3.568, 1.741562], 2.54: [3.856196, 2.168731]}) is rating_table({2.54: [3.856196, 2.168731], 0.509: [3.568, 1.741562]})
+    >>> True
     """
-    Check to be sure the interval is the correct length
-    the default correct length is 5 minutes
+
+    key = tuple(sorted((x, tuple(eqns[x])) for x in eqns))
+
+    if key not in RATING_TABLES:
+        RATING_TABLES[key] = RatingTable(eqns)
+
+    return RATING_TABLES[key]
+
+def check_value_versus_keys(rating_calib, value):
     """
-    if type(first_date) == str:
-        dt1 = datetime.datetime.strptime(first_date,'%Y-%m-%d %H:%M:%S')
-    else:
-        pass
+    Finds the equation that applies to a value, returning a minimum threshold (maximum height of previous equation) and the value (max height) that is the upper threshold
 
-    if type(second_date) == str:
-        dt2 = datetime.datetime.strptime(second_date,'%Y-%m-%d %H:%M:%S')
-    else:
-        pass
+    :rating_calib: the 'eqns' dictionary or a RatingTable; build the RatingTable once if you are looking up many values
+    """
 
-    try:
-        dt_diff = second_date - first_date
-    except Exception:
-        dt_diff = dt2-dt1
+    if not isinstance(rating_calib, RatingTable):
+        rating_calib = rating_table(rating_calib)
 
-    if dt_diff.seconds == 300 and dt_diff.days == 0:
-        return 5
-    else:
-        # make sure to include the whole days too
-        #print("interval is not the right length!")
-        #print("using " + str(int(dt_diff.seconds)/60))
-        return int(dt_diff.days)*1440 + int(dt_diff.seconds)/60
+    return rating_calib.bounds(value)
 
 def logfunc(a,b,x):
     """ the transform we need to solve for winters """
@@ -517,18 +847,22 @@ def flag_daily_streams(output_5, output_daily):
         else:
             reader.next()
 
-        for row in reader:
-            # get date-time, flag, etc.
-            dt = datetime.datetime.strptime(str(row[4]), '%Y-%m-%d %H:%M:%S')
-            flag = str(row[13])
-            # set new date-time to be based on year, month, day
-            new_dt = datetime.datetime(dt.year, dt.month, dt.day)
-
-            # now append all flags to a list like 2015-05-15 : ['A', 'A', 'A']
-            if new_dt not in od:
-                od[new_dt] = [flag]
-            elif new_dt in od:
-                od[new_dt].append(flag)
+        rows = list(reader)
+
+    # get date-time, flag, etc. - the dates are parsed as one column and floored to the day; the five minute file is in order, so each day is one run of rows
+    day_of = parse_dates([str(row[4]) for row in rows], DATEFORMAT_IDEAL) // 1440
+    flags = np.array([str(row[13]) for row in rows], dtype=object)
+
+    if len(rows) != 0:
+        starts = np.flatnonzero(np.concatenate(([True], day_of[1:] != day_of[:-1])))
+        day_counts = np.diff(np.concatenate((starts, [len(rows)])))
+
+        flag_counts = dict((x, np.add.reduceat((flags == x).astype(np.int64), starts).tolist()) for x in ["M", "E", "Q"])
+
+        # the number of each flag in each day, like 2015-05-15 : {'M': 0, 'E': 2, 'Q': 0, 'total': 288}
+        for index, each_day in enumerate(minutes_to_datetimes(day_of[starts]*1440)):
+            od[each_day] = {'M': flag_counts["M"][index], 'E': flag_counts["E"][index], 'Q': flag_counts["Q"][index], 'total': int(day_counts[index])}
+
     od_1 = {}
 
     if sys.version_info >= (3,0):
@@ -543,17 +877,20 @@ def flag_daily_streams(output_5, output_daily):
         else:
             reader.next()
 
-        for row in reader:
-            dt = datetime.datetime.strptime(str(row[4]), '%Y-%m-%d')
-            other_stuff = [str(x) for x in row]
+        rows = list(reader)
+
+    daily_dates = minutes_to_datetimes(parse_dates([str(row[4]) for row in rows], DATEFORMAT_DAY))
 
-            od_1[dt] = other_stuff
+    for index, row in enumerate(rows):
+        other_stuff = [str(x) for x in row]
+
+        od_1[daily_dates[index]] = other_stuff
 
     for each_key in od.keys():
 
-        percent_m = len([x for x in od[each_key] if x == "M"])/len(od[each_key])
-        percent_e = len([x for x in od[each_key] if x == "E"])/len(od[each_key])
-        percent_q = len([x for x in od[each_key] if x == "Q"])/len(od[each_key])
+        percent_m = float(od[each_key]["M"])/od[each_key]['total']
+        percent_e = float(od[each_key]["E"])/od[each_key]['total']
+        percent_q = float(od[each_key]["Q"])/od[each_key]['total']
 
         if percent_m > 0.2:
             daily_flag = "M"
@@ -586,322 +923,185 @@ def flag_daily_streams(output_5, output_daily):
 
             writer.writerow(od_1[each_new_key])
 
-def flow_the_data(raw_dts, raw_hts, rating_calib, desired=300):
+@timed('flow_the_data', rows=len)
+def flow_the_data(raw_dts, raw_hts, rating_calib, desired=300, report=True):
     """
-    the actual computation occurs here
+    the actual computation occurs here, for one span of data on one equation set, all at once
     the desired interval is 300 seconds, or "5 minutes"
-    """
-
-    od = {}
-
-    # initial values - database precision is 6. Since we need to round it out, go to 7.
-    # You might have to play with this if the numbers are off a little bit.
-    # Not going out enough or too much will throw you into the wrong equation set.
 
-    if sys.version_info >= (3,0):
-        try:
-            this_stage = round(float(next(raw_hts)),7)
-        except Exception:
-            import pdb; pdb.set_trace()
-    else:
-        this_stage = round(float(raw_hts.next()),7)
+    Each reading is paired with the one after it, and the pair is computed one of three ways:
 
-    print("the first stage is " + str(this_stage))
+    - HAPPIEST CASE: five minutes apart at the same height. The q at this height is integrated over 300 seconds.
+    - NEXT HAPPIEST CASE: five minutes apart and the next height is in the same "bracket" of the rating (above the max height of the equation below this one, up to this one's max height). The trapezoid method.
+    - otherwise: the height is linearly interpolated for each minute from this reading up to the next, and the q of each minute comes from the equation that minute's height falls in. Every five of those minutes make a five minute value, at this reading's date and then every five minutes after it (the "pseudo dates"), so sparse data is filled out to five minutes; minutes left over at the end do not make a value. The total of a pseudo date is the sum of its first four minutes, as it always has been.
 
-    if sys.version_info >= (3,0):
-        this_date = next(raw_dts)
-    else:
-        this_date = raw_dts.next()
-    print("the first date is " + datetime.datetime.strftime(this_date,'%Y-%m-%d %H:%M:%S'))
+    Missing heights are passed over, so the readings on either side of them are one (longer) interval. A height above the top of the rating ends the span: it is reported and nothing from that reading on is computed.
 
-    # Iteration will continue until we run out of values... exception is thrown and results returned
-    while True:
+    **Inputs**
+    :raw_dts: int64 array of minutes since the epoch, sorted
+    :raw_hts: float64 array of heights, nan for missing
+    :rating_calib: the RatingTable for the equation set (an 'eqns' dictionary is also accepted)
+    :report: print the first stage and date (a span computed a chunk at a time, see SpanFlow, only reports its first chunk)
 
-        try:
-            try:
-                low_cutoff, this_max = check_value_versus_keys(rating_calib, this_stage)
-
-            except TypeError:
-                import pdb; pdb.set_trace()
-                try:
-                    low_cutoff, this_max = None, None
-                    print("A type error occurred, check if there is a None in the data on " + datetime.datetime.strftime(this_date, '%Y-%m-%d %H:%M:%S'))
-                except Exception:
-                    print("the exception was thrown here and od was returned")
-                    import pdb; pdb.set_trace()
-                    return od
-
-            try:
-                if sys.version_info >= (3,0):
-                    next_stage = round(float(next(raw_hts)),7)
-                else:
-                    next_stage = round(float(raw_hts.next()),7)
+    **Returns**
+    :od: a Series with the values 'stage', 'inst_q', 'total_q', 'mean_q'; a five minute date that has no q has its stage and nan for the rest
+    """
 
-                if sys.version_info >= (3,0):
-                    next_date = next(raw_dts)
-                else:
-                    next_date = raw_dts.next()
+    if not isinstance(rating_calib, RatingTable):
+        rating_calib = rating_table(rating_calib)
 
-            except Exception:
-                # iterate over the "next" values that don't work - i.e. you want to pass over the value that doesn't work because it is a None or NaN ...
-                #import pdb; pdb.set_trace()
-                if sys.version_info >= (3,0):
-                    discard_output1 = next(raw_hts)
-                else:
-                    discard_output1 = raw_hts.next()
+    # initial values - database precision is 6. Since we need to round it out, go to 7.
+    # You might have to play with this if the numbers are off a little bit.
+    # Not going out enough or too much will throw you into the wrong equation set.
+    stages = round_column(raw_hts, 7)
+    minutes = np.asarray(raw_dts, dtype=np.int64)
 
-                if sys.version_info >= (3,0):
-                    discard_output2 = next(raw_dts)
-                else:
-                    discard_output2 = raw_dts.next()
+    # missing heights are skipped over
+    present = ~np.isnan(stages)
+    stages = stages[present]
+    minutes = minutes[present]
 
-                print("unexpected next value of " + str(discard_output1) + " for " + datetime.datetime.strftime(discard_output2, '%Y-%m-%d %H:%M:%S'))
-                print("skipping this value and continuing")
+    segment = rating_calib.segments(stages)
 
-                if str(discard_output1) == "nan":
-                    discard_output1 = "None"
+    # a height over the top of the rating can't be computed, and neither can anything after it
+    above = np.flatnonzero(segment == len(rating_calib.max_heights))
 
-                # dealing with when you have an interval that comes off a missing value - if there isn't a stage, all outputs is none -- if there is a stage, give the stage
-                if str(discard_output1)=="None":
-                    od[discard_output2] = {'stage': None, 'inst_q': None, 'total_q': None, 'mean_q':None}
-                else:
-                    od[discard_output2] ={'stage': discard_output1, 'inst_q': None, 'total_q': None, 'mean_q': None}
+    if len(above) > 0:
+        print("the height of " + str(stages[above[0]]) + " on " + datetime.datetime.strftime(minutes_to_datetime(minutes[above[0]]), '%Y-%m-%d %H:%M:%S') + " is over the max height of the rating, please check it. Nothing from there to the end of this equation set is computed")
+        stages = stages[:above[0]]
+        minutes = minutes[:above[0]]
+        segment = segment[:above[0]]
 
-                #import pdb; pdb.set_trace()
-                continue
+    if len(stages) < 2:
+        return Series(np.zeros(0, dtype=np.int64), values={'stage': [], 'inst_q': [], 'total_q': [], 'mean_q': []})
 
-            #if this_date == datetime.datetime(2014,10,2,0,0):
-            #    import pdb; pdb.set_trace()
-            # makes sure that the interval is the correct length (300 seconds == 5 minutes). if it is not, returns the appropriate length. If you want not five minutes add in a third arguement for a different stamp like: interval_length = check_interval_length(this_date, next_date, desired = 100) or whatever you want
-            interval_length = check_interval_length(this_date, next_date)
+    if report:
+        print("the first stage is " + str(stages[0]))
+        print("the first date is " + datetime.datetime.strftime(minutes_to_datetime(minutes[0]),'%Y-%m-%d %H:%M:%S'))
 
-            # HAPPIEST CASE: if the next stage is the same height as this stage height and they are 5 minutes apart then we can take the calculated value for this height and integrate it over 300 seconds (5 minutes)
-            if next_stage == this_stage and interval_length == desired/60:
+    # this reading and the next one
+    this_stage = stages[:-1]
+    next_stage = stages[1:]
+    this_segment = segment[:-1]
 
-                #print "desired interval length is " + str(desired/60)
+    # minutes from this reading to the next one
+    interval_length = np.diff(minutes)
 
-                #print "next stage is this stage : " + str(this_stage) + " on " + datetime.datetime.strftime(this_date,'%Y-%m-%d %H:%M:%S')
+    # q at every reading; nan where there is none (like a height of 0)
+    inst_q = rating_calib.discharge(stages)
+    instq_now = inst_q[:-1]
+    instq_next = inst_q[1:]
 
-                inst_q = logfunc(rating_calib[this_max][0],rating_calib[this_max][1], this_stage)
+    five_minutes = interval_length == desired/60
 
-                # record the values
-                if this_date not in od:
-                    try:
-                        od[this_date] ={'stage': round(this_stage,3), 'inst_q': inst_q, 'total_q': desired*inst_q, 'mean_q': inst_q}
+    # HAPPIEST CASE
+    happiest = five_minutes & (next_stage == this_stage)
 
-                    except Exception:
-                        # this might happen if there is no flow or "negative flow"
-                        od[this_date] ={'stage': round(this_stage,3), 'inst_q': None, 'total_q': None, 'mean_q': None}
-                else:
-                    print("this error should never occur - " + datetime.datetime.strftime(this_date, '%Y-%m-%d %H:%M:%S') + " has already been processed for this site and value!!")
+    # NEXT HAPPIEST CASE: the next stage is in the same bracket
+    low_cutoff = np.array(rating_calib.min_heights, dtype=np.float64)[this_segment]
+    this_max = rating_calib.max_array[this_segment]
+    like = five_minutes & ~happiest & (next_stage <= this_max) & (next_stage > low_cutoff)
 
-                # update the "current stage and date"
-                this_stage = next_stage
-                this_date = next_date
-                continue
+    unlike = ~happiest & ~like
 
-            # NEXT HAPPIEST CASE: if the next stage height is in the same "bracket" as this stage height and they are five minutes apart then we can do the trapezoid method
-            elif next_stage <= this_max and next_stage > low_cutoff and interval_length==desired/60:
+    # the happiest and next happiest values go on this reading's date
+    happiest_q = instq_now[happiest]
 
-                #print "next stage is LIKE stage : " + str(this_stage) + " on " + datetime.datetime.strftime(this_date, '%Y-%m-%d %H:%M:%S')
+    # 1/2 * 300 seconds interval  * (base 1 + base 2)
+    traps = 0.5*desired*(instq_now[like] + instq_next[like])
 
-                # current q, q in 5 minutes
-                instq_now  = logfunc(rating_calib[this_max][0],rating_calib[this_max][1], this_stage)
-                instq_next = logfunc(rating_calib[this_max][0],rating_calib[this_max][1], next_stage)
+    # if either q is missing, none of the q's are kept
+    like_q = np.where(np.isnan(traps), np.nan, instq_now[like])
 
-                try:
-                    # 1/2 * 300 seconds interval  * (base 1 + base 2)
-                    traps = 0.5*desired*(instq_now + instq_next)
+    # for the rest, interpolate for one minute for each value from this reading up to the next
+    unlike_index = np.flatnonzero(unlike)
+    unlike_length = interval_length[unlike]
 
-                    # record the values
-                    if this_date not in od:
-                        od[this_date] = {'stage': this_stage, 'inst_q': instq_now, 'total_q': traps, 'mean_q': traps/desired}
-                    else:
-                        print("this error should never occur - " + datetime.datetime.strftime(this_date, '%Y-%m-%d %H:%M:%S') + " has already been processed for this site and value!!")
+    starts = np.cumsum(unlike_length) - unlike_length
+    owner = np.repeat(np.arange(len(unlike_index)), unlike_length)
+    minute_of = np.arange(len(owner)) - starts[owner]
 
-                except Exception:
+    # the same arithmetic np.interp does on [0, interval_length]
+    slope = (next_stage[unlike_index] - this_stage[unlike_index])/unlike_length.astype(np.float64)
+    one_minute_heights = slope[owner]*minute_of + this_stage[unlike_index][owner]
 
-                    # record the values - in this case there is some problem with the processing of now or later, don't know which
-                    if this_date not in od:
-                        od[this_date] = {'stage': this_stage, 'inst_q': None, 'total_q': None, 'mean_q': None}
-                    else:
-                        print("this error should never occur - " + datetime.datetime.strftime(this_date, '%Y-%m-%d %H:%M:%S') + " has already been processed for this site and value!!")
+    # this is essentially cf/minute; nan where there is no q
+    one_minute_q = 60*rating_calib.discharge(one_minute_heights)
+    summable_q = np.where(np.isnan(one_minute_q), 0., one_minute_q)
 
-                # update the "current stage and date"
-                this_stage = next_stage
-                this_date = next_date
+    # every five minutes makes a value: the first minute gives the height and the inst q, the five together give the total
+    chunks = unlike_length//5
+    chunk_owner = np.repeat(np.arange(len(unlike_index)), chunks)
+    chunk_number = np.arange(len(chunk_owner)) - (np.cumsum(chunks) - chunks)[chunk_owner]
+    first_minute = starts[chunk_owner] + 5*chunk_number
 
-                continue
+    # added in order, like the sum of a list. Only a five minute reading has all five minutes in its total; the pseudo dates have always been totalled before their fifth minute was added, so they are kept that way
+    whole_interval = unlike_length[chunk_owner] == desired/60
 
+    this_total = summable_q[first_minute]
+    for each_minute in range(1, 4):
+        this_total = this_total + summable_q[first_minute + each_minute]
+    this_total = np.where(whole_interval, this_total + summable_q[first_minute + 4], this_total)
 
-            # if the next stage > this_max or the next_stage <= the low cutoff or the interval length is not 5
-            else:
-                try:
+    this_inst = one_minute_q[first_minute]/60
+    this_mean = this_total/300
+    # the interpolated heights have always been rounded the numpy way (scaled and rounded to even), not like the builtin round
+    chunk_stage = np.round(one_minute_heights[first_minute], 3)
+    chunk_minutes = minutes[unlike_index][chunk_owner] + 5*chunk_number
 
-                    # if its not in that same range we get a new calibration
-                    low_cutoff, this_max = check_value_versus_keys(rating_calib, next_stage)
+    # without a q at the first minute, there is no value
+    no_first = np.isnan(this_inst)
+    this_total[no_first] = np.nan
+    this_mean[no_first] = np.nan
 
-                except Exception:
-                    # will be called  if the value is none/nan/unexpected
-                    print("Adam has assigned an unexceptable missing code or the data value is way out of the allowed range of the max height, please check on " + datetime.datetime.strftime(this_date, '%Y-%m-%d %H:%M:%S') + ", converting to Pythonic None")
+    # a five minute interval whose first minute has no q but whose other minutes do is left out altogether
+    all_missing = np.isnan(one_minute_q[first_minute])
+    for each_minute in range(1, 5):
+        all_missing = all_missing & np.isnan(one_minute_q[first_minute + each_minute])
 
-                    if str(next_stage) == "nan":
-                        next_stage = None
-                    elif next_stage > this_max:
-                        next_stage = None
+    keep = ~(no_first & ~all_missing & whole_interval)
 
-                    #else:
-                    #    next_stage = "None"
+    # put the three cases back together in date order
+    od = Series(np.concatenate((minutes[:-1][happiest], minutes[:-1][like], chunk_minutes[keep])))
 
-                    return od
+    od.set_values('stage', np.concatenate((round_column(this_stage[happiest], 3), this_stage[like], chunk_stage[keep])))
+    od.set_values('inst_q', np.concatenate((happiest_q, like_q, this_inst[keep])))
+    od.set_values('total_q', np.concatenate((desired*happiest_q, traps, this_total[keep])))
+    od.set_values('mean_q', np.concatenate((happiest_q, traps/desired, this_mean[keep])))
 
-                #print "next stage is UNLIKE stage : " + str(this_stage) + " on " + datetime.datetime.strftime(this_date,'%Y-%m-%d %H:%M:%S')
+    return od.take(np.argsort(od.minutes, kind='mergesort'))
 
-                # interpolate for one minute for each value
-                one_minute_heights = interpolate_raw(this_stage, next_stage, interval_length)
+def quickly_recheck_data(data_in_csv):
+    """
+    Checks the input data for values that are un-expected; i.e. cannot be turned to float numericals, etc.
 
-                # blank for wrong length interval - ex. when sparse
-                pseudo_dates = []
+    :data_in_csv: the Series from get_data_from_csv; anything that could not be read as a number is nan in 'val'
+    """
 
-                # if the interval is the wrong length, create fake date stamps where the minutes are 5
-                if interval_length != 5:
-                    pseudo_dates = drange(this_date, next_date, datetime.timedelta(minutes=5))
+    bad = np.flatnonzero(np.isnan(data_in_csv.values['val']))
 
-                # append the one minute values to here
-                local_sum = []
+    if len(bad) != 0:
+        print("there are bad values on : -->")
+        bad_dates = data_in_csv.take(bad).dates()
+        for each_date in bad_dates:
+            print(datetime.datetime.strftime(each_date,'%Y-%m-%d %H:%M:%S') + " : " + 'Output forced to \'None\'')
+    else:
+        pass
 
-                # number of seconds in the total interval
-                interval_length_seconds = interval_length*60
+# the area of each gauged watershed, in acres
+AREAS = {'GSWS01': 237., 'GSWS02': 149., 'GSWS03': 250., 'GSWS06':32, 'GSWS07':38., 'GSWS08':53., 'GSWS09':21., 'GSWS10':25.3, 'GSWSMA':1436., 'GSWSMF':1436., 'GSCC01':171., 'GSCC02': 169., 'GSCC03': 123., 'GSCC04':120.}
 
-                # for each one minute height, compute the correct q from the rating equations
-                for each_height in one_minute_heights:
+def to_area(sitecode, instq, totalq, meanq):
+    """ converts the values to the area; the values can be numbers or numpy arrays of them"""
 
-                    _, local_max = check_value_versus_keys(rating_calib, each_height)
+    acres_to_cfs = AREAS[sitecode]*43560.
+    acres_to_sqmiles = AREAS[sitecode]*0.0015625
 
-                    try:
-                        # this is essentially cf/minute
-                        instq = 60*logfunc(rating_calib[local_max][0], rating_calib[local_max][1], each_height)
-
-                    except Exception:
-                        instq = None
-
-                    # this will give back a number of instq values
-                    local_sum.append(instq)
-
-                # if the pseudo dates exist because the interval is the wrong length
-                if this_date not in od and pseudo_dates != []:
-
-                    # iterate over the local sum and create 5 minute values
-                    for index, each_instq in enumerate(local_sum):
-
-                        # if the index is a multiple of 5, a new list is started
-                        if index%5 == 0:
-                            mini_sum = []
-                            mini_sum.append(each_instq)
-                            # assign height to first value
-                            my_height = one_minute_heights[index]
-
-                        # append to that list each incoming cfm
-                        elif index%5 <4:
-                            mini_sum.append(each_instq)
-
-                        # and then if you have 5 values in it, stick that with a 5 minute date thing and add to the reference
-                        elif index%5 == 4:
-
-                            this_total = sum([x for x in mini_sum if str(x) != 'None'])
-                            this_inst = mini_sum[0]/60
-                            # mean is in cfs
-                            this_mean = sum([x for x in mini_sum if str(x) != 'None'])/300
-
-                            if sys.version_info >=(3,0):
-                                my_date = next(pseudo_dates)
-                            else:
-                                my_date = pseudo_dates.next()
-
-                            try:
-                                od[my_date] ={'stage': round(my_height,3), 'inst_q': this_inst, 'total_q': this_total, 'mean_q': this_mean}
-
-                            except Exception:
-                                od[my_date]= {'stage': round(my_height,3), 'inst_q': None, 'total_q' : None, 'mean_q': None}
-
-                elif this_date not in od and pseudo_dates == []:
-                    # as long as there actually is some data
-                    if len([x for x in local_sum if str(x) != 'None']) != 0:
-
-                        try:
-                            od[this_date] = {'stage': round(this_stage,3), 'inst_q': local_sum[0]/60, 'total_q' : sum([x for x in local_sum if str(x) != 'None']), 'mean_q': sum([x for x in local_sum if str(x) != 'None'])/interval_length_seconds}
-
-                        except Exception:
-                            # strage cases where there is a "one second value" when the code switches
-                            test_date = datetime.datetime.strftime(this_date, '%Y-%m-%d %H:%M:%S')[-1]
-
-                            if test_date != 0:
-                                print("this is a one second measurement on " + datetime.datetime.strftime(this_date, '%Y-%m-%d %H:%M:%S') + " which will go into the next value")
-                                pass
-                            else:
-                                import pdb; pdb.set_trace
-
-                    # if for some reason there isn't some data
-                    elif len([x for x in local_sum if str(x) != 'None']) == 0:
-                        od[this_date]= {'stage': round(this_stage,3), 'inst_q': None, 'total_q' : None, 'mean_q': None}
-
-                else:
-                    print("this is an error")
-
-                # update the "current stage and date"
-                this_stage = next_stage
-                this_date = next_date
-
-                #print("date is" + datetime.datetime.strftime(this_date,'%Y-%m-%d %H:%M:%S'))
-
-        except StopIteration:
-            break
-
-    return od
-
-def drange(start, stop, step):
-    """ fraction/date range generator """
-    r = start
-    while r < stop:
-        yield r
-        r += step
-
-def quickly_recheck_data(data_in_csv):
-    """
-    Checks the input data for values that are un-expected; i.e. cannot be turned to float numericals, etc.
-    """
-
-    # initiate with a value of none
-    bad = []
-    for each_day in sorted(list(data_in_csv.keys())):
-        try:
-            valid = float(data_in_csv[each_day])
-        except Exception:
-            bad.append((each_day, valid))
-
-    if bad != []:
-        print("there are bad values on : -->")
-        for each_tuple in bad:
-            try:
-                print(datetime.datetime.strftime(each_tuple[0],'%Y-%m-%d %H:%M:%s') + " : " + str(each_tuple[1]))
-            except Exception:
-                print(datetime.datetime.strftime(each_tuple[0],'%Y-%m-%d %H:%M:%s') + " : " + 'Output forced to \'None\'')
-    else:
-        pass
-
-def to_area(sitecode, instq, totalq, meanq):
-    """ converts the values to the area"""
-
-    areas = {'GSWS01': 237., 'GSWS02': 149., 'GSWS03': 250., 'GSWS06':32, 'GSWS07':38., 'GSWS08':53., 'GSWS09':21., 'GSWS10':25.3, 'GSWSMA':1436., 'GSWSMF':1436., 'GSCC01':171., 'GSCC02': 169., 'GSCC03': 123., 'GSCC04':120.}
-
-    acres_to_cfs = areas[sitecode]*43560.
-    acres_to_sqmiles = areas[sitecode]*0.0015625
-
-    try:
-        # total q in inches per acre
-        total_q_area_ft = (totalq/acres_to_cfs)
-        # fixed -- total q area incheas should be feet * 12 not divided by 12
-        total_q_area_inches = total_q_area_ft*12.
+    try:
+        # total q in inches per acre
+        total_q_area_ft = (totalq/acres_to_cfs)
+        # fixed -- total q area incheas should be feet * 12 not divided by 12
+        total_q_area_inches = total_q_area_ft*12.
 
     except Exception:
         total_q_area_ft = None
@@ -940,117 +1140,261 @@ def name_my_csv(sitecode, wateryear, type_of_data):
 
     return csvfilename
 
+@timed('print_five_minute_file')
 def print_five_minute_file(final_dictionary, sitecode, wateryear, interval_length, original_data, sample_dates):
-    """ Creates the five minute values -- now including sample dates!"""
+    """ Creates the five minute values -- now including sample dates!
 
-    if sample_dates != None:
-        # go from 1 to end of sample dates because we added in the first day to do the first "calculation"
-        ordered_samples = iter(sample_dates[1:])
-        # test each sample in order rather than all
-        if sys.version_info >= (3,0):
-            given_sample = next(ordered_samples)
-            mode = 'w'
-        else:
-            given_sample = ordered_samples.next()
-            mode = 'wb'
-    else:
-        # give some ridiculous value for given sample so that it will never test "S"
-        given_sample = datetime.datetime(1,1,1,0,0)
+    The whole file is formatted a column at a time and written in blocks; the text is the same as writing it row by row with csv.writer.
 
-    csvfilename = name_my_csv(sitecode, wateryear, interval_length)
+    :final_dictionary: the Series from loop_over_data
+    :original_data: the Series from get_data_from_csv, for the flags and events
+    :sample_dates: the list from get_samples_dates, or None
+    """
 
-    if sys.version_info >=(3,0):
-        mode = 'w'
-    else:
-        mode = 'wb'
+    five_minute_file = FiveMinuteFile(sitecode, wateryear, interval_length, sample_dates)
 
-    with open(csvfilename, mode) as writefile:
-        writer = csv.writer(writefile, quoting = csv.QUOTE_NONNUMERIC, delimiter = ",")
+    try:
+        five_minute_file.write(final_dictionary, original_data)
+    finally:
+        five_minute_file.close()
+
+    #print("Finished processing the five minute data, output location : " + csvfilename)
+
+class FiveMinuteFile(object):
+    """ The five minute file, written a piece of the year at a time; print_five_minute_file writes the whole year as one piece
+
+    What carries from one piece to the next is the mean and total q of the last row (each row is written with the ones of the row before it) and the next sample date to look for.
+
+    **Inputs**
+    :sitecode: ex. GSWS01
+    :wateryear: ex. 2015
+    :interval_length: 5
+    :sample_dates: the list from get_samples_dates, or None
+
+    ..Example:
+    five_minute_file = FiveMinuteFile('GSWS01', 2015, 5, sd)
+    five_minute_file.write(o4, o2)
+    five_minute_file.close()
+    """
+
+    def __init__(self, sitecode, wateryear, interval_length, sample_dates):
+        self.sitecode = sitecode
+        self.wateryear = wateryear
+        self.interval_length = interval_length
+        self.filename = name_my_csv(sitecode, wateryear, interval_length)
+
+        # the rows written so far, and the mean and total q of the last one
+        self.rows = 0
+        self.last_mean = None
+        self.last_total = None
+
+        # go from 1 to end of sample dates because we added in the first day to do the first "calculation"; none are looked for once one is not found
+        if sample_dates != None:
+            self.sample_dates = sample_dates[1:]
+        else:
+            self.sample_dates = []
+
+        self.last_sample = None
+
+        self.writefile = open_csv(self.filename)
+        writer = csv.writer(self.writefile, quoting = csv.QUOTE_NONNUMERIC, delimiter = ",")
 
         writer.writerow(['STCODE', 'FORMAT', 'SITECODE', 'WATERYEAR', 'DATE_TIME', 'EQN_SET_CODE', 'STAGE', 'INST_Q', 'INST_Q_AREA', 'INTERVAL', 'MEAN_Q', 'MEAN_Q_AREA', 'TOTAL_Q_INT', 'EST_CODE', 'EVENT_CODE'])
 
-        sorted_dates = sorted(list(final_dictionary.keys()))
+    def write(self, final_dictionary, original_data):
+        """ Writes the rows of a piece of the year, after the rows already written
 
+        :final_dictionary: the Series from loop_over_data, or the part of it for this piece
+        :original_data: the Series from get_data_from_csv, for the flags and events; it has to hold the rows of the dates in final_dictionary
+        """
 
-        #import pdb; pdb.set_trace()
+        number_of_rows = len(final_dictionary)
 
-        for index, each_date in enumerate(sorted_dates):
-            stage = final_dictionary[each_date]['stage']
-            instq = final_dictionary[each_date]['inst_q']
-            totalq = final_dictionary[each_date]['total_q']
-            eqn_set = final_dictionary[each_date]['eqn_set']
+        if number_of_rows == 0:
+            return
 
-            try:
-                flag  = original_data[each_date]['fval']
-            except KeyError:
-                flag  = 'A'
+        sitecode = self.sitecode
 
-            try:
-                event = original_data[each_date]['event']
-            except KeyError:
-                event = 'NA'
+        stages = final_dictionary.values['stage']
+        inst_qs = final_dictionary.values['inst_q']
 
-            try:
-                # test that a date is not a sample date
-                if each_date == given_sample:
-                    flag = 'S'
-                    if sys.version_info >= (3,0):
-                        given_sample = next(ordered_samples)
-                    else:
-                        given_sample = ordered_samples.next()
-                else:
-                    pass
-            except Exception:
-                pass
+        # if its not the first value - the mean value computed to the "end" of the interval should be reflected in the previous entry; the total also
+        if self.rows == 0:
+            self.last_mean = final_dictionary.values['mean_q'][:1]
+            self.last_total = final_dictionary.values['total_q'][:1]
 
-            # if its not the first value - the mean value computed to the "end" of the interval should be reflected in the previous entry; the total also
-            if index != 0:
-                meanq = final_dictionary[sorted_dates[index-1]]['mean_q']
-                totalq = final_dictionary[sorted_dates[index-1]]['total_q']
-            else:
-                meanq = final_dictionary[each_date]['mean_q']
-                totalq = final_dictionary[each_date]['total_q']
+        mean_qs = np.concatenate((self.last_mean, final_dictionary.values['mean_q'][:-1]))
+        total_qs = np.concatenate((self.last_total, final_dictionary.values['total_q'][:-1]))
 
-            iqa, tqa, mqa =  to_area(sitecode, instq, totalq, meanq)
+        self.last_mean = final_dictionary.values['mean_q'][-1:]
+        self.last_total = final_dictionary.values['total_q'][-1:]
 
-            dt = datetime.datetime.strftime(each_date,'%Y-%m-%d %H:%M:%S')
-            study_code = "HF004"
-            entity = 1
+        iqa, tqa, mqa = to_area(sitecode, inst_qs, total_qs, mean_qs)
 
-            interval = interval_length
+        # the flags and events for each date; dates not in the original data are 'A' and 'NA'
+        positions, found = original_data.locate(final_dictionary.minutes)
 
-            # sometimes Adam's flag has extra quotes in it. Sometimes it doesn't.
-            if "\"M\"" in flag:
-                flag = "M"
-            else:
-                pass
+        # sometimes Adam's flag has extra quotes in it. Sometimes it doesn't.
+        flag_labels = np.array(["M" if "\"M\"" in x else x for x in original_data.labels['fval']] + ['A'], dtype=object)
+        event_labels = np.array(original_data.labels['event'] + ['NA'], dtype=object)
 
-            # if the data is None because of some failure to estimate the height we need to mark it as missing.
-            if str(stage) == "None" or str(instq) == "None" or str(totalq) == "None":
-                flag = "M"
+        flags = flag_labels[np.where(found, original_data.codes['fval'][positions], len(flag_labels) - 1)]
+        events = event_labels[np.where(found, original_data.codes['event'][positions], len(event_labels) - 1)]
 
-            try:
-                new_row = [study_code, entity, sitecode, wateryear, dt, eqn_set, round(float(stage),3), round(float(instq),3), round(float(iqa),3), str(interval), round(float(meanq),3), round(float(mqa),3), round(float(tqa),7), flag, event]
+        # the sample dates are matched in order: each one is looked for after the one before it, and once one is not found no more are. One after the last date of this piece is looked for in the next.
+        while self.sample_dates != []:
+            given_sample = self.sample_dates[0]
 
-            except Exception:
-                # testing if the str(stage) == "None" or not is better than testing for None and "None"
-                if str(stage) == "None":
-                    new_row = [study_code, entity, sitecode, wateryear, dt, eqn_set, 'None', 'None', 'None', str(interval), 'None', 'None', 'None', flag, event]
+            if given_sample.second != 0 or given_sample.microsecond != 0:
+                self.sample_dates = []
+                break
 
-                elif str(stage) != "None":
-                    try:
-                        new_row = [study_code, entity, sitecode, wateryear, dt, eqn_set, round(float(stage),3), 'None', 'None', str(interval), 'None', 'None', 'None', flag, event]
-                    except Exception:
-                        new_row = [study_code, entity, sitecode, wateryear, dt, eqn_set, 'None', 'None', 'None', str(interval), 'None', 'None', 'None', flag, event]
+            sample_minute = datetime_to_minutes(given_sample)
 
-            writer.writerow(new_row)
+            if sample_minute > final_dictionary.minutes[-1]:
+                break
 
+            index = int(np.searchsorted(final_dictionary.minutes, sample_minute))
 
-    #print("Finished processing the five minute data, output location : " + csvfilename)
+            if final_dictionary.minutes[index] != sample_minute or (self.last_sample != None and sample_minute <= self.last_sample):
+                self.sample_dates = []
+                break
 
+            flags[index] = 'S'
+            self.last_sample = sample_minute
+            self.sample_dates = self.sample_dates[1:]
+
+        # if the data is None because of some failure to estimate the height we need to mark it as missing.
+        flags[np.isnan(stages) | np.isnan(inst_qs) | np.isnan(total_qs)] = 'M'
+
+        # the q's are only written when every one of them is there; otherwise the stage (if there is one) and 'None' for the rest
+        complete = ~(np.isnan(stages) | np.isnan(inst_qs) | np.isnan(iqa) | np.isnan(mean_qs) | np.isnan(mqa) | np.isnan(tqa))
+        nothing = np.nan
+
+        study_code = "HF004"
+        entity = 1
+
+        columns = [csv_field(study_code), csv_field(entity), csv_field(sitecode), csv_field(self.wateryear), csv_date_fields(final_dictionary.minutes), csv_code_fields(final_dictionary.codes['eqn_set'], final_dictionary.labels['eqn_set']), csv_number_fields(stages, 3, missing='"None"'), csv_number_fields(np.where(complete, inst_qs, nothing), 3, missing='"None"'), csv_number_fields(np.where(complete, iqa, nothing), 3, missing='"None"'), csv_field(str(self.interval_length)), csv_number_fields(np.where(complete, mean_qs, nothing), 3, missing='"None"'), csv_number_fields(np.where(complete, mqa, nothing), 3, missing='"None"'), csv_number_fields(np.where(complete, tqa, nothing), 7, missing='"None"'), csv_text_fields(flags.tolist()), csv_text_fields(events.tolist())]
+
+        write_csv_columns(self.writefile, columns)
+
+        self.rows += number_of_rows
+
+    def close(self):
+        self.writefile.close()
+
+# the percentages behind the daily flags have always been taken of four (the number of lists the old per-day dictionary held), not of the number of values in the day; so one 'M' makes a day 'M', and so on
+DAILY_FLAG_DIVISOR = 4
+
+def sums_by_day(values, counts):
+    """ Adds up each day's values in order, the way sum() adds a list
+
+    :values: the values that are there, one day after another
+    :counts: how many of them are in each day
+    """
+
+    ends = np.cumsum(counts).tolist()
+    as_list = values.tolist()
+
+    sums = []
+    begin = 0
+    for end in ends:
+        sums.append(float(sum(as_list[begin:end])))
+        begin = end
+
+    return sums
+
+@timed('summarize_days', rows=lambda x: len(x['minutes']))
+def summarize_days(final_dictionary, original_dictionary):
+    """ Reduces the five minute values to one row per day in one pass, for the daily and monthly files
+
+    The rows are split on day boundaries. Counts, maximums, minimums and flag counts are reduced with reduceat. The sums are added in order and the mean for the daily area is np.mean of the day, over the values that are there, because those are the numbers the daily and monthly files have always been made from.
+
+    **Inputs**
+    :final_dictionary: the Series from loop_over_data
+    :original_dictionary: the Series from get_data_from_csv, for the flags; dates not in it are 'A'
+
+    **Returns**
+    :days: dictionary of one entry per day - 'minutes' (midnight of the day), 'mean_count', 'inst_count', 'mean_sum', 'tot_sum', 'mean_np', 'max' and 'min' of inst_q (nan when there are none), and 'flag'
+    """
+
+    minutes = final_dictionary.minutes
+    means = final_dictionary.values['mean_q']
+    insts = final_dictionary.values['inst_q']
+    tots = final_dictionary.values['total_q']
+
+    if len(minutes) == 0:
+        return {'minutes': minutes, 'mean_count': [], 'inst_count': [], 'mean_sum': [], 'tot_sum': [], 'mean_np': [], 'max': [], 'min': [], 'flag': []}
+
+    day_of = minutes // 1440
+    starts = np.flatnonzero(np.concatenate(([True], day_of[1:] != day_of[:-1])))
+
+    has_mean = ~np.isnan(means)
+    has_inst = ~np.isnan(insts)
+    has_tot = ~np.isnan(tots)
+
+    mean_count = np.add.reduceat(has_mean.astype(np.int64), starts)
+    tot_count = np.add.reduceat(has_tot.astype(np.int64), starts)
+
+    mean_bounds = np.concatenate(([0], np.cumsum(mean_count))).tolist()
+    kept_means = means[has_mean]
+
+    # np.mean (not sum over len) is what the daily area has always used
+    mean_np = [np.mean(kept_means[mean_bounds[x]:mean_bounds[x+1]]) if mean_bounds[x+1] > mean_bounds[x] else np.nan for x in range(len(starts))]
+
+    # the flags of each row; dates not in the original data are 'A'
+    positions, found = original_dictionary.locate(minutes)
+    flag_codes = original_dictionary.codes['fval'][positions]
+
+    flag_counts = {}
+    for each_flag in ["M", "E", "Q"]:
+        if each_flag in original_dictionary.labels['fval']:
+            is_flag = found & (flag_codes == original_dictionary.labels['fval'].index(each_flag))
+            flag_counts[each_flag] = np.add.reduceat(is_flag.astype(np.int64), starts).tolist()
+        else:
+            flag_counts[each_flag] = [0]*len(starts)
+
+    daily_flags = []
+
+    for count_m, count_e, count_q in zip(flag_counts["M"], flag_counts["E"], flag_counts["Q"]):
+
+        percent_m = float(count_m)/DAILY_FLAG_DIVISOR
+        percent_e = float(count_e)/DAILY_FLAG_DIVISOR
+        percent_q = float(count_q)/DAILY_FLAG_DIVISOR
+
+        # flags re-ordered to fit our daily method
+        if percent_m > 0.2:
+            daily_flags.append("M")
+        elif percent_e > 0.05:
+            daily_flags.append("E")
+        elif percent_q > 0.05:
+            daily_flags.append("Q")
+        elif percent_m + percent_e + percent_q > 0.05:
+            daily_flags.append("Q")
+        else:
+            daily_flags.append("A")
+
+    return {'minutes': day_of[starts]*1440, 'mean_count': mean_count.tolist(), 'inst_count': np.add.reduceat(has_inst.astype(np.int64), starts).tolist(), 'mean_sum': sums_by_day(kept_means, mean_count), 'tot_sum': sums_by_day(tots[has_tot], tot_count), 'mean_np': mean_np, 'max': np.fmax.reduceat(insts, starts).tolist(), 'min': np.fmin.reduceat(insts, starts).tolist(), 'flag': daily_flags}
+
+def join_days(pieces):
+    """ One result of summarize_days from the results for pieces of the year that follow one another, each of whole days (see FlowStream)"""
+
+    days = {'minutes': np.concatenate([x['minutes'] for x in pieces] + [np.zeros(0, dtype=np.int64)])}
+
+    for name in ['mean_count', 'inst_count', 'mean_sum', 'tot_sum', 'mean_np', 'max', 'min', 'flag']:
+        days[name] = []
+
+        for each_piece in pieces:
+            days[name].extend(each_piece[name])
+
+    return days
+
+@timed('create_monthly_files')
 def create_monthly_files(sitecode, wateryear, daily_dictionary):
     """
     Creates the monthly files for your site and wateryear based on a daily reference table you created in the main loop.
+
+    The months are rolled up from the rounded daily values, as they are written in the daily dictionary.
     """
     md = {}
 
@@ -1060,68 +1404,44 @@ def create_monthly_files(sitecode, wateryear, daily_dictionary):
 
     stcode = 'HF004'
     format = '3'
-    sorted_dates = sorted(list(daily_dictionary.keys()))
 
-    if sys.version_info >= (3,0):
-        mode = 'w'
-    else:
-        mode = 'wb'
-
-    # we already have a way to write the daily csv, so this is just for monthly and annual
-    with open(csvfilename_m, mode) as writefile_m:
-        writer_m = csv.writer(writefile_m, quoting = csv.QUOTE_NONNUMERIC, delimiter=",")
-
-        headers_m = ['STCODE', 'FORMAT', 'SITECODE', 'ANNUAL_YEAR', 'WATERYEAR', 'MONTH', 'MEAN_Q', 'MAX_Q', 'MIN_Q', 'MEAN_Q_AREA', 'TOTAL_Q_AREA', 'ESTCODE','ESTDAYS', 'TOTAL_DAYS']
-
-        writer_m.writerow(headers_m)
+    # only the days of the water year; a month is every day with that month number
+    end_of_year = datetime.datetime(int(wateryear), 10, 1, 0, 0)
 
-        for each_day in sorted_dates:
+    for each_day in sorted(daily_dictionary.keys()):
 
-            month_found = each_day.month
-            year_found = each_day.year
+        if each_day >= end_of_year:
+            continue
 
-            if each_day >= datetime.datetime(int(wateryear), 10, 1, 0, 0):
-                continue
-            else:
-                pass
+        if each_day.month not in md:
+            md[each_day.month] = {'mean':[], 'max':[], 'min': [], 'mqa': [], 'tqa':[], 'flag':[]}
 
-            if month_found not in md:
-                md[month_found]={'mean':[], 'max':[], 'min': [], 'mqa': [], 'tqa':[], 'flag':[]}
-                md[month_found]['mean'].append(daily_dictionary[each_day]['mean'])
-                md[month_found]['max'].append(daily_dictionary[each_day]['max'])
-                md[month_found]['min'].append(daily_dictionary[each_day]['min'])
-                md[month_found]['mqa'].append(daily_dictionary[each_day]['mqa'])
-                md[month_found]['tqa'].append(daily_dictionary[each_day]['tqa'])
-                md[month_found]['flag'].append(daily_dictionary[each_day]['flag'])
+        for each_key in md[each_day.month]:
+            md[each_day.month][each_key].append(daily_dictionary[each_day][each_key])
 
-            elif month_found in md:
-                md[month_found]['mean'].append(daily_dictionary[each_day]['mean'])
-                md[month_found]['max'].append(daily_dictionary[each_day]['max'])
-                md[month_found]['min'].append(daily_dictionary[each_day]['min'])
-                md[month_found]['mqa'].append(daily_dictionary[each_day]['mqa'])
-                md[month_found]['tqa'].append(daily_dictionary[each_day]['tqa'])
-                md[month_found]['flag'].append(daily_dictionary[each_day]['flag'])
+    # reorganize the months to reflect the water year, and if months are missing, then do not try to find them
+    month_keys = [x for x in [10, 11, 12, 1, 2, 3, 4, 5, 6, 7, 8, 9] if x in md]
 
+    with open_csv(csvfilename_m) as writefile_m:
+        writer_m = csv.writer(writefile_m, quoting = csv.QUOTE_NONNUMERIC, delimiter=",")
 
-        # reorganize the months to reflect the water year, and if months are missing, then do not try to find them
-        month_keys = [10, 11, 12, 1, 2, 3, 4, 5, 6, 7, 8, 9]
-        real_keys = list(sorted(md.keys()))
+        headers_m = ['STCODE', 'FORMAT', 'SITECODE', 'ANNUAL_YEAR', 'WATERYEAR', 'MONTH', 'MEAN_Q', 'MAX_Q', 'MIN_Q', 'MEAN_Q_AREA', 'TOTAL_Q_AREA', 'ESTCODE','ESTDAYS', 'TOTAL_DAYS']
 
-        shared_keys = [x for x in month_keys if x in real_keys]
+        writer_m.writerow(headers_m)
 
-        for each_month in shared_keys:
-            num_est = len([x for x in md[each_month]['flag'] if x == 'E'])
-            num_question = len([x for x in md[each_month]['flag'] if x == 'Q'])
-            num_missing = len([x for x in md[each_month]['flag'] if x == 'M'])
-            num_tot = len([x for x in md[each_month]['flag']])
+        for each_month in month_keys:
 
+            month_flags = md[each_month]['flag']
+            num_est = month_flags.count('E')
+            num_question = month_flags.count('Q')
+            num_missing = month_flags.count('M')
+            num_tot = len(month_flags)
 
             if float(num_est)/num_tot >= 0.05:
                 monthly_flag = "E"
 
             elif float(num_question)/num_tot >= 0.05:
                 monthly_flag = "Q"
-                import pdb; pdb.set_trace()
 
             elif float(num_missing)/num_tot >= 0.2:
                 monthly_flag = "M"
@@ -1132,413 +1452,591 @@ def create_monthly_files(sitecode, wateryear, daily_dictionary):
             else:
                 monthly_flag = "A"
 
-
-            if str(each_month) == "10" or str(each_month) == "11" or str(each_month) == "12":
+            if each_month in [10, 11, 12]:
                 this_year = str(int(wateryear) -1)
             else:
                 this_year = str(wateryear)
 
-            month_mean = str(round(sum([float(x) for x in md[each_month]['mean'] if str(x) != "None"])/len([float(x) for x in md[each_month]['mean'] if str(x) != "None"]),4))
-            month_max = str(round(max([float(x) for x in md[each_month]['max'] if str(x) != "None"]),4))
-            month_min = str(round(min([float(x) for x in md[each_month]['min'] if str(x) != "None"]),4))
-            month_mqa = str(round(sum([float(x) for x in md[each_month]['mqa'] if str(x) != "None"])/len([float(x) for x in md[each_month]['mean'] if str(x) != "None"]),4))
-            month_tqa = str(round(sum([float(x) for x in md[each_month]['tqa'] if str(x) != "None"]),4))
+            # the daily values as numbers, without the days that have none
+            month_values = dict((x, [float(y) for y in md[each_month][x] if str(y) != "None"]) for x in ['mean', 'max', 'min', 'mqa', 'tqa'])
+
+            month_mean = str(round(sum(month_values['mean'])/len(month_values['mean']),4))
+            month_max = str(round(max(month_values['max']),4))
+            month_min = str(round(min(month_values['min']),4))
+            month_mqa = str(round(sum(month_values['mqa'])/len(month_values['mean']),4))
+            month_tqa = str(round(sum(month_values['tqa']),4))
 
             writer_m.writerow([stcode, format, sitecode, str(this_year), wateryear, str(each_month), month_mean, month_max, month_min, month_mqa, month_tqa, monthly_flag, str(num_est), str(num_tot)])
 
 
-def compute_daily_dictionary(sitecode, wateryear, final_dictionary, original_dictionary):
+@timed('compute_daily_dictionary', rows=len)
+def compute_daily_dictionary(sitecode, wateryear, final_dictionary, original_dictionary, days=None):
     """
     Computes daily values as a dictionary of monthly/ annual values
+
+    :final_dictionary: the Series from loop_over_data
+    :original_dictionary: the Series from get_data_from_csv, for the flags
+    :days: the result of summarize_days, if it has already been made (optional)
     """
-    daily_d = {}
-    output_d = {}
 
-    for each_date in sorted(list(final_dictionary.keys())):
+    if days == None:
+        days = summarize_days(final_dictionary, original_dictionary)
 
-        alt_date = datetime.datetime(each_date.year, each_date.month, each_date.day)
+    output_d = {}
 
-        if alt_date not in daily_d:
+    for index, each_day in enumerate(minutes_to_datetimes(days['minutes'])):
 
-            daily_d[alt_date] = {'means':[final_dictionary[each_date]['mean_q']], 'insts':[final_dictionary[each_date]['inst_q']], 'tots':[final_dictionary[each_date]['total_q']], 'flags':[original_dictionary[each_date]['fval']]}
+        mean_count = days['mean_count'][index]
 
-        elif alt_date in daily_d:
+        # a day with no values at all has nothing to give
+        if mean_count == 0 or days['inst_count'][index] == 0:
+            output_d[each_day] = {'mean': "None", 'max': "None", 'min': "None", 'mqa': "None", 'tqa': "None", 'flag': days['flag'][index]}
+            continue
 
-            daily_d[alt_date]['means'].append(final_dictionary[each_date]['mean_q'])
-            daily_d[alt_date]['insts'].append(final_dictionary[each_date]['inst_q'])
-            daily_d[alt_date]['tots'].append(final_dictionary[each_date]['total_q'])
+        day_mean = days['mean_sum'][index]/mean_count
 
-            try:
-                daily_d[alt_date]['flags'].append(original_dictionary[each_date]['fval'])
-            except KeyError:
-                daily_d[alt_date]['flags'].append('A')
+        _, tqa, mqa = to_area(sitecode, None, days['tot_sum'][index], day_mean)
 
+        # same format as the csv for daily but to a dictionary
+        output_d[each_day] = {'mean': str(round(day_mean,4)), 'max': str(round(days['max'][index],4)), 'min': str(round(days['min'][index],4)), 'mqa': str(round(mqa,4)), 'tqa': str(round(tqa,4)), 'flag': days['flag'][index]}
 
-    for each_alternate_date in sorted(list(daily_d.keys())):
+    return output_d
 
-        percent_m = float(len([x for x in daily_d[each_alternate_date]['flags'] if x == "M"]))/len(daily_d[each_alternate_date])
-        percent_e = float(len([x for x in daily_d[each_alternate_date]['flags']  if x == "E"]))/len(daily_d[each_alternate_date])
-        percent_q = float(len([x for x in daily_d[each_alternate_date]['flags']  if x == "Q"]))/len(daily_d[each_alternate_date])
+def print_monthly_values(sitecode, wateryear, final_dictionary, original_dictionary, days=None):
+    """ creates the monthly output csv, from the daily values (see compute_daily_dictionary and create_monthly_files)"""
 
-        if percent_m > 0.2:
-            daily_flag = "M"
-            #daily_d[each_alternate_date].append(daily_flag)
-        elif percent_e > 0.05:
-            daily_flag = "E"
-        elif percent_q > 0.05:
-            daily_flag = "Q"
-        elif percent_m + percent_e + percent_q > 0.05:
-            daily_flag = "Q"
-        else:
-            daily_flag = "A"
+    o_daily = compute_daily_dictionary(sitecode, wateryear, final_dictionary, original_dictionary, days)
+    create_monthly_files(sitecode, wateryear, o_daily)
 
-        try:
-            _, tqa, mqa = to_area(sitecode, None, sum(daily_d[each_alternate_date]['tots']), sum(daily_d[each_alternate_date]['means'])/len(daily_d[each_alternate_date]['means']))
+@timed('print_daily_values')
+def print_daily_values(sitecode, wateryear, final_dictionary, original_dictionary, days=None):
+    """
+    creates a daily output csv
 
-        except Exception:
-            # find the total number of values which are not Null
-            mean_from_not_none_tot = sum([float(x) for x in daily_d[each_alternate_date]['means'] if str(x) !="None"])/len([float(x) for x in daily_d[each_alternate_date]['means'] if str(x) !="None"])
+    :final_dictionary: the Series from loop_over_data
+    :original_dictionary: the Series from get_data_from_csv, for the flags
+    :days: the result of summarize_days, if it has already been made (optional)
+    """
 
-            not_none_tot = sum([float(x) for x in daily_d[each_alternate_date]['tots'] if str(x) != 'None'])
-            _, tqa, mqa = to_area(sitecode, None, not_none_tot, mean_from_not_none_tot)
+    csvfilename = name_my_csv(sitecode, wateryear, "d")
 
-        try:
-            # same format as the csv for daily but to a dictionary
-            if each_alternate_date not in output_d:
-                output_d[each_alternate_date] = {'mean': str(round(sum([float(x) for x in daily_d[each_alternate_date]['means'] if str(x) != "None"])/len([float(x) for x in daily_d[each_alternate_date]['means'] if str(x) != "None"]),4)), 'max': str(round(max([float(x) for x in daily_d[each_alternate_date]['insts'] if str(x) != "None"]),4)), 'min': str(round(min([float(x) for x in daily_d[each_alternate_date]['insts'] if str(x) != "None"]),4)), 'mqa': str(round(mqa),4), 'tqa': str(round(tqa),4), 'flag': daily_flag }
+    stcode = 'HF004'
+    format = '2'
 
-            elif each_alternate_date in output_d:
-                print("the alternate date is already listed?")
+    if days == None:
+        days = summarize_days(final_dictionary, original_dictionary)
 
-        except Exception:
+    with open_csv(csvfilename) as writefile:
+        writer = csv.writer(writefile, quoting = csv.QUOTE_NONNUMERIC, delimiter=",")
 
-            not_none_mean_day = [x for x in daily_d[each_alternate_date]['means'] if str(x) != 'None']
-            not_none_inst_day = [x for x in daily_d[each_alternate_date]['insts'] if str(x) != 'None']
+        headers = ['STCODE', 'FORMAT', 'SITECODE', 'WATERYEAR', 'DATE', 'MEAN_Q', 'MAX_Q', 'MIN_Q', 'MEAN_Q_AREA', 'TOTAL_Q_AREA', 'ESTCODE']
 
-            try:
+        writer.writerow(headers)
 
-                if each_alternate_date not in output_d:
-                    output_d[each_alternate_date] = {'mean': str(round(sum(not_none_mean_day)/len(not_none_mean_day),4)), 'max': str(round(max(not_none_inst_day),4)), 'min': str(round(min(not_none_inst_day),4)), 'mqa': str(round(mqa,4)), 'tqa': str(round(tqa,4)), 'flag': daily_flag}
-                elif each_alternate_date in output_d:
-                    print("the alternate date is already listed- part 2 error with Nones")
+        for index, each_day in enumerate(minutes_to_datetimes(days['minutes'])):
 
-            except Exception:
-                if each_alternate_date not in output_d:
-                    output_d[each_alternate_date] = {'mean': str(round(sum(not_none_mean_day)/len(not_none_mean_day),4)), 'max': str(round(max(not_none_inst_day),4)), 'min': str(round(min(not_none_inst_day),4)), 'mqa': "None", 'tqa': "None", 'flag': daily_flag}
-                elif each_alternate_date in output_d:
-                    print("the alternate date is already listed- part 2 error with Nones")
+            mean_count = days['mean_count'][index]
+            inst_count = days['inst_count'][index]
+            daily_flag = days['flag'][index]
 
+            print_date = datetime.datetime.strftime(each_day, '%Y-%m-%d')
 
-    return output_d
+            # a day with no values at all is written with 'None'
+            if mean_count == 0 or inst_count == 0:
+                writer.writerow([stcode, format, sitecode, wateryear, print_date, "None", "None", "None", "None", "None", daily_flag])
+                continue
 
-def print_daily_values(sitecode, wateryear, final_dictionary, original_dictionary):
-    """
-    creates a daily output csv
-    """
+            _, tqa, mqa = to_area(sitecode, None, days['tot_sum'][index], days['mean_np'][index])
 
-    naner = lambda x: 'None' if x == 'nan' else x
+            writer.writerow([stcode, format, sitecode, wateryear, print_date, str(round(days['mean_sum'][index]/mean_count,4)), str(round(days['max'][index],4)), str(round(days['min'][index],4)), str(round(mqa,4)), str(round(tqa,4)), daily_flag])
 
-    csvfilename = name_my_csv(sitecode, wateryear, "d")
+class SampleIntegrator(object):
+    """ Total Q over any window of dates, from a running sum of the five minute totals
 
-    daily_d = {}
+    Each window costs two binary searches, so windows can be asked for in any order, overlapping or not, without going over the year again. A window is [begin, end): the five minute total at the begin date is in it and the one at the end date is not. Missing totals add nothing.
 
-    stcode = 'HF004'
-    format = '2'
-    sorted_dates = sorted(list(final_dictionary.keys()))
+    :final_dictionary: the Series from loop_over_data
+    """
 
+    def __init__(self, final_dictionary):
+        self.minutes = final_dictionary.minutes
 
-    if sys.version_info >= (3,0):
-        mode = 'w'
-    else:
-        mode = 'wb'
+        totals = final_dictionary.values['total_q']
+        self.running = np.concatenate(([0.], np.cumsum(np.where(np.isnan(totals), 0., totals))))
 
-    with open(csvfilename, mode) as writefile:
-        writer = csv.writer(writefile, quoting = csv.QUOTE_NONNUMERIC, delimiter=",")
+        # the first five minute value, or None when there are none
+        self.first_minute = int(self.minutes[0]) if len(self.minutes) > 0 else None
 
-        headers = ['STCODE', 'FORMAT', 'SITECODE', 'WATERYEAR', 'DATE', 'MEAN_Q', 'MAX_Q', 'MIN_Q', 'MEAN_Q_AREA', 'TOTAL_Q_AREA', 'ESTCODE']
+    def has(self, minutes):
+        """ True for each of the minutes that has a five minute value"""
+        minutes = np.asarray(minutes, dtype=np.int64)
+        positions = np.searchsorted(self.minutes, minutes)
 
-        writer.writerow(headers)
+        return (positions < len(self.minutes)) & (self.minutes[np.minimum(positions, max(len(self.minutes) - 1, 0))] == minutes)
 
-        for each_date in sorted(list(final_dictionary.keys())):
+    def total_q(self, begins, ends):
+        """ Total Q (cubic feet) in each window, for arrays of begin and end minutes"""
+        first = np.searchsorted(self.minutes, np.asarray(begins, dtype=np.int64), side='left')
+        last = np.searchsorted(self.minutes, np.asarray(ends, dtype=np.int64), side='left')
 
-            alt_date = datetime.datetime(each_date.year, each_date.month, each_date.day)
+        return self.running[last] - self.running[first]
 
-            if alt_date not in daily_d:
+    def sample_total(self, sitecode, begin, end):
+        """ Total Q between two datetimes as inches over the watershed, ex. integrator.sample_total('GSWS01', datetime.datetime(2015, 1, 6, 8, 55), datetime.datetime(2015, 1, 26, 11, 35))"""
+        return float(self.total_q([datetime_to_minutes(begin)], [datetime_to_minutes(end)])[0])*12/(43560*AREAS[sitecode])
 
-                # at least one date must be present and we prefer midnight
-                daily_d[alt_date] = {'means': naner([final_dictionary[each_date]['mean_q']]), 'insts': naner([final_dictionary[each_date]['inst_q']]), 'tots': naner([final_dictionary[each_date]['total_q']]), 'flags':[original_dictionary[each_date]['fval']]}
+class StreamedSampleIntegrator(object):
+    """ SampleIntegrator for five minute values that come a piece at a time, for the windows of a list of sample dates
 
-            elif alt_date in daily_d:
+    Only the running sum at the begin and end dates of the windows is kept: when a piece comes, the sum of the totals before each of those dates in it is recorded, and whether it has a five minute value. The sums are added in the same order as SampleIntegrator adds them, so the totals are the same.
 
-                daily_d[alt_date]['means'].append(naner(final_dictionary[each_date]['mean_q']))
-                daily_d[alt_date]['insts'].append(naner(final_dictionary[each_date]['inst_q']))
-                daily_d[alt_date]['tots'].append(naner(final_dictionary[each_date]['total_q']))
+    :boundaries: int64 array of the begin and end minutes of the windows, ex. from sample_windows
+    """
 
-                try:
-                    daily_d[alt_date]['flags'].append(original_dictionary[each_date]['fval'])
-                except KeyError:
-                    daily_d[alt_date]['flags'].append('A')
+    def __init__(self, boundaries):
+        self.boundaries = np.unique(np.asarray(boundaries, dtype=np.int64))
+        self.next_boundary = 0
+        self.running = 0.
+        self.running_at = {}
+        self.present = set()
+        self.first_minute = None
 
+    def add(self, final_dictionary):
+        """ Takes the next piece of the five minute values, after the ones before it
 
-        for each_alternate_date in sorted(daily_d.keys()):
+        :final_dictionary: a Series with the value 'total_q'
+        """
 
-            percent_m = float(len([x for x in daily_d[each_alternate_date]['flags'] if x == "M"]))/len(daily_d[each_alternate_date])
-            percent_e = float(len([x for x in daily_d[each_alternate_date]['flags']  if x == "E"]))/len(daily_d[each_alternate_date])
-            percent_q = float(len([x for x in daily_d[each_alternate_date]['flags']  if x == "Q"]))/len(daily_d[each_alternate_date])
+        if len(final_dictionary) == 0:
+            return
 
+        minutes = final_dictionary.minutes
+        totals = final_dictionary.values['total_q']
 
-            # flags re-ordered to fit our daily method
-            if percent_m > 0.2:
-                daily_flag = "M"
+        if self.first_minute == None:
+            self.first_minute = int(minutes[0])
 
-            elif percent_e > 0.05:
-                daily_flag = "E"
+        running = np.cumsum(np.concatenate(([self.running], np.where(np.isnan(totals), 0., totals))))
 
-            elif percent_q > 0.05:
-                daily_flag = "Q"
+        stop = int(np.searchsorted(self.boundaries, minutes[-1], side='right'))
+        wanted = self.boundaries[self.next_boundary:stop]
+        positions = np.searchsorted(minutes, wanted, side='left')
 
-            elif percent_m + percent_e + percent_q > 0.05:
-                daily_flag = "Q"
+        self.running_at.update(zip(wanted.tolist(), running[positions].tolist()))
+        self.present.update(wanted[minutes[np.minimum(positions, len(minutes) - 1)] == wanted].tolist())
 
-            else:
-                daily_flag = "A"
+        self.running = float(running[-1])
+        self.next_boundary = stop
 
+    def has(self, minutes):
+        """ True for each of the minutes that has a five minute value; the minutes have to be among the boundaries"""
+        return np.array([x in self.present for x in np.asarray(minutes, dtype=np.int64).tolist()], dtype=bool)
 
-            try:
-                _, tqa, mqa = to_area(sitecode, None, sum(daily_d[each_alternate_date]['tots']), np.mean(daily_d[each_alternate_date]['means']))
+    def total_q(self, begins, ends):
+        """ Total Q (cubic feet) in each window, for arrays of begin and end minutes among the boundaries; a date after the last piece has the sum of everything"""
+        at = lambda x: np.array([self.running_at.get(y, self.running) for y in np.asarray(x, dtype=np.int64).tolist()], dtype=np.float64)
 
-            except Exception:
-                not_none_tot = sum([x for x in daily_d[each_alternate_date]['tots'] if str(x) != 'None'])
-                mean_from_not_none_tot = np.mean([x for x in daily_d[each_alternate_date]['means'] if str(x) !='None'])
-                _, tqa, mqa = to_area(sitecode, None, not_none_tot, mean_from_not_none_tot)
+        return at(ends) - at(begins)
 
-            try:
-                new_row = [stcode, format, sitecode, wateryear, datetime.datetime.strftime(each_alternate_date, '%Y-%m-%d'), str(round(sum(daily_d[each_alternate_date]['means'])/len(daily_d[each_alternate_date]['means']),4)), str(round(max(daily_d[each_alternate_date]['insts']),4)), str(round(min(daily_d[each_alternate_date]['insts']),4)), str(round(mqa,4)), str(round(tqa,4)), daily_flag]
+def sample_windows(sDate_list):
+    """ The begin and end minutes of the windows between the sample dates
 
-            except Exception:
+    The list starts on the first day of the water year and ends on its last five minutes; every date is moved up to five minutes.
 
-                not_none_mean_day = [float(x) for x in daily_d[each_alternate_date]['means'] if str(x) != 'None']
-                not_none_inst_day = [float(x) for x in daily_d[each_alternate_date]['insts'] if str(x) != 'None']
+    :sDate_list: the list from get_samples_dates
+    """
 
-                try:
-                    new_row = [stcode, format, sitecode , wateryear, datetime.datetime.strftime(each_alternate_date, '%Y-%m-%d'), str(round(sum(not_none_mean_day)/len(not_none_mean_day),4)), str(round(max(not_none_inst_day),4)), str(round(min(not_none_inst_day),4)), str(round(mqa,4)), str(round(tqa,4)), daily_flag]
+    sample_minutes = np.array([datetime_to_minutes(x) for x in sDate_list], dtype=np.int64)
+    sample_minutes = sample_minutes + (-sample_minutes) % 5
 
-                except Exception:
-                    import pdb; pdb.set_trace()
-                    new_row = [stcode, format, sitecode , wateryear, datetime.datetime.strftime(each_alternate_date, '%Y-%m-%d'), str(round(sum(not_none_mean_day)/len(not_none_inst_day),4)), str(round(max(not_none_inst_day),4)), str(round(min(not_none_inst_day),4)), "None", "None", daily_flag]
+    return sample_minutes[:-1], sample_minutes[1:]
 
-            writer.writerow(new_row)
+@timed('print_sdate_values')
+def print_sdate_values(wateryear, final_dictionary, sitecode_in, sDate_list, integrator=None):
+    """ prints the sdates and total q area between them if if it possible
 
-def print_sdate_values(wateryear, final_dictionary, sitecode_in, sDate_list):
-    """ prints the sdates and total q area between them if if it possible"""
+    Each window runs from one sample date to the next. A window is only written when there is a five minute value at both its begin and its end, so a total is never of part of a window; a sample date that is not in the data leaves out the windows on either side of it, not the rest of the year. The first window begins at the start of the water year, which the data of a whole year does not have a value at (its equation sets begin at 00:01, so its first value is at 00:05); that window is totalled from the first value, as long as the data starts within five minutes of it.
 
-    sDate_d = {}
-    areas = {'GSWS01': 237., 'GSWS02': 149., 'GSWS03': 250., 'GSWS06':32, 'GSWS07':38., 'GSWS08':53., 'GSWS09':21., 'GSWS10':25.3, 'GSWSMA':1436., 'GSWSMF':1436., 'GSCC01':171., 'GSCC02': 169., 'GSCC03': 123., 'GSCC04':120.}
+    :final_dictionary: the Series from loop_over_data
+    :sDate_list: the list from get_samples_dates
+    :integrator: a StreamedSampleIntegrator that has been given every five minute value, in place of final_dictionary (optional)
+    """
 
     stcode = 'HF004'
     format = '6'
     sitecode = sitecode_in
-    sorted_dates = sorted(list(final_dictionary.keys()))
 
     csvfilename = name_my_csv(sitecode_in, wateryear, 's')
 
-    if sys.version_info >= (3,0):
-        mode = 'w'
-    else:
-        mode = 'wb'
+    begins, ends = sample_windows(sDate_list)
 
-    with open(csvfilename, mode) as writefile:
-        writer = csv.writer(writefile, quoting = csv.QUOTE_NONNUMERIC, delimiter=",")
+    if integrator == None:
+        integrator = SampleIntegrator(final_dictionary)
+
+    present = integrator.has(begins)
+
+    if len(begins) > 0 and integrator.first_minute != None and begins[0] <= integrator.first_minute <= begins[0] + 5:
+        present[0] = True
+
+    written = np.flatnonzero((begins < ends) & present & integrator.has(ends))
+    sample_totals = integrator.total_q(begins[written], ends[written])*12/(43560*AREAS[sitecode])
+
+    with open_csv(csvfilename) as writefile:
+        writer = csv.writer(writefile, quoting = csv.QUOTE_NONNUMERIC, delimiter = ",")
 
         headers = ['STCODE', 'FORMAT' ,'SITECODE', 'WATERYEAR', 'BEGIN_DATETIME', 'END_DATETIME', 'TOTAL_Q_SMPL', 'ESTCODE']
 
         writer.writerow(headers)
 
-        # add an extra copy of the final day to act as a buffer for the second index
-        sDate_list.append(datetime.datetime(int(wateryear),10,1,0,0))
+        for index, each_window in enumerate(written.tolist()):
 
-        starting = iter(sDate_list)
+            print_date = datetime.datetime.strftime(minutes_to_datetime(begins[each_window]), '%Y-%m-%d %H:%M:%S')
+            print_date_2 = datetime.datetime.strftime(minutes_to_datetime(ends[each_window]), '%Y-%m-%d %H:%M:%S')
 
-        if sys.version_info >= (3,0):
-            this_date = next(starting)
-            subsequent = next(starting)
+            writer.writerow([stcode, format, sitecode, wateryear, print_date, print_date_2, round(float(sample_totals[index]),3)])
+
+    print("S-points have been output to the final available date.")
+
+class SpanFlow(object):
+    """ flow_the_data for one span from equation_spans, on data that comes a chunk at a time
+
+    Each reading is computed with the one after it, so the last reading present so far is carried to the next chunk and computed again with it. After a height over the top of the rating nothing more of the span is computed, as in flow_the_data.
+
+    :span: one of the spans from equation_spans
+    :rating_calib: the RatingTable of its equation set
+    """
+
+    def __init__(self, span, rating_calib):
+        self.span = span
+        self.rating_calib = rating_calib
+
+        # the reading carried to the next chunk
+        self.minute = None
+        self.height = None
+
+        self.stopped = False
+        self.reported = False
+
+    def add(self, od):
+        """ The Series flow_the_data gives for the rows of the span in the next chunk (and the reading carried from the chunks before)"""
+
+        rows = od.between(self.span['first_minute'], self.span['last_minute'])
+
+        return self.flow(od.minutes[rows], od.values['val'][rows])
+
+    def finish(self, final_val):
+        """ The Series flow_the_data gives for the last value of the data, when it is added on at the end of the water year"""
+
+        if self.span['ends_the_year']:
+            return self.flow(np.array([self.span['last_minute']], dtype=np.int64), np.array([final_val], dtype=np.float64))
+
+        return self.flow(np.zeros(0, dtype=np.int64), np.zeros(0))
+
+    def carried(self, last_minute):
+        """ The date of the reading carried to the chunks after last_minute, or None when nothing more of the span can come from them"""
+
+        if self.stopped or (self.span['last_minute'] <= last_minute and not self.span['ends_the_year']):
+            return None
+
+        return self.minute
+
+    def flow(self, raw_dts, raw_hts):
+
+        present = np.flatnonzero(~np.isnan(raw_hts))
+
+        if self.stopped or len(present) == 0:
+            return Series(np.zeros(0, dtype=np.int64), values={'stage': [], 'inst_q': [], 'total_q': [], 'mean_q': []})
+
+        # the same rounding flow_the_data gives the heights, to find a height over the top of the rating
+        above = self.rating_calib.segments(round_column(raw_hts[present], 7)) == len(self.rating_calib.max_heights)
+
+        # the last reading present, to carry
+        last_reading = (int(raw_dts[present[-1]]), raw_hts[present[-1]])
+
+        if self.minute != None:
+            raw_dts = np.concatenate(([self.minute], raw_dts))
+            raw_hts = np.concatenate(([self.height], raw_hts))
+
+        od = flow_the_data(raw_dts, raw_hts, self.rating_calib, desired=300, report=not self.reported)
+
+        # flow_the_data reports once there are two readings
+        self.reported = self.reported or self.minute != None or len(present) > 1
+
+        if above.any():
+            self.stopped = True
         else:
-            this_date = starting.next()
-            subsequent = starting.next()
-
-        if this_date.minute%5 != 0:
-            add_to_date = datetime.timedelta(minutes = (5-this_date.minute%5))
-            this_date = this_date + add_to_date
-            print("added minutes to date")
-
-        if subsequent.minute%5 != 0:
-            add_to_date = datetime.timedelta(minutes = (5-subsequent.minutes%5))
-            subsequent = subsequent + add_to_date
-            print("added minutes to date")
-
-
-        # these are the final outputs from the data
-        sorted_dates = sorted(list(final_dictionary.keys()))
-
-        for each_date in sorted_dates:
-
-            try:
-
-                if type(this_date) != datetime.datetime:
-                    this_date = datetime.datetime.strptime(this_date, '%Y-%m-%d %H:%M:%S')
-                    #print("converted this date to correct format")
-
-                if type(each_date) != datetime.datetime:
-                    each_date = datetime.datetime.strptime(each_date, '%Y-%m-%d %H:%M:%S')
-                    #print("converted each date to correct format")
-
-                if each_date>= this_date and each_date<subsequent:
-
-                    if this_date not in sDate_d:
-                        sDate_d[this_date] = {'total_q':[final_dictionary[each_date]['total_q']] }
-                    elif this_date in sDate_d:
-                        if final_dictionary[each_date]['total_q'] != None:
-                            sDate_d[this_date]['total_q'].append(final_dictionary[each_date]['total_q'])
-                        else:
-                            pass
-
-                elif each_date == subsequent:
-
-                    this_date = subsequent
-
-                    if sys.version_info >= (3,0):
-                        subsequent = next(starting)
-                    else:
-                        subsequent = starting.next()
-
-                    if this_date not in sDate_d:
-                        sDate_d[this_date] = {'total_q':[final_dictionary[each_date]['total_q']] }
-                    elif this_date in sDate_d:
-                        if final_dictionary[each_date]['total_q'] !=None:
-                            sDate_d[this_date]['total_q'].append(final_dictionary[each_date]['total_q'])
-                        else:
-                            pass
-
-                elif each_date > subsequent and subsequent.minutes%5 != 0:
-                    remainder = subsequent.minutes%5
-                    five_minus = 5-remainder
-                    subsequent += datetime.timedelta(minutes = five_minus)
-                    print(subsequent)
-
-                    if each_date == subsequent:
-
-                        this_date = subsequent
-
-                        if sys.version_info >= (3,0):
-                            subsequent = next(starting)
-                        else:
-                            subsequent = starting.next()
-
-                        if this_date not in sDate_d:
-                            sDate_d[this_date] = {'total_q':[final_dictionary[each_date]['total_q']] }
-                        elif this_date in sDate_d:
-                            if final_dictionary[each_date]['total_q'] !=None:
-                                sDate_d[this_date]['total_q'].append(final_dictionary[each_date]['total_q'])
-                            else:
-                                pass
-                elif each_date > subsequent and subsequent.minutes%5 == 0:
-                    import pdb; pdb.set_trace()
-                    # if you are at the end of the data you can comment this in to see what dates still exist
-                    # print "found: " + datetime.datetime.strftime(each_date, '%Y-%m-%d %H:%M:%S') + " which is bigger than the last day"
-
-            except Exception:
-                pass
+            self.minute, self.height = last_reading
+
+        return od
+
+class FlowStream(object):
+    """ loop_over_data and the five minute, daily and sample totals made from it, for data that comes a chunk at a time (see stream_flows)
+
+    What carries from one chunk to the next is the reading of each span (see SpanFlow), the five minute file (see FiveMinuteFile), the running sum of the sample totals (see StreamedSampleIntegrator), the five minute values of the day not over yet, which are summed up once it is, and the rows of the data from the earliest of those on, for their flags.
+
+    **Inputs**
+    :sitecode: ex. GSWS01
+    :wateryear: ex. 2015
+    :o1: the equation sets, from get_equations_by_value
+    :spans: from equation_spans
+    :sample_dates: the list from get_samples_dates, or None
+    """
 
+    def __init__(self, sitecode, wateryear, o1, spans, sample_dates):
 
-        for index,each_date in enumerate(sorted(list(sDate_d.keys()))):
+        rating_tables = {}
+        self.spans = []
 
-            # create a date that you can print based on the first date
-            print_date = datetime.datetime.strftime(each_date, '%Y-%m-%d %H:%M:%S')
+        for index, each_span in enumerate(spans):
+            each_key = each_span['key']
 
-            try:
-                print_date_2 = datetime.datetime.strftime(sorted(sDate_d.keys())[index + 1], '%Y-%m-%d %H:%M:%S')
-            except Exception:
-                print("S-points have been output to the final available date.")
-                return True
+            if each_key not in rating_tables:
+                rating_tables[each_key] = rating_table(o1[each_key]['eqns'])
 
-            sDate_d[each_date].update({'sample_total': sum(sDate_d[each_date]['total_q'])*12/(43560*areas[sitecode])})
+            print("the key processed is " + each_key + " and the index is " + str(len([x for x in spans[:index] if x['key'] == each_key])))
+
+            self.spans.append(SpanFlow(each_span, rating_tables[each_key]))
+
+        self.five_minute_file = FiveMinuteFile(sitecode, wateryear, 5, sample_dates)
+
+        if sample_dates != None:
+            self.integrator = StreamedSampleIntegrator(np.concatenate(sample_windows(sample_dates)))
+        else:
+            self.integrator = None
+
+        self.original = None
+        self.held = None
+        self.days = []
+        self.repeated = 0
+        self.last_minute = None
+
+    def add(self, od):
+        """ Computes and writes what can be from the next chunk of the data
+
+        :od: the next Series from stream_working_data
+        """
+
+        if self.original == None:
+            self.original = od
+        else:
+            self.original = Series.concatenate([self.original, od])
 
-            new_row = [stcode, format, sitecode, wateryear, print_date, print_date_2, round(sDate_d[each_date]['sample_total'],3)]
+        self.write([x.add(od) for x in self.spans], False)
+
+    def finish(self, final_val):
+        """ Computes and writes the rest, once every chunk has been added, and closes the five minute file
+
+        **Returns**
+        :days: the result of summarize_days for the year
+        """
+
+        self.write([x.finish(final_val) for x in self.spans], True)
+        self.five_minute_file.close()
+
+        if self.repeated > 0:
+            print(str(self.repeated) + " dates had already been included in the lookup")
+
+        return join_days(self.days)
+
+    def write(self, flows, last):
+
+        od, repeated = join_span_flows(flows, [x.span['eqn_set'] for x in self.spans])
+        self.repeated += repeated
+
+        held = self.held
+
+        if len(od) != 0:
+
+            if self.last_minute != None and od.minutes[0] <= self.last_minute:
+                raise ValueError("The equation sets computed " + datetime.datetime.strftime(minutes_to_datetime(od.minutes[0]), '%Y-%m-%d %H:%M:%S') + " after " + datetime.datetime.strftime(minutes_to_datetime(self.last_minute), '%Y-%m-%d %H:%M:%S') + ", so the data can not be computed a chunk at a time. Run without --stream.")
+
+            self.last_minute = int(od.minutes[-1])
+
+            self.five_minute_file.write(od, self.original)
+
+            if self.integrator != None:
+                self.integrator.add(od)
+
+            if held == None:
+                held = od
+            else:
+                held = Series.concatenate([held, od])
+
+        # the days before the one of the last value are over
+        if held != None and len(held) != 0:
+
+            if last:
+                over = len(held)
+            else:
+                over = int(np.searchsorted(held.minutes, (held.minutes[-1]//1440)*1440, side='left'))
 
-            writer.writerow(new_row)
+            if over > 0:
+                self.days.append(summarize_days(held.take(slice(0, over)), self.original))
+                held = held.take(slice(over, None))
+
+        self.held = held
+
+        if last or self.original == None or len(self.original) == 0:
+            return
+
+        # the rows of the data still needed for the flags: from the earliest reading carried, and from the day not over yet
+        needed = [x.carried(int(self.original.minutes[-1])) for x in self.spans]
+        needed = [x for x in needed if x != None]
+
+        if held != None and len(held) != 0:
+            needed.append((int(held.minutes[0])//1440)*1440)
+
+        if needed == []:
+            needed = [int(self.original.minutes[-1]) + 1]
+
+        self.original = self.original.take(slice(int(np.searchsorted(self.original.minutes, min(needed), side='left')), None))
+
+@timed('stream_flows')
+def stream_flows(sitecode, wateryear, csvfilename, chunk_rows, o1, sample_dates, first_minute, last_minute, final_val):
+    """ set_up_iterators, loop_over_data, print_five_minute_file and summarize_days, a chunk of the working file at a time, for --stream; the five minute file is the same as theirs
+
+    **Inputs**
+    :csvfilename: the working file
+    :chunk_rows: how many rows to read at a time
+    :o1: the equation sets, from get_equations_by_value
+    :sample_dates: the list from get_samples_dates, or None
+    :first_minute, last_minute, final_val: from scan_working_file
+
+    **Returns**
+    :days: the result of summarize_days, for print_daily_values and compute_daily_dictionary
+    :integrator: a StreamedSampleIntegrator for print_sdate_values, or None without sample dates
+    """
+
+    spans = equation_spans(o1, minutes_to_datetime(first_minute), minutes_to_datetime(last_minute), wateryear)
+
+    flow_stream = FlowStream(sitecode, wateryear, o1, spans, sample_dates)
+
+    try:
+        for od in stream_working_data(csvfilename, chunk_rows):
+            flow_stream.add(od)
+
+        days = flow_stream.finish(final_val)
+
+    except Exception:
+        # a five minute file stopped part way is not left behind
+        flow_stream.five_minute_file.close()
+
+        if os.path.isfile(flow_stream.five_minute_file.filename):
+            os.remove(flow_stream.five_minute_file.filename)
+        raise
+
+    return days, flow_stream.integrator
 
 if __name__ == "__main__":
 
+    # --profile anywhere on the command line times each stage; see profiling.py
+    sys.argv = switch_on_profile(sys.argv, 'pyflow')
+
+    # --stream reads the working file a chunk of rows at a time; see timeseries.stream_option
+    sys.argv, stream_rows = stream_option(sys.argv)
+
     sitecode = sys.argv[1]
-    wateryear = sys.argv[2]
     filetype = sys.argv[3]
 
-    print("Now processing \'pyflow\' for sitecode \'" + str(sitecode) + "\' and wateryear \'" + str(wateryear) + "\', with a source of was \'" + str(filetype) + "\'")
+    # the server (through the cache), or a local snapshot given on the command line or in PYFLOW_METADATA
+    if len(sys.argv) > 4:
+        metadata = open_metadata(sys.argv[4])
+    else:
+        metadata = open_metadata()
+
+    # the metadata queries are done while the working file is read, and the output files are written side by side
+    executor = io_executor()
 
-    if filetype.lower() == "csv":
+    # a range of water years, ex. 2010-2015 (as weir3k.py adjusts them in one pass), is done one year after the other with the same connection
+    for wateryear in [str(x) for x in water_year_range(sys.argv[2])]:
 
-        csvfilename = os.path.join(sitecode.upper() + "_" + str(wateryear) + "_working", sitecode.upper() + "_" + str(wateryear) + "_re.csv")
-        print("......Getting data from csv file :\'" + csvfilename + "\', which is located in your \'working\' directory. I always get files ending in \'_re\'")
+        print("Now processing \'pyflow\' for sitecode \'" + str(sitecode) + "\' and wateryear \'" + str(wateryear) + "\', with a source of was \'" + str(filetype) + "\'")
 
-        # new: bfav is bad flags and values, which may indicate some problems in the data
-        o2, bfav = get_data_from_csv(csvfilename)
+        # the equation sets, the equations by value, and the sample dates
+        metadata_call = start(executor, fetch_metadata, metadata, sitecode, wateryear)
 
-        if bfav != {}:
-            quickly_recheck_data(o2)
+        if filetype.lower() == "csv":
 
-            if sys.version_info >= (3,0):
-                value = input("It appears your data may not be complete. Press 'y' to continue or enter to quit")
+            csvfilename = os.path.join(sitecode.upper() + "_" + str(wateryear) + "_working", sitecode.upper() + "_" + str(wateryear) + "_re.csv")
+            print("......Getting data from csv file :\'" + csvfilename + "\', which is located in your \'working\' directory. I always get files ending in \'_re\'")
+
+            # new: bfav is bad flags and values, which may indicate some problems in the data
+            if stream_rows != None:
+                # the data is gone through a chunk at a time once the equations are in; for now only what is needed before that
+                o2 = None
+                first_minute, last_minute, final_val, missing, bfav = scan_working_file(csvfilename, stream_rows)
             else:
-                value = raw_input("It appears your data may not be complete. Press 'y' to continue or enter to quit")
+                o2, bfav = get_data_from_csv(csvfilename)
+                missing = o2
 
-            if value != 'y':
-                sys.exit("Exiting. Please check the adjusted data in " + csvfilename)
+            if bfav != {}:
+                quickly_recheck_data(missing)
 
-    elif filetype.lower() == "sql":
-        conn, cur = fc()
-        print(".....Getting data from SQL Server... warning, this function has NEVER been used before. ")
-        first_day = datetime.datetime(int(wateryear)-1, 10, 1, 0, 0)
-        last_day = datetime.datetime(wateryear, 10, 1, 0, 0)
-        o2 = get_data_from_sql(cur, sitecode, first_day, last_day)
+                if sys.version_info >= (3,0):
+                    value = input("It appears your data may not be complete. Press 'y' to continue or enter to quit")
+                else:
+                    value = raw_input("It appears your data may not be complete. Press 'y' to continue or enter to quit")
 
-    else:
-        print(" I have no idea where you want to get the data from, try \'csv\' or \'sql\' ")
+                if value != 'y':
+                    sys.exit("Exiting. Please check the adjusted data in " + csvfilename)
 
-    # connect to server to get the data
-    conn, cur = fc()
+        elif filetype.lower() == "sql":
+            stream_rows = None
+            conn, cur = fc()
+            print(".....Getting data from SQL Server... warning, this function has NEVER been used before. ")
+            first_day = datetime.datetime(int(wateryear)-1, 10, 1, 0, 0)
+            last_day = datetime.datetime(wateryear, 10, 1, 0, 0)
+            o2 = get_data_from_sql(cur, sitecode, first_day, last_day)
 
-    # get the equation sets you need to run this analysis
-    o = get_equation_sets(cur, sitecode, wateryear)
+        else:
+            print(" I have no idea where you want to get the data from, try \'csv\' or \'sql\' ")
 
-    # modify that dictionary to have the maxheight mapped to ln_a and b
-    o1 = get_equations_by_value(cur, sitecode, o)
+        o1, sd = metadata_call.result()
 
-    # get the sample dates.
-    sd = get_samples_dates(cur, sitecode, wateryear)
+        # the files being written; each only reads what it is given
+        writes = []
 
-    # create iterators for the pyflow
-    o3 = set_up_iterators(o2, o1, wateryear)
+        if stream_rows != None:
+            # the five minute file is written as the data goes by, and the days and the sample totals are kept
+            print("... now printing the five minute file to csv, a chunk at a time ... ")
+            o4 = None
+            days, integrator = stream_flows(sitecode, wateryear, csvfilename, stream_rows, o1, sd, first_minute, last_minute, final_val)
 
+        else:
+            # create iterators for the pyflow
+            o3 = set_up_iterators(o2, o1, wateryear)
 
 
-    # go through the data
-    o4 = loop_over_data(o3, o1)
 
-    print("... now printing the five minute file to csv ... ")
-    print_five_minute_file(o4, sitecode, wateryear, 5, o2, sd)
+            # go through the data
+            o4 = loop_over_data(o3, o1)
 
-    print("... now printing the daily file to csv ...")
-    print_daily_values(sitecode, wateryear, o4, o2)
+            print("... now printing the five minute file to csv ... ")
+            writes.append(start(executor, print_five_minute_file, o4, sitecode, wateryear, 5, o2, sd))
 
-    if sd != None:
-        print("... now printing the S codes to csv ... ")
-        print_sdate_values(wateryear, o4, sitecode, sd)
-    else:
-       pass
+            # the days are summed up once, for the daily and the monthly files, while the five minute file is written
+            days = summarize_days(o4, o2)
+            integrator = None
 
-    print("... now printing the monthly file to csv ...")
-    o_daily = compute_daily_dictionary(sitecode, wateryear, o4, o2)
-    create_monthly_files(sitecode, wateryear, o_daily)
+        print("... now printing the daily file to csv ...")
+        writes.append(start(executor, print_daily_values, sitecode, wateryear, o4, o2, days))
+
+        if sd != None:
+            print("... now printing the S codes to csv ... ")
+            writes.append(start(executor, print_sdate_values, wateryear, o4, sitecode, sd, integrator))
+        else:
+           pass
+
+        print("... now printing the monthly file to csv ...")
+        writes.append(start(executor, print_monthly_values, sitecode, wateryear, o4, o2, days))
+
+        # all of them are done (and any error comes out here) before the next year
+        for each_write in writes:
+            each_write.result()
+
+    if executor != None:
+        executor.shutdown()
 
+    metadata.close()
 
-    print("Finished creating your pyflow. see the root of your directory for the files :)")
\ No newline at end of file
+    print("Finished creating your pyflow. see the root of your directory for the files :)")
@@ -1,9 +1,28 @@
 from pyflow import *
 from nose import with_setup
+import contextlib
+import shutil
+import tempfile
 
 
 # This file contains a series of tests that do the workflow of GSWSMA in 2015.
 
+@contextlib.contextmanager
+def scratch_directory(site_years=None):
+	""" Runs the body of a 'with' in a new temporary directory, with the made-up data of site_years in it (see benchmark.make_site_years), and then goes back to where it was and removes the directory. Gives the name of the metadata snapshot of the site_years, or of the directory without them"""
+	here = os.getcwd()
+	directory = tempfile.mkdtemp()
+	os.chdir(directory)
+	try:
+		if site_years == None:
+			yield directory
+		else:
+			import benchmark
+			yield benchmark.make_site_years(site_years)
+	finally:
+		os.chdir(here)
+		shutil.rmtree(directory, ignore_errors=True)
+
 def test_pymssql_connection():
 	""" Tests that the SQL connection can be formed"""
 	conn, cur = fc()
@@ -38,4 +57,485 @@ def test_sample_dates():
 	wateryear = 2015
 	sd = get_samples_dates(cur, sitecode, wateryear)
 	mocked = [datetime.datetime(2014, 10, 1, 0, 0), datetime.datetime(2014, 10, 15, 11, 5), datetime.datetime(2014, 11, 5, 14, 0), datetime.datetime(2014, 11, 24, 14, 0), datetime.datetime(2014, 12, 16, 9, 0), datetime.datetime(2015, 1, 6, 8, 55), datetime.datetime(2015, 1, 26, 11, 35), datetime.datetime(2015, 2, 18, 16, 25), datetime.datetime(2015, 3, 11, 10, 25), datetime.datetime(2015, 4, 1, 8, 45), datetime.datetime(2015, 4, 22, 8, 5), datetime.datetime(2015, 5, 13, 7, 55), datetime.datetime(2015, 6, 3, 8, 5), datetime.datetime(2015, 6, 22, 15, 50), datetime.datetime(2015, 7, 14, 9, 15), datetime.datetime(2015, 8, 4, 19, 15), datetime.datetime(2015, 8, 25, 18, 10), datetime.datetime(2015, 9, 15, 9, 25), datetime.datetime(2015, 10, 1, 0, 0)]
-	assert sd == mocked
\ No newline at end of file
+	assert sd == mocked
+
+def test_assign_corrections():
+	""" Observations are walked onto the correction that ends on or after them, one correction per observation"""
+	import numpy as np
+	import weir3k
+	corr_ends = np.array([600, 1200, 1500])
+	observed = np.array([0, 300, 600, 900, 1800])
+	index, advanced = weir3k.assign_corrections(corr_ends, observed)
+	assert index.tolist() == [0, 0, 0, 1, 2]
+	assert advanced.tolist() == [False, False, False, True, True]
+
+def test_series_from_rows():
+	""" The compact series sorts by date, keeps the first of a repeated date, and gives None back for missing values"""
+	from timeseries import Series, FLAG_LABELS
+	dates = [datetime.datetime(2014, 10, 1, 0, 5), datetime.datetime(2014, 10, 1, 0, 0), datetime.datetime(2014, 10, 1, 0, 5)]
+	s = Series.from_rows(dates, values={'val': [None, 0.2, 0.3]}, codes={'fval': ['M', 'A', 'E']}, code_labels={'fval': FLAG_LABELS})
+	assert s.dates() == [datetime.datetime(2014, 10, 1, 0, 0), datetime.datetime(2014, 10, 1, 0, 5)]
+	assert s.as_list('val') == [0.2, None]
+	assert s.as_list('fval') == ['A', 'M']
+
+def test_parse_dates_mixed():
+	""" Each date string is read with the first format that fits it, and strings that fit none are marked as not found"""
+	from timeseries import parse_dates_mixed, minutes_to_datetimes, DATEFORMAT_IDEAL, DATEFORMAT_OLD, DATEFORMAT_13CHAR
+	strings = ['2014-10-01 00:05:00', '10/1/2014 0:10', '20141001 0015', '2014-02-30 00:00:00']
+	minutes, found = parse_dates_mixed(strings, [DATEFORMAT_IDEAL, DATEFORMAT_OLD, DATEFORMAT_13CHAR])
+	assert found.tolist() == [True, True, True, False]
+	assert minutes_to_datetimes(minutes[found]) == [datetime.datetime(2014, 10, 1, 0, 5), datetime.datetime(2014, 10, 1, 0, 10), datetime.datetime(2014, 10, 1, 0, 15)]
+
+def test_fill_gaps():
+	""" Gaps between observations are interpolated and flagged 'E', with the last date of a gap taking the next observation's value. The output stops at the last observation"""
+	import weir3k
+	from timeseries import Series, datetime_to_minutes
+	start = datetime.datetime(2014, 10, 1, 0, 0)
+	dates = [start, start + datetime.timedelta(minutes=5), start + datetime.timedelta(minutes=20), start + datetime.timedelta(minutes=30)]
+	od = Series.from_rows(dates, values={'raw': [1.0, 2.0, 1.0, 1.0]})
+	filled = weir3k.fill_gaps(od, datetime_to_minutes(start), datetime_to_minutes(start) + 40)
+	assert filled.as_list('raw') == [1.0, 2.0, None, None, 1.0, None]
+	assert filled.as_list('estim') == [1.0, 2.0, 1.5, 1.0, 1.0, 1.0]
+	assert filled.as_list('flag') == ['A', 'E', 'E', 'E', 'E', 'E']
+
+def test_working_binary():
+	""" The binary copy of a working file reads back the columns it was written with, and is ignored once the csv changes"""
+	from timeseries import Series, FLAG_LABELS, EVENT_LABELS, write_working_binary, read_working_binary
+	dates = [datetime.datetime(2014, 10, 1, 0, 0), datetime.datetime(2014, 10, 1, 0, 5)]
+	s = Series.from_rows(dates, values={'raw': [0.1, None], 'val': [0.1, 0.2], 'adj': [0.105, 0.205]}, codes={'flag': ['A', 'E'], 'event': ['NA', 'MAINTE']}, code_labels={'flag': FLAG_LABELS, 'event': EVENT_LABELS})
+	with scratch_directory():
+		csvfilename = "GSWS01_2015_re.csv"
+		with open(csvfilename, 'w') as writefile:
+			writefile.write("the csv\n")
+		write_working_binary(csvfilename, s, 'GSWS01', 2015, False)
+		working, header = read_working_binary(csvfilename)
+		assert header == {'sitecode': 'GSWS01', 'wateryear': 2015, 'partial': False}
+		assert working.dates() == dates
+		assert working.as_list('raw') == [0.1, None]
+		assert working.as_list('adj') == [0.105, 0.205]
+		assert working.as_list('event') == ['NA', 'MAINTE']
+		with open(csvfilename, 'a') as writefile:
+			writefile.write("edited by hand\n")
+		assert read_working_binary(csvfilename) == (None, None)
+
+def test_find_jobs():
+	""" The batch finds the site-years with corr tables, runs 're' where there is already a working file and 'first' where there is only raw data, and says why it skips the others"""
+	from batch import find_jobs
+	with scratch_directory():
+		for name in ['corr_table', 'raw_data', 'GSWS01_2015_working']:
+			os.mkdir(name)
+		for name in ['corr_table/corr_table_gsws01_2015.csv', 'corr_table/corr_table_gscc01_2015.csv', 'corr_table/corr_table_gsws02_2015.csv', 'corr_table/corr_table_gsxx99_2015.csv', 'corr_table/corr_table_gsws01_2014.csv', 'corr_table/notes.txt', 'raw_data/GSWS01_2015_first.csv', 'raw_data/GSCC01_2015_first.csv', 'GSWS01_2015_working/GSWS01_2015_re.csv', 'GSWS01_2015_working/GSWS01_2015_re_partial.csv']:
+			open(name, 'w').close()
+		jobs, skipped = find_jobs(2015)
+		assert jobs == [{'sitecode': 'GSCC01', 'wateryear': 2015, 'method': 'first'}, {'sitecode': 'GSWS01', 'wateryear': 2015, 'method': 're'}]
+		assert skipped == [{'sitecode': 'GSWS02', 'wateryear': 2015, 'method': 'first', 'message': "needs exactly one file in 'raw_data', found 0"}, {'sitecode': 'GSXX99', 'wateryear': 2015, 'method': 'auto', 'message': "not a gauged site in pyflow.AREAS"}]
+		jobs, skipped = find_jobs(None, 're')
+		assert jobs == [{'sitecode': 'GSWS01', 'wateryear': 2015, 'method': 're'}]
+		assert [(x['sitecode'], x['wateryear']) for x in skipped] == [('GSCC01', 2015), ('GSWS01', 2014), ('GSWS02', 2015), ('GSXX99', 2015)]
+
+def test_rating_table():
+	""" Stages find their equation by bisection, with the max height of the equation below as the lower cutoff"""
+	rating = RatingTable({0.509: [3.568, 1.741562], 2.54: [3.856196, 2.168731]})
+	assert rating.bounds(0.2) == (0, 0.509)
+	assert rating.bounds(0.509) == (0, 0.509)
+	assert rating.bounds(1.2) == (0.509, 2.54)
+	assert rating.bounds(3.0) == None
+	assert rating.segments([0.2, 0.509, 1.2, 3.0]).tolist() == [0, 0, 1, 2]
+	q = rating.discharge([0.2, 1.2, 3.0, 0.0])
+	assert abs(q[0] - logfunc(3.568, 1.741562, 0.2)) < 1e-12
+	assert abs(q[1] - logfunc(3.856196, 2.168731, 1.2)) < 1e-12
+	assert np.isnan(q[2]) and np.isnan(q[3])
+
+def test_flow_the_data():
+	""" Five minute readings of one height give q for 300 seconds; a ten minute interval is split into two pseudo dates from its one minute heights"""
+	eqns = {0.509: [3.568, 1.741562], 2.54: [3.856196, 2.168731]}
+	minutes = np.array([datetime_to_minutes(datetime.datetime(2014,10,1,0,x)) for x in [0, 5, 10, 20]])
+	od = flow_the_data(minutes, np.array([0.2, 0.2, 0.2, 0.3]), eqns)
+	q = logfunc(3.568, 1.741562, 0.2)
+	assert [x.minute for x in od.dates()] == [0, 5, 10, 15]
+	assert abs(od.as_list('total_q')[0] - 300*q) < 1e-9
+	assert od.as_list('stage') == [0.2, 0.2, 0.2, 0.25]
+	# the pseudo dates total their first four minutes
+	assert abs(od.as_list('total_q')[2] - sum([60*logfunc(3.568, 1.741562, 0.2 + 0.01*x) for x in range(4)])) < 1e-9
+
+def test_metadata_snapshot():
+	""" The equations and sample dates of GSWSMA in 2015 come out of a local snapshot the same as from the server, and the cache answers when its backend can not"""
+	from metadata import write_snapshot, CachedBackend, MetadataBackend
+	with scratch_directory() as directory:
+		snapshot = os.path.join(directory, 'metadata.sqlite')
+		sample_dates = ['2014-10-15 11:05:00', '2014-11-05 14:00:00', '2014-11-24 14:00:00', '2014-12-16 09:00:00', '2015-01-06 08:55:00', '2015-01-26 11:35:00', '2015-02-18 16:25:00', '2015-03-11 10:25:00', '2015-04-01 08:45:00', '2015-04-22 08:05:00', '2015-05-13 07:55:00', '2015-06-03 08:05:00', '2015-06-22 15:50:00', '2015-07-14 09:15:00', '2015-08-04 19:15:00', '2015-08-25 18:10:00', '2015-09-15 09:25:00']
+		write_snapshot(snapshot, {'HF00204': [('GSWSMA', 'A', 3, '32', datetime.datetime(1979, 10, 1, 0, 1), datetime.datetime(1995, 10, 1, 0, 0)), ('GSWSMA', 'A', 3, '35', datetime.datetime(1995, 10, 1, 0, 1), datetime.datetime(2051, 1, 1, 0, 0))], 'HF00203': [('GSWSMA', 'A', 3, 2, '1436.0', 2.54, 3.856196, 2.168731), ('GSWSMA', 'A', 3, 1, '1436.0', 0.509, 3.568, 1.741562)], 'CF00206': [('GSMACK', x) for x in sample_dates] + [('GSWS01', '2015-01-01 00:00:00')]})
+		metadata = open_metadata(snapshot)
+		o = get_equation_sets(metadata, 'GSWSMA', 2015)
+		assert get_equations_by_value(metadata, 'GSWSMA', o, 2015) == {'A3': {'eqns': {0.509: [3.568, 1.741562], 2.54: [3.856196, 2.168731]}, 'eqn_set': ['32', '35'], 'acres': '1436.0', 'tuple_date': [(datetime.datetime(1979, 10, 1, 0, 1), datetime.datetime(1995, 10, 1, 0, 0)), (datetime.datetime(1995, 10, 1, 0, 1), datetime.datetime(2051, 1, 1, 0, 0))]}}
+		sd = get_samples_dates(CachedBackend(metadata, os.path.join(directory, 'cache')), 'GSWSMA', 2015)
+		assert sd == [datetime.datetime(2014, 10, 1, 0, 0)] + [datetime.datetime.strptime(x, '%Y-%m-%d %H:%M:%S') for x in sample_dates] + [datetime.datetime(2015, 10, 1, 0, 0)]
+		assert get_samples_dates(CachedBackend(MetadataBackend(), os.path.join(directory, 'cache'), ttl=0), 'GSWSMA', 2015) == sd
+
+def test_csv_columns():
+	""" Columns written in blocks come out the same as csv.writer writing the rows one at a time"""
+	import io
+	from timeseries import csv_field, csv_number_fields, csv_date_fields, csv_text_fields, write_csv_columns
+	dates = [datetime.datetime(2014, 10, 1, 0, 0), datetime.datetime(2014, 10, 1, 0, 5), datetime.datetime(2015, 9, 30, 23, 55)]
+	values = [0.0795, None, -0.0001]
+	flags = ['A', 'M', 'q"x']
+	expected = io.StringIO()
+	writer = csv.writer(expected, quoting = csv.QUOTE_NONNUMERIC, delimiter = ",")
+	for each_date, value, flag in zip(dates, values, flags):
+		writer.writerow(["GSWS01", 2015, datetime.datetime.strftime(each_date, '%Y-%m-%d %H:%M:%S'), value, None if value == None else round(value, 3), flag])
+	written = io.StringIO()
+	column = np.array([np.nan if x == None else x for x in values])
+	write_csv_columns(written, [csv_field("GSWS01"), csv_field(2015), csv_date_fields(np.array([datetime_to_minutes(x) for x in dates])), csv_number_fields(column), csv_number_fields(column, 3), csv_text_fields(flags)])
+	assert written.getvalue() == expected.getvalue()
+
+def test_summarize_days():
+	""" Five minute values are reduced to one row per day, and one 'M' in a day makes the day 'M'"""
+	from timeseries import Series, FLAG_LABELS, EVENT_LABELS
+	first = datetime_to_minutes(datetime.datetime(2014, 10, 1, 23, 50))
+	minutes = first + 5*np.arange(4)
+	final = Series(minutes, values={'mean_q': np.array([1.0, 2.0, np.nan, 4.0]), 'inst_q': np.array([1.0, 3.0, np.nan, 4.0]), 'total_q': np.array([300., 600., np.nan, 1200.])})
+	original = Series(minutes[1:], values={'val': np.zeros(3)}, codes={'fval': (np.array([1, 0, 0], dtype=np.uint8), FLAG_LABELS), 'event': (np.zeros(3, dtype=np.uint8), EVENT_LABELS)})
+	days = summarize_days(final, original)
+	assert minutes_to_datetimes(days['minutes']) == [datetime.datetime(2014, 10, 1), datetime.datetime(2014, 10, 2)]
+	assert days['mean_count'] == [2, 1] and days['mean_sum'] == [3.0, 4.0] and days['tot_sum'] == [900.0, 1200.0]
+	assert days['max'] == [3.0, 4.0] and days['min'] == [1.0, 4.0]
+	assert days['flag'] == ['M', 'A']
+
+def test_sample_integrator():
+	""" Windows of any order or overlap are summed from one running total; missing totals add nothing"""
+	from timeseries import Series
+	first = datetime_to_minutes(datetime.datetime(2014, 10, 1, 0, 0))
+	integrator = SampleIntegrator(Series(first + 5*np.arange(6), values={'total_q': np.array([1., 2., np.nan, 4., 8., 16.])}))
+	assert integrator.total_q([first + 25, first, first + 5], [first + 30, first + 30, first + 20]).tolist() == [16., 31., 6.]
+	assert integrator.has([first, first + 3, first + 30]).tolist() == [True, False, False]
+	assert integrator.sample_total('GSWS01', datetime.datetime(2014, 10, 1, 0, 0), datetime.datetime(2014, 10, 1, 0, 10)) == 3.*12/(43560*237.)
+
+def test_patch_adjustments():
+	""" Redoing 're' over an edited correction writes the same working file as redoing the whole year, and only for the months it covers"""
+	import weir3k
+	from timeseries import FLAG_LABELS, EVENT_LABELS
+	def correction(bgn_dt, enddt, bgn_diff, end_diff):
+		return {'sitecode': 'GSWS01', 'bgn_cr': 1.0, 'bgn_hg': 1.0 + bgn_diff, 'bgn_rat': 1.0 + bgn_diff, 'bgn_dt': bgn_dt, 'end_cr': 1.0, 'end_hg': 1.0 + end_diff, 'end_rat': 1.0 + end_diff, 'duration': (enddt - bgn_dt).days*1440 + (enddt - bgn_dt).seconds//60, 'end_diff': end_diff, 'bgn_diff': bgn_diff}
+	ends = [datetime.datetime(2014, 10, 1), datetime.datetime(2014, 10, 20), datetime.datetime(2014, 11, 10), datetime.datetime(2014, 12, 1)]
+	corr_od = dict((ends[x + 1], correction(ends[x], ends[x + 1], 0.01*x, 0.02*x)) for x in range(3))
+	first = datetime_to_minutes(datetime.datetime(2014, 10, 1, 0, 5))
+	minutes = first + 5*np.arange(12000)
+	od = Series(minutes, values={'raw': np.linspace(0.1, 0.5, 12000), 'val': np.linspace(0.1, 0.5, 12000)}, codes={'fval': (np.zeros(12000, dtype=np.uint8), FLAG_LABELS), 'event': (np.zeros(12000, dtype=np.uint8), EVENT_LABELS)})
+	with scratch_directory():
+		os.mkdir("GSWS01_2015_backups")
+		def write_full(filename):
+			wd = weir3k.determine_weights('GSWS01', 2015, corr_od, od, False)
+			copy = weir3k.working_rows(wd)
+			with weir3k.open_csv(filename) as writefile:
+				weir3k.write_csv_columns(writefile, weir3k.working_csv_columns('GSWS01', copy))
+			weir3k.write_working_copy(filename, copy, 'GSWS01', 2015, False)
+			index, advanced = weir3k.assign_corrections(weir3k.datetimes_to_minutes(ends[1:]), od.minutes)
+			weir3k.write_corr_record(filename, corr_od, ends[1:], od.minutes, index)
+		write_full("GSWS01_2015_re.csv")
+		assert weir3k.patch_adjustments('GSWS01', 2015, "GSWS01_2015_re.csv", corr_od, False)[1] == []
+		corr_od[ends[2]] = correction(ends[1], ends[2], 0.01, 0.05)
+		wd, months = weir3k.patch_adjustments('GSWS01', 2015, "GSWS01_2015_re.csv", corr_od, False)
+		assert months == [(2014, 10), (2014, 11)]
+		write_full("full_re.csv")
+		with open("GSWS01_2015_re.csv", 'r') as patched:
+			with open("full_re.csv", 'r') as full:
+				assert patched.read() == full.read()
+		corr_od[datetime.datetime(2014, 11, 1)] = correction(ends[1], datetime.datetime(2014, 11, 1), 0.0, 0.0)
+		assert weir3k.patch_adjustments('GSWS01', 2015, "GSWS01_2015_re.csv", corr_od, False) == (None, None)
+
+def test_make_graphs():
+	""" Each month is drawn once; drawing again with the same values leaves the images alone, and a changed month is drawn again"""
+	import weir3k
+	first = datetime_to_minutes(datetime.datetime(2014, 10, 1, 0, 0))
+	minutes = first + 60*np.arange(24*61)
+	wd = Series(minutes, values={'val': np.linspace(0.1, 0.5, len(minutes)), 'adj_diff': np.linspace(0.1, 0.6, len(minutes))})
+	os.environ[weir3k.GRAPH_WORKERS_ENVIRONMENT] = '1'
+	try:
+		with scratch_directory():
+			os.mkdir("GSWS01_2015_images")
+			weir3k.make_graphs('GSWS01', 2015, wd)
+			images = sorted(x for x in os.listdir("GSWS01_2015_images") if x.endswith('.png'))
+			assert len(images) == 12 and "2014_10_wy_GSWS01.png" in images
+			for name in images:
+				os.utime(os.path.join("GSWS01_2015_images", name), (0, 0))
+			wd.values['adj_diff'][-1] = 1.0
+			weir3k.make_graphs('GSWS01', 2015, wd)
+			drawn = [x for x in images if os.path.getmtime(os.path.join("GSWS01_2015_images", x)) != 0]
+			assert drawn == ["2014_11_wy_GSWS01.png"]
+			# thinning the lines changes what every graph is drawn from
+			os.environ[weir3k.GRAPH_BUCKETS_ENVIRONMENT] = '50'
+			assert weir3k.graph_buckets() == 50
+			for name in images:
+				os.utime(os.path.join("GSWS01_2015_images", name), (0, 0))
+			weir3k.make_graphs('GSWS01', 2015, wd)
+			assert [x for x in images if os.path.getmtime(os.path.join("GSWS01_2015_images", x)) != 0] == images
+	finally:
+		del os.environ[weir3k.GRAPH_WORKERS_ENVIRONMENT]
+		os.environ.pop(weir3k.GRAPH_BUCKETS_ENVIRONMENT, None)
+
+def test_decimate_minmax():
+	""" Thinning a line keeps the ends, every spike, and the values either side of a step"""
+	import weir3k
+	minutes = 5*np.arange(10000)
+	values = np.where(minutes < 30000, 1.0, 2.0)
+	values[4321] = 9.0
+	values[4322] = -9.0
+	thin_minutes, thin_values = weir3k.decimate_minmax(minutes, values, 100)
+	assert len(thin_minutes) <= 400 and (np.diff(thin_minutes) > 0).all()
+	assert thin_minutes[0] == 0 and thin_minutes[-1] == 49995
+	assert 9.0 in thin_values and -9.0 in thin_values
+	assert 29995 in thin_minutes and 30000 in thin_minutes
+	assert weir3k.decimate_minmax(minutes, values, None)[0] is minutes
+
+def test_profile():
+	""" --profile comes off the command line and switches the stages on; each stage is written with the one it ran in and its rows"""
+	import json
+	from profiling import PROFILE, timed, switch_on_profile
+	@timed('inner', rows=len)
+	def inner():
+		return [1, 2]
+	assert switch_on_profile(['weir3k.py', 'GSWS01', '2015', 're'], 'weir3k') == ['weir3k.py', 'GSWS01', '2015', 're']
+	assert not PROFILE.enabled
+	try:
+		with scratch_directory():
+			assert switch_on_profile(['weir3k.py', 'GSWS01', '--profile', '2015', 're'], 'weir3k') == ['weir3k.py', 'GSWS01', '2015', 're']
+			with PROFILE.stage('outer') as stage:
+				inner()
+				stage.rows = 3
+			filenames = PROFILE.write()
+			assert not PROFILE.enabled
+			with open(filenames[0], 'r') as readfile:
+				profile = json.load(readfile)
+			assert profile['run'] == 'weir3k_GSWS01_2015_re'
+			assert [(x['stage'], x['parent'], x['rows']) for x in profile['stages']] == [('outer', None, 3), ('inner', 'outer', 2)]
+	finally:
+		PROFILE.records = []
+
+def test_benchmark_data():
+	""" The made-up site-years are the same every time, read back as raw data and a corr table, and the sparse kind only keeps changes"""
+	import weir3k
+	import benchmark
+	site_years = benchmark.synthetic_site_years(5)
+	assert [x['kind'] for x in site_years] == ['regular', 'sparse', 'gappy', 'storm', 'regular']
+	assert site_years[0]['wateryear'] == 2015
+	minutes, values = benchmark.synthetic_stage(2015, 'regular', 1)
+	again_minutes, again_values = benchmark.synthetic_stage(2015, 'regular', 1)
+	assert (minutes == again_minutes).all() and (values == again_values).all()
+	assert len(minutes) == 105121
+	sparse_minutes, sparse_values = benchmark.synthetic_stage(2015, 'sparse', site_years[1]['seed'])
+	assert len(sparse_minutes) < len(minutes)
+	with scratch_directory(site_years[:2]):
+		corr_od = weir3k.convert_corr_to_dict(site_years[0]['sitecode'], 2015)
+		assert len(corr_od) > 8 and max(corr_od) > datetime.datetime(2015, 10, 1, 0, 0)
+		od, date_column = weir3k.parameterize_first(site_years[1]['sitecode'], 2015, os.path.join('raw_data', site_years[1]['sitecode'] + "_2015_first.csv"))
+		assert date_column == 1 and len(od) == len(sparse_minutes)
+
+def test_file_catalog():
+	""" The catalog files each file under its site, year and role, sees a file added to a directory, and finds what the walk found"""
+	import weir3k
+	from catalog import FileCatalog, parse_name
+	assert parse_name('GSWS01_2015_re_partial.csv') == ('GSWS01', 2015, 're_partial')
+	assert parse_name('GSWS01_2014_2015_first.csv') == None
+	with scratch_directory():
+		for name in ['raw_data', 'GSWS01_2015_working', 'GSWS01_2015_images']:
+			os.mkdir(name)
+		for name in ['raw_data/GSWS01_2015_first.csv', 'raw_data/GSWS01 wy2015.csv', 'GSWS01_2015_working/GSWS01_2015_re.csv', 'GSWS01_2015_images/2014_10_wy_GSWS01.png', 'GSWS01_2015_first.csv']:
+			open(name, 'w').close()
+		catalog = FileCatalog().refresh()
+		assert catalog.site_year_files('GSWS01', 2015, 'image') == [os.path.join('.', 'GSWS01_2015_images', '2014_10_wy_GSWS01.png')]
+		assert catalog.site_year_files('GSWS01', 2015, 'raw') == [os.path.join('.', 'raw_data', 'GSWS01_2015_first.csv')]
+		assert sorted(weir3k.find_files('GSWS01', 2015, 'raw_data')) == [os.path.join('raw_data', 'GSWS01 wy2015.csv'), os.path.join('raw_data', 'GSWS01_2015_first.csv')]
+		assert weir3k.find_root_files('GSWS01', 2015) == ['GSWS01_2015_first.csv']
+		open('GSWS01_2015_working/GSWS01_2015_re_partial.csv', 'w').close()
+		os.utime('GSWS01_2015_working', (1, 1))
+		assert FileCatalog().refresh().site_year_files('GSWS01', 2015, 're_partial') == [os.path.join('.', 'GSWS01_2015_working', 'GSWS01_2015_re_partial.csv')]
+
+def test_light_imports():
+	""" Importing weir3k or pyflow does not load matplotlib, scipy or pymssql; they are loaded where they are used"""
+	import benchmark
+	for module in ['weir3k', 'pyflow', 'batch']:
+		seconds, heavy = benchmark.import_time(module)
+		assert heavy == []
+
+def test_stream():
+	""" weir3k and pyflow with --stream write the same working file and five minute, daily and sample files as without it"""
+	import weir3k
+	import benchmark
+	site_year = benchmark.synthetic_site_years(1)[0]
+	sitecode = site_year['sitecode']
+	outputs = []
+	for stream_rows in [None, 4000]:
+		with scratch_directory([site_year]) as metadata_filename:
+			corr_od = weir3k.convert_corr_to_dict(sitecode, 2015)
+			weir3k.create_subfolders(sitecode, 2015)
+			raw_filename = os.path.join('raw_data', sitecode + "_2015_first.csv")
+			if stream_rows == None:
+				od, date_column = weir3k.parameterize_first(sitecode, 2015, raw_filename)
+				first_filename = weir3k.generate_first(od, sitecode, 2015, False)
+				adjusted_dictionary, re_filename = weir3k.do_adjustments(sitecode, 2015, first_filename, corr_od, 'first', False, date_column)
+			else:
+				first_filename, date_column = weir3k.stream_first(sitecode, 2015, raw_filename, False, False, stream_rows)
+				re_filename = weir3k.stream_adjustments(sitecode, 2015, first_filename, corr_od, 'first', False, date_column, stream_rows)
+			source = open_metadata(metadata_filename)
+			o1 = get_equations_by_value(source, sitecode, get_equation_sets(source, sitecode, 2015), 2015)
+			sd = get_samples_dates(source, sitecode, 2015)
+			source.close()
+			if stream_rows == None:
+				o2, bfav = get_data_from_csv(re_filename)
+				o4 = loop_over_data(set_up_iterators(o2, o1, 2015), o1)
+				print_five_minute_file(o4, sitecode, 2015, 5, o2, sd)
+				days = summarize_days(o4, o2)
+				integrator = None
+			else:
+				o2 = o4 = None
+				first_minute, last_minute, final_val, missing, bfav = scan_working_file(re_filename, stream_rows)
+				days, integrator = stream_flows(sitecode, 2015, re_filename, stream_rows, o1, sd, first_minute, last_minute, final_val)
+			print_daily_values(sitecode, 2015, o4, o2, days)
+			print_sdate_values(2015, o4, sitecode, sd, integrator)
+			outputs.append([open(x, 'rb').read() for x in [re_filename, name_my_csv(sitecode, 2015, 5), name_my_csv(sitecode, 2015, 'd'), name_my_csv(sitecode, 2015, 's')]])
+	assert outputs[0] == outputs[1]
+
+def test_corr_table():
+	""" The compiled corr table gives the same rows as the dictionary, is kept until its csv changes, and says where corrections overlap"""
+	import weir3k
+	import benchmark
+	site_year = benchmark.synthetic_site_years(1)[0]
+	sitecode = site_year['sitecode']
+	with scratch_directory([site_year]):
+		corr_od = weir3k.convert_corr_to_dict(sitecode, 2015)
+		corr_table = weir3k.load_corr_table(sitecode, 2015)
+		corr_dates = sorted([x for x in corr_od.keys() if x != None])
+		assert len(corr_table) == len(corr_dates)
+		assert [corr_table.row(x) for x in corr_table.positions(corr_dates)] == [corr_od[x] for x in corr_dates]
+		index, inside = corr_table.locate(weir3k.datetimes_to_minutes([corr_dates[1], corr_dates[-1] + datetime.timedelta(minutes=5)]))
+		assert index.tolist() == [1, len(corr_dates)] and inside.tolist() == [True, False]
+		assert os.path.isfile(os.path.join(weir3k.CORR_CACHE_DIRECTORY, sitecode + "_2015.npz"))
+		assert weir3k.load_corr_table(sitecode, 2015).ends.tolist() == corr_table.ends.tolist()
+		# a correction that begins a day before the last one ends, put right after the header
+		last = corr_od[corr_dates[-1]]
+		lines = open(weir3k.corr_table_name(sitecode, 2015), 'r').readlines()
+		with open(weir3k.corr_table_name(sitecode, 2015), 'w') as writefile:
+			writefile.write(lines[0])
+			writefile.write(",".join(["HF002", "6", sitecode, (corr_dates[-1] - datetime.timedelta(days=1)).strftime('%Y-%m-%d %H:%M:%S'), str(last['bgn_cr']), str(last['bgn_hg']), (corr_dates[-1] + datetime.timedelta(days=2)).strftime('%Y-%m-%d %H:%M:%S'), str(last['bgn_cr']), str(last['bgn_hg']), ""]) + "\n")
+			writefile.write("".join(lines[1:]))
+		changed_table = weir3k.load_corr_table(sitecode, 2015)
+		assert len(changed_table) == len(corr_dates) + 1
+		assert len(changed_table.problems()) == len(corr_table.problems()) + 1
+
+def test_water_year_range():
+	""" A range of water years is adjusted in one pass and split into the 're' file of each year, which share the row of October 1st"""
+	import weir3k
+	import benchmark
+	site_years = [{'sitecode': 'GSWS01', 'wateryear': x, 'kind': 'gappy', 'seed': x} for x in [2014, 2015]]
+	assert water_year_range('2014-2015') == [2014, 2015] and water_year_range('2015') == [2015]
+	with scratch_directory(site_years):
+		corr_od = weir3k.load_corr_tables('GSWS01', [2014, 2015])
+		assert corr_od.ends.tolist() == sorted(set(corr_od.ends.tolist()))
+		assert set(weir3k.load_corr_table('GSWS01', 2015).ends.tolist()) <= set(corr_od.ends.tolist())
+		for each_year in [2014, 2015]:
+			weir3k.create_subfolders('GSWS01', each_year)
+		output_filenames = [weir3k.working_output_filename('GSWS01', x, 'first', False) for x in [2014, 2015]]
+		filenames, date_columns = weir3k.generate_water_years('GSWS01', [2014, 2015], False)
+		wd, written = weir3k.adjust_water_years('GSWS01', [2014, 2015], filenames, corr_od, 'first', date_columns, output_filenames)
+		assert written == output_filenames
+		rows = [open(x, 'r').read().splitlines() for x in written]
+		assert rows[0][0].split(',')[1] == '"2013-10-01 00:00:00"' and rows[1][-1].split(',')[1] == '"2015-10-01 00:00:00"'
+		assert rows[0][-1] == rows[1][0] and rows[1][0].split(',')[1] == '"2014-10-01 00:00:00"'
+		assert len(rows[0]) + len(rows[1]) - 1 == len(wd)
+		# one year of the range on its own is redone with its own corr table
+		assert weir3k.read_corr_record(written[1])['wateryears'] == [2014, 2015]
+		assert weir3k.patch_adjustments('GSWS01', 2015, written[1], weir3k.load_corr_table('GSWS01', 2015), False) == (None, None)
+
+def test_io_threads():
+	""" The metadata is fetched in a thread while the main thread goes on, the same as without threads, and the stages of the thread do not nest inside the main thread's"""
+	import benchmark
+	from profiling import PROFILE
+	site_year = benchmark.synthetic_site_years(1)[0]
+	try:
+		with scratch_directory([site_year]) as metadata_filename:
+			metadata = open_metadata(metadata_filename)
+			PROFILE.start('test_io_threads')
+			executor = io_executor()
+			with PROFILE.stage('main'):
+				threaded = start(executor, fetch_metadata, metadata, site_year['sitecode'], '2015')
+				inline = start(None, fetch_metadata, metadata, site_year['sitecode'], '2015')
+				assert threaded.result() == inline.result()
+			if executor != None:
+				executor.shutdown()
+				assert sorted([str(x['parent']) for x in PROFILE.records if x['stage'] == 'fetch_metadata']) == ['None', 'main']
+			metadata.close()
+	finally:
+		PROFILE.enabled = False
+		PROFILE.records = []
+
+def test_bulk_metadata():
+	""" The metadata of several sites fetched at once on a pool is the same as each site's fetched on its own, and the pool opens no more connections than its size"""
+	import benchmark
+	from metadata import ConnectionPool, prefetch_metadata
+	site_years = benchmark.synthetic_site_years(3)
+	sitecodes = [x['sitecode'] for x in site_years]
+	with scratch_directory(site_years) as filename:
+		opened = []
+		def connect():
+			opened.append(SQLiteBackend(filename))
+			return opened[-1]
+		pool = ConnectionPool(connect, 2)
+		bulk = metadata_by_site(prefetch_metadata(pool, sitecodes[:2]), sitecodes[:2], '2015')
+		assert 0 < len(opened) <= 2
+		pool.close()
+		metadata = SQLiteBackend(filename)
+		assert bulk == dict((x, fetch_metadata(metadata, x, '2015')) for x in sitecodes[:2])
+		assert bulk[sitecodes[0]] != bulk[sitecodes[1]]
+		metadata.close()
+
+def test_rating_lookup():
+	""" The q looked up for a stage to the thousandth of a foot is the very q the equations give, a stage between thousandths is worked out, and the same equations share one table"""
+	eqns = {0.509: [3.568, 1.741562], 2.54: [3.856196, 2.168731]}
+	rating = rating_table(eqns)
+	assert rating is rating_table(dict(reversed(list(eqns.items()))))
+	assert len(rating.lookup()) == 2541
+	stages = np.array([0.0, 0.001, 0.2, 0.509, 0.51, 1.2, 2.54, 2.541, 1.2345, -0.5, np.nan])
+	q = rating.discharge(stages)
+	direct = rating.evaluate(stages)
+	assert np.array_equal(np.isnan(q), np.isnan(direct))
+	assert (q[~np.isnan(q)] == direct[~np.isnan(direct)]).all()
+	assert abs(q[5] - logfunc(3.856196, 2.168731, 1.2)) < 1e-12
+
+def test_sample_windows_start():
+	""" Data whose first five minute value is at 00:05 still gets the window from the start of the water year, totalled from that value, streamed or not; data that starts later does not"""
+	from timeseries import Series
+	first = datetime_to_minutes(datetime.datetime(2014, 10, 1, 0, 5))
+	sd = [datetime.datetime(2014, 10, 1, 0, 0), datetime.datetime(2014, 10, 1, 12, 0), datetime.datetime(2014, 10, 2, 0, 0)]
+	def written(start, streamed):
+		final = Series(first + start + 5*np.arange(600), values={'total_q': np.ones(600)})
+		integrator = None
+		if streamed:
+			integrator = StreamedSampleIntegrator(np.concatenate(sample_windows(sd)))
+			integrator.add(Series(final.minutes[:100], values={'total_q': final.values['total_q'][:100]}))
+			integrator.add(Series(final.minutes[100:], values={'total_q': final.values['total_q'][100:]}))
+		print_sdate_values(2015, final, 'GSWS01', sd, integrator)
+		with open(name_my_csv('GSWS01', 2015, 's'), 'r') as readfile:
+			return [x.split(',')[4:7] for x in readfile.read().splitlines()[1:]]
+	with scratch_directory():
+		rows = written(0, False)
+		assert rows == [['"2014-10-01 00:00:00"', '"2014-10-01 12:00:00"', str(round(143.*12/(43560*237.), 3))], ['"2014-10-01 12:00:00"', '"2014-10-02 00:00:00"', str(round(144.*12/(43560*237.), 3))]]
+		assert written(0, True) == rows
+		assert written(5, False) == written(5, True) == rows[1:]
+
+def test_empty_month_graph():
+	""" A month with no data is drawn the same as it always was with pyplot, without date ticks"""
+	import weir3k
+	import matplotlib
+	matplotlib.use('Agg')
+	import matplotlib.pyplot as plt
+	import matplotlib.dates as mdates
+	with scratch_directory():
+		fig, ax = plt.subplots()
+		fig.autofmt_xdate()
+		ax.fmt_xdata = mdates.DateFormatter('%Y-%m')
+		ax.plot([], [], color = 'blue', linewidth= 1.2, alpha = 0.5, label = 'corrected cr logger')
+		ax.plot([], [], color = 'red', linewidth= 0.7, label = 'adjusted to hg')
+		plt.savefig("before.png")
+		plt.close()
+		weir3k.draw_month(("after.png", np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0, dtype=np.int64), np.zeros(0), None))
+		assert open("before.png", 'rb').read() == open("after.png", 'rb').read()
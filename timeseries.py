@@ -0,0 +1,1018 @@
+#!/usr/bin env python
+# -*- coding: utf-8 -*-
+
+import csv
+import datetime
+import os
+import shutil
+import sys
+from itertools import islice
+import numpy as np
+
+"""
+timeseries.py is the in-memory store shared by weir3k.py and pyflow.py
+
+A Series holds one reading per row as columns rather than as a dictionary per datetime:
+    - minutes : int64 minutes since 1970-01-01 00:00, sorted and unique
+    - values  : float64 columns (raw, val, stage, inst_q, ...) where missing is nan
+    - codes   : uint8 columns (flags, events, equation sets) that index into a short list of labels
+
+A water year of five minute data is about 105k rows, so a handful of flat arrays instead of 105k dictionaries.
+"""
+
+# 1970-01-01 as a proleptic ordinal, so datetimes can be turned into minutes with integer math
+EPOCH_ORDINAL = 719163
+
+EPOCH = datetime.datetime(1970, 1, 1, 0, 0)
+
+def datetime_to_minutes(dt):
+    """ Converts one datetime to integer minutes since the epoch (seconds are dropped)"""
+    return (dt.toordinal() - EPOCH_ORDINAL)*1440 + dt.hour*60 + dt.minute
+
+def minutes_to_datetime(minutes):
+    """ Converts integer minutes since the epoch back to a datetime"""
+    return EPOCH + datetime.timedelta(minutes=int(minutes))
+
+def datetimes_to_minutes(list_of_dates):
+    """ Converts a list of datetimes into an int64 numpy array of minutes since the epoch"""
+    as_minutes = ((x.toordinal() - EPOCH_ORDINAL)*1440 + x.hour*60 + x.minute for x in list_of_dates)
+
+    return np.fromiter(as_minutes, dtype=np.int64, count=len(list_of_dates))
+
+def minutes_to_datetimes(minutes):
+    """ Converts an array of minutes since the epoch into a list of datetimes"""
+    return minutes.astype('datetime64[m]').astype(datetime.datetime).tolist()
+
+def encode_labels(strings, labels=None):
+    """ Turns a list of strings into uint8 codes and the list of labels that the codes index into
+
+    **Inputs**
+    :strings: ex. ['A', 'A', 'E', 'M']
+    :labels: an existing list of labels to extend, ex. ['A', 'M', 'E'] (optional)
+
+    **Returns**
+    :codes: numpy uint8 array, ex. [0, 0, 2, 1]
+    :labels: the labels, with any new ones appended in the order they were found
+    """
+
+    if labels == None:
+        labels = []
+    else:
+        labels = list(labels)
+
+    lookup = dict((label, index) for index, label in enumerate(labels))
+
+    codes = np.empty(len(strings), dtype=np.uint8)
+
+    for index, each_string in enumerate(strings):
+        try:
+            codes[index] = lookup[each_string]
+        except KeyError:
+            if len(labels) > 255:
+                raise ValueError("More than 256 different labels in one code column")
+            lookup[each_string] = len(labels)
+            labels.append(each_string)
+            codes[index] = lookup[each_string]
+
+    return codes, labels
+
+# the date formats that the csv readers know about (see test_csv_date in weir3k.py), plus the date-only format of the daily files
+DATEFORMAT_IDEAL = '%Y-%m-%d %H:%M:%S'
+DATEFORMAT_OLD = '%m/%d/%Y %H:%M'
+DATEFORMAT_OLDER = '%m/%d/%y %H:%M'
+DATEFORMAT_13CHAR = '%Y%m%d %H%M'
+DATEFORMAT_DAY = '%Y-%m-%d'
+
+# how each format is laid out, left to right: a field name with its width (a width of 0 means one or two digits, the way strptime reads %m, %d, %H and %M), or a separator character
+DATE_LAYOUTS = {
+    DATEFORMAT_IDEAL: [('year', 4), '-', ('month', 0), '-', ('day', 0), ' ', ('hour', 0), ':', ('minute', 0), ':', ('second', 0)],
+    DATEFORMAT_OLD: [('month', 0), '/', ('day', 0), '/', ('year', 4), ' ', ('hour', 0), ':', ('minute', 0)],
+    DATEFORMAT_OLDER: [('month', 0), '/', ('day', 0), '/', ('year2', 2), ' ', ('hour', 0), ':', ('minute', 0)],
+    DATEFORMAT_13CHAR: [('year', 4), ('month', 2), ('day', 2), ' ', ('hour', 2), ('minute', 2)],
+    DATEFORMAT_DAY: [('year', 4), '-', ('month', 0), '-', ('day', 0)],
+}
+
+def days_from_civil(year, month, day):
+    """ Days since 1970-01-01 for arrays of year, month, day (the proleptic gregorian calendar, as datetime uses)"""
+    year = year - (month <= 2)
+    era = year // 400
+    year_of_era = year - era*400
+    day_of_year = (153*(month + np.where(month > 2, -3, 9)) + 2)//5 + day - 1
+    day_of_era = year_of_era*365 + year_of_era//4 - year_of_era//100 + day_of_year
+
+    return era*146097 + day_of_era - 719468
+
+def days_in_month(year, month):
+    """ The number of days in each month, for arrays of year and month"""
+    lengths = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])[np.clip(month, 1, 12) - 1]
+    leap = ((year % 4 == 0) & (year % 100 != 0)) | (year % 400 == 0)
+
+    return lengths + ((month == 2) & leap)
+
+def scan_layout(characters, layout):
+    """ Reads the fields of a layout out of a matrix of characters, one row per date string
+
+    **Inputs**
+    :characters: uint8 array with one row per string and a column per character, padded with zeros
+    :layout: one of the DATE_LAYOUTS
+
+    **Returns**
+    :fields: dictionary of int64 arrays, ex. {'year': ..., 'month': ...}
+    :ok: True for the rows that fit the layout
+    """
+
+    count, width = characters.shape
+
+    # one extra zero column so that looking one character past the end of the longest string is safe
+    padded = np.zeros((count, width + 1), dtype=np.uint8)
+    padded[:, :width] = characters
+    flat = padded.ravel()
+
+    # where each row starts in the flattened matrix, and where we are reading in each row
+    row_start = np.arange(count, dtype=np.int64)*(width + 1)
+    position = np.zeros(count, dtype=np.int64)
+
+    ok = np.ones(count, dtype=bool)
+    fields = {}
+
+    def digit_at(offset):
+        # the digit at position + offset in each row and whether it is a digit at all; positions past the string are never digits
+        at = np.minimum(position + offset, width)
+        value = flat.take(row_start + at).astype(np.int64) - 48
+        return value, (value >= 0) & (value <= 9)
+
+    for token in layout:
+
+        if not isinstance(token, tuple):
+            ok &= flat.take(row_start + np.minimum(position, width)) == ord(token)
+            position = position + 1
+            continue
+
+        name, size = token
+
+        if size == 0:
+            # one or two digits
+            first, first_ok = digit_at(0)
+            second, second_ok = digit_at(1)
+            value = np.where(second_ok, first*10 + second, first)
+            ok &= first_ok
+            position = position + 1 + second_ok
+        else:
+            value = np.zeros(count, dtype=np.int64)
+            for offset in range(size):
+                this_digit, this_ok = digit_at(offset)
+                ok &= this_ok
+                value = value*10 + this_digit
+            position = position + size
+
+        fields[name] = value
+
+    # nothing may be left over at the end of the string
+    ok &= flat.take(row_start + np.minimum(position, width)) == 0
+
+    return fields, ok
+
+def fields_to_minutes(fields):
+    """ Turns the fields read by scan_layout into minutes since the epoch, and marks the impossible dates (month 13, February 30th, 25 o'clock...)"""
+
+    if 'year2' in fields:
+        # like strptime: 69-99 are the 1900s and 00-68 are the 2000s
+        year = np.where(fields['year2'] < 69, 2000 + fields['year2'], 1900 + fields['year2'])
+    else:
+        year = fields['year']
+
+    month = fields['month']
+    day = fields['day']
+    hour = fields.get('hour', np.zeros_like(month))
+    minute = fields.get('minute', np.zeros_like(month))
+    second = fields.get('second', np.zeros_like(month))
+
+    valid = (year >= 1) & (month >= 1) & (month <= 12) & (day >= 1) & (day <= days_in_month(year, month)) & (hour <= 23) & (minute <= 59) & (second <= 61)
+
+    minutes = days_from_civil(year, month, day)*1440 + hour*60 + minute
+
+    return minutes, valid
+
+def parse_column(strings, date_format):
+    """ Parses a list of date strings that share one format
+
+    The whole column is read at once from a character matrix. Rows that do not fit are retried one at a time with strptime, so anything strptime can read is still read.
+
+    **Returns**
+    :minutes: int64 minutes since the epoch (seconds are dropped)
+    :ok: True for the rows that were read
+    """
+
+    minutes = np.zeros(len(strings), dtype=np.int64)
+    ok = np.zeros(len(strings), dtype=bool)
+
+    if len(strings) == 0:
+        return minutes, ok
+
+    try:
+        characters = np.array(strings, dtype=bytes)
+        characters = characters.view(np.uint8).reshape(len(strings), characters.dtype.itemsize)
+        fields, ok = scan_layout(characters, DATE_LAYOUTS[date_format])
+        minutes, valid = fields_to_minutes(fields)
+        ok &= valid
+    except (UnicodeEncodeError, KeyError, ValueError, TypeError):
+        # not plain text or not a known layout - let strptime have all of it
+        ok = np.zeros(len(strings), dtype=bool)
+
+    for index in np.flatnonzero(~ok).tolist():
+        try:
+            dt = datetime.datetime.strptime(str(strings[index]), date_format)
+            minutes[index] = datetime_to_minutes(dt)
+            ok[index] = True
+        except ValueError:
+            pass
+
+    return minutes, ok
+
+def parse_dates(strings, date_format):
+    """ Parses a whole column of date strings in one format to int64 minutes since the epoch
+
+    Meant to be called once per file with the format found by test_csv_date. A water year of 105k dates takes a few tens of milliseconds rather than the second or more that strptime on every row takes.
+
+    ..Example:
+
+    >>> parse_dates(['2014-10-01 00:00:00', '2014-10-01 00:05:00'], '%Y-%m-%d %H:%M:%S')
+    >>> array([23830560, 23830565])
+
+    Raises ValueError for the first row that does not match, as strptime would.
+    """
+
+    minutes, ok = parse_column(strings, date_format)
+
+    if not ok.all():
+        bad = int(np.flatnonzero(~ok)[0])
+        raise ValueError("time data " + repr(strings[bad]) + " on row " + str(bad) + " does not match format " + repr(date_format))
+
+    return minutes
+
+def parse_dates_mixed(strings, date_formats):
+    """ Parses a column where each row may be in a different format; each format is tried in turn on the rows not read yet (like the nested try/excepts did row by row)
+
+    **Returns**
+    :minutes: int64 minutes since the epoch
+    :ok: True for the rows that were read by one of the formats
+    """
+
+    minutes = np.zeros(len(strings), dtype=np.int64)
+    ok = np.zeros(len(strings), dtype=bool)
+
+    for each_format in date_formats:
+
+        remaining = np.flatnonzero(~ok)
+        if len(remaining) == 0:
+            break
+
+        these_minutes, these_ok = parse_column([strings[x] for x in remaining.tolist()], each_format)
+        minutes[remaining[these_ok]] = these_minutes[these_ok]
+        ok[remaining[these_ok]] = True
+
+    return minutes, ok
+
+# the labels that weir3k and pyflow use, listed first so that their codes are always the same
+FLAG_LABELS = ['A', 'M', 'E', 'Q', 'S']
+EVENT_LABELS = ['NA', 'MAINTE', 'MAINTV']
+
+class Series(object):
+    """ A compact time series: a sorted int64 minute index, float64 value columns and uint8 code columns
+
+    **Inputs**
+    :minutes: int64 array of minutes since the epoch; must be sorted and unique (see Series.from_rows for unsorted data)
+    :values: dictionary of float64 arrays, nan for missing, ex. {'raw': ..., 'val': ...}
+    :codes: dictionary of (uint8 array, list of labels) tuples, ex. {'fval': (codes, ['A', 'M', 'E'])}
+
+    ..Example:
+
+    >>> s = Series.from_rows([datetime.datetime(2014, 10, 1, 0, 5), datetime.datetime(2014, 10, 1, 0, 0)], values={'val': [0.2, 0.1]}, codes={'fval': ['E', 'A']})
+    >>> s.dates()
+    >>> [datetime.datetime(2014, 10, 1, 0, 0), datetime.datetime(2014, 10, 1, 0, 5)]
+    >>> s.as_list('fval')
+    >>> ['A', 'E']
+    """
+
+    def __init__(self, minutes, values=None, codes=None):
+
+        self.minutes = np.asarray(minutes, dtype=np.int64)
+        self.values = {}
+        self.codes = {}
+        self.labels = {}
+
+        if values != None:
+            for name in values:
+                self.set_values(name, values[name])
+
+        if codes != None:
+            for name in codes:
+                self.set_codes(name, codes[name][0], codes[name][1])
+
+    @classmethod
+    def from_rows(cls, dates, values=None, codes=None, code_labels=None):
+        """ Builds a Series from columns in file order. Rows are sorted by date, and if a date repeats the first one wins (like the 'if dt not in od' checks did)
+
+        **Inputs**
+        :dates: list of datetimes or int64 array of minutes
+        :values: dictionary of lists of floats (None is missing)
+        :codes: dictionary of lists of strings
+        :code_labels: dictionary of starting label lists for the code columns, ex. {'fval': FLAG_LABELS}
+        """
+
+        if isinstance(dates, np.ndarray):
+            minutes = dates.astype(np.int64)
+        else:
+            minutes = datetimes_to_minutes(dates)
+
+        # sorted unique minutes, and the index of the first row that had each
+        unique_minutes, first_rows = np.unique(minutes, return_index=True)
+
+        series = cls(unique_minutes)
+
+        if values != None:
+            for name in values:
+                series.set_values(name, as_float_column(values[name])[first_rows])
+
+        if codes != None:
+            for name in codes:
+                starting = None
+                if code_labels != None:
+                    starting = code_labels.get(name)
+                column, labels = encode_labels(codes[name], starting)
+                series.set_codes(name, column[first_rows], labels)
+
+        return series
+
+    @classmethod
+    def concatenate(cls, pieces):
+        """ One Series from pieces that follow one another in time, ex. the chunks of a file read a chunk at a time. Each piece can have its own labels; the codes are renumbered onto one list of them.
+
+        :pieces: list of Series with the same columns, each one after the one before it
+        """
+
+        new = cls(np.concatenate([x.minutes for x in pieces]))
+
+        for name in pieces[0].values:
+            new.values[name] = np.concatenate([x.values[name] for x in pieces])
+
+        for name in pieces[0].codes:
+            labels = []
+            columns = []
+
+            for each_piece in pieces:
+                # the code each of this piece's labels has in the new list
+                renumber, labels = encode_labels(each_piece.labels[name], labels)
+                columns.append(renumber[each_piece.codes[name]])
+
+            new.codes[name] = np.concatenate(columns).astype(np.uint8)
+            new.labels[name] = labels
+
+        return new
+
+    def __len__(self):
+        return len(self.minutes)
+
+    def set_values(self, name, column):
+        """ Adds or replaces a float64 column"""
+        column = np.asarray(column, dtype=np.float64)
+
+        if len(column) != len(self.minutes):
+            raise ValueError("Column " + name + " has " + str(len(column)) + " rows but the series has " + str(len(self.minutes)))
+
+        self.values[name] = column
+
+    def set_codes(self, name, column, labels):
+        """ Adds or replaces a uint8 code column and its labels"""
+        column = np.asarray(column, dtype=np.uint8)
+
+        if len(column) != len(self.minutes):
+            raise ValueError("Column " + name + " has " + str(len(column)) + " rows but the series has " + str(len(self.minutes)))
+
+        self.codes[name] = column
+        self.labels[name] = list(labels)
+
+    def set_strings(self, name, strings, labels=None):
+        """ Encodes a list of strings as a code column"""
+        column, labels = encode_labels(strings, labels)
+        self.set_codes(name, column, labels)
+
+    def code_of(self, name, label):
+        """ The code used for a label in a code column, adding the label if it is new"""
+        if label not in self.labels[name]:
+            self.labels[name].append(label)
+        return self.labels[name].index(label)
+
+    def is_label(self, name, label):
+        """ Boolean array, True where the code column holds that label"""
+        if label not in self.labels[name]:
+            return np.zeros(len(self.minutes), dtype=bool)
+        return self.codes[name] == self.labels[name].index(label)
+
+    def as_list(self, name):
+        """ A column as a plain python list - floats with None for missing, or the label strings for a code column"""
+
+        if name in self.codes:
+            labels = self.labels[name]
+            return [labels[x] for x in self.codes[name].tolist()]
+
+        column = self.values[name]
+        missing = np.isnan(column)
+        as_list = column.tolist()
+
+        for index in np.flatnonzero(missing).tolist():
+            as_list[index] = None
+
+        return as_list
+
+    def dates(self):
+        """ The index as a list of datetimes"""
+        return minutes_to_datetimes(self.minutes)
+
+    def first_date(self):
+        return minutes_to_datetime(self.minutes[0])
+
+    def last_date(self):
+        return minutes_to_datetime(self.minutes[-1])
+
+    def take(self, selection):
+        """ A new Series with just the rows in selection (a slice, a boolean mask or an array of indices)"""
+
+        new = Series(self.minutes[selection])
+
+        for name in self.values:
+            new.values[name] = self.values[name][selection]
+
+        for name in self.codes:
+            new.codes[name] = self.codes[name][selection]
+            new.labels[name] = list(self.labels[name])
+
+        return new
+
+    def locate(self, minutes):
+        """ Finds rows by their minute
+
+        **Returns**
+        :positions: the row for each of the minutes (only meaningful where found)
+        :found: True where the minute is in the series
+        """
+        minutes = np.asarray(minutes, dtype=np.int64)
+        positions = np.searchsorted(self.minutes, minutes)
+        clipped = np.minimum(positions, max(len(self.minutes) - 1, 0))
+
+        if len(self.minutes) == 0:
+            return clipped, np.zeros(len(minutes), dtype=bool)
+
+        found = self.minutes[clipped] == minutes
+
+        return clipped, found
+
+    def between(self, first_minute, last_minute):
+        """ A slice of the rows with first_minute <= minutes <= last_minute"""
+        start = int(np.searchsorted(self.minutes, first_minute, side='left'))
+        stop = int(np.searchsorted(self.minutes, last_minute, side='right'))
+
+        return slice(start, stop)
+
+    def nbytes(self):
+        """ Memory held by the columns, in bytes"""
+        total = self.minutes.nbytes
+        total += sum(x.nbytes for x in self.values.values())
+        total += sum(x.nbytes for x in self.codes.values())
+
+        return total
+
+def as_float_column(list_of_values):
+    """ Turns a list of floats, strings and Nones into a float64 array; anything that is not a number becomes nan"""
+
+    try:
+        return np.array(list_of_values, dtype=np.float64)
+    except (TypeError, ValueError):
+        pass
+
+    column = np.empty(len(list_of_values), dtype=np.float64)
+
+    for index, each_value in enumerate(list_of_values):
+        try:
+            column[index] = float(each_value)
+        except (TypeError, ValueError):
+            column[index] = np.nan
+
+    return column
+
+def round_column(values, digits):
+    """ Rounds a whole numpy column the same way the builtin round() rounds one value at a time
+
+    numpy rounds on value * 10**digits, which can land on the other side of a half than round() does. Those few values are redone with round() so the written files do not change by a digit.
+
+    :values: array-like of floats (nan stays nan)
+    :digits: number of decimal places, ex. 3
+    """
+    values = np.asarray(values, dtype=float)
+    scaled = values * 10.0 ** digits
+    rounded = np.round(values, digits)
+
+    # anything within a hair of a half could go either way; let python decide
+    near_half = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    for index in np.flatnonzero(near_half):
+        rounded[index] = round(float(values[index]), digits)
+
+    return rounded
+
+# the csv outputs are written column by column, as the same text csv.writer(quoting=csv.QUOTE_NONNUMERIC) would write them a row at a time
+CSV_LINE_TERMINATOR = '\r\n'
+
+# rows joined into one string before each write, and the size of the file buffer
+CSV_BLOCK_ROWS = 8192
+CSV_BUFFER_SIZE = 1048576
+
+def open_csv(filename):
+    """ Opens a csv output for writing, in the mode csv.writer needs on this python, with a large buffer"""
+
+    if sys.version_info >= (3,0):
+        return open(filename, 'w', CSV_BUFFER_SIZE)
+    else:
+        return open(filename, 'wb', CSV_BUFFER_SIZE)
+
+def csv_field(value):
+    """ One value the way csv.writer with QUOTE_NONNUMERIC writes it: numbers bare (floats by repr), None as an empty quoted string, and anything else quoted"""
+
+    if value is None:
+        return '""'
+
+    elif isinstance(value, bool):
+        return str(value)
+
+    elif isinstance(value, float):
+        return repr(float(value))
+
+    elif isinstance(value, (int, np.integer)) or (sys.version_info < (3,0) and isinstance(value, long)):
+        return str(value)
+
+    else:
+        return '"' + str(value).replace('"', '""') + '"'
+
+def csv_text_fields(strings):
+    """ The fields of a column of strings (or None), each quoted once no matter how many times it repeats"""
+
+    quoted = dict((x, csv_field(x)) for x in set(strings))
+
+    return [quoted[x] for x in strings]
+
+def csv_code_fields(codes, labels):
+    """ The fields of a code column, ex. the flags of a Series: csv_code_fields(s.codes['fval'], s.labels['fval'])"""
+
+    quoted = np.array([csv_field(x) for x in labels], dtype=object)
+
+    return quoted[codes].tolist()
+
+def csv_number_fields(values, digits=None, missing='""'):
+    """ The fields of a float column, rounded like round() when digits are given
+
+    **Inputs**
+    :values: float64 array, nan where missing
+    :digits: number of decimal places (optional, not rounded by default)
+    :missing: the field written where the value is nan, ex. '"None"' (an empty quoted string like None by default)
+
+    **Returns**
+    :fields: list of strings
+    """
+
+    values = np.asarray(values, dtype=float)
+
+    if digits != None:
+        values = round_column(values, digits)
+
+    # rounded columns repeat a few thousand values over and over, so each different value is formatted once; unique() counts 0.0 and -0.0 as one value, so the zeros are written as 0.0 and any -0.0 is put back after
+    unique_values, unique_index = np.unique(values, return_inverse=True)
+    unique_fields = np.array([missing if x != x else repr(x + 0.0) for x in unique_values.tolist()], dtype=object)
+
+    fields = unique_fields[unique_index.ravel()].tolist()
+
+    for index in np.flatnonzero((values == 0) & np.signbit(values)).tolist():
+        fields[index] = '-0.0'
+
+    return fields
+
+# the quoted time of day of each minute, ex. '00:05:00"', made the first time it is needed
+TIME_OF_DAY_FIELDS = []
+
+def csv_date_fields(minutes, date_format=DATEFORMAT_IDEAL):
+    """ The quoted date fields of a column of minutes, ex. '"2014-10-01 00:05:00"'
+
+    Each day is formatted once and each time of day comes from a table, so a year of five minute dates does not go through strftime 105k times. Only DATEFORMAT_IDEAL and DATEFORMAT_DAY are built this way; any other format is formatted date by date.
+
+    :minutes: int64 array of minutes since the epoch
+    :date_format: ex. DATEFORMAT_IDEAL
+    """
+
+    minutes = np.asarray(minutes, dtype=np.int64)
+
+    if date_format not in [DATEFORMAT_IDEAL, DATEFORMAT_DAY]:
+        return ['"' + x.strftime(date_format) + '"' for x in minutes_to_datetimes(minutes)]
+
+    days, minute_of_day = np.divmod(minutes, 1440)
+    unique_days, day_index = np.unique(days, return_inverse=True)
+
+    day_text = ['"' + minutes_to_datetime(x*1440).strftime(DATEFORMAT_DAY) for x in unique_days.tolist()]
+
+    if date_format == DATEFORMAT_DAY:
+        day_fields = [x + '"' for x in day_text]
+        return [day_fields[x] for x in day_index.ravel().tolist()]
+
+    if TIME_OF_DAY_FIELDS == []:
+        TIME_OF_DAY_FIELDS.extend([' ' + str(x//60).zfill(2) + ':' + str(x%60).zfill(2) + ':00"' for x in range(1440)])
+
+    return [day_text[x] + TIME_OF_DAY_FIELDS[y] for x, y in zip(day_index.ravel().tolist(), minute_of_day.tolist())]
+
+def write_csv_columns(writefile, columns):
+    """ Writes rows made of columns of fields, CSV_BLOCK_ROWS rows per write
+
+    **Inputs**
+    :writefile: an open file, ex. from open_csv
+    :columns: list of columns in order; each is a list of fields (from the csv_*_fields functions) or one field for every row, ex. ['"GSWS01"', dates, raws]
+    """
+
+    lengths = [len(x) for x in columns if isinstance(x, list)]
+    number_of_rows = lengths[0]
+
+    for start in range(0, number_of_rows, CSV_BLOCK_ROWS):
+        stop = min(start + CSV_BLOCK_ROWS, number_of_rows)
+
+        pieces = [x[start:stop] if isinstance(x, list) else [x]*(stop - start) for x in columns]
+
+        writefile.write(CSV_LINE_TERMINATOR.join([",".join(x) for x in zip(*pieces)]) + CSV_LINE_TERMINATOR)
+
+def replace_csv_rows(filename, number_of_rows, first, stop, columns):
+    """ Replaces rows first through stop - 1 of a csv made by write_csv_columns, and keeps every other row as the text it already is
+
+    **Inputs**
+    :filename: the csv
+    :number_of_rows: how many rows the csv should have; if it has another number, it is not the file the caller thinks it is and nothing is changed
+    :first: the first row replaced
+    :stop: the row after the last one replaced
+    :columns: the rows that go in their place, as for write_csv_columns - there can be more or fewer of them
+
+    **Returns**
+    :replaced: True, or False when the csv did not have number_of_rows rows
+    """
+
+    if sys.version_info >= (3,0):
+        with open(filename, 'r', newline='') as readfile:
+            lines = readfile.read().split(CSV_LINE_TERMINATOR)
+    else:
+        with open(filename, 'rb') as readfile:
+            lines = readfile.read().split(CSV_LINE_TERMINATOR)
+
+    # the text ends with a terminator, so the last piece is empty
+    if len(lines) != number_of_rows + 1 or lines[-1] != '':
+        return False
+
+    # write to the side and swap it in, like the binary copy
+    temporary_filename = filename + '.tmp'
+
+    with open_csv(temporary_filename) as writefile:
+        if first > 0:
+            writefile.write(CSV_LINE_TERMINATOR.join(lines[:first]) + CSV_LINE_TERMINATOR)
+
+        write_csv_columns(writefile, columns)
+
+        if stop < number_of_rows:
+            writefile.write(CSV_LINE_TERMINATOR.join(lines[stop:number_of_rows]) + CSV_LINE_TERMINATOR)
+
+    if sys.version_info >= (3,0):
+        os.replace(temporary_filename, filename)
+    else:
+        os.remove(filename)
+        os.rename(temporary_filename, filename)
+
+    return True
+
+# in streaming mode (--stream) files are read this many rows at a time, a few megabytes of rows, so a run holds about the same memory however long its files are
+CSV_CHUNK_ROWS = 50000
+
+# set to a number of rows to stream every run, ex. every job of a batch; 1 streams with CSV_CHUNK_ROWS
+STREAM_ENVIRONMENT = 'WEIR3K_STREAM'
+
+def stream_option(argv):
+    """ Takes --stream or --stream=<rows> out of a command line
+
+    **Inputs**
+    :argv: the command line, ex. sys.argv
+
+    **Returns**
+    :argv: the command line without the option, so the other arguments are where they always were
+    :chunk_rows: how many rows to read at a time, or None to read each file whole as always
+    """
+
+    option = os.environ.get(STREAM_ENVIRONMENT)
+    remaining = []
+
+    for each_argument in argv:
+        if each_argument == '--stream':
+            option = '1'
+        elif each_argument.startswith('--stream='):
+            option = each_argument[len('--stream='):]
+        else:
+            remaining.append(each_argument)
+
+    if option == None or option in ['', '0']:
+        return remaining, None
+
+    if int(option) <= 1:
+        return remaining, CSV_CHUNK_ROWS
+
+    return remaining, int(option)
+
+def water_year_range(argument):
+    """ The water years of the year on a command line, which can be a range
+
+    ..Example:
+    >>> water_year_range('2015')
+    >>> [2015]
+    >>> water_year_range('2010-2012')
+    >>> [2010, 2011, 2012]
+    """
+
+    if '-' not in str(argument):
+        return [int(argument)]
+
+    first, last = [int(x) for x in str(argument).split('-', 1)]
+
+    if last < first:
+        raise ValueError("The water years " + str(argument) + " go backwards; give the earlier one first, ex. " + str(last) + "-" + str(first))
+
+    return list(range(first, last + 1))
+
+def read_csv_chunks(filename, chunk_rows=CSV_CHUNK_ROWS):
+    """ Reads a csv a chunk of rows at a time, so that a file of any length is read in the same memory
+
+    ..Example:
+    for rows in read_csv_chunks('GSWS01_2015_first.csv', 50000):
+        ...
+
+    :rows: list of up to chunk_rows rows, each a list of strings
+    """
+
+    if sys.version_info >= (3,0):
+        mode = 'r'
+    else:
+        mode = 'rb'
+
+    with open(filename, mode) as readfile:
+        reader = csv.reader(readfile)
+
+        while True:
+            rows = list(islice(reader, chunk_rows))
+
+            if rows == []:
+                break
+
+            yield rows
+
+def following_rows(series, last_minute, filename):
+    """ The rows of the next chunk of a file that is read a chunk at a time, after the chunks before it
+
+    Series.from_rows sorts each chunk and keeps the first of a repeated date. That is what it would have done with the whole file only if the file is in order by date, so a chunk that goes back before the one before it is an error. A date repeated across the two chunks is dropped like any other repeat.
+
+    **Inputs**
+    :series: the chunk, from Series.from_rows
+    :last_minute: the last date of the chunks before it, or None for the first chunk
+    :filename: the file, for the error
+
+    **Returns**
+    :series: the chunk, without the repeated date
+    """
+
+    if last_minute == None or len(series) == 0 or series.minutes[0] > last_minute:
+        return series
+
+    if series.minutes[0] < last_minute:
+        raise ValueError(filename + " goes back in time after " + minutes_to_datetime(last_minute).strftime(DATEFORMAT_IDEAL) + ", so it can not be read a chunk at a time. Put it in order by date or run without --stream.")
+
+    return series.take(slice(1, None))
+
+# the binary copy of a working file ("_re.csv" or "_re_partial.csv") is written next to it with this extension
+WORKING_BINARY_EXTENSION = '.bin'
+
+WORKING_BINARY_MAGIC = b'WEIR'
+WORKING_BINARY_VERSION = 1
+
+# a 192 byte header. csv_size and csv_mtime are the size and modification time of the csv when the binary copy was made, so an edited csv is never shadowed by an old binary copy
+WORKING_BINARY_HEADER = np.dtype([('magic', 'S4'), ('version', '<u2'), ('partial', 'u1'), ('spare', 'u1'), ('wateryear', '<i4'), ('spare2', '<i4'), ('rows', '<i8'), ('csv_size', '<i8'), ('csv_mtime', '<f8'), ('sitecode', 'S16'), ('flag_labels', 'S64'), ('event_labels', 'S64'), ('spare3', 'S8')])
+
+# after the header each column is stored whole, one after the other, in this order
+WORKING_BINARY_COLUMNS = [('minutes', '<i8'), ('raw', '<f8'), ('val', '<f8'), ('adj', '<f8'), ('flag', 'u1'), ('event', 'u1')]
+
+def working_binary_name(csv_filename):
+    """ The name of the binary copy of a working csv, ex. GSWS01_2015_working/GSWS01_2015_re.bin"""
+    return os.path.splitext(csv_filename)[0] + WORKING_BINARY_EXTENSION
+
+def working_binary_header(csv_filename, rows, sitecode, wateryear, partial, flag_labels, event_labels):
+    """ The header of the binary copy of a working csv, made once the csv is written and closed (it holds the size and time of the csv)
+
+    Raises ValueError when the labels do not fit in it.
+    """
+
+    for labels in [flag_labels, event_labels]:
+        if len(','.join(labels)) > 64 or any(',' in x for x in labels):
+            raise ValueError("The labels " + ','.join(labels) + " do not fit in a working binary header")
+
+    csv_stat = os.stat(csv_filename)
+
+    header = np.zeros(1, dtype=WORKING_BINARY_HEADER)
+    header['magic'] = WORKING_BINARY_MAGIC
+    header['version'] = WORKING_BINARY_VERSION
+    header['partial'] = int(partial == True)
+    header['wateryear'] = int(wateryear)
+    header['rows'] = rows
+    header['csv_size'] = csv_stat.st_size
+    header['csv_mtime'] = csv_stat.st_mtime
+    header['sitecode'] = sitecode.encode('ascii')
+    header['flag_labels'] = ','.join(flag_labels).encode('ascii')
+    header['event_labels'] = ','.join(event_labels).encode('ascii')
+
+    return header
+
+def write_working_binary(csv_filename, series, sitecode, wateryear, partial):
+    """ Writes the binary copy of a working csv file, after the csv has been written
+
+    The csv stays the file of record (it goes to the database loaders); the binary copy only saves the next 're' run, and pyflow, from parsing it again.
+
+    **Inputs**
+    :csv_filename: the working csv that was just written
+    :series: a Series holding the rows as they were written - values 'raw', 'val', 'adj' and codes 'flag', 'event'
+    :sitecode: ex. GSWS01
+    :wateryear: ex. 2015
+    :partial: True or False
+
+    **Returns**
+    :binary_filename: the name of the file written
+    """
+
+    header = working_binary_header(csv_filename, len(series), sitecode, wateryear, partial, series.labels['flag'], series.labels['event'])
+
+    columns = {'minutes': series.minutes, 'raw': series.values['raw'], 'val': series.values['val'], 'adj': series.values['adj'], 'flag': series.codes['flag'], 'event': series.codes['event']}
+
+    binary_filename = working_binary_name(csv_filename)
+
+    # write to the side and swap it in, so nobody ever maps a half written file
+    temporary_filename = binary_filename + '.tmp'
+
+    with open(temporary_filename, 'wb') as writefile:
+        writefile.write(header.tobytes())
+
+        for name, dtype in WORKING_BINARY_COLUMNS:
+            writefile.write(np.ascontiguousarray(columns[name], dtype=dtype).tobytes())
+
+    if sys.version_info >= (3,0):
+        os.replace(temporary_filename, binary_filename)
+    else:
+        os.rename(temporary_filename, binary_filename)
+
+    return binary_filename
+
+class WorkingBinaryWriter(object):
+    """ Writes the binary copy of a working csv that is written a chunk of rows at a time
+
+    Each column goes to a file of its own until close, and then they are put one after the other behind the header the way write_working_binary writes them, so the rows are never all in memory. Each chunk can have its own labels; the codes are renumbered onto one list of them.
+
+    **Inputs**
+    :csv_filename: the working csv (its final name, not one it is written under until it is done)
+    :sitecode: ex. GSWS01
+    :wateryear: ex. 2015
+    :partial: True or False
+    """
+
+    def __init__(self, csv_filename, sitecode, wateryear, partial):
+        self.csv_filename = csv_filename
+        self.sitecode = sitecode
+        self.wateryear = wateryear
+        self.partial = partial
+        self.rows = 0
+        self.labels = {'flag': [], 'event': []}
+
+        binary_filename = working_binary_name(csv_filename)
+        self.column_filenames = dict((name, binary_filename + '.' + name + '.tmp') for name, dtype in WORKING_BINARY_COLUMNS)
+        self.column_files = dict((name, open(self.column_filenames[name], 'wb')) for name, dtype in WORKING_BINARY_COLUMNS)
+
+    def write(self, series):
+        """ Adds rows, as for write_working_binary: values 'raw', 'val', 'adj' and codes 'flag', 'event'"""
+
+        columns = {'minutes': series.minutes, 'raw': series.values['raw'], 'val': series.values['val'], 'adj': series.values['adj']}
+
+        for name in ['flag', 'event']:
+            renumber, self.labels[name] = encode_labels(series.labels[name], self.labels[name])
+            columns[name] = renumber[series.codes[name]]
+
+        for name, dtype in WORKING_BINARY_COLUMNS:
+            self.column_files[name].write(np.ascontiguousarray(columns[name], dtype=dtype).tobytes())
+
+        self.rows += len(series)
+
+    def close(self):
+        """ Puts the binary copy together, once the csv has been written and closed
+
+        **Returns**
+        :binary_filename: the name of the file written
+        """
+
+        for name in self.column_files:
+            self.column_files[name].close()
+
+        try:
+            header = working_binary_header(self.csv_filename, self.rows, self.sitecode, self.wateryear, self.partial, self.labels['flag'], self.labels['event'])
+
+            binary_filename = working_binary_name(self.csv_filename)
+            temporary_filename = binary_filename + '.tmp'
+
+            with open(temporary_filename, 'wb') as writefile:
+                writefile.write(header.tobytes())
+
+                for name, dtype in WORKING_BINARY_COLUMNS:
+                    with open(self.column_filenames[name], 'rb') as readfile:
+                        shutil.copyfileobj(readfile, writefile, CSV_BUFFER_SIZE)
+
+        finally:
+            self.discard()
+
+        if sys.version_info >= (3,0):
+            os.replace(temporary_filename, binary_filename)
+        else:
+            os.rename(temporary_filename, binary_filename)
+
+        return binary_filename
+
+    def discard(self):
+        """ Removes the files of the columns, ex. when the run stops before the csv is done"""
+
+        for name in self.column_files:
+            self.column_files[name].close()
+
+            try:
+                os.remove(self.column_filenames[name])
+            except OSError:
+                pass
+
+def read_working_header(csv_filename):
+    """ The header of the binary copy of a working csv, or None if there is no binary copy or the csv has changed since it was made"""
+
+    binary_filename = working_binary_name(csv_filename)
+
+    try:
+        header = np.fromfile(binary_filename, dtype=WORKING_BINARY_HEADER, count=1)
+        binary_size = os.path.getsize(binary_filename)
+        csv_stat = os.stat(csv_filename)
+    except (IOError, OSError):
+        return None
+
+    if len(header) == 0 or header['magic'][0] != WORKING_BINARY_MAGIC or header['version'][0] != WORKING_BINARY_VERSION:
+        return None
+
+    rows = int(header['rows'][0])
+    row_size = sum(np.dtype(dtype).itemsize for name, dtype in WORKING_BINARY_COLUMNS)
+
+    if binary_size != WORKING_BINARY_HEADER.itemsize + rows*row_size:
+        return None
+
+    if header['csv_size'][0] != csv_stat.st_size or header['csv_mtime'][0] != csv_stat.st_mtime:
+        return None
+
+    return header[0]
+
+def read_working_binary(csv_filename):
+    """ Memory-maps the binary copy of a working csv
+
+    The columns are mapped copy-on-write, so they can be changed in memory without touching the file.
+
+    **Returns**
+    :series: a Series with values 'raw', 'val', 'adj' and codes 'flag', 'event' - the rows as they are in the csv. None if there is no binary copy or the csv has changed since it was made
+    :header: dictionary of 'sitecode', 'wateryear', and 'partial'
+    """
+
+    header = read_working_header(csv_filename)
+
+    if header == None:
+        return None, None
+
+    binary_filename = working_binary_name(csv_filename)
+    rows = int(header['rows'])
+    offset = WORKING_BINARY_HEADER.itemsize
+
+    columns = {}
+
+    for name, dtype in WORKING_BINARY_COLUMNS:
+        # numpy can not map zero bytes
+        if rows > 0:
+            columns[name] = np.memmap(binary_filename, dtype=dtype, mode='c', offset=offset, shape=(rows,))
+        else:
+            columns[name] = np.zeros(0, dtype=dtype)
+
+        offset += rows*np.dtype(dtype).itemsize
+
+    flag_labels = header['flag_labels'].decode('ascii').split(',')
+    event_labels = header['event_labels'].decode('ascii').split(',')
+
+    series = Series(columns['minutes'], values={'raw': columns['raw'], 'val': columns['val'], 'adj': columns['adj']}, codes={'flag': (columns['flag'], flag_labels), 'event': (columns['event'], event_labels)})
+
+    return series, {'sitecode': header['sitecode'].decode('ascii'), 'wateryear': int(header['wateryear']), 'partial': bool(header['partial'])}
@@ -4,17 +4,18 @@ import os
 import fnmatch
 import sys
 import shutil
-import pymssql
 import os.path
 from itertools import islice
 import math
 import numpy as np
-import matplotlib.pyplot as plt
+import multiprocessing
 #import mpld3
-import matplotlib.dates as mdates
-import matplotlib
 import errno
-from scipy.interpolate import interp1d
+import hashlib
+import json
+from profiling import PROFILE, timed, switch_on_profile
+from catalog import FILE_CATALOG
+from timeseries import Series, FLAG_LABELS, EVENT_LABELS, datetime_to_minutes, round_column, datetimes_to_minutes, minutes_to_datetime, minutes_to_datetimes, parse_column, parse_dates, parse_dates_mixed, read_working_binary, read_working_header, write_working_binary, WorkingBinaryWriter, WORKING_BINARY_EXTENSION, read_csv_chunks, following_rows, stream_option, water_year_range, open_csv, csv_field, csv_code_fields, csv_number_fields, csv_date_fields, write_csv_columns, replace_csv_rows
 
 
 """
@@ -25,6 +26,27 @@ Creative Commons ShareAlike 3.0 License
 You are free to share, copy, transmit, and adapt this work, but you must provide attribution to Fox Peterson and ShareAlike in kind.
 """
 
+# the record of which corrections a working file was made from is written next to it with this extension, so 're' can redo only the corrections edited since
+CORR_RECORD_EXTENSION = '.corr.json'
+
+# how many processes draw the month graphs at once (the number of cpus by default); batch.py sets it so the site-years it runs side by side share the cpus
+GRAPH_WORKERS_ENVIRONMENT = 'WEIR3K_GRAPH_WORKERS'
+
+# kept in the images directory: the hash of what each graph was drawn from, so a month that has not changed is not drawn again
+GRAPH_HASHES_FILENAME = 'graph_hashes.json'
+
+# goes into every hash; change it when the look of the graphs changes so they are all drawn again
+GRAPH_STYLE = '2'
+
+# the compiled corr tables (see CorrTable) are kept here, one per site and water year, with the hash of the csv they were compiled from
+CORR_CACHE_DIRECTORY = 'corr_cache'
+
+# goes into the hash; change it when convert_corr_to_dict or CorrTable changes so every corr table is compiled again
+CORR_CACHE_VERSION = '1'
+
+# set this to a number of equal spans of time, ex. 500 for one per pixel across the plot of the default figure, to draw each graph from the first, lowest, highest and last value of each span rather than from every reading (see decimate_minmax). Unset, every reading is drawn, and the images are the same as they always were.
+GRAPH_BUCKETS_ENVIRONMENT = 'WEIR3K_GRAPH_BUCKETS'
+
 def make_sure_path_exists(path):
     """ A cross platform solution for making a path correctly.
 
@@ -52,28 +74,38 @@ def string_correct(sitecode_raw, wateryear_raw):
 def find_files(sitecode, wateryear, subfolder):
     """ Finds the raw data files by searching 'raw_data' directory as a subfolder
 
+    The files come from the catalog of the directory (see catalog.py), which only reads again the directories that have changed; a subfolder outside of it is walked.
+
     :sitecode: ex. GSWS01
     :wateryear: ex. 2010
     :subfolder: ex. '~/myData/working/'
     """
 
+    if os.path.isabs(subfolder) or os.path.normpath(subfolder).startswith('..'):
+        names = [x for root, dir, names in os.walk(subfolder) for x in names]
+    else:
+        names = [x[1] for x in FILE_CATALOG.refresh(subfolder).candidates(sitecode, wateryear, subfolder)]
+
     raw_data_file = []
-    for root, dir, names in os.walk(subfolder):
-        for x in names:
+    for x in names:
 
-            # exclude filenames with bak or BAK
-            if 'bak' in x or 'BAK' in x:
-                continue
+        # exclude filenames with bak or BAK
+        if 'bak' in x or 'BAK' in x:
+            continue
 
-            # append possible files to the list
-            if sitecode in x and str(wateryear) in x:
-                raw_data_file.append(os.path.join(subfolder,x))
+        # exclude the binary copies of working files and their records of corrections; they go with their csv
+        if WORKING_BINARY_EXTENSION in x or CORR_RECORD_EXTENSION in x:
+            continue
 
-            elif sitecode.lower() in x and str(wateryear) in x:
-                raw_data_file.append(os.path.join(subfolder,x))
+        # append possible files to the list
+        if sitecode in x and str(wateryear) in x:
+            raw_data_file.append(os.path.join(subfolder,x))
 
-            else:
-                pass
+        elif sitecode.lower() in x and str(wateryear) in x:
+            raw_data_file.append(os.path.join(subfolder,x))
+
+        else:
+            pass
 
 
     return raw_data_file
@@ -81,21 +113,21 @@ def find_files(sitecode, wateryear, subfolder):
 def find_root_files(sitecode, wateryear):
     """ Finds the files containing 'first' that are not in 'raw_data' directory
 
+    Only the files that can be of this site and year are looked at, from the catalog of the directory.
     """
     scary_file = []
-    for root, dir, files in os.walk('.', topdown="False"):
+    for root, name, role in FILE_CATALOG.refresh('.').candidates(sitecode, wateryear):
         if 'raw_data' not in root and 'backups' not in root and 'working' not in root:
-            for name in files:
-
-                # if the file name contains first and it's not in raw_data
-                if 'first' in name:
-                    # and if it also has the sitecode in its name
-                    if sitecode.upper() in name and str(wateryear) in name:
-                        scary_file.append(name)
-                    elif sitecode.lower() in name and str(wateryear) in name:
-                        scary_file.append(name)
-                    else:
-                        pass
+
+            # if the file name contains first and it's not in raw_data
+            if 'first' in name:
+                # and if it also has the sitecode in its name
+                if sitecode.upper() in name and str(wateryear) in name:
+                    scary_file.append(name)
+                elif sitecode.lower() in name and str(wateryear) in name:
+                    scary_file.append(name)
+                else:
+                    pass
 
     return scary_file
 
@@ -139,6 +171,7 @@ def create_subfolders(sitecode, wateryear):
     except Exception:
         pass
 
+@timed('convert_corr_to_dict', rows=len)
 def convert_corr_to_dict(sitecode, wateryear):
     """ Converts a correction table to a dictionary
 
@@ -162,8 +195,7 @@ def convert_corr_to_dict(sitecode, wateryear):
     """
 
     # note: did not have the wy explicitly in here before 09-30-2015, may have caused namespace errors?
-    corr_name = "corr_table_" + sitecode.lower() + "_" + str(wateryear) + ".csv"
-    corr = os.path.join('corr_table', corr_name)
+    corr = corr_table_name(sitecode, wateryear)
 
     # three possible date formats!
     dateformat_ideal = '%Y-%m-%d %H:%M:%S'
@@ -184,129 +216,357 @@ def convert_corr_to_dict(sitecode, wateryear):
     with open(corr, mode) as readfile:
         reader = csv.reader(readfile)
 
-        # no need to bring in any values that begin after this water year
-        test_value = datetime.datetime(wateryear,10,1,0,5)
+        # skip header lines
+        rows = [row for row in reader if str(row[2]) == sitecode]
 
-        for row in reader:
+    # the begin dates are usually the ideal format and the end dates the old format, but either column can hold any of the three; each row is read with the first format that fits. A row that fits none gets None.
+    bgn_minutes, bgn_found = parse_dates_mixed([str(row[3]) for row in rows], [dateformat_ideal, dateformat_old, dateformat_13char])
+    end_minutes, end_found = parse_dates_mixed([str(row[6]) for row in rows], [dateformat_old, dateformat_ideal, dateformat_13char])
+
+    # no need to bring in any values that begin after this water year
+    test_value = datetime.datetime(wateryear,10,1,0,5)
+
+    for index, row in enumerate(rows):
+
+        if bgn_found[index]:
+            dt = minutes_to_datetime(bgn_minutes[index])
+
+            # set the correction to occur on the next five minute interval
+            if dt.minute % 5 != 0:
+                new_minute = dt.minute // 5 * 5
+                dt = datetime.datetime(dt.year, dt.month, dt.day, dt.hour, new_minute, 0)
+                dt += datetime.timedelta(minutes = 5)
+
+                # if the beginning date time from the corr table is bigger than the last day of the water year, we won't ever use this correction, so don't bother to import it.
+                if dt >= test_value:
+                    return od
+        else:
+            #print "error importing corr table due to incompatible date on the begin date. check the format and try again"
+            dt = None
+
+        bgncr = float(row[4])
+        bgnhg = float(row[5])
+
+        bgnratio = bgnhg/bgncr
+        bgn_diff = bgnhg - bgncr
+
+        if end_found[index]:
+            enddt = minutes_to_datetime(end_minutes[index])
+
+            if enddt.minute % 5 != 0:
+                new_minute = enddt.minute // 5 * 5
+                enddt = datetime.datetime(enddt.year, enddt.month, enddt.day, enddt.hour, new_minute, 0)
+                enddt += datetime.timedelta(minutes = 5)
+        else:
+            #print "There is an error importing corr table due to incompatible date on end date - can you bring over an extra record from the subsequent table? In the meantime, I\'ll pass in a None and your adjustments will stop on the last known good correction date"
+            enddt = None
+
+        try:
+            endcr = float(row[7])
+            endhg = float(row[8])
+            endratio = endhg/endcr
+            end_diff = endhg - endcr
+
+        except Exception as exc:
+            endcr = None
+            endhg = None
+            endratio = None
+            end_diff = None
+
+        try:
+            # compute the duration of the interval from that beginning time to its follower in minutes
+            duration = (enddt - dt).days*1440 + (enddt - dt).seconds//60
+
+        except Exception:
+            duration = None
+
+
+        # if the key is already in the dictionary, skip it
+        if enddt not in od:
+            # populate it
+            od[enddt] = {'sitecode': sitecode, 'bgn_cr': bgncr, 'bgn_hg': bgnhg, 'bgn_rat': bgnratio, 'bgn_dt' : dt, 'end_cr': endcr, 'end_hg': endhg, 'end_rat': endratio, 'duration':duration, 'end_diff': end_diff, 'bgn_diff': bgn_diff}
+
+        elif enddt in od:
+            pass
+
+    # return the correction table as dictioanry
+    return od
+
+class CorrTable(object):
+    """ A correction table compiled into columns, sorted by the end date of each correction, for looking corrections up by date with a binary search
+
+    A correction without an end date (the one still open) is not applied, as always, and is not in the table. Where a value is missing (None in convert_corr_to_dict) its column holds nan.
+
+    **Inputs**
+    :sitecode: ex. GSWS01
+    :ends: sorted int64 array of the end date of each correction, in minutes since the epoch
+    :begins: int64 array of the begin dates, lined up with ends (0 where there is none)
+    :has_begin: boolean array, False where the begin date could not be read
+    :has_end_values: boolean array, False where the end cr and hg are missing
+    :columns: dictionary of float64 arrays lined up with ends - 'duration' and every name in CORR_COLUMNS
+
+    ..Example:
+
+    >>> corr_table = load_corr_table('GSWS01', 2015)
+    >>> corr_table.locate(datetimes_to_minutes([datetime.datetime(2014, 9, 25, 0, 0)]))
+    >>> (array([3]), array([ True]))
+    """
+
+    # the values of each row of the corr table besides the dates
+    CORR_COLUMNS = ['bgn_cr', 'bgn_hg', 'bgn_rat', 'bgn_diff', 'end_cr', 'end_hg', 'end_rat', 'end_diff']
+
+    def __init__(self, sitecode, ends, begins, has_begin, has_end_values, columns):
+        self.sitecode = sitecode
+        self.ends = np.asarray(ends, dtype=np.int64)
+        self.begins = np.asarray(begins, dtype=np.int64)
+        self.has_begin = np.asarray(has_begin, dtype=bool)
+        self.has_end_values = np.asarray(has_end_values, dtype=bool)
+        self.columns = dict((x, np.asarray(columns[x], dtype=np.float64)) for x in ['duration'] + self.CORR_COLUMNS)
+
+    @classmethod
+    def from_dict(cls, corr_od):
+        """ Compiles the dictionary of corrections convert_corr_to_dict gives (or one made the same way)"""
+
+        end_dates = sorted([x for x in corr_od.keys() if x != None])
+        rows = [corr_od[x] for x in end_dates]
+
+        # None is missing
+        as_column = lambda name: np.array([np.nan if x[name] == None else x[name] for x in rows], dtype=np.float64)
+
+        columns = dict((x, as_column(x)) for x in ['duration'] + cls.CORR_COLUMNS)
+
+        if rows != []:
+            sitecode = rows[0]['sitecode']
+        else:
+            sitecode = ''
+
+        begins = np.array([datetime_to_minutes(x['bgn_dt']) if x['bgn_dt'] != None else 0 for x in rows], dtype=np.int64)
+
+        return cls(sitecode, datetimes_to_minutes(end_dates), begins, [x['bgn_dt'] != None for x in rows], [x['end_cr'] != None for x in rows], columns)
 
-            # skip header lines
-            if str(row[2]) != sitecode:
+    @classmethod
+    def stitch(cls, tables, wateryears):
+        """ One table from the tables of consecutive water years
+
+        A correction can be in more than one of them, ex. the one going over October 1st, which the next year's table has as well. It is taken from the table of the water year it ends in, or if that one does not have it, from the latest table that does.
+
+        **Inputs**
+        :tables: list of CorrTables, in order
+        :wateryears: the water year of each
+        """
+
+        # end minute : (table, position, whether the table is of the water year it ends in)
+        chosen = {}
+
+        for table, wateryear in zip(tables, wateryears):
+            first_minute, last_minute = water_year_bounds(wateryear)
+
+            for position, end in enumerate(table.ends.tolist()):
+                owned = first_minute <= end < last_minute
+
+                if end not in chosen or owned or not chosen[end][2]:
+                    chosen[end] = (table, position, owned)
+
+        picked = [chosen[x] for x in sorted(chosen)]
+
+        return cls(tables[0].sitecode, sorted(chosen), [x[0].begins[x[1]] for x in picked], [x[0].has_begin[x[1]] for x in picked], [x[0].has_end_values[x[1]] for x in picked], dict((name, [x[0].columns[name][x[1]] for x in picked]) for name in ['duration'] + cls.CORR_COLUMNS))
+
+    def __len__(self):
+        return len(self.ends)
+
+    def end_dates(self, selection=slice(None)):
+        """ The end dates of some of the corrections, as a list of datetimes"""
+        return minutes_to_datetimes(self.ends[selection])
+
+    def positions(self, corr_dates):
+        """ The position of each of a list of end dates in the table; they have to be in it"""
+
+        corr_ends = datetimes_to_minutes(corr_dates)
+        positions = np.searchsorted(self.ends, corr_ends)
+
+        if len(positions) > 0 and (positions.max() >= len(self.ends) or (self.ends[positions] != corr_ends).any()):
+            raise KeyError("A correction date is not in the corr table for " + self.sitecode)
+
+        return positions
+
+    def locate(self, minutes):
+        """ The correction that governs each of an array of dates, by binary search
+
+        **Returns**
+        :index: the position of the first correction ending at or after each date; len(self) after the last one
+        :inside: True where the date is also on or after the begin of that correction
+        """
+
+        minutes = np.asarray(minutes, dtype=np.int64)
+        index = np.searchsorted(self.ends, minutes, side='left')
+
+        if len(self.ends) == 0:
+            return index, np.zeros(len(minutes), dtype=bool)
+
+        # a date after the last correction is looked up against the last one, and then left outside
+        clipped = np.minimum(index, len(self.ends) - 1)
+        inside = (index < len(self.ends)) & self.has_begin[clipped] & (self.begins[clipped] <= minutes)
+
+        return index, inside
+
+    def correction_columns(self, positions):
+        """ The columns weigh_corrections needs, for the corrections at those positions"""
+        return dict((x, self.columns[x][positions]) for x in ['duration', 'bgn_rat', 'bgn_diff', 'end_rat', 'end_diff'])
+
+    def row(self, position):
+        """ One correction as convert_corr_to_dict has it, ex. for its fingerprint"""
+
+        row = {'sitecode': self.sitecode}
+
+        for name in self.CORR_COLUMNS:
+            row[name] = float(self.columns[name][position])
+
+        if not self.has_end_values[position]:
+            for name in ['end_cr', 'end_hg', 'end_rat', 'end_diff']:
+                row[name] = None
+
+        if self.has_begin[position]:
+            row['bgn_dt'] = minutes_to_datetime(self.begins[position])
+        else:
+            row['bgn_dt'] = None
+
+        if np.isnan(self.columns['duration'][position]):
+            row['duration'] = None
+        else:
+            row['duration'] = int(self.columns['duration'][position])
+
+        return row
+
+    def problems(self):
+        """ What looks wrong in the table: a correction that begins before the one before it ends (an overlap) or after it (a gap), or that ends before it begins
+
+        **Returns**
+        :problems: list of strings, one per problem
+        """
+
+        problems = []
+        as_text = lambda x: minutes_to_datetime(x).strftime('%Y-%m-%d %H:%M:%S')
+
+        for position in range(len(self.ends)):
+            end_text = as_text(self.ends[position])
+
+            if not self.has_begin[position]:
+                problems.append("The correction ending on " + end_text + " has no begin date that can be read")
                 continue
 
-            try:
-                # first date format
-                dt = datetime.datetime.strptime(str(row[3]), dateformat_ideal)
+            if self.begins[position] > self.ends[position]:
+                problems.append("The correction ending on " + end_text + " begins after it ends, on " + as_text(self.begins[position]))
 
-                if dt.minute % 5 != 0:
-                    new_minute = dt.minute // 5 * 5
-                    dt = datetime.datetime(dt.year, dt.month, dt.day, dt.hour, new_minute, 0)
-                    dt += datetime.timedelta(minutes = 5)
+            if position == 0:
+                continue
 
-                    # if the beginning date time from the corr table is bigger than the last day of the water year, we won't ever use this correction, so don't bother to import it.
-                    if dt >= test_value:
-                        return od
+            if self.begins[position] < self.ends[position - 1]:
+                problems.append("The correction ending on " + end_text + " begins on " + as_text(self.begins[position]) + ", before the one before it ends on " + as_text(self.ends[position - 1]))
 
-            except Exception:
+            elif self.begins[position] > self.ends[position - 1]:
+                problems.append("The correction ending on " + end_text + " begins on " + as_text(self.begins[position]) + ", leaving a gap after the one before it ends on " + as_text(self.ends[position - 1]))
 
-                try:
-                    # second date format
-                    dt = datetime.datetime.strptime(str(row[3]), dateformat_old)
-                    if dt.minute % 5 != 0:
-                        new_minute = dt.minute // 5 * 5
-                        dt = datetime.datetime(dt.year, dt.month, dt.day, dt.hour, new_minute, 0)
-                        dt += datetime.timedelta(minutes = 5)
+        return problems
 
-                        # see note above
-                        if dt >= test_value:
-                            return od
+    def save(self, filename, digest):
+        """ Writes the table and the hash it was compiled from to an .npz file"""
 
-                except Exception:
-                    try:
-                        # third date format
-                        dt = datetime.datetime.strptime(str(row[3]), dateformat_13char)
-                        # set the correction to occur on the last five minute interval
-                        if dt.minute % 5 != 0:
-                            new_minute = dt.minute // 5 * 5
-                            dt = datetime.datetime(dt.year, dt.month, dt.day, dt.hour, new_minute, 0)
-                            dt += datetime.timedelta(minutes = 5)
-                            if dt >= test_value:
-                                return od
+        temporary_filename = filename + '.tmp'
 
-                    except Exception:
+        arrays = dict(('column_' + x, self.columns[x]) for x in self.columns)
 
-                        #print "error importing corr table due to incompatible date on the begin date. check the format and try again"
-                        dt = None
+        with open(temporary_filename, 'wb') as writefile:
+            np.savez(writefile, digest=np.array(digest), sitecode=np.array(self.sitecode), ends=self.ends, begins=self.begins, has_begin=self.has_begin, has_end_values=self.has_end_values, **arrays)
 
-            bgncr = float(row[4])
-            bgnhg = float(row[5])
+        if sys.version_info >= (3,0):
+            os.replace(temporary_filename, filename)
+        else:
+            if os.path.isfile(filename):
+                os.remove(filename)
+            os.rename(temporary_filename, filename)
 
-            bgnratio = bgnhg/bgncr
-            bgn_diff = bgnhg - bgncr
+    @classmethod
+    def load(cls, filename, digest):
+        """ Reads a table written by save, or None if there is none, it can not be read, or it was compiled from a different csv"""
 
+        try:
+            with np.load(filename, allow_pickle=False) as kept:
+                if str(kept['digest']) != digest:
+                    return None
 
-            try:
-                # first date format
-                enddt = datetime.datetime.strptime(str(row[6]), dateformat_old)
+                return cls(str(kept['sitecode']), kept['ends'], kept['begins'], kept['has_begin'], kept['has_end_values'], dict((x, kept['column_' + x]) for x in ['duration'] + cls.CORR_COLUMNS))
 
-                if enddt.minute % 5 != 0:
-                    new_minute = enddt.minute // 5 * 5
-                    enddt = datetime.datetime(enddt.year, enddt.month, enddt.day, enddt.hour, new_minute, 0)
-                    enddt += datetime.timedelta(minutes = 5)
+        except (IOError, OSError, ValueError, KeyError):
+            return None
 
-            except Exception as exc:
+def compile_corrections(corr_od):
+    """ The CorrTable of a dictionary of corrections, or the table itself if it is already compiled"""
 
-                try:
-                    # second date format
-                    enddt = datetime.datetime.strptime(str(row[6]), dateformat_ideal)
-                    if enddt.minute % 5 != 0:
-                        new_minute = enddt.minute // 5 * 5
-                        enddt = datetime.datetime(enddt.year, enddt.month, enddt.day, enddt.hour, new_minute, 0)
-                        enddt += datetime.timedelta(minutes = 5)
-                except Exception:
-                    try:
-                        # third date format
-                        enddt = datetime.datetime.strptime(str(row[6]), dateformat_13char)
+    if isinstance(corr_od, CorrTable):
+        return corr_od
 
-                        if enddt.minute % 5 != 0:
-                            new_minute = enddt.minute // 5 * 5
-                            enddt = datetime.datetime(enddt.year, enddt.month, enddt.day, enddt.hour, new_minute, 0)
-                            enddt += datetime.timedelta(minutes = 5)
+    return CorrTable.from_dict(corr_od)
 
-                    except Exception:
+def corr_table_name(sitecode, wateryear):
+    """ The corr table csv of a site and water year, ex. corr_table/corr_table_gsws01_2015.csv"""
+    return os.path.join('corr_table', "corr_table_" + sitecode.lower() + "_" + str(wateryear) + ".csv")
 
-                        #print "There is an error importing corr table due to incompatible date on end date - can you bring over an extra record from the subsequent table? In the meantime, I\'ll pass in a None and your adjustments will stop on the last known good correction date"
-                        enddt = None
+@timed('load_corr_table', rows=len)
+def load_corr_table(sitecode, wateryear):
+    """ The compiled correction table of a site and water year
 
-            try:
-                endcr = float(row[7])
-                endhg = float(row[8])
-                endratio = endhg/endcr
-                end_diff = endhg - endcr
+    It is compiled from the csv (see convert_corr_to_dict) once, checked for overlaps and gaps, and kept in CORR_CACHE_DIRECTORY with the hash of the csv; until the csv changes, it is read from there. Deleting the cache is always safe.
 
-            except Exception as exc:
-                endcr = None
-                endhg = None
-                endratio = None
-                end_diff = None
+    **Inputs**
+    :sitecode: ex. GSWS01
+    :wateryear: ex. 2015
 
-            try:
-                # compute the duration of the interval from that beginning time to its follower in minutes
-                duration = (enddt - dt).days*1440 + (enddt - dt).seconds//60
+    **Returns**
+    :corr_table: a CorrTable, which can be passed anywhere a corr_od can
+    """
 
-            except Exception:
-                duration = None
+    with open(corr_table_name(sitecode, wateryear), 'rb') as readfile:
+        digest = hashlib.sha1(readfile.read() + ("|" + sitecode + "|" + str(wateryear) + "|" + CORR_CACHE_VERSION).encode('utf-8')).hexdigest()
 
+    cache_filename = os.path.join(CORR_CACHE_DIRECTORY, sitecode + "_" + str(wateryear) + ".npz")
 
-            # if the key is already in the dictionary, skip it
-            if enddt not in od:
-                # populate it
-                od[enddt] = {'sitecode': sitecode, 'bgn_cr': bgncr, 'bgn_hg': bgnhg, 'bgn_rat': bgnratio, 'bgn_dt' : dt, 'end_cr': endcr, 'end_hg': endhg, 'end_rat': endratio, 'duration':duration, 'end_diff': end_diff, 'bgn_diff': bgn_diff}
+    corr_table = CorrTable.load(cache_filename, digest)
 
-            elif enddt in od:
-                pass
+    if corr_table != None:
+        return corr_table
 
-    # return the correction table as dictioanry
-    return od
+    corr_table = CorrTable.from_dict(convert_corr_to_dict(sitecode, wateryear))
+
+    for each_problem in corr_table.problems():
+        print("Check the corr table for " + sitecode + " " + str(wateryear) + ": " + each_problem)
+
+    # the cache only saves time
+    try:
+        make_sure_path_exists(CORR_CACHE_DIRECTORY)
+        corr_table.save(cache_filename, digest)
+    except (IOError, OSError) as exc:
+        print("Could not keep the compiled corr table (" + str(exc) + ")")
+
+    return corr_table
+
+def load_corr_tables(sitecode, wateryears):
+    """ The corr tables of consecutive water years as one CorrTable (see CorrTable.stitch), for adjusting them in one pass
+
+    What looks wrong where the tables meet is printed; what looks wrong in each table was printed when it was compiled.
+    """
+
+    tables = [load_corr_table(sitecode, x) for x in wateryears]
+    corr_table = CorrTable.stitch(tables, wateryears)
+
+    known = set()
+    for each_table in tables:
+        known.update(each_table.problems())
+
+    for each_problem in corr_table.problems():
+        if each_problem not in known:
+            print("Check the corr tables for " + sitecode + " " + str(wateryears[0]) + "-" + str(wateryears[-1]) + ": " + each_problem)
+
+    return corr_table
 
 def drange(start, stop, step):
     """
@@ -328,11 +588,41 @@ def wrapper(walk, stop):
     finally:
         del(walk)
 
+def raw_value(row, column):
+    """ The value of one row of raw data, from the column to the right of the dates; None when it is missing or is not a number
+
+    :row: the row, as csv.reader gives it
+    :column: the column of the dates, from test_csv_structure
+    """
+
+    try:
+        data_value = round(float(row[column + 1]),3)
+
+        if str(data_value) == "nan":
+            data_value = None
+
+        # if you forgot and put ESTIMATED DATA IN THE RAW DATA FOLDER
+
+        if len(row) > 4 and row[column + 4] == "E":
+            data_value = round(float(row[column + 2]),3)
+        else:
+            pass
+
+    except Exception:
+        data_value = None
+
+    return data_value
+
+@timed('parameterize_first', rows=lambda x: len(x[0]))
 def parameterize_first(sitecode, wateryear, filename):
-    """ from the raw input figure out which column has the dates and what its format is. assume that the data is in the column which is to the right of the dates. """
+    """ from the raw input figure out which column has the dates and what its format is. assume that the data is in the column which is to the right of the dates.
 
-    # "output dictionary" --> anytime I use od in a program this is what it is -- Fox 09/10/2015
-    od = {}
+    Returns a Series with one value column, 'raw', and the date column.
+    """
+
+    # the raw data as it is read; turned into the "output" Series at the end -- anytime I use od in a program this is what it is -- Fox 09/10/2015
+    date_strings = []
+    raw_values = []
     date_column = ""
 
     # figure out which column contains the date and what its type is
@@ -351,45 +641,230 @@ def parameterize_first(sitecode, wateryear, filename):
 
         for row in reader:
 
-            # get the date time and call it dt.
-            dt = datetime.datetime.strptime(str(row[column]), date_type)
+            # the dates are read all at once after the loop
+            date_strings.append(str(row[column]))
+            raw_values.append(raw_value(row, column))
 
-            try:
-                data_value = round(float(row[column + 1]),3)
+    # get the date times
+    minutes = parse_dates(date_strings, date_type)
 
-                if str(data_value) == "nan":
-                    data_value = None
+    # stop at the first reading past the end of the water year
+    past_the_end = np.flatnonzero(minutes > datetime_to_minutes(datetime.datetime(wateryear, 10, 1, 0, 0)))
+    if len(past_the_end) != 0:
+        minutes = minutes[:past_the_end[0]]
+        raw_values = raw_values[:past_the_end[0]]
 
-                # if you forgot and put ESTIMATED DATA IN THE RAW DATA FOLDER
+    # sorted by date; if a date is repeated the first one is kept
+    od = Series.from_rows(minutes, values={'raw': raw_values})
 
-                if len(row) > 4 and row[column + 4] == "E":
-                    data_value = round(float(row[column + 2]),3)
-                else:
-                    pass
+    return od, date_column
 
-            except Exception:
-                data_value = None
+def stream_raw_data(wateryear, filename, chunk_rows):
+    """ parameterize_first a chunk of rows at a time, for --stream
 
-            # break out of the loop if you have done more than the water year
-            if dt > datetime.datetime(wateryear, 10, 1, 0, 0):
-                return od
-            else:
-                pass
+    The raw data has to be in order by date (see following_rows). Reading stops at the first reading past the end of the water year, as parameterize_first does.
 
-            if dt not in od:
-                od[dt] = data_value
-            elif dt in od:
-                pass
+    **Inputs**
+    :wateryear: ex. 2015
+    :filename: the raw data
+    :chunk_rows: how many rows to read at a time
 
+    **Returns**
+    :chunks: generator of Series with the column 'raw', one after the other in time
+    """
 
-    return od, date_column
+    date_type, column = test_csv_structure(filename)
+    end_minute = datetime_to_minutes(datetime.datetime(wateryear, 10, 1, 0, 0))
+    last_minute = None
+
+    for rows in read_csv_chunks(filename, chunk_rows):
+
+        minutes = parse_dates([str(row[column]) for row in rows], date_type)
+        raw_values = [raw_value(row, column) for row in rows]
+
+        past_the_end = np.flatnonzero(minutes > end_minute)
+        if len(past_the_end) != 0:
+            minutes = minutes[:past_the_end[0]]
+            raw_values = raw_values[:past_the_end[0]]
+
+        od = following_rows(Series.from_rows(minutes, values={'raw': raw_values}), last_minute, filename)
+
+        if len(od) != 0:
+            last_minute = int(od.minutes[-1])
+            yield od
+
+        if len(past_the_end) != 0:
+            return
+
+@timed('fill_gaps', rows=len)
+def fill_gaps(od, first_minute, stop_minute):
+    """ Puts the raw data onto a five minute grid and linearly fills the gaps between observations
+
+    The grid runs from first_minute up to (not including) stop_minute. Raw dates that are off of the grid are kept as rows of their own. Each stretch between two observations that are not five minutes apart gets the dates drange would walk from the first observation, and those dates are filled by one np.interp call and flagged 'E'. Like interp1d on the indices of each stretch, the last date before the next observation is given the next observation's value. Output stops at the first date that has no estimate (before the first observation or after the last one), because the csv writer in generate_first always stopped there.
+
+    **Inputs**
+    :od: the Series from parameterize_first, with the column 'raw'
+    :first_minute: start of the grid, in minutes since the epoch
+    :stop_minute: end of the grid, in minutes since the epoch
+
+    **Returns**
+    :filled: a Series with the value columns 'raw' (nan when missing) and 'estim', and the code column 'flag' ('A', 'M', or 'E')
+    """
+
+    # the grid together with any dates from the raw data
+    grid = np.arange(first_minute, stop_minute, 5, dtype=np.int64)
+    minutes = np.union1d(grid, od.minutes)
+
+    positions, found = od.locate(minutes)
+    raw = np.full(len(minutes), np.nan)
+    raw[found] = od.values['raw'][positions[found]]
+
+    # missing raw data is 'M', everything else is 'A' until it is estimated
+    flags = np.where(np.isnan(raw), FLAG_LABELS.index('M'), FLAG_LABELS.index('A')).astype(np.uint8)
+
+    estim = np.full(len(minutes), np.nan)
+    has_estim = np.zeros(len(minutes), dtype=bool)
+
+    # the observations, which are the dates of raw data that is not missing
+    has_value = ~np.isnan(od.values['raw'])
+    obs = od.minutes[has_value]
+    obs_values = od.values['raw'][has_value]
+
+    if len(obs) > 1:
+
+        # which observation each row follows, and how far past it the row is
+        following = np.searchsorted(obs, minutes, side='right') - 1
+        rows = np.flatnonzero((following >= 0) & (following < len(obs) - 1))
+        following = following[rows]
+        offset = minutes[rows] - obs[following]
+
+        # drange only makes dates at whole five minute steps from the observation
+        on_step = offset % 5 == 0
+        rows = rows[on_step]
+        following = following[on_step]
+        step = offset[on_step] // 5
+
+        # drange makes this many dates from each observation toward the next one
+        spacing = obs[1:] - obs[:-1]
+        lengths = (spacing + 4) // 5
+
+        # each stretch gets its own part of one x axis, going from 0 to lengths - 1 like the indices interp1d was given
+        starts = np.cumsum(lengths) - lengths
+        known_x = np.column_stack((starts, starts + lengths - 1)).ravel()
+        known_y = np.column_stack((obs_values[:-1], obs_values[1:])).ravel()
+        interpolated = np.interp(starts[following] + step, known_x, known_y)
+
+        # if the current value and the next one are the same, fill with that value
+        first_value = obs_values[following]
+        interpolated = np.where(first_value == obs_values[following + 1], first_value, interpolated)
+
+        # observations that are five minutes from the next one just keep their own value
+        is_gap = spacing[following] != 5
+        estim[rows] = np.where(is_gap, interpolated, first_value)
+        has_estim[rows] = True
+        flags[rows[is_gap]] = FLAG_LABELS.index('E')
+
+    # if the last date has no estimate it gets its raw value
+    if len(minutes) > 0 and not has_estim[-1]:
+        estim[-1] = raw[-1]
+        has_estim[-1] = True
+
+    # stop at the first date with no estimate
+    without = np.flatnonzero(~has_estim)
+    if len(without) > 0:
+        stop = without[0]
+    else:
+        stop = len(minutes)
+
+    return Series(minutes[:stop], values={'raw': raw[:stop], 'estim': estim[:stop]}, codes={'flag': (flags[:stop], FLAG_LABELS)})
+
+class GapFiller(object):
+    """ fill_gaps for raw data that comes a chunk at a time
+
+    How a date is filled depends on the observations on either side of it, so the rows after the last observation so far are held back, with that observation, until the next observation comes. The first window of rows starts the grid at first_minute; the windows after it pick the grid up at the next grid date.
+
+    **Inputs**
+    :first_minute: start of the grid, in minutes since the epoch
+    :stop_minute: end of the grid, in minutes since the epoch
+
+    ..Example:
+    filler = GapFiller(first_minute, stop_minute)
+    for od in stream_raw_data(wateryear, filename, 50000):
+        write_first_rows(writefile, sitecode, filler.add(od), False)
+    write_first_rows(writefile, sitecode, filler.finish(), False)
+    """
+
+    def __init__(self, first_minute, stop_minute):
+        self.first_minute = first_minute
+        self.stop_minute = stop_minute
+        self.held = None
+        self.started = False
+        self.stopped = False
+
+    def grid_start(self, minute):
+        """ Where the grid of a window that starts at minute starts"""
+
+        if not self.started:
+            return self.first_minute
+
+        return max(self.first_minute, minute + (self.first_minute - minute) % 5)
+
+    def add(self, od):
+        """ The filled rows up to the last observation in od (not including it), once there is an observation to fill them toward
+
+        :od: the next chunk, with the column 'raw'
+        """
+
+        nothing = Series(np.zeros(0, dtype=np.int64), values={'raw': [], 'estim': []}, codes={'flag': ([], FLAG_LABELS)})
+
+        if self.stopped:
+            return nothing
+
+        if self.held != None:
+            od = Series.concatenate([self.held, od])
 
+        observed = np.flatnonzero(~np.isnan(od.values['raw']))
+
+        # the observation held back, and nothing yet to fill toward
+        if len(observed) < 2:
+            self.held = od
+            return nothing
+
+        last = int(observed[-1])
+        window = od.take(slice(0, last + 1))
+        last_minute = int(window.minutes[-1])
+        grid_start = self.grid_start(int(window.minutes[0]))
+
+        filled = fill_gaps(window, grid_start, last_minute)
+        filled = filled.take(slice(0, int(np.searchsorted(filled.minutes, last_minute, side='left'))))
+
+        # fill_gaps stops at the first date it could not fill, and so does the whole file
+        expected = len(np.union1d(np.arange(grid_start, last_minute, 5, dtype=np.int64), window.minutes[:-1]))
+        if len(filled) < expected:
+            self.stopped = True
+
+        self.started = True
+        self.held = od.take(slice(last, None))
+
+        return filled
+
+    def finish(self):
+        """ The rows held back at the end, filled the way fill_gaps fills the end of the grid"""
+
+        if self.stopped or self.held == None:
+            return Series(np.zeros(0, dtype=np.int64), values={'raw': [], 'estim': []}, codes={'flag': ([], FLAG_LABELS)})
+
+        return fill_gaps(self.held, self.grid_start(int(self.held.minutes[0])), self.stop_minute)
+
+@timed('generate_first')
 def generate_first(od, sitecode, wateryear, partial, sparse=False):
     """ Generates the outputs with estimations if sparse is set to false and without estimations if sparse is set to True
 
     The "first" output will not show the adjustments, just the site code, date, data, and estimated data if you set sparse to false
 
     ** new feature : if an extra arguement of 'partial' exists, the date will start on a more recent day.
+
+    :od: the Series from parameterize_first
     """
 
     output_filename = sitecode + "_" + str(wateryear) + "_" + "first.csv"
@@ -398,170 +873,119 @@ def generate_first(od, sitecode, wateryear, partial, sparse=False):
 
         # this section just deals with the partial method
         if partial != True:
-            # generator to make iterator of a perfect wateryear at 5 minute intervals going from before your data started to after it completes by 5 minutes. The StopIteration gets thrown on the last one, so you wend at 10-01-wateryear.
-            compare_range = drange(datetime.datetime(wateryear-1, 10, 1, 0, 0), datetime.datetime(wateryear, 10, 1, 0, 5), datetime.timedelta(minutes=5))
+            # a perfect wateryear at 5 minute intervals, ending on 10-01-wateryear.
+            first_minute = datetime_to_minutes(datetime.datetime(wateryear-1, 10, 1, 0, 0))
 
         elif partial == True:
 
             output_filename = sitecode + "_" + str(wateryear) + "_" + "partial.csv"
 
-            start_date = min(list(od.keys()))
+            start_date = od.first_date()
             print(" You are processing a partial water year. Your data will start on " + datetime.datetime.strftime(start_date, '%Y-%m-%d %H:%M:%S'))
 
-            #  generator to make iterator of a perfect wateryear at 5 minute intervals going from before your data started to after it completes by 5 minutes. The StopIteration gets thrown on the last one, so you wend at 10-01-wateryear.
-            compare_range = drange(start_date, datetime.datetime(wateryear, 10, 1, 0, 5), datetime.timedelta(minutes=5))
-
-        # Create a blank dictionary with 5 minute spacing. Last value will be on 10-01-wateryear
-        blank_dict = dict.fromkeys(compare_range)
-
-        # update your blank dictionary it with existing values from the raw data
-        # anything that doesn't have a value will be None
-        blank_dict.update(od)
-
-        # create another dictionary to contain flags associated with those estimations
-        flag_dict = {}
-
-        # first fill it with blanks and accepteds based on the blanks!
-        for each_date in sorted(list(blank_dict.keys())):
-
-            # if data is missing from the raw data, fill in with 'M'
-            if blank_dict[each_date] == None:
-                flag_dict.update({each_date:'M'})
-            else:
-                flag_dict.update({each_date:'A'})
-
-        # create a dictionary to contain estimations (remember this is not the sparse method!)
-        estim_dict = {}
-
-        # a list of all of the observed dates in the raw data
-        list_obs_1 = sorted(list(od.keys()))
-
-        # a list of the dates which come in via the raw data and have either an observation or a non-conventional missing value (i.e. anything but numeric none)
-        list_possible_data = [key for (key,value) in sorted(list(od.items())) if value != None]
+            # 5 minute intervals going from when your data started to 10-01-wateryear.
+            first_minute = int(od.minutes[0])
 
-        # if the observational data has any gaps in it, it will be smaller than the filled up data and we will want our observations array to be smaller than the filled up array, otherwise, they can be the same size
-        if len(list_possible_data) < len(list_obs_1):
-            list_obs = list_possible_data
-        else:
-            list_obs = list_obs_1
+        filled = fill_gaps(od, first_minute, datetime_to_minutes(datetime.datetime(wateryear, 10, 1, 0, 5)))
 
-        # iterate over the observed dates in the raw data
-        #(note that it will only go up to the second to last thing, so that when we add 1 index to it, the last thing will be ok)
-        for index, each_obs in enumerate(list_obs[:-1]):
+        # write it to a csv file for subsequent generation
+        with open_csv(output_filename) as writefile:
 
-            # compute the difference between subsequent observations and test if it is 5 minutes. Subtracting these should result in datetime.timedelta(0, 300)
-            compute_obs = list_obs[index+1] - list_obs[index]
+            write_first_rows(writefile, sitecode, filled, sparse)
 
-            # if the obsevations computed are five minutes from one another, store them in the estimated dictionary, otherwise, use the drange function to do a linear interpolation between them
-            if compute_obs == datetime.timedelta(minutes=5):
+    elif sparse == True:
 
-                # in the estimation dictionary, we store({the datetime : the measured value at that date time})
-                estim_dict.update({list_obs[index]:od[list_obs[index]]})
+        # if the final date time in the sparse method is before the end of the water year notify user
+        if od.last_date() < datetime.datetime(wateryear, 10, 1, 0, 0):
+            print("In this sparse analysis, your final data occurs BEFORE the end of the water year, on :" + datetime.datetime.strftime(od.last_date(), '%Y-%m-%d %H:%M:%S'))
 
-            else:
-                # generate a small range of dates for the missing dates and listify
-                mini_dates = drange(list_obs[index], list_obs[index+1], datetime.timedelta(minutes=5))
-                dl = [x for x in mini_dates]
-
-                # if the current value and the next one are the same
-                if od[list_obs[index]] == od[list_obs[index+1]]:
-                    vl = [od[list_obs[index]]]*len(dl)
-                    el = 'E'*len(vl)
-                    # update the estimations dictionary with these new values
-                    newd = dict(zip(dl,vl))
-                    # update the flags with "E"
-                    newd2 = dict(zip(dl,el))
-                    # update the estimations dictionary
-                    estim_dict.update(newd)
-                    flag_dict.update(newd2)
+        # write it to a csv file for subsequent generation
+        with open_csv(output_filename) as writefile:
 
-                else:
-                    # a numpy array for the number of missing
-                    indices_missing = np.arange(len(dl))
-                    knownx = [indices_missing[0], indices_missing[-1]]
-                    knowny = [od[list_obs[index]], od[list_obs[index+1]]]
+            # the observed dates in the raw data; NOT gap filled
+            write_first_rows(writefile, sitecode, od, sparse)
 
-                    # interpolation function
-                    fx = interp1d(knownx, knowny)
+    return output_filename
 
-                    # apply to the indices
-                    vl = fx(indices_missing)
+def write_first_rows(writefile, sitecode, rows, sparse):
+    """ Writes rows of the 'first' file - sitecode, date, raw, the value to adjust, flag
 
-                    # estimate code for the length of vl
-                    el = 'E'*len(vl)
+    :rows: the Series from fill_gaps, or in sparse the Series from parameterize_first, whose raw value is written twice and flagged 'A'
+    """
 
-                    # update the estimations dictionary with these new values
-                    newd = dict(zip(dl,vl))
+    if len(rows) == 0:
+        return
 
-                    # update the flags with "E"
-                    newd2 = dict(zip(dl,el))
-                    estim_dict.update(newd)
-                    flag_dict.update(newd2)
+    if sparse == False:
+        write_csv_columns(writefile, [csv_field(sitecode), csv_date_fields(rows.minutes), csv_number_fields(rows.values['raw']), csv_number_fields(rows.values['estim']), csv_code_fields(rows.codes['flag'], rows.labels['flag'])])
 
-                    newd={}
-                    newd2={}
+    else:
+        raw_fields = csv_number_fields(rows.values['raw'])
+        write_csv_columns(writefile, [csv_field(sitecode), csv_date_fields(rows.minutes), raw_fields, raw_fields, csv_field('A')])
 
-        # if the maximum from the blank is not in the estimated we need to add it
-        if max(blank_dict.keys()) not in estim_dict.keys():
-            estim_dict.update({max(blank_dict.keys()):blank_dict[max(blank_dict.keys())]})
 
-        # writing modes for python3
-        if sys.version_info >= (3,0):
-            mode = 'w'
-        else:
-            mode = 'wb'
+@timed('stream_first')
+def stream_first(sitecode, wateryear, filename, partial, sparse, chunk_rows):
+    """ parameterize_first and generate_first a chunk of rows at a time, for --stream; the 'first' file is the same as theirs
 
+    **Inputs**
+    :filename: the raw data, in order by date
+    :partial: True or False
+    :sparse: True or False
+    :chunk_rows: how many rows to read at a time
 
-        # write it to a csv file for subsequent generation
-        with open(output_filename, mode) as writefile:
-            writer = csv.writer(writefile, delimiter = ",", quoting=csv.QUOTE_NONNUMERIC)
+    **Returns**
+    :output_filename: the 'first' file
+    :date_column: the column of the dates in the raw data
+    """
 
-            try:
-                # blank dict has been gap filled
-                for each_date in sorted(list(blank_dict.keys())):
+    date_column = test_csv_structure(filename)[1]
 
-                    dt = datetime.datetime.strftime(each_date, '%Y-%m-%d %H:%M:%S')
+    output_filename = sitecode + "_" + str(wateryear) + "_" + "first.csv"
 
-                    writer.writerow([sitecode, dt, blank_dict[each_date], estim_dict[each_date], flag_dict[each_date]])
+    if partial == True and sparse == False:
+        output_filename = sitecode + "_" + str(wateryear) + "_" + "partial.csv"
 
-            except Exception:
-                pass
+    filler = None
+    first_minute = None
 
-    elif sparse == True:
+    with open_csv(output_filename) as writefile:
 
-        # a list of the observed dates in the raw data
-        list_obs = sorted(list(od.keys()))
+        for od in stream_raw_data(wateryear, filename, chunk_rows):
 
-        # if the final date time in the sparse method is before the end of the water year notify user
-        if max(od.keys()) < datetime.datetime(wateryear, 10, 1, 0, 0):
-            print("In this sparse analysis, your final data occurs BEFORE the end of the water year, on :" + datetime.datetime.strftime(max(od.keys()), '%Y-%m-%d %H:%M:%S'))
+            if first_minute == None:
+                first_minute = int(od.minutes[0])
+                print("The first day and time in your raw data is " + datetime.datetime.strftime(od.first_date(), '%Y-%m-%d %H:%M:%S'))
 
-        if sys.version_info >= (3,0):
-            mode = 'w'
-        else:
-            mode = 'wb'
+                # a perfect wateryear at 5 minute intervals ending on 10-01-wateryear, or for partial from when your data started
+                if partial != True:
+                    filler = GapFiller(datetime_to_minutes(datetime.datetime(wateryear-1, 10, 1, 0, 0)), datetime_to_minutes(datetime.datetime(wateryear, 10, 1, 0, 5)))
+                else:
+                    print(" You are processing a partial water year. Your data will start on " + datetime.datetime.strftime(od.first_date(), '%Y-%m-%d %H:%M:%S'))
+                    filler = GapFiller(first_minute, datetime_to_minutes(datetime.datetime(wateryear, 10, 1, 0, 5)))
 
+            last_date = od.last_date()
 
-        # write it to a csv file for subsequent generation
-        with open(output_filename, mode) as writefile:
-            writer = csv.writer(writefile, delimiter = ",", quoting=csv.QUOTE_NONNUMERIC)
+            if sparse == False:
+                write_first_rows(writefile, sitecode, filler.add(od), sparse)
+            else:
+                write_first_rows(writefile, sitecode, od, sparse)
 
-            try:
-                # blank dict has NOT  been gap filled
-                for each_date in list_obs:
-                    dt = datetime.datetime.strftime(each_date, '%Y-%m-%d %H:%M:%S')
+        if first_minute == None:
+            raise ValueError("There is no raw data for water year " + str(wateryear) + " in " + filename)
 
-                    try:
-                        writer.writerow([sitecode, dt, od[each_date], od[each_date], 'A'])
-                    except Exception:
-                        pass
+        if sparse == False:
+            write_first_rows(writefile, sitecode, filler.finish(), sparse)
 
-            except Exception:
-                pass
+    print("The final day and time in your raw data is " + datetime.datetime.strftime(last_date, '%Y-%m-%d %H:%M:%S'))
 
-    return output_filename
+    # if the final date time in the sparse method is before the end of the water year notify user
+    if sparse == True and last_date < datetime.datetime(wateryear, 10, 1, 0, 0):
+        print("In this sparse analysis, your final data occurs BEFORE the end of the water year, on :" + datetime.datetime.strftime(last_date, '%Y-%m-%d %H:%M:%S'))
 
+    return output_filename, date_column
 
+@timed('do_adjustments', rows=lambda x: len(x[0]))
 def do_adjustments(sitecode, wateryear, filename, corr_od, method, partial, date_column):
     """ Performs adjustments on the outputs - ALWAYS pulls from column 3!
 
@@ -574,410 +998,1014 @@ def do_adjustments(sitecode, wateryear, filename, corr_od, method, partial, date
     :date_column: in which column of the data is the date
     """
 
-    # on the first go round
-    if method == "first" or method == "sparse":
+    output_filename = working_output_filename(sitecode, wateryear, method, partial)
 
+    od = read_working_file(filename, method, date_column)
 
-        # new output location
-        dirname = str(sitecode) + "_" + str(wateryear) + "_" + "working"
-        filename_list = find_files(sitecode, wateryear, dirname)
+    # the key function is "determine weights" -- this is where the adjustment happens
+    wd = determine_weights(sitecode, wateryear, corr_od, od, partial)
 
-        # make sure working directory is blank
-        if filename_list == []:
+    write_working_file(output_filename, wd, od.minutes, sitecode, wateryear, corr_od, partial)
 
-            if partial == True:
+    return wd, output_filename
+
+def read_working_file(filename, method, date_column):
+    """ The Series do_adjustments adjusts, from a 'first' or 're' file: values 'raw' and 'val', codes 'fval' and 'event'
+
+    In 're', a binary copy of the working file that still matches it is loaded instead of parsing the csv.
+    """
+
+    if method == "re":
+        working, header = read_working_binary(filename)
+    else:
+        working = None
+
+    if working != None:
+
+        # the binary copy holds the columns as they were written; events are assigned after adjusting
+        return Series(working.minutes, values={'raw': working.values['raw'], 'val': working.values['val']}, codes={'fval': (working.codes['flag'], working.labels['flag']), 'event': (np.zeros(len(working), dtype=np.uint8), EVENT_LABELS)})
+
+    date_type = working_date_type(filename, date_column)
+
+    if sys.version_info >= (3,0):
+        mode = 'r'
+    else:
+        mode = 'rb'
+
+    # open the input file and process
+    with open(filename, mode) as readfile:
+        columns = working_file_columns(csv.reader(readfile), method, date_column)
+
+    return working_file_series(columns, date_type)
+
+def write_working_file(output_filename, wd, observed, sitecode, wateryear, corr_od, partial, wateryears=None):
+    """ Writes the 're' file of the adjusted Series, its binary copy, and the record of the corrections it was made from
+
+    **Inputs**
+    :output_filename: from working_output_filename
+    :wd: the adjusted Series from determine_weights
+    :observed: the minutes of every observation that was adjusted, including those past the last correction
+    :wateryears: the water years adjusted together, when this is one year of a range (optional)
+    """
+
+    # the difference method does resolve correctly, as far as I can see from testing on ws1 alone
+    copy = working_rows(wd)
+
+    with PROFILE.stage('write_re') as stage:
+        with open_csv(output_filename) as writefile:
+            write_csv_columns(writefile, working_csv_columns(sitecode, copy))
+
+            # add on one extra date stamp to buffer the output. Make the event 'NA'
+            #last_date = valid_dates[-1] + datetime.timedelta(minutes = 5)
+            #writer.writerow([sitecode, datetime.datetime.strftime(last_date, '%Y-%m-%d %H:%M:%S'), wd[valid_dates[-1]]['raw'], wd[valid_dates[-1]]['val'], round(wd[valid_dates[-1]]['adj_diff'],3), wd[valid_dates[-1]]['fval'], 'NA'])
+
+        write_working_copy(output_filename, copy, sitecode, wateryear, partial)
+        stage.rows = len(copy)
+
+    # what the next 're' needs to tell which corrections were edited since this one
+    relevant_corr_dates = relevant_corrections(wateryear, corr_od, observed[0], partial)
+    index, advanced = assign_corrections(datetimes_to_minutes(relevant_corr_dates), observed)
+    write_corr_record(output_filename, corr_od, relevant_corr_dates, observed, index, wateryears)
+
+def working_output_filename(sitecode, wateryear, method, partial):
+    """ The working file that do_adjustments writes to. In 'first' and 'sparse' the working directory must not already have one; in 're' the one there is copied to 'backups' before it is written over.
+
+    :method: 're', 'first' or 'sparse'
+    :partial: True or False
+    """
+
+    # on the first go round
+    if method == "first" or method == "sparse":
+
+
+        # new output location
+        dirname = str(sitecode) + "_" + str(wateryear) + "_" + "working"
+        filename_list = find_files(sitecode, wateryear, dirname)
+
+        # make sure working directory is blank
+        if filename_list == []:
+
+            if partial == True:
+
+                output_filename = os.path.join(str(sitecode) + "_" + str(wateryear) + "_" + "working", sitecode + "_" + str(wateryear) + "_" + "re_partial.csv")
+
+                print("Creating " + output_filename + " to \'working\'. Running \'re\' \'partial\'")
+
+            elif partial == False:
+
+                output_filename = os.path.join(str(sitecode) + "_" + str(wateryear) + "_" + "working", sitecode + "_" + str(wateryear) + "_" + "re.csv")
+
+                print("Creating " + output_filename + " to \'working\'. Running \'re\'")
+
+        # if it's not blank, check for existing file you don't want to over write
+        elif filename_list != []:
+
+            if partial == True:
+
+                for name in filename_list:
+                    if 'partial' in name:
+
+                        sys.exit("You have a file in the working directory called " + name + ". Please save this file elsewhere and remove it from working before continuing")
+                    else:
+                        output_filename = os.path.join(str(sitecode) + "_" + str(wateryear) + "_" + "working", sitecode + "_" + str(wateryear) + "_" + "re_partial.csv")
+
+            elif partial == False:
+
+                for name in filename_list:
+                    if 'partial' not in name:
+
+                        sys.exit("You have a file in the working directory called " + name + ". Please save this file elsewhere and remove it from working before continuing")
+                    else:
+                        output_filename = os.path.join(str(sitecode) + "_" + str(wateryear) + "_" + "working", sitecode + "_" + str(wateryear) + "_" + "re.csv")
+
+            else:
+                possibly_dangerous = ", ".join(filename_list)
+
+                sys.exit("You have a files in the working directory called " + possibly_dangerous + ". Please save these files elsewhere and remove them from working before continuing")
+
+    # if the re adjustmet, check the working directory for the files with your sitecode and wateryear
+    elif method == "re":
+
+        dirname = str(sitecode) + "_" + str(wateryear) + "_" + "working"
+        filename_list = find_files(sitecode, wateryear, dirname)
+
+        if len(filename_list) > 1:
+
+            if partial == True:
+
+                # if we find a partial and we're doing partial, we want to break out
+                for name in filename_list:
+
+                    # if you have a partial already and you are running partial, you'll want to use it
+                    if 'partial' in name:
+
+                        # you will overwriate the old one -- i.e. you write to "re_partial" and you input from "re_partial"
+                        output_filename = name
+
+                        # if you already have the re, you want to copy it
+                        shutil.copy(output_filename, os.path.join(str(sitecode) + "_" + str(wateryear) + "_" + "backups",sitecode + "_" + str(wateryear) + "_" + "re_partial.csv"))
+
+                        print("saved a copy of " + name + " to \'backups\'. Running \'re\' \'partial\' on " + name + " and outputs go to \'working\'")
+
+                        # write over the existing file with your new one
+                        #filename = os.path.join(dirname,name)
+                        break
+
+                    # if we don't find a partial and we're doing partial we must make one
+                    elif 'partial' not in name:
+
+                        # create a name for your output files which are of the partial method
+                        output_filename = os.path.join(str(sitecode) + "_" + str(wateryear) + "_" + "working", sitecode + "_" + str(wateryear) + "_" + "re_partial.csv")
+
+                        print("creating " + name + " to \'backups\'. Running \'re\' \'partial\' on " + name + " and outputs go to \'working\'")
+
+            elif partial == False:
+
+                # if we find a partial and we're not doing partial, we want to skip it
+                for name in filename_list:
+
+                    # if partial is in the name, skip it
+                    if 'partial' in name:
+                        continue
+
+                    else:
+                        output_filename = name
+
+                        # if you already have the re, you want to copy it
+                        shutil.copy(output_filename, os.path.join(str(sitecode) + "_" + str(wateryear) + "_" + "backups",sitecode + "_" + str(wateryear) + "_" + "re.csv"))
+                        print("saved a copy of " + name + " to \'backups\'. Running \'re\' on " + name + " and outputs go to \'working\'")
+
+                        #filename = os.path.join(dirname,name)
+                        break
+
+        elif len(filename_list) == 1:
+
+            if partial==True and 'partial' in filename_list[0]:
+                output_filename = filename_list[0]
+
+                print("saved a copy of " + filename_list[0] + " to \'backups\'. Running \'re\' \'partial\' on " + filename_list[0] + " and outputs go to \'working\'")
+
+                shutil.copy(output_filename, os.path.join(str(sitecode) + "_" + str(wateryear) + "_" + "backups",sitecode + "_" + str(wateryear) + "_" + "re_partial.csv"))
+
+            elif partial== False and 'partial' not in filename_list[0]:
+                output_filename = filename_list[0]
+
+                print("saved a copy of " + filename_list[0] + " to \'backups\'. Running \'re\' on " + filename_list[0] + " and outputs go to \'working\'")
+                shutil.copy(output_filename, os.path.join(str(sitecode) + "_" + str(wateryear) + "_" + "backups",sitecode + "_" + str(wateryear) + "_" + "re.csv"))
+
+    return output_filename
+
+def working_date_type(filename, date_column):
+    """ The format of the dates of a 'first' or 're' file, found from its first row"""
+
+    # check date type by using the first column
+    try:
+        date_type = test_csv_date(filename, date_column)
+
+    except Exception:
+        try:
+            date_type = test_csv_date(filename, 1)
+        except Exception:
+            # raw data of ws3 it's on the 0th column!
+            date_type = test_csv_date(filename, 0)
+
+    if date_type == False:
+        date_type = '%Y-%m-%d %H:%M:%S'
+
+    return date_type
+
+def working_file_columns(rows, method, date_column):
+    """ The columns of the rows of a 'first' or 're' file, as they are read
+
+    **Inputs**
+    :rows: the rows, ex. a csv.reader or a chunk from read_csv_chunks
+    :method: 're', 'first' or 'sparse'
+    :date_column: in which column of the data is the date
+
+    **Returns**
+    :columns: dictionary of lists - 'dates' and 'references' (the date strings of column 1 and of the date column), 'val', 'raw' and 'flag'
+    """
+
+    date_strings = []
+    reference_strings = []
+    data_values = []
+    raw_values = []
+    flag_values = []
+
+    for row in rows:
+
+        # don't bother carrying site code, we'll have it in the function
+        # we know that this file is either a 'first' or a 're' file and therefore the date column is always column 1. Dates are read all at once after the loop.
+        date_strings.append(str(row[1]) if len(row) > 1 else "")
+
+        # just in case, reference column
+        reference_strings.append(str(row[date_column]) if len(row) > date_column else "")
+
+        # in both the first and "re", the data on which the computation is done is in column 3 (4th column). Raw data is always in column 2 (3rd column)
+        try:
+            data_value = round(float(row[3]),3)
+        except Exception:
+            data_value = None
+
+
+        # raw values brought across, but don't do anything with them in times other than the first time, store in column 2 (third column)
+        try:
+            raw_value = round(float(row[2]),3)
+        except Exception:
+            raw_value = None
+
+        if method != "re":
+            # flag values are just assigned as "A" or "M" or "E" in first and sparse modes; we do anything with them; in column 4 (fifth column)
+            flag_value = str(row[4])
+
+        elif method == "re":
+            # flag values are carried across from subsequent runs using re - now in column 5 (6th column) because the new adjustments are in column 4
+            flag_value = str(row[5])
+
+        data_values.append(data_value)
+        raw_values.append(raw_value)
+        flag_values.append(flag_value)
+
+    return {'dates': date_strings, 'references': reference_strings, 'val': data_values, 'raw': raw_values, 'flag': flag_values}
+
+def working_file_series(columns, date_type):
+    """ The Series do_adjustments adjusts, from working_file_columns: values 'raw' and 'val', and codes 'fval' and 'event' (all 'NA' until adjusting)"""
+
+    # the dates from column 1; any that cannot be read there come from the reference column
+    dates, found = parse_column(columns['dates'], date_type)
+
+    if not found.all():
+        not_found = np.flatnonzero(~found)
+        dates[not_found] = parse_dates([columns['references'][x] for x in not_found.tolist()], date_type)
+
+    # a Series of all the values in the inputs - datetime : raw, adjustable, flag, event. Assign 'NA' for events beforehand, update after adjusting
+    return Series.from_rows(dates, values={'raw': columns['raw'], 'val': columns['val']}, codes={'fval': columns['flag'], 'event': ['NA']*len(dates)}, code_labels={'fval': FLAG_LABELS, 'event': EVENT_LABELS})
+
+def working_rows(wd):
+    """ The rows of the adjusted Series that go in the 're' file, as they are written
+
+    A row without an adjustment is only written when its raw value is missing too, and then it is flagged 'M'.
+
+    **Inputs**
+    :wd: the adjusted Series from determine_weights
+
+    **Returns**
+    :copy: a Series with values 'raw', 'val', 'adj' and codes 'flag', 'event'
+    """
+
+    no_adjustment = np.isnan(wd.values['adj_diff'])
+    written = ~no_adjustment | np.isnan(wd.values['raw'])
+
+    flags = np.where(no_adjustment, wd.code_of('fval', 'M'), wd.codes['fval']).astype(np.uint8)
+
+    return Series(wd.minutes[written], values={'raw': wd.values['raw'][written], 'val': wd.values['val'][written], 'adj': round_column(wd.values['adj_diff'][written], 3)}, codes={'flag': (flags[written], wd.labels['fval']), 'event': (wd.codes['event'][written], wd.labels['event'])})
+
+def working_csv_columns(sitecode, copy):
+    """ The columns of the 're' file for write_csv_columns - sitecode, date, raw, val, adjusted, flag, event
+
+    :copy: rows from working_rows
+    """
+
+    return [csv_field(sitecode), csv_date_fields(copy.minutes), csv_number_fields(copy.values['raw']), csv_number_fields(copy.values['val']), csv_number_fields(copy.values['adj'], 3), csv_code_fields(copy.codes['flag'], copy.labels['flag']), csv_code_fields(copy.codes['event'], copy.labels['event'])]
+
+def write_working_copy(output_filename, copy, sitecode, wateryear, partial):
+    """ Writes the binary copy of the 're' file that was just written, so the next 're' and pyflow can load it without parsing
+
+    :output_filename: the 're' csv
+    :copy: the rows of the csv, from working_rows
+    """
+
+    # the csv is what matters; without a binary copy the next run just parses it
+    try:
+        write_working_binary(output_filename, copy, sitecode, wateryear, partial)
+    except (IOError, OSError, ValueError) as exc:
+        print("Could not write a binary copy of " + output_filename + " (" + str(exc) + "). The next run will read the csv.")
+
+def corr_record_name(csv_filename):
+    """ The record of the corrections behind a working csv, ex. GSWS01_2015_working/GSWS01_2015_re.corr.json"""
+    return os.path.splitext(csv_filename)[0] + CORR_RECORD_EXTENSION
+
+def corr_fingerprints(corr_od, corr_dates):
+    """ A fingerprint of each correction, as convert_corr_to_dict built it - if anything in a row of the corr table changes, so does its fingerprint
+
+    **Inputs**
+    :corr_od: CorrTable or dictionary of corrections
+    :corr_dates: the end dates of the corrections to fingerprint
+
+    **Returns**
+    :fingerprints: list of hex strings lined up with corr_dates
+    """
+
+    corr_table = compile_corrections(corr_od)
+
+    return [hashlib.sha1(repr(sorted(corr_table.row(x).items())).encode('utf-8')).hexdigest() for x in corr_table.positions(corr_dates).tolist()]
+
+def write_corr_record(csv_filename, corr_od, corr_dates, observed, index, wateryears=None):
+    """ Records which corrections a working csv was computed from, right after the csv and its binary copy are written
+
+    Besides the fingerprints, the record keeps the first observation each correction was applied to, since which correction an observation gets depends on the observations before it (see assign_corrections).
+
+    **Inputs**
+    :csv_filename: the working csv
+    :corr_od: dictionary of corrections
+    :corr_dates: the corrections that were applied, from relevant_corrections
+    :observed: the observations they were applied to, in minutes
+    :index: the correction of each observation, from assign_corrections
+    :wateryears: the water years adjusted together, when the csv is one year of a range (optional)
+    """
+
+    corr_ends = datetimes_to_minutes(corr_dates)
+
+    # the first observation of each correction; the ones never applied have none
+    firsts = [None]*len(corr_dates)
+    starts = np.flatnonzero(np.concatenate(([True], index[1:] != index[:-1]))) if len(index) > 0 else np.zeros(0, dtype=np.int64)
+
+    for position in starts.tolist():
+        if index[position] < len(corr_dates):
+            firsts[int(index[position])] = int(observed[position])
+
+    csv_stat = os.stat(csv_filename)
+
+    record = {'csv_size': csv_stat.st_size, 'csv_mtime': csv_stat.st_mtime, 'ends': [int(x) for x in corr_ends], 'fingerprints': corr_fingerprints(corr_od, corr_dates), 'firsts': firsts}
+
+    if wateryears != None:
+        record['wateryears'] = [int(x) for x in wateryears]
+
+    # the record only saves time; without it the next run redoes the whole year
+    try:
+        with open(corr_record_name(csv_filename), 'w') as writefile:
+            json.dump(record, writefile)
+    except (IOError, OSError) as exc:
+        print("Could not write the record of corrections for " + csv_filename + " (" + str(exc) + "). The next run will redo the whole year.")
+
+def read_corr_record(csv_filename):
+    """ The record of the corrections behind a working csv, or None if there is none or the csv has changed since it was made"""
+
+    try:
+        with open(corr_record_name(csv_filename), 'r') as readfile:
+            record = json.load(readfile)
+        csv_stat = os.stat(csv_filename)
+    except (IOError, OSError, ValueError):
+        return None
+
+    if record.get('csv_size') != csv_stat.st_size or record.get('csv_mtime') != csv_stat.st_mtime:
+        return None
+
+    return record
+
+@timed('patch_adjustments', rows=lambda x: len(x[0]))
+def patch_adjustments(sitecode, wateryear, filename, corr_od, partial):
+    """ Redoes 're' only over the spans of the corrections that were edited since the working file was made
+
+    This needs the binary copy of the working file and the record of the corrections it was made from, both still matching the csv, and the same correction dates as then. Each observation is adjusted by the correction it falls in alone, so the rows of corrections whose fingerprint is the same, and which still fall in the same correction, come out of a full 're' exactly as they are. Only the rows of the edited corrections are adjusted again, and only their lines of the csv are rewritten.
+
+    **Inputs**
+    :sitecode: ex. GSWS01
+    :wateryear: ex. 2015
+    :filename: the working 're' csv
+    :corr_od: dictionary of corrections
+    :partial: True or False
+
+    **Returns**
+    :wd: Series of the working file after the patch, with values 'raw', 'val', 'adj_diff' and codes 'fval', 'event' - or None when the whole year has to be redone
+    :months: list of (year, month) of the rows that changed, for make_graphs
+    """
+
+    record = read_corr_record(filename)
+
+    if record == None:
+        return None, None
+
+    # a range of water years is adjusted with their corr tables stitched together (see adjust_water_years), so near October 1st it is not what this year's own corr table gives
+    if len(record.get('wateryears', [])) > 1:
+        print(filename + " was made in a run of water years " + str(record['wateryears'][0]) + "-" + str(record['wateryears'][-1]) + ", redoing the whole year with its own corr table")
+        return None, None
+
+    working, header = read_working_binary(filename)
+
+    if working == None or len(working) == 0 or header['partial'] != (partial == True):
+        return None, None
+
+    relevant_corr_dates = relevant_corrections(wateryear, corr_od, working.minutes[0], partial)
+    corr_ends = datetimes_to_minutes(relevant_corr_dates)
+
+    # a correction added or taken away moves which correction the observations fall in
+    if relevant_corr_dates == [] or corr_ends.tolist() != record['ends']:
+        print("The dates in the corr table have changed since " + filename + " was made, redoing the whole year")
+        return None, None
+
+    changed = np.array([x != y for x, y in zip(corr_fingerprints(corr_od, relevant_corr_dates), record['fingerprints'])], dtype=bool)
+
+    observed = working.minutes
+    index, advanced = assign_corrections(corr_ends, observed)
+
+    # the correction each row fell in last time, from the first observation of each correction then
+    applied = np.array([x for x in range(len(corr_ends)) if record['firsts'][x] != None], dtype=np.int64)
+    applied_firsts = np.array([record['firsts'][x] for x in applied.tolist()], dtype=np.int64)
+
+    if len(applied) == 0 or observed[0] < applied_firsts[0]:
+        return None, None
+
+    previous_index = applied[np.searchsorted(applied_firsts, observed, side='right') - 1]
+
+    # once the corrections run out nothing more is written
+    stop = int(np.searchsorted(index, len(corr_ends), side='left'))
+
+    redo = np.zeros(len(observed), dtype=bool)
+    redo[:stop] = changed[index[:stop]] | (previous_index[:stop] != index[:stop])
+
+    events = np.zeros(len(observed), dtype=np.uint8)
+    events[:stop][~advanced[:stop] & (observed[:stop] == corr_ends[index[:stop]])] = working.code_of('event', 'MAINTE')
+
+    # the rows from the first one that changes to the last one, and everything past the end of the corrections
+    touched = np.flatnonzero(redo | (events != working.codes['event']))
+    if stop < len(observed):
+        touched = np.concatenate((touched, np.arange(stop, len(observed))))
+
+    wd = Series(observed, values={'raw': working.values['raw'], 'val': working.values['val'], 'adj_diff': working.values['adj'].copy()}, codes={'fval': (working.codes['flag'].copy(), working.labels['flag']), 'event': (events, working.labels['event'])})
+
+    if len(touched) == 0:
+        print("No corrections have changed since " + filename + " was made")
+        return wd, []
+
+    first = int(touched.min())
+    last = int(touched.max()) + 1
+
+    print("Redoing the adjustments of " + str(int(changed.sum())) + " edited correction(s), rows " + str(first) + " to " + str(last - 1) + " of " + filename)
+
+    shutil.copy(filename, os.path.join(str(sitecode) + "_" + str(wateryear) + "_" + "backups", os.path.basename(filename)))
+
+    rows = np.flatnonzero(redo)
+    wd.values['adj_diff'][rows] = weigh_corrections(corr_ends, correction_columns(corr_od, relevant_corr_dates), index[rows], observed[rows], working.values['val'][rows])['adj_diff']
+
+    # the working file as a full 're' would write it; outside the span it is what is already there
+    wd = wd.take(slice(0, stop))
+    copy = working_rows(wd)
+
+    span = slice(int(np.searchsorted(copy.minutes, observed[first], side='left')), int(np.searchsorted(copy.minutes, observed[last - 1], side='right')))
+
+    if not replace_csv_rows(filename, len(working), first, last, working_csv_columns(sitecode, copy.take(span))):
+        print("The rows of " + filename + " do not match its binary copy, redoing the whole year")
+        return None, None
+
+    write_working_copy(filename, copy, sitecode, wateryear, partial)
+    write_corr_record(filename, corr_od, relevant_corr_dates, wd.minutes, index[:stop])
+
+    # the months the span covers
+    month_number = np.unique(observed[first:last].astype('datetime64[m]').astype('datetime64[M]').astype(np.int64))
+    months = [(x // 12 + 1970, x % 12 + 1) for x in month_number.tolist()]
+
+    return wd, months
+
+def assign_corrections(corr_ends, observed, previous=0):
+    """ Finds which correction interval (by index into corr_ends) is applied to each observation
+
+    The row-by-row walk only stepped forward one correction per observation, so when the data jumps over more than one correction date the intermediate correction is still used for one reading. That behaviour is kept so the adjusted values match what has already been published.
+
+    **Inputs**
+    :corr_ends: sorted numpy array of correction end times, in minutes
+    :observed: sorted numpy array of observation times, in minutes
+    :previous: the correction of the observation before these, when the observations come a chunk at a time (optional; the walk starts on the first correction)
+
+    **Returns**
+    :index: the index of the correction applied to each observation; an index equal to len(corr_ends) means the corrections ran out
+    :advanced: True where the walk stepped to a new correction on that observation
+    """
+
+    # the first correction ending at or after each observation - where the walk is trying to get to
+    ideal = np.searchsorted(corr_ends, observed, side='left')
+
+    # the walk starts on the first correction and can only move one step per observation, so index = min(ideal, previous index + 1)
+    positions = np.arange(len(observed))
+    index = positions + np.minimum(np.minimum.accumulate(ideal - positions), previous + 1)
+
+    advanced = index != np.concatenate(([previous], index[:-1]))
+
+    return index, advanced
+
+def weigh_corrections(corr_ends, corr_columns, index, observed, val):
+    """ The arithmetic of the adjustment: weighs the two ends of the correction each observation falls in
+
+    **Inputs**
+    :corr_ends: sorted numpy array of correction end times, in minutes
+    :corr_columns: dictionary of numpy arrays lined up with corr_ends - 'duration', 'bgn_rat', 'bgn_diff', 'end_rat', 'end_diff' (missing values are nan)
+    :index: the correction of each observation, from assign_corrections - all below len(corr_ends)
+    :observed: numpy array of observation times, in minutes
+    :val: numpy array of the values to adjust (missing values are nan)
+
+    **Returns**
+    :ac: dictionary of numpy arrays - 'adj_diff', 'adj_rat', 'wt_bgn', 'wt_end', 'wt_bgn_ratio', 'wt_end_ratio'
+    """
+
+    duration = corr_columns['duration'][index]
+
+    # the number of minutes left until the end of the interval - for example, if the interval is 9000 minutes long and we are 7000 minutes in, this is 2000
+    time_difference = (corr_ends[index] - observed).astype(float)
+
+    # the number of minutes elapsed from the starting time
+    time_from_start = duration - time_difference
+
+    # let's say we are 8130/9050 minutes into the interval.
+    # the weight of the beginning of the interval would be 1 if we were 0/9050, and 0 if we were 9050 of 9050
+    beginning_weight = (1-(time_from_start/duration))
+
+    # the weight of the end of the interval would be 1 if we were at 9050/9050 and 0 if we are at 0/9050.
+    ending_weight = (time_from_start/duration)
+
+    # the ratio and the difference at each end of the interval carry that end's weight
+    weighted_begin_ratio = corr_columns['bgn_rat'][index]*beginning_weight
+    weighted_begin_diff = corr_columns['bgn_diff'][index]*beginning_weight
+    weighted_end_ratio = corr_columns['end_rat'][index]*ending_weight
+    weighted_end_diff = corr_columns['end_diff'][index]*ending_weight
+
+    ac = {}
+
+    # adjusted by the ratio method
+    ac['adj_rat'] = round_column(weighted_begin_ratio*val + weighted_end_ratio*val, 3)
+
+    # adjusted by difference method
+    # ex, if the beginning is 50% of the weight and the adj is + 3 and the end is 50% of the weight and the adj is -5, then the middle is + 1.5 - 2.5, which is -1, plus whatever the actual value on the cr logger is
+    ac['adj_diff'] = round_column(weighted_begin_diff, 3) + round_column(weighted_end_diff, 3) + val
+
+    ac['wt_bgn'] = round_column(time_difference/duration, 3)
+    ac['wt_end'] = round_column(1-time_difference/duration, 3)
+    ac['wt_bgn_ratio'] = round_column(weighted_begin_ratio, 3)
+    ac['wt_end_ratio'] = round_column(weighted_end_ratio, 3)
+
+    return ac
+
+def adjust_columns(corr_ends, corr_columns, observed, val):
+    """ The adjustment engine: applies the correction table to a whole column of observations at once
+
+    **Inputs**
+    :corr_ends: sorted numpy array of correction end times, in minutes
+    :corr_columns: dictionary of numpy arrays lined up with corr_ends - 'duration', 'bgn_rat', 'bgn_diff', 'end_rat', 'end_diff' (missing values are nan)
+    :observed: sorted numpy array of observation times, in minutes
+    :val: numpy array of the values to adjust (missing values are nan)
+
+    **Returns**
+    :ac: dictionary of numpy arrays - 'adj_diff', 'adj_rat', 'wt_bgn', 'wt_end', 'wt_bgn_ratio', 'wt_end_ratio' and 'event' (True on MAINTE). Once the corrections run out nothing more is adjusted, so these can be shorter than the observations.
+    """
+
+    index, advanced = assign_corrections(corr_ends, observed)
+
+    # once the corrections run out, nothing after that observation is adjusted or written
+    stop = int(np.searchsorted(index, len(corr_ends), side='left'))
+    index = index[:stop]
+    advanced = advanced[:stop]
+    observed = observed[:stop]
+
+    ac = weigh_corrections(corr_ends, corr_columns, index, observed, val[:stop])
+
+    # a correction event is marked when the observation lands exactly on the end of the interval it is already in
+    ac['event'] = ~advanced & (observed == corr_ends[index])
+
+    return ac
+
+def relevant_corrections(wateryear, corr_od, first_minute, partial):
+    """ The end dates of the corrections that apply to a water year of data, in order
+
+    The corr dates prior to the start of the data set can be disregarded except for the one just prior to the start
+
+    **Inputs**
+    :wateryear: ex. 2015
+    :corr_od: the CorrTable from load_corr_table, or the dictionary of corrections from convert_corr_to_dict
+    :first_minute: the first observation, in minutes
+    :partial: True or False
+
+    **Returns**
+    :relevant_corr_dates: sorted list of datetimes, the end dates of the corrections
+    """
+
+    # these are the sorted "ending dates"; in the most recent year the end date is missing so it is not in the table
+    corr_table = compile_corrections(corr_od)
+
+    # filter the correction table to only include things that are indexed on an enddate which is in our water year - nothing after this year.
+    if partial == True:
+
+        first_index_preceding_data = int(np.searchsorted(corr_table.ends, first_minute, side='left')) - 1
+
+        # remove corr dates you don't need to look at if doing a partial year.
+        if first_index_preceding_data >= 0:
+            return corr_table.end_dates(slice(first_index_preceding_data, None))
+
+    # if not processing a partial year, or nothing precedes the data
+    return corr_table.end_dates(slice(int(np.searchsorted(corr_table.ends, datetime_to_minutes(datetime.datetime(wateryear-1, 10,1,0,0)), side='left')), None))
+
+def correction_columns(corr_od, corr_dates):
+    """ The correction table as columns lined up with corr_dates; a missing value (None) becomes nan"""
+
+    corr_table = compile_corrections(corr_od)
+
+    return corr_table.correction_columns(corr_table.positions(corr_dates))
+
+@timed('determine_weights', rows=len)
+def determine_weights(sitecode, wateryear, corr_od, od, partial):
+    """ Determines the adjustment for each given observation and applies it.
 
-                output_filename = os.path.join(str(sitecode) + "_" + str(wateryear) + "_" + "working", sitecode + "_" + str(wateryear) + "_" + "re_partial.csv")
+    :od: Series with 'raw' and 'val' values and 'fval' and 'event' codes, from do_adjustments
 
-                print("Creating " + output_filename + " to \'working\'. Running \'re\' \'partial\'")
+    Returns the Series with the adjustment columns added ('adj_diff', 'adj_rat', 'wt_bgn', 'wt_end', 'wt_bgn_ratio', 'wt_end_ratio') and the events marked; it stops where the corrections run out.
+    """
 
-            elif partial == False:
+    relevant_corr_dates = relevant_corrections(wateryear, corr_od, od.minutes[0], partial)
 
-                output_filename = os.path.join(str(sitecode) + "_" + str(wateryear) + "_" + "working", sitecode + "_" + str(wateryear) + "_" + "re.csv")
+    if relevant_corr_dates == []:
+        raise ValueError("No corrections in the corr table for " + sitecode + " end in water year " + str(wateryear))
 
-                print("Creating " + output_filename + " to \'working\'. Running \'re\'")
+    ac = adjust_columns(datetimes_to_minutes(relevant_corr_dates), correction_columns(corr_od, relevant_corr_dates), od.minutes, od.values['val'])
 
-        # if it's not blank, check for existing file you don't want to over write
-        elif filename_list != []:
+    # working Series - the observations that were adjusted, plus the adjustments
+    wd = od.take(slice(0, len(ac['adj_diff'])))
 
-            if partial == True:
+    for name in ['adj_diff', 'adj_rat', 'wt_bgn', 'wt_end', 'wt_bgn_ratio', 'wt_end_ratio']:
+        wd.set_values(name, ac[name])
 
-                for name in filename_list:
-                    if 'partial' in name:
+    wd.codes['event'][ac['event']] = wd.code_of('event', 'MAINTE')
 
-                        sys.exit("You have a file in the working directory called " + name + ". Please save this file elsewhere and remove it from working before continuing")
-                    else:
-                        output_filename = os.path.join(str(sitecode) + "_" + str(wateryear) + "_" + "working", sitecode + "_" + str(wateryear) + "_" + "re_partial.csv")
+    return wd
 
-            elif partial == False:
+def stream_working_file(filename, method, date_column, chunk_rows):
+    """ The Series do_adjustments adjusts, a chunk of rows at a time, for --stream: from the binary copy of the working file in 're' when it still matches, otherwise from the csv, which has to be in order by date
 
-                for name in filename_list:
-                    if 'partial' not in name:
+    **Returns**
+    :chunks: generator of Series with values 'raw' and 'val' and codes 'fval' and 'event', one after the other in time
+    """
 
-                        sys.exit("You have a file in the working directory called " + name + ". Please save this file elsewhere and remove it from working before continuing")
-                    else:
-                        output_filename = os.path.join(str(sitecode) + "_" + str(wateryear) + "_" + "working", sitecode + "_" + str(wateryear) + "_" + "re.csv")
+    if method == "re":
+        working, header = read_working_binary(filename)
+    else:
+        working = None
 
-            else:
-                possibly_dangerous = ", ".join(filename_list)
+    if working != None:
+        for start in range(0, len(working), chunk_rows):
+            piece = working.take(slice(start, start + chunk_rows))
+            yield Series(piece.minutes, values={'raw': piece.values['raw'], 'val': piece.values['val']}, codes={'fval': (piece.codes['flag'], piece.labels['flag']), 'event': (np.zeros(len(piece), dtype=np.uint8), EVENT_LABELS)})
 
-                sys.exit("You have a files in the working directory called " + possibly_dangerous + ". Please save these files elsewhere and remove them from working before continuing")
+        return
 
-    # if the re adjustmet, check the working directory for the files with your sitecode and wateryear
-    elif method == "re":
+    date_type = working_date_type(filename, date_column)
+    last_minute = None
 
-        dirname = str(sitecode) + "_" + str(wateryear) + "_" + "working"
-        filename_list = find_files(sitecode, wateryear, dirname)
+    for rows in read_csv_chunks(filename, chunk_rows):
 
-        if len(filename_list) > 1:
+        od = following_rows(working_file_series(working_file_columns(rows, method, date_column), date_type), last_minute, filename)
 
-            if partial == True:
+        if len(od) != 0:
+            last_minute = int(od.minutes[-1])
+            yield od
 
-                # if we find a partial and we're doing partial, we want to break out
-                for name in filename_list:
+@timed('stream_adjustments')
+def stream_adjustments(sitecode, wateryear, filename, corr_od, method, partial, date_column, chunk_rows):
+    """ do_adjustments and make_graphs a chunk of rows at a time, for --stream; the working file, its binary copy, the record of corrections and the graphs are the same as theirs
 
-                    # if you have a partial already and you are running partial, you'll want to use it
-                    if 'partial' in name:
+    What carries from one chunk to the next is the correction the last observation fell in (see assign_corrections) and the rows of the month not yet drawn. The working file is written to the side and swapped in at the end, since in 're' it is also the file being read.
 
-                        # you will overwriate the old one -- i.e. you write to "re_partial" and you input from "re_partial"
-                        output_filename = name
+    **Inputs**
+    :filename: the 'first' file, or the working file in 're'
+    :method: 're', 'first' or 'sparse'
+    :chunk_rows: how many rows to read at a time
 
-                        # if you already have the re, you want to copy it
-                        shutil.copy(output_filename, os.path.join(str(sitecode) + "_" + str(wateryear) + "_" + "backups",sitecode + "_" + str(wateryear) + "_" + "re_partial.csv"))
+    **Returns**
+    :output_filename: the working file
+    """
 
-                        print("saved a copy of " + name + " to \'backups\'. Running \'re\' \'partial\' on " + name + " and outputs go to \'working\'")
+    output_filename = working_output_filename(sitecode, wateryear, method, partial)
+    temporary_filename = output_filename + '.tmp'
 
-                        # write over the existing file with your new one
-                        #filename = os.path.join(dirname,name)
-                        break
+    binary_writer = WorkingBinaryWriter(output_filename, sitecode, wateryear, partial)
 
-                    # if we don't find a partial and we're doing partial we must make one
-                    elif 'partial' not in name:
+    relevant_corr_dates = None
+    previous = 0
 
-                        # create a name for your output files which are of the partial method
-                        output_filename = os.path.join(str(sitecode) + "_" + str(wateryear) + "_" + "working", sitecode + "_" + str(wateryear) + "_" + "re_partial.csv")
+    # the first observation of each correction, for the record
+    starts = []
 
-                        print("creating " + name + " to \'backups\'. Running \'re\' \'partial\' on " + name + " and outputs go to \'working\'")
+    # the rows of the months not drawn yet, and the months drawn
+    month_rows = []
+    drawn = []
 
-            elif partial == False:
+    try:
+        with open_csv(temporary_filename) as writefile:
 
-                # if we find a partial and we're not doing partial, we want to skip it
-                for name in filename_list:
+            for od in stream_working_file(filename, method, date_column, chunk_rows):
 
-                    # if partial is in the name, skip it
-                    if 'partial' in name:
-                        continue
+                if relevant_corr_dates == None:
+                    relevant_corr_dates = relevant_corrections(wateryear, corr_od, od.minutes[0], partial)
 
-                    else:
-                        output_filename = name
+                    if relevant_corr_dates == []:
+                        raise ValueError("No corrections in the corr table for " + sitecode + " end in water year " + str(wateryear))
 
-                        # if you already have the re, you want to copy it
-                        shutil.copy(output_filename, os.path.join(str(sitecode) + "_" + str(wateryear) + "_" + "backups",sitecode + "_" + str(wateryear) + "_" + "re.csv"))
-                        print("saved a copy of " + name + " to \'backups\'. Running \'re\' on " + name + " and outputs go to \'working\'")
+                    corr_ends = datetimes_to_minutes(relevant_corr_dates)
+                    corr_columns = correction_columns(corr_od, relevant_corr_dates)
+                    is_start = np.concatenate(([True], np.zeros(len(od) - 1, dtype=bool)))
+                else:
+                    is_start = np.zeros(len(od), dtype=bool)
 
-                        #filename = os.path.join(dirname,name)
-                        break
+                index, advanced = assign_corrections(corr_ends, od.minutes, previous)
 
-        elif len(filename_list) == 1:
+                is_start[1:] = index[1:] != index[:-1]
+                is_start[0] = is_start[0] or index[0] != previous
+                starts.append((od.minutes[is_start], index[is_start]))
+                previous = int(index[-1])
 
-            if partial==True and 'partial' in filename_list[0]:
-                output_filename = filename_list[0]
+                # once the corrections run out, nothing after that observation is adjusted or written
+                stop = int(np.searchsorted(index, len(corr_ends), side='left'))
 
-                print("saved a copy of " + filename_list[0] + " to \'backups\'. Running \'re\' \'partial\' on " + filename_list[0] + " and outputs go to \'working\'")
+                wd = od.take(slice(0, stop))
+                ac = weigh_corrections(corr_ends, corr_columns, index[:stop], wd.minutes, wd.values['val'])
 
-                shutil.copy(output_filename, os.path.join(str(sitecode) + "_" + str(wateryear) + "_" + "backups",sitecode + "_" + str(wateryear) + "_" + "re_partial.csv"))
+                for name in ['adj_diff', 'adj_rat', 'wt_bgn', 'wt_end', 'wt_bgn_ratio', 'wt_end_ratio']:
+                    wd.set_values(name, ac[name])
 
-            elif partial== False and 'partial' not in filename_list[0]:
-                output_filename = filename_list[0]
+                wd.codes['event'][~advanced[:stop] & (wd.minutes == corr_ends[index[:stop]])] = wd.code_of('event', 'MAINTE')
 
-                print("saved a copy of " + filename_list[0] + " to \'backups\'. Running \'re\' on " + filename_list[0] + " and outputs go to \'working\'")
-                shutil.copy(output_filename, os.path.join(str(sitecode) + "_" + str(wateryear) + "_" + "backups",sitecode + "_" + str(wateryear) + "_" + "re.csv"))
+                copy = working_rows(wd)
+                write_csv_columns(writefile, working_csv_columns(sitecode, copy))
+                binary_writer.write(copy)
 
-    # a blank output dictionary structure
-    od = {}
+                # the months before the one of the last row are done, and are drawn
+                if len(wd) != 0:
+                    month_rows.append(Series(wd.minutes, values={'val': wd.values['val'], 'adj_diff': wd.values['adj_diff']}))
+                    drawn.extend(draw_finished_months(sitecode, wateryear, month_rows, int(wd.minutes[-1])))
 
-    # check date type by using the first column
-    try:
-        date_type = test_csv_date(filename, date_column)
+                if stop < len(od):
+                    break
 
     except Exception:
-        try:
-            date_type = test_csv_date(filename, 1)
-        except Exception:
-            # raw data of ws3 it's on the 0th column!
-            date_type = test_csv_date(filename, 0)
+        binary_writer.discard()
 
-    if date_type == False:
-        date_type = '%Y-%m-%d %H:%M:%S'
+        if os.path.isfile(temporary_filename):
+            os.remove(temporary_filename)
+        raise
 
     if sys.version_info >= (3,0):
-        mode = 'r'
+        os.replace(temporary_filename, output_filename)
     else:
-        mode = 'rb'
-
-
-    # open the input file and process
-    with open(filename, mode) as readfile:
-        reader = csv.reader(readfile)
-        for row in reader:
-
-            # don't bother carrying site code, we'll have it in the function
-            # we know that this file is either a 'first' or a 're' file and therefore the date column is always column 1.
-            try:
-                dt = datetime.datetime.strptime(str(row[1]), date_type)
-            except Exception:
-                # just in case, reference column
-                dt = datetime.datetime.strptime(str(row[date_column]), date_type)
-
-            # in both the first and "re", the data on which the computation is done is in column 3 (4th column). Raw data is always in column 2 (3rd column)
-            try:
-                data_value = round(float(row[3]),3)
-            except Exception:
-                data_value = None
+        if os.path.isfile(output_filename):
+            os.remove(output_filename)
+        os.rename(temporary_filename, output_filename)
 
+    # the csv is what matters; without a binary copy the next run just parses it
+    try:
+        binary_writer.close()
+    except (IOError, OSError, ValueError) as exc:
+        print("Could not write a binary copy of " + output_filename + " (" + str(exc) + "). The next run will read the csv.")
 
-            # raw values brought across, but don't do anything with them in times other than the first time, store in column 2 (third column)
-            try:
-                raw_value = round(float(row[2]),3)
-            except Exception:
-                raw_value = None
+    if relevant_corr_dates != None:
+        write_corr_record(output_filename, corr_od, relevant_corr_dates, np.concatenate([x[0] for x in starts]), np.concatenate([x[1] for x in starts]))
 
-            if method != "re":
-                # flag values are just assigned as "A" or "M" or "E" in first and sparse modes; we do anything with them; in column 4 (fifth column)
-                flag_value = str(row[4])
+    # the rest of the last month, and any month without rows, which gets the empty graph make_graphs would give it
+    drawn.extend(draw_finished_months(sitecode, wateryear, month_rows, None))
+    months_left = [x for x in water_year_months(wateryear) if x not in drawn]
 
-            elif method == "re":
-                # flag values are carried across from subsequent runs using re - now in column 5 (6th column) because the new adjustments are in column 4
-                flag_value = str(row[5])
+    if months_left != []:
+        make_graphs(sitecode, wateryear, Series(np.zeros(0, dtype=np.int64), values={'val': [], 'adj_diff': []}), months_left, missing=False)
 
-            # generate a dictionary of all the values in the inputs - datetime : raw, adjustable, flag, event
-            if dt not in od:
-                # assign 'NA' for events beforehand, update after adjusting
-                od[dt] = {'raw' : raw_value, 'val': data_value, 'fval': flag_value, 'event':'NA'}
+    return output_filename
 
-            elif dt in od:
-                pass
+def water_year_bounds(wateryear):
+    """ The first and last minute of the rows of one water year's files, the start of October 1st of the year before and of October 1st - both are in the file, so two consecutive years share a row"""
+    return datetime_to_minutes(datetime.datetime(wateryear-1, 10, 1, 0, 0)), datetime_to_minutes(datetime.datetime(wateryear, 10, 1, 0, 0))
 
-        # the key function is "determine weights" -- this is where the adjustment happens
-        wd = determine_weights(sitecode, wateryear, corr_od, od, partial)
+def stitch_water_years(pieces):
+    """ One Series from the Series of consecutive water years. Each piece only adds the rows after the last row of the pieces before it, so where they overlap the earlier year's file wins, like a repeated date in Series.from_rows.
 
-    # setting mode to be python 3 friendly
-    if sys.version_info >=(3,0):
-        mode = 'w'
-    else:
-        mode = 'wb'
+    :pieces: list of Series with the same columns, in order of water year
+    """
 
-    # the difference method does resolve correctly, as far as I can see from testing on ws1 alone
-    with open(output_filename, mode) as writefile:
-        writer = csv.writer(writefile, delimiter = ",", quoting=csv.QUOTE_NONNUMERIC)
+    kept = []
+    last_minute = None
 
-        valid_dates = sorted(list(wd.keys()))
+    for each_piece in pieces:
 
-        for each_date in valid_dates:
+        if last_minute != None:
+            each_piece = each_piece.take(slice(int(np.searchsorted(each_piece.minutes, last_minute, side='right')), None))
 
-            try:
-                writer.writerow([sitecode, datetime.datetime.strftime(each_date, '%Y-%m-%d %H:%M:%S'), wd[each_date]['raw'], wd[each_date]['val'], round(wd[each_date]['adj_diff'],3), wd[each_date]['fval'], wd[each_date]['event']])
+        if len(each_piece) == 0:
+            continue
 
-            except Exception:
-                if wd[each_date]['raw'] == None:
-                    writer.writerow([sitecode, datetime.datetime.strftime(each_date, '%Y-%m-%d %H:%M:%S'), wd[each_date]['raw'], wd[each_date]['val'], None, 'M', wd[each_date]['event']])
+        kept.append(each_piece)
+        last_minute = int(each_piece.minutes[-1])
 
-        # add on one extra date stamp to buffer the output. Make the event 'NA'
-        #last_date = valid_dates[-1] + datetime.timedelta(minutes = 5)
-        #writer.writerow([sitecode, datetime.datetime.strftime(last_date, '%Y-%m-%d %H:%M:%S'), wd[valid_dates[-1]]['raw'], wd[valid_dates[-1]]['val'], round(wd[valid_dates[-1]]['adj_diff'],3), wd[valid_dates[-1]]['fval'], 'NA'])
+    return Series.concatenate(kept)
 
-    return wd, output_filename
+def water_year_slices(minutes, wateryears):
+    """ The rows of each of consecutive water years in a sorted array of minutes, see water_year_bounds. The first year also gets any rows before it, and the last any rows after it.
 
-def determine_weights(sitecode, wateryear, corr_od, od, partial):
-    """ Determines the adjustment for each given observation and applies it.
+    **Returns**
+    :slices: list of slices, lined up with wateryears
+    """
 
-    The corr dates prior to the start of the data set can be disregarded except for the one just prior to the start
+    slices = []
 
-    """
+    for position, wateryear in enumerate(wateryears):
+        first_minute, last_minute = water_year_bounds(wateryear)
 
-    # these are the sorted "ending dates"
-    try:
-        corr_dates_as_list = sorted(list(corr_od.keys()))
+        if position == 0:
+            start = 0
+        else:
+            start = int(np.searchsorted(minutes, first_minute, side='left'))
 
-    except Exception:
-        # in the most recent year the end date is missing so we need to not use that one, it is "None"
-        corr_dates_1 = [x for x in corr_od.keys() if x != None]
-        corr_dates_as_list = sorted(list(corr_dates_1))
+        if position == len(wateryears) - 1:
+            stop = len(minutes)
+        else:
+            stop = int(np.searchsorted(minutes, last_minute, side='right'))
 
-    # generate a list of observed dates
-    observed_dates_as_list = sorted(list(od.keys()))
+        slices.append(slice(start, stop))
 
-    # filter the correction table to only include things that are indexed on an enddate which is in our water year - nothing after this year.
+    return slices
 
-    if partial == True:
+def range_input_file(sitecode, wateryear, subfolder, method):
+    """ The one raw data file (or in 're', the one 're' file) of a water year in a range. Nobody is asked to pick one for each year of a range, so with none or with several the run stops before anything is written."""
 
-        first_index_preceding_data = [index for index,x in enumerate(corr_dates_as_list) if x>=min(od.keys())][0] - 1
+    filename_list = find_files(sitecode, wateryear, subfolder)
 
-        # remove corr dates you don't need to look at if doing a partial year.
-        if first_index_preceding_data >= 0:
-            relevant_corr_dates = corr_dates_as_list[first_index_preceding_data:]
-        else:
-            relevant_corr_dates = [x for x in corr_dates_as_list if x >= datetime.datetime(wateryear-1, 10,1,0,0)]
+    if method == "re":
+        filename_list = [x for x in filename_list if 'partial' not in x]
 
-    else:
-        # if not processing a partial year.
-        relevant_corr_dates = [x for x in corr_dates_as_list if x >= datetime.datetime(wateryear-1, 10,1,0,0)]
+    if len(filename_list) != 1:
+        sys.exit("Running a range of water years needs exactly one file for each year in \'" + subfolder + "\', and there are " + str(len(filename_list)) + " for " + sitecode + " " + str(wateryear) + (" -- " + ", ".join(filename_list) if filename_list != [] else "") + ". Try cleaning the directory or running that year on its own.")
 
-    # working dictionary
-    wd = {}
+    print("File found for the " + method + " method : " + filename_list[0])
 
-    # we'll use the same "correction" until we pass that time, at which point, we'll move to the next correction factor, by calling the iterator.next() method
-    # by indexing on the final date we don't have to worry that we'll run over the boundary of the iterator
-    iterator_for_correction = iter(relevant_corr_dates)
+    return filename_list[0]
 
-    # the first correction to be applied - first date-time in your list
-    if sys.version_info >=(3,0):
-        this_correction = next(iterator_for_correction)
-    else:
-        this_correction = iterator_for_correction.next()
+@timed('generate_water_years')
+def generate_water_years(sitecode, wateryears, sparse):
+    """ parameterize_first and generate_first for consecutive water years at once
 
-    for each_date in observed_dates_as_list:
+    The raw data of every year is stitched into one record, so a gap going over October 1st is filled from the readings on both sides of it, and then split into the 'first' file of each year.
 
-        # as long as the date is less than the correction factor or equal to it
-        if each_date <= this_correction:
+    **Inputs**
+    :sitecode: ex. GSWS01
+    :wateryears: ex. [2010, 2011, 2012]
+    :sparse: True or False
 
-            # the number of minutes left until the end of the interval, in minutes - for example, if the interval is 9000 minutes long and we are 7000 minutes in, this is 2000
-            time_difference = float((this_correction-each_date).days*1440 + (this_correction - each_date).seconds//60)
+    **Returns**
+    :output_filenames: the 'first' file of each water year
+    :date_columns: the column of the dates in the raw data of each water year
+    """
 
-            # the number of minutes elapsed from the starting time
-            time_from_start = corr_od[this_correction]['duration'] - time_difference
+    pieces = []
+    date_columns = []
 
-            # let's say we are 8130/9050 minutes into the interval.
-            # the weight of the beginning of the interval would be 1 if we were 0/9050, and 0 if we were 9050 of 9050
-            # as it stands, the weight of the beginning is (1 - (minutes_in/total_minutes))
-            beginning_weight = (1-(time_from_start/corr_od[this_correction]['duration']))
+    for wateryear in wateryears:
+        filename = range_input_file(sitecode, wateryear, 'raw_data', "sparse" if sparse else "first")
 
-            # for the end, the weight of the end of the interval would be 1 if we were at 9050/9050 and 0 if we are at 0/9050.
-            # as it stands, the weight of the end is (minutes_in/total_minutes)
-            # in this case, that is 0.89
-            ending_weight = (time_from_start/corr_od[this_correction]['duration'])
+        # the 'first' files in the root are about to be written over
+        for each_file in find_root_files(sitecode, wateryear):
+            print("There is a file in your root that contains the string \'first\', " + each_file + ". For your safety, I am copying it to your \'backups\' directory.")
+            shutil.copy(each_file, os.path.join(str(sitecode) + "_" + str(wateryear) + "_" + "backups", each_file))
 
-            # in this case, that is 1-0.89 = 0.11
-            # the ratio at the beginning ('bgn_rat') carries a 0.11 weight.
-            weighted_begin_ratio = corr_od[this_correction]['bgn_rat']*beginning_weight
+        od, date_column = parameterize_first(sitecode, wateryear, filename)
+        pieces.append(od)
+        date_columns.append(date_column)
 
-            # if we use the diff method, we need that the weight of the beginning of the interval has an offset of 1 of its own weight and 0 of the ends weight - for example a value of 0.211 should go up to .214 with the largest offset as represented by the beginning
-            weighted_begin_diff = corr_od[this_correction]['bgn_diff']*beginning_weight
+    od = stitch_water_years(pieces)
 
-            # the ratio at the end ('end_rat') carries a 0.89 weight
-            weighted_end_ratio = corr_od[this_correction]['end_rat']*ending_weight
+    print("The first day and time in your raw data is " + datetime.datetime.strftime(od.first_date(), '%Y-%m-%d %H:%M:%S'))
+    print("The final day and time in your raw data is " + datetime.datetime.strftime(od.last_date(), '%Y-%m-%d %H:%M:%S'))
 
-            # if we use the end method, then the adjustment at the end time should be the whole weight of that adjustment and should peak at the exact time that the time from start is = the duration
-            weighted_end_diff = corr_od[this_correction]['end_diff']*ending_weight
+    if sparse == False:
+        # perfect water years at 5 minute intervals, ending on 10-01 of the last one
+        rows = fill_gaps(od, water_year_bounds(wateryears[0])[0], datetime_to_minutes(datetime.datetime(wateryears[-1], 10, 1, 0, 5)))
+    else:
+        rows = od
 
-            # now we will take the weighted beginning ratio and multiply the value by it, and add that to the weighted ending ratio, also multiplied by the value, to generate the adjustment.
-            try:
-                adjusted_value_rat = round(weighted_begin_ratio*od[each_date]['val'] + weighted_end_ratio*od[each_date]['val'],3)
+    output_filenames = []
 
-            except Exception:
-                adjusted_value_rat = None
+    for wateryear, selection in zip(wateryears, water_year_slices(rows.minutes, wateryears)):
+        output_filename = sitecode + "_" + str(wateryear) + "_" + "first.csv"
 
-            try:
-                # adjusted by difference method
-                # ex, if the beginning is 50% of the weight and the adj is + 3 and the end is 50% of the weight and the adj is -5, then the middle is + 1.5 - 2.5, which is -1, plus whatever the actual value on the cr logger is
-                adjusted_value_diff = round(weighted_begin_diff, 3) + round(weighted_end_diff,3) + od[each_date]['val']
+        with open_csv(output_filename) as writefile:
+            write_first_rows(writefile, sitecode, rows.take(selection), sparse)
 
-            except Exception:
-                adjusted_value_diff= None
+        output_filenames.append(output_filename)
 
-            # try:
-            #     print "ratio adjusted: " + str(adjusted_value_rat) + " | diff adjusted: " + str(adjusted_value_diff) + " | cr value: " + str(od[each_date]['val']) + " | correction ends: " + datetime.datetime.strftime(each_date, '%Y-%m-%d %H:%M:%S')
+    return output_filenames, date_columns
 
-            # except Exception:
-            #     pass
+@timed('adjust_water_years', rows=lambda x: len(x[0]))
+def adjust_water_years(sitecode, wateryears, filenames, corr_od, method, date_columns, output_filenames):
+    """ do_adjustments for consecutive water years in one pass
 
+    The 'first' or 're' files of the years are stitched together and adjusted with the stitched corr table (see load_corr_tables), so a correction going over October 1st is weighed over its whole length the same way in both years. The result is split into the 're' file of each year, each with its binary copy and its record of corrections, so the next 're' of one year on its own picks up from there.
 
-            # if the date incoming is not the same as the correction date, the event is a nonevent.
-            if each_date != this_correction:
-                event = 'NA'
-            # if the date incoming is a correction event, mark it
-            else:
-                event = "MAINTE"
+    **Inputs**
+    :filenames: the 'first' or 're' file of each water year
+    :corr_od: the CorrTable from load_corr_tables
+    :method: 'first', 'sparse' or 're'
+    :date_columns: in which column of each file is the date
+    :output_filenames: the 're' file of each water year, from working_output_filename
 
-        # if the event is more than the correction date, we need to move to the next correction factor.
-        elif each_date > this_correction:
+    **Returns**
+    :wd: the adjusted Series of all the years, for the graphs
+    :output_filenames: the 're' files written
+    """
 
+    od = stitch_water_years([read_working_file(x, method, y) for x, y in zip(filenames, date_columns)])
 
-            # assign the event
-            event = 'NA'
+    wd = determine_weights(sitecode, wateryears[0], corr_od, od, False)
 
-            if sys.version_info >= (3,0):
-                try:
-                    this_correction = next(iterator_for_correction)
-                except StopIteration:
-                    return wd
-            else:
-                # step to the next correction factor
-                try:
-                    this_correction = iterator_for_correction.next()
-                except StopIteration:
-                    return wd
+    written = []
 
-            # you still need to compute this value here! because the correction has moved on it should fall into the less than pool on the next loop
+    for wateryear, output_filename, adjusted, observed in zip(wateryears, output_filenames, water_year_slices(wd.minutes, wateryears), water_year_slices(od.minutes, wateryears)):
 
-            # the number of minutes left until the end of the interval, in minutes - for example, if the interval is 9000 minutes long and we are 7000 minutes in, this is 2000
-            time_difference = float((this_correction-each_date).days*1440 + (this_correction - each_date).seconds//60)
+        if adjusted.stop <= adjusted.start:
+            print("No corrections in the corr tables reach water year " + str(wateryear) + ", so " + output_filename + " was not written")
+            continue
 
-            # the number of minutes elapsed from the starting time
-            time_from_start = corr_od[this_correction]['duration'] - time_difference
+        write_working_file(output_filename, wd.take(adjusted), od.minutes[observed], sitecode, wateryear, corr_od, False, wateryears)
+        written.append(output_filename)
 
-            # let's say we are 8130/9050 minutes into the interval.
-            # the weight of the beginning of the interval would be 1 if we were 0/9050, and 0 if we were 9050 of 9050
-            # as it stands, the weight of the beginning is (1 - (minutes_in/total_minutes))
-            beginning_weight = (1-(time_from_start/corr_od[this_correction]['duration']))
+    return wd, written
 
-            # for the end, the weight of the end of the interval would be 1 if we were at 9050/9050 and 0 if we are at 0/9050.
-            # as it stands, the weight of the end is (minutes_in/total_minutes)
-            # in this case, that is 0.89
-            ending_weight = (time_from_start/corr_od[this_correction]['duration'])
+def water_year_months(wateryear):
+    """ The (year, month) of each month of a water year, October to September"""
+    return [(wateryear - 1, x) for x in [10, 11, 12]] + [(wateryear, x) for x in range(1, 10)]
 
-            # in this case, that is 1-0.89 = 0.11
-            # the ratio at the beginning ('bgn_rat') carries a 0.11 weight.
-            weighted_begin_ratio = corr_od[this_correction]['bgn_rat']*beginning_weight
+def draw_finished_months(sitecode, wateryear, month_rows, last_minute):
+    """ Draws the graphs of the months before the month of last_minute from the rows kept for them, and keeps the rest
 
-            # if we use the diff method, we need that the weight of the beginning of the interval has an offset of 1 of its own weight and 0 of the ends weight - for example a value of 0.211 should go up to .214 with the largest offset as represented by the beginning
-            weighted_begin_diff = corr_od[this_correction]['bgn_diff']*beginning_weight
+    :month_rows: list of Series with the values 'val' and 'adj_diff', one after the other in time; it is left holding the rows not drawn
+    :last_minute: the last row so far, or None when there are no more rows and every month is done
 
-            # the ratio at the end ('end_rat') carries a 0.89 weight
-            weighted_end_ratio = corr_od[this_correction]['end_rat']*ending_weight
+    Returns the list of (year, month) drawn.
+    """
 
-            # if we use the end method, then the adjustment at the end time should be the whole weight of that adjustment and should peak at the exact time that the time from start is = the duration
-            weighted_end_diff = corr_od[this_correction]['end_diff']*ending_weight
+    if month_rows == []:
+        return []
 
-            # now we will take the weighted beginning ratio and multiply the value by it, and add that to the weighted ending ratio, also multiplied by the value, to generate the adjustment.
-            try:
-                adjusted_value_rat = round(weighted_begin_ratio*od[each_date]['val'] + weighted_end_ratio*od[each_date]['val'],3)
-            except Exception:
-                adjusted_value_rat = None
+    if last_minute != None:
+        last_date = minutes_to_datetime(last_minute)
+        month_start = datetime_to_minutes(datetime.datetime(last_date.year, last_date.month, 1))
 
-            try:
-                # adjusted by difference method
-                # ex, if the beginning is 50% of the weight and the adj is + 3 and the end is 50% of the weight and the adj is -5, then the middle is + 1.5 - 2.5, which is -1, plus whatever the actual value on the cr logger is
-                adjusted_value_diff = round(weighted_begin_diff, 3) + round(weighted_end_diff,3) + od[each_date]['val']
-            except Exception:
-                adjusted_value_diff = None
+        # nothing done yet
+        if month_rows[0].minutes[0] >= month_start:
+            return []
+    else:
+        month_start = None
 
-            # try:
-            #     print "ratio adjusted: " + str(adjusted_value_rat) + " | diff adjusted: " + str(adjusted_value_diff) + " | cr value: " + str(od[each_date]['val']) + " | correction ends: " + datetime.datetime.strftime(each_date, '%Y-%m-%d %H:%M:%S')
+    rows = Series.concatenate(month_rows)
 
-            # except Exception:
-            #     adjusted_value_di = None
+    if month_start == None:
+        split = len(rows)
+    else:
+        split = int(np.searchsorted(rows.minutes, month_start, side='left'))
 
-        # if we aren't writing it out already
-        if each_date not in wd:
+    done = rows.take(slice(0, split))
+    del month_rows[:]
 
-            wd[each_date] = {'val': od[each_date]['val'], 'adj_diff': adjusted_value_diff, 'adj_rat': adjusted_value_rat, 'wt_bgn': round(time_difference/corr_od[this_correction]['duration'],3), 'wt_end': round((1-time_difference/corr_od[this_correction]['duration']),3), 'wt_bgn_ratio': round(weighted_begin_ratio,3), 'wt_end_ratio': round(weighted_end_ratio,3), 'raw' : od[each_date]['raw'], 'fval': od[each_date]['fval'], 'event': event}
+    if split < len(rows):
+        month_rows.append(rows.take(slice(split, None)))
 
-        elif each_date in wd:
-            print("this date has already been put in")
+    month_number = np.unique(done.minutes.astype('datetime64[m]').astype('datetime64[M]').astype(np.int64))
+    months = [x for x in [(y // 12 + 1970, y % 12 + 1) for y in month_number.tolist()] if x in water_year_months(wateryear)]
 
-    return wd
+    if months != []:
+        make_graphs(sitecode, wateryear, done, months, missing=False)
 
+    return months
 
 def test_csv_date(filename, date_column):
     """ figure out what date format to use """
@@ -1042,95 +2070,246 @@ def test_csv_structure(filename):
         else:
             continue
 
-def make_graphs(sitecode, wateryear, adjusted_dictionary):
-    """ make the graphs as you did before"""
+def decimate_minmax(minutes, values, buckets):
+    """ Thins a line to what can be seen of it: the time is cut into equal buckets and only the first, lowest, highest and last value of each is kept
+
+    A spike or the notch of a MAINTE is kept because it is the lowest or highest value of its bucket, and a step between buckets is kept by the last value of one and the first of the next.
+
+    **Inputs**
+    :minutes: sorted numpy array of times, in minutes
+    :values: numpy array of values, without nan
+    :buckets: how many buckets, ex. 500; None keeps everything
+
+    **Returns**
+    :minutes: the times kept, in order
+    :values: the values kept
+    """
+
+    if buckets == None or len(minutes) <= 4*buckets:
+        return minutes, values
+
+    # which bucket each reading is in
+    bucket = (minutes - minutes[0])*buckets // (minutes[-1] - minutes[0] + 1)
+
+    starts = np.flatnonzero(np.concatenate(([True], bucket[1:] != bucket[:-1])))
+    bucket_index = np.cumsum(np.concatenate(([False], bucket[1:] != bucket[:-1])))
+
+    keep = [starts, np.concatenate((starts[1:], [len(minutes)])) - 1]
+
+    # the first reading in each bucket that is its lowest, and its highest
+    for extreme in [np.minimum.reduceat(values, starts), np.maximum.reduceat(values, starts)]:
+        found = np.flatnonzero(values == extreme[bucket_index])
+        keep.append(found[np.unique(bucket_index[found], return_index=True)[1]])
+
+    keep = np.unique(np.concatenate(keep))
+
+    return minutes[keep], values[keep]
+
+def graph_modules():
+    """ The parts of matplotlib the graphs are drawn with. matplotlib takes longer to load than everything else weir3k needs, so it is loaded the first time a graph is drawn rather than when weir3k starts.
+
+    **Returns**
+    :Figure: matplotlib.figure.Figure
+    :FigureCanvasAgg: the canvas that draws without a display
+    :mdates: matplotlib.dates
+    """
+
+    import matplotlib.dates as mdates
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    return Figure, FigureCanvasAgg, mdates
+
+def draw_month(task):
+    """ Draws and saves the graph of one month, on its own figure, so the months can be drawn by separate processes
+
+    :task: (image filename, minutes of the prior values, prior values, minutes of the adjusted values, adjusted values, buckets for decimate_minmax)
+    """
+
+    name1, prior_minutes, prior_values, adjusted_minutes, adjusted_values, buckets = task
+
+    prior_minutes, prior_values = decimate_minmax(prior_minutes, prior_values, buckets)
+    adjusted_minutes, adjusted_values = decimate_minmax(adjusted_minutes, adjusted_values, buckets)
+
+    Figure, FigureCanvasAgg, mdates = graph_modules()
+
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    fig.autofmt_xdate()
+    ax.fmt_xdata = mdates.DateFormatter('%Y-%m')
+    # a line with no values is drawn from empty lists, as it always was; empty dates would give the axis date ticks that a month with no data never had
+    for line_minutes, line_values, style in [(prior_minutes, prior_values, {'color': 'blue', 'linewidth': 1.2, 'alpha': 0.5, 'label': 'corrected cr logger'}), (adjusted_minutes, adjusted_values, {'color': 'red', 'linewidth': 0.7, 'label': 'adjusted to hg'})]:
+        if len(line_minutes) == 0:
+            ax.plot([], [], **style)
+        else:
+            ax.plot(line_minutes.astype('datetime64[m]'), line_values, **style)
+    #ax.legend(loc = 1)
+    fig.savefig(name1)
+
+    #html = mpld3.fig_to_html(fig)
+    #mpld3.save_html(fig, name2)
+
+    return name1
+
+def graph_hash(task):
+    """ The hash of what a month's graph is drawn from - if it is the same as last time, the image already on disk is this graph"""
+
+    digest = hashlib.sha1((GRAPH_STYLE + " " + str(task[5])).encode('ascii'))
+
+    for column in task[1:5]:
+        digest.update(np.ascontiguousarray(column).tobytes())
+
+    return digest.hexdigest()
+
+def graph_workers():
+    """ The number of processes the month graphs are drawn with, from GRAPH_WORKERS_ENVIRONMENT or the number of cpus"""
+
+    try:
+        return max(1, int(os.environ[GRAPH_WORKERS_ENVIRONMENT]))
+    except (KeyError, ValueError):
+        return multiprocessing.cpu_count()
+
+def graph_buckets():
+    """ The number of buckets the lines of the graphs are thinned to, from GRAPH_BUCKETS_ENVIRONMENT, or None to draw every reading"""
+
+    try:
+        return max(1, int(os.environ[GRAPH_BUCKETS_ENVIRONMENT]))
+    except (KeyError, ValueError):
+        return None
+
+@timed('make_graphs')
+def make_graphs(sitecode, wateryear, adjusted_dictionary, months=None, buckets=None, missing=True):
+    """ make the graphs as you did before
+
+    A month whose values are the same as when its image was drawn is not drawn again; the rest are drawn side by side in a pool of processes.
+
+    :adjusted_dictionary: the adjusted Series from do_adjustments
+    :months: only redraw these, a list of (year, month) - optional, all twelve by default. A month without an image is always drawn.
+    :buckets: how finely the lines are thinned, see decimate_minmax - optional, from GRAPH_BUCKETS_ENVIRONMENT by default
+    :missing: False to leave the months not in months alone even without an image, when adjusted_dictionary only holds the rows of those months - optional
+    """
+
+    if buckets == None:
+        buckets = graph_buckets()
 
     # directory of images; path to images with a slash in case
     dir_images = str(sitecode) + "_" + str(wateryear) + "_" + "images"
+    hashes_filename = os.path.join(dir_images, GRAPH_HASHES_FILENAME)
 
-    # no sense in sorting this a million times
-    sorted_dates = sorted(adjusted_dictionary.keys())
+    # the hashes of the images already drawn
+    try:
+        with open(hashes_filename, 'r') as readfile:
+            hashes = json.load(readfile)
+    except (IOError, OSError, ValueError):
+        hashes = {}
+
+    minutes = adjusted_dictionary.minutes
+    prior = adjusted_dictionary.values['val']
+    adjusted = adjusted_dictionary.values['adj_diff']
 
     if sys.version_info >= (3,0):
         param_set = range(1,13)
     else:
         param_set = xrange(1,13)
 
+    tasks = []
+    task_hashes = {}
+
     for each_month in param_set:
 
-        # generate graphs for months with the wateryear as the year (vs. those year before)
+        # generate graphs for months with the wateryear as the year, and for the year before for october - december (ie wy 2014 these have year 2013)
         if each_month not in [10, 11, 12]:
-            dates = [x for x in sorted_dates if x.month == each_month and x.year==wateryear]
+            this_year = wateryear
+        else:
+            this_year = wateryear - 1
 
-            prior_values = [adjusted_dictionary[x]['val'] for x in dates if adjusted_dictionary[x]['val'] != None]
-            pvd = [x for x in dates if adjusted_dictionary[x]['val'] != None]
+        # image name for png
+        image_name = str(this_year) + "_" + str(each_month) + "_wy_" + sitecode + ".png"
+        name1 = os.path.join(dir_images, image_name)
 
-            adjusted_values = [adjusted_dictionary[x]['adj_diff'] for x in dates if adjusted_dictionary[x]['adj_diff'] != None]
-            avd = [x for x in dates if adjusted_dictionary[x]['adj_diff'] != None]
+        # image name for html
+        #html_image_name = str(this_year) + "_" + str(each_month) + "_wy_" + sitecode + ".html"
+        #name2 = os.path.join(dir_images, html_image_name)
 
-            # image name for png
-            image_name = str(wateryear) + "_" + str(each_month) + "_wy_" + sitecode + ".png"
-            name1 = os.path.join(dir_images, image_name)
+        if months != None and (this_year, each_month) not in months and (os.path.isfile(name1) or missing == False):
+            continue
+
+        # the minutes are sorted, so the month is the rows between the start of it and the start of the next
+        if each_month == 12:
+            month_after = datetime.datetime(this_year + 1, 1, 1)
+        else:
+            month_after = datetime.datetime(this_year, each_month + 1, 1)
+
+        first = int(np.searchsorted(minutes, datetime_to_minutes(datetime.datetime(this_year, each_month, 1)), side='left'))
+        last = int(np.searchsorted(minutes, datetime_to_minutes(month_after), side='left'))
 
-            # image name for html
-            #html_image_name = str(wateryear) + "_" + str(each_month) + "_wy_" + sitecode + ".html"
-            #name2 = os.path.join(dir_images, html_image_name)
+        month_minutes = minutes[first:last]
+        prior_rows = ~np.isnan(prior[first:last])
+        adjusted_rows = ~np.isnan(adjusted[first:last])
 
-            fig, ax = plt.subplots()
-            fig.autofmt_xdate()
-            ax.fmt_xdata = mdates.DateFormatter('%Y-%m')
-            ax.plot(pvd, prior_values, color = 'blue', linewidth= 1.2, alpha = 0.5, label = 'corrected cr logger')
-            ax.plot(avd, adjusted_values, color = 'red', linewidth= 0.7, label = 'adjusted to hg')
-            #ax.legend(loc = 1)
-            plt.savefig(name1)
+        task = (name1, month_minutes[prior_rows], prior[first:last][prior_rows], month_minutes[adjusted_rows], adjusted[first:last][adjusted_rows], buckets)
 
-            #html = mpld3.fig_to_html(fig)
-            #mpld3.save_html(fig, name2)
+        task_hash = graph_hash(task)
 
-            plt.close()
+        if hashes.get(image_name) == task_hash and os.path.isfile(name1):
+            continue
+
+        tasks.append(task)
+        task_hashes[image_name] = task_hash
 
-        # generate graphs for the year before (ie wy 2014 these have year 2013)
-        elif each_month in [10,11,12]:
-            dates = [x for x in sorted_dates if x.month == each_month and x.year == (wateryear -1)]
-            prior_values = [adjusted_dictionary[x]['val'] for x in dates if adjusted_dictionary[x]['val'] != None]
-            pvd = [x for x in dates if adjusted_dictionary[x]['val'] != None]
+    if tasks == []:
+        return
 
-            adjusted_values = [adjusted_dictionary[x]['adj_diff'] for x in dates if adjusted_dictionary[x]['adj_diff'] != None]
-            avd = [x for x in dates if adjusted_dictionary[x]['adj_diff'] != None]
+    workers = min(graph_workers(), len(tasks))
 
-            image_name = str(wateryear-1) + "_" + str(each_month) + "_wy_" + sitecode + ".png"
-            name1 = os.path.join(dir_images, image_name)
+    # loaded before the pool starts, so that on systems that fork, the workers have it already and do not each load it again
+    graph_modules()
 
-            #html_image_name = str(wateryear-1) + "_" + str(each_month) + "_wy_" + sitecode + ".html"
-            #name2 = os.path.join(dir_images, html_image_name)
+    if workers > 1:
+        pool = multiprocessing.Pool(processes=workers)
+
+        try:
+            pool.map(draw_month, tasks)
+        finally:
+            pool.close()
+            pool.join()
 
-            fig, ax = plt.subplots()
-            fig.autofmt_xdate()
-            ax.fmt_xdata = mdates.DateFormatter('%Y-%m')
-            ax.plot(pvd, prior_values, color = 'blue', linewidth= 1.2, alpha = 0.5, label = 'corrected cr logger')
-            ax.plot(avd, adjusted_values, color = 'red', linewidth= 0.7, label = 'adjusted to hg')
-            #ax.legend(loc = 1)
-            plt.savefig(name1)
+    else:
+        for each_task in tasks:
+            draw_month(each_task)
 
-            #html = mpld3.fig_to_html(fig)
-            #mpld3.save_html(fig, name2)
+    # only once the images are on disk
+    hashes.update(task_hashes)
 
-            plt.close()
+    with open(hashes_filename, 'w') as writefile:
+        json.dump(hashes, writefile, sort_keys=True)
 
 if __name__ == "__main__":
     """ This is the code to run the "main" loop.
 
     :sitecode: - on command line, "GSWS01"
-    :year: - on command line 2014
+    :year: - on command line 2014, or a range of water years 2010-2014 to adjust in one pass
     :mode: - on command line 'first', 'sparse'', 're'
     :partial: - optional fourth argument of 'partial'.
+    :--profile: - optional, anywhere; '--profile=determine_weights' also runs that stage under cProfile
+    :--stream: - optional, anywhere; '--stream=<rows>' reads that many rows at a time
 
 
     ..Example:
     python weir2k.py "GSWS01" 2014 "first"
     python weir3k.py "GSWS03" 2015 "re" "partial"
+    python weir3k.py "GSWS03" 2015 "re" --profile
+    python weir3k.py "GSWS03" 2015 "first" --stream
+    python weir3k.py "GSWS03" 2010-2015 "first"
 
     """
+    # --profile anywhere on the command line times each stage; see profiling.py
+    sys.argv = switch_on_profile(sys.argv, 'weir3k')
+
+    # --stream reads the raw data and the working files a chunk of rows at a time, in the same memory however long they are
+    sys.argv, stream_rows = stream_option(sys.argv)
+
     sitecode_raw = sys.argv[1]
     wateryear_raw = sys.argv[2]
     method= sys.argv[3]
@@ -1142,17 +2321,54 @@ if __name__ == "__main__":
     if len(sys.argv) > 4 and str(sys.argv[4]).lower() == 'partial':
         partial = True
 
+    # a range of water years, ex. 2010-2015, is stitched together, adjusted in one pass, and split back into the files of each year
+    wateryears = water_year_range(wateryear_raw)
+
+    if len(wateryears) > 1 and partial == True:
+        sys.exit("Only a whole water year can be part of a range; run the partial year on its own.")
+
+    if len(wateryears) > 1 and stream_rows != None:
+        sys.exit("A range of water years is read whole; run the years one at a time to use --stream.")
+
     # checks for upper and lower case things
-    sitecode, wateryear = string_correct(sitecode_raw, wateryear_raw)
+    sitecode, wateryear = string_correct(sitecode_raw, wateryears[0])
 
-    # get the corr table and put it into a dictionary
-    corr_od = convert_corr_to_dict(sitecode, wateryear)
+    # get the corr table and put it into a dictionary; for a range, the tables of all the years as one
+    if len(wateryears) > 1:
+        corr_od = load_corr_tables(sitecode, wateryears)
+    else:
+        corr_od = load_corr_table(sitecode, wateryear)
 
     # create subfolders for images and working data
-    create_subfolders(sitecode, wateryear)
+    for each_year in wateryears:
+        create_subfolders(sitecode, each_year)
+
+    if len(wateryears) > 1:
+
+        if method not in ["first", "sparse", "re"]:
+            sys.exit("The method has to be \'first\', \'sparse\' or \'re\'.")
+
+        # every year's files are found, and the output names checked (in 're', backed up), before anything is written
+        if method == "re":
+            filenames = [range_input_file(sitecode, x, sitecode + "_" + str(x) + "_working", method) for x in wateryears]
+
+        output_filenames = [working_output_filename(sitecode, x, method, False) for x in wateryears]
+
+        if method == "re":
+            # with a current binary copy there is nothing to parameterize; the dates of a working file are in column 1
+            date_columns = [1 if read_working_header(x) != None else test_csv_structure(x)[1] for x in filenames]
+        else:
+            filenames, date_columns = generate_water_years(sitecode, wateryears, method == "sparse")
+
+        adjusted_dictionary, written = adjust_water_years(sitecode, wateryears, filenames, corr_od, method, date_columns, output_filenames)
+
+        print("Generated the \'re\' files " + ", ".join(written) + " in one pass")
+
+        for each_year in wateryears:
+            make_graphs(sitecode, each_year, adjusted_dictionary)
 
     # for the "first" and "sparse" methods, we'll generate only the four column format
-    if method == "first":
+    elif method == "first":
 
         # return a list of files in raw data that contain your site code and water year.
         filename_list = find_files(sitecode, wateryear, 'raw_data')
@@ -1210,15 +2426,19 @@ if __name__ == "__main__":
             for each_file in scary_files:
                 shutil.copy(each_file, os.path.join(str(sitecode) + "_" + str(wateryear) + "_" + "backups", each_file))
 
-        # figure out what columns contain the dates (date_column) and raw values and read in from csv
-        # note, if you started after the beginning of the water year, you will see the first day here as after he beginning of the water year.
-        od, date_column = parameterize_first(sitecode, wateryear, filename)
+        if stream_rows != None:
+            output_filename_first, date_column = stream_first(sitecode, wateryear, filename, partial, False, stream_rows)
+
+        else:
+            # figure out what columns contain the dates (date_column) and raw values and read in from csv
+            # note, if you started after the beginning of the water year, you will see the first day here as after he beginning of the water year.
+            od, date_column = parameterize_first(sitecode, wateryear, filename)
 
-        print("The first day and time in your raw data is " + datetime.datetime.strftime(min(od.keys()), '%Y-%m-%d %H:%M:%S'))
-        print("The final day and time in your raw data is " + datetime.datetime.strftime(max(od.keys()), '%Y-%m-%d %H:%M:%S'))
+            print("The first day and time in your raw data is " + datetime.datetime.strftime(od.first_date(), '%Y-%m-%d %H:%M:%S'))
+            print("The final day and time in your raw data is " + datetime.datetime.strftime(od.last_date(), '%Y-%m-%d %H:%M:%S'))
 
-        # generate a first data with or without estimations
-        output_filename_first = generate_first(od, sitecode, wateryear, partial, sparse=False)
+            # generate a first data with or without estimations
+            output_filename_first = generate_first(od, sitecode, wateryear, partial, sparse=False)
 
 
         print("Generating \'re\' file from " + output_filename_first + " for the method: " + method + ". Recall that the file named " + output_filename_first + " contains merely a replicate of the raw data, although possibly gapfilled, in the second data column. However, this column is necessary so as not to overwrite the raw data.")
@@ -1226,14 +2446,18 @@ if __name__ == "__main__":
         if partial == True:
             print("Remeber that you used the partial method!")
 
-        # generate the adjustments data with the extra column
-        adjusted_dictionary, output_filename_re = do_adjustments(sitecode, wateryear, output_filename_first, corr_od, method, partial, date_column)
+        # generate the adjustments data with the extra column; streaming draws the graphs a month at a time as it goes
+        if stream_rows != None:
+            output_filename_re = stream_adjustments(sitecode, wateryear, output_filename_first, corr_od, method, partial, date_column, stream_rows)
+        else:
+            adjusted_dictionary, output_filename_re = do_adjustments(sitecode, wateryear, output_filename_first, corr_od, method, partial, date_column)
 
         print("Generated \'re\'' file named " + output_filename_re + " and put it in the working directory!")
 
 
         #make_optioal_graphs(adjusted_dictionary) <--- do not run this! not for use!!
-        make_graphs(sitecode, wateryear, adjusted_dictionary)
+        if stream_rows == None:
+            make_graphs(sitecode, wateryear, adjusted_dictionary)
 
     elif method == "sparse":
 
@@ -1291,24 +2515,32 @@ if __name__ == "__main__":
             for each_file in scary_files:
                 shutil.copy(each_file, os.path.join(str(sitecode) + "_" + str(wateryear) + "_" + "backups", each_file))
 
-        # figure out what columns contain the dates and raw values and read in from csv
-        # note, if you start after the beginning of the water year you will see the first day as after the beginning of the water year
-        od, date_column = parameterize_first(sitecode, wateryear, filename)
+        if stream_rows != None:
+            output_filename_first, date_column = stream_first(sitecode, wateryear, filename, partial, True, stream_rows)
+
+        else:
+            # figure out what columns contain the dates and raw values and read in from csv
+            # note, if you start after the beginning of the water year you will see the first day as after the beginning of the water year
+            od, date_column = parameterize_first(sitecode, wateryear, filename)
 
-        print("The first day and time in your raw data is " + datetime.datetime.strftime(sorted(list(od.keys()))[0], '%Y-%m-%d %H:%M:%S'))
+            print("The first day and time in your raw data is " + datetime.datetime.strftime(od.first_date(), '%Y-%m-%d %H:%M:%S'))
 
-        # generate a first data with or without estimations
-        output_filename_first = generate_first(od, sitecode, wateryear, partial, sparse=True)
+            # generate a first data with or without estimations
+            output_filename_first = generate_first(od, sitecode, wateryear, partial, sparse=True)
 
 
         print("Generating \'re\' file from " + output_filename_first + " for the method: " + method + ". Recall that the file named " + output_filename_first + " contains merely a replicate of the raw data, and not gapfilled in the " + method + " method, located in the second data column. The leftmost column is the raw data - it is never over written.")
 
         # generate the adjustments data with the extra column
-        adjusted_dictionary, output_filename_re = do_adjustments(sitecode, wateryear, output_filename_first, corr_od, method, partial, date_column)
+        if stream_rows != None:
+            output_filename_re = stream_adjustments(sitecode, wateryear, output_filename_first, corr_od, method, partial, date_column, stream_rows)
+        else:
+            adjusted_dictionary, output_filename_re = do_adjustments(sitecode, wateryear, output_filename_first, corr_od, method, partial, date_column)
 
         print("Generated re file named " + output_filename_re + " !")
 
-        make_graphs(sitecode, wateryear, adjusted_dictionary)
+        if stream_rows == None:
+            make_graphs(sitecode, wateryear, adjusted_dictionary)
 
     elif method == "re":
 
@@ -1362,11 +2594,22 @@ if __name__ == "__main__":
             shutil.copy(filename, os.path.join(str(sitecode) + "_" + str(wateryear) + "_" + "backups", sitecode + "_" + str(wateryear) + "_" + "first.csv"))
 
         # try to find re file or re_partial file!
+        if partial != True:
+            re_name = "re.csv"
+        elif partial == True:
+            re_name = "re_partial.csv"
+
+        output_filename_re = os.path.join(str(sitecode) + "_" + str(wateryear) + "_" + "working", sitecode + "_" + str(wateryear) + "_" + re_name)
+
         try:
-            if partial != True:
-                output_filename_re = os.path.join(str(sitecode) + "_" + str(wateryear) + "_" + "working", sitecode + "_" + str(wateryear) + "_" + "re.csv")
-            elif partial == True:
-                output_filename_re = os.path.join(str(sitecode) + "_" + str(wateryear) + "_" + "working", sitecode + "_" + str(wateryear) + "_" + "re_partial.csv")
+            open(output_filename_re, 'r').close()
+
+        except (IOError, OSError):
+            # if for some reason you make it with the sitecode in lower case.
+            output_filename_re_lower = os.path.join(str(sitecode) + "_" + str(wateryear) + "_" + "working", sitecode.lower() + "_" + str(wateryear) + "_" + re_name)
+
+            if os.path.isfile(output_filename_re_lower):
+                output_filename_re = output_filename_re_lower
 
         #     try:
         #         output_filename_re = os.path.join(str(sitecode) + "_" + str(wateryear) + "_" + "working", sitecode + "_" + str(wateryear) + "_" + "re_partial.csv")
@@ -1380,22 +2623,26 @@ if __name__ == "__main__":
         #         elif 're' in output_filename_re or 'RE' in output_filename_re:
         #             print("Looks like there is a re file here to process, but the name is unconventional : " + output_filename_re)
 
-            print("You are running the \'re\' method, using the file named " + output_filename_re + " which is located in the working directory. A backup has been saved in the backups directory.")
+        print("You are running the \'re\' method, using the file named " + output_filename_re + " which is located in the working directory. A backup has been saved in the backups directory.")
 
-            od, date_column = parameterize_first(sitecode, wateryear, output_filename_re)
+        # if only some rows of the corr table were edited since the working file was made, only their spans are redone and only their months are redrawn
+        adjusted_dictionary, months = patch_adjustments(sitecode, wateryear, output_filename_re, corr_od, partial)
 
-            adjusted_dictionary, output_filename = do_adjustments(sitecode, wateryear, output_filename_re, corr_od, method, partial, date_column)
+        if adjusted_dictionary == None:
 
+            # with a current binary copy there is nothing to parameterize; the dates of a working file are in column 1
+            if read_working_header(output_filename_re) != None:
+                date_column = 1
+            elif stream_rows != None:
+                date_column = test_csv_structure(output_filename_re)[1]
+            else:
+                od, date_column = parameterize_first(sitecode, wateryear, output_filename_re)
 
-        except Exception:
-            # if for some reason you make it with the sitecode in lower case.
-            output_filename_re_lower = os.path.join(str(sitecode) + "_" + str(wateryear) + "_" + "working", sitecode.lower() + "_" + str(wateryear) + "_" + "re.csv")
-
-            if partial == True:
-                output_filename_re_lower = os.path.join(str(sitecode) + "_" + str(wateryear) + "_" + "working", sitecode.lower() + "_" + str(wateryear) + "_" + "re_partial.csv")
-
-            od, date_column = parameterize_first(sitecode, wateryear, output_filename_re_lower)
-
-            adjusted_dictionary, output_filename = do_adjustments(sitecode, wateryear, output_filename_re_lower, corr_od, method, partial, date_column)
+            if stream_rows != None:
+                output_filename = stream_adjustments(sitecode, wateryear, output_filename_re, corr_od, method, partial, date_column, stream_rows)
+            else:
+                adjusted_dictionary, output_filename = do_adjustments(sitecode, wateryear, output_filename_re, corr_od, method, partial, date_column)
 
-        make_graphs(sitecode, wateryear, adjusted_dictionary)
+        # streaming has drawn them already
+        if adjusted_dictionary != None:
+            make_graphs(sitecode, wateryear, adjusted_dictionary, months)